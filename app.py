@@ -22,6 +22,8 @@ login_manager = LoginManager()
 
 
 def create_app():
+    from services.startup_timer import StartupTimer
+    StartupTimer.start()
     app = Flask(__name__)
     # TEMPLATES_AUTO_RELOAD now controlled by config.py (follows DEBUG); not hardcoded True.
 
@@ -34,8 +36,14 @@ def create_app():
     instance_config = Path(app.instance_path) / 'config.py'
     if instance_config.exists():
         app.config.from_pyfile(instance_config)
+    StartupTimer.mark('配置')
 
+    from services.sqlite_tuning import SQLiteTuning
+    SQLiteTuning.configure(app)  # 连接池参数须在 db.init_app 之前定好
     db.init_app(app)
+    SQLiteTuning.init_app(app)   # 连接时 PRAGMA + 自检
+    from services.unit_of_work import UnitOfWork
+    UnitOfWork.init_app(app)     # 请求级提交合并，须先于其他 before_request 注册
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login_page'
     login_manager.login_message = None
@@ -44,7 +52,13 @@ def create_app():
     def load_user(user_id):
         return PlayerModel.query.get(int(user_id))
 
+    from services.shared_state import SharedState
+    SharedState.init_app(app)
+    StartupTimer.mark('数据库与共享状态')
     DataService.init_app(app)
+    StartupTimer.mark('静态数据')
+    from services.achievement_queue import AchievementQueue
+    AchievementQueue.init_app(app)
 
     # ── 多窗口 sid 贯穿机制（Flask 官方 url_defaults/url_value_preprocessor）──
     # 让所有 url_for（模板 468 处 redirect + 167 个模板）自动带上当前 sid，
@@ -207,6 +221,7 @@ def create_app():
 
     from services.world_boss_service import WorldBossService
     WorldBossService.init_bosses()
+    StartupTimer.mark('世界BOSS')
 
     # Finance bandit monsters are injected after tables are ready inside app_context.
     from services.finance_service import FinanceService
@@ -276,278 +291,34 @@ def create_app():
         from flask import redirect, url_for
         return redirect(url_for('game.scene'))
 
+    StartupTimer.mark('蓝图与钩子')
+
     with app.app_context():
         # 确保 ActiveSession 表被注册后再 create_all（单点登录会话表）
         from models.active_session import ActiveSession  # noqa: F401
         db.create_all()
-        # 蛮夷入侵活动（南蛮/北夷）：确保活动状态表与双方首领存在
-        # 兼容旧版单阵营表结构（无 side/active 列）—— 重建活动表
-        try:
-            from sqlalchemy import inspect as _sa_inspect
-            _insp = _sa_inspect(db.engine)
-            _inv_cols = [c['name'] for c in _insp.get_columns('barbarian_invasion')]
-            _lead_cols = [c['name'] for c in _insp.get_columns('barbarian_leaders')]
-            if ('side' not in _inv_cols) or ('side' not in _lead_cols):
-                db.session.execute(db.text('DROP TABLE IF EXISTS barbarian_leaders'))
-                db.session.execute(db.text('DROP TABLE IF EXISTS barbarian_invasion'))
-                db.session.commit()
-                db.create_all()
-        except Exception:
-            db.session.rollback()
+        StartupTimer.mark('建表')
+        # 旧库补列、补索引、数据修补：按 schema_version 只执行尚未执行的迁移（services.schema_migrations）
+        from services.schema_migrations import SchemaMigrations
+        SchemaMigrations.run(app)
+        StartupTimer.mark('库结构迁移')
+        db.configure_mappers()  # 首次查询才会做的模型映射配置，单独计时
+        StartupTimer.mark('模型映射')
+        # 上次进程被强杀时残留在 achievement_events 的成就事件，同步补判（services.achievement_queue）
+        AchievementQueue.recover(app)
+        StartupTimer.mark('成就补判')
+        # 蛮夷入侵活动（南蛮/北夷）：确保活动状态与双方首领存在
         from services.barbarian_service import BarbarianService
         for _side in ('南', '北'):
             BarbarianService.get_or_create_state(_side)
             BarbarianService.seed_leaders(_side)
-        # 蛮夷首领落点列（旧库兼容）
-        try:
-            db.session.execute(db.text(
-                "ALTER TABLE barbarian_leaders ADD COLUMN location_id VARCHAR(80)"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        # 多窗口 SSO：为旧版 active_session 表补齐 active_sid / tokens 列
-        # （旧表只有 player_id/token/updated_at，create_all 不会改已存在的表）
-        try:
-            db.session.execute(db.text("ALTER TABLE active_session ADD COLUMN active_sid VARCHAR(16)"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE active_session ADD COLUMN tokens TEXT"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        # 为已有数据库添加新列（SQLite 不支持 ALTER TABLE ADD COLUMN IF NOT EXISTS）
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN player_uid VARCHAR(10)"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN is_designer BOOLEAN DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        # 战斗界面生命/魔法净变化括号显示(带符号)
-        for _col_def in (
-            "ALTER TABLE players ADD COLUMN last_hp_delta INTEGER DEFAULT 0",
-            "ALTER TABLE players ADD COLUMN last_mp_delta INTEGER DEFAULT 0",
-        ):
-            try:
-                db.session.execute(db.text(_col_def))
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN warehouse_gold INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN backpack_capacity INTEGER DEFAULT 20"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN warehouse_capacity INTEGER DEFAULT 20"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE lieutenant ADD COLUMN tier INTEGER DEFAULT 3"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        # 副将自定义基础属性(工作台副将设计模块):可空,未设则走 get_xxx 公式
-        for _col_def in (
-            "ALTER TABLE lieutenant ADD COLUMN base_max_health INTEGER",
-            "ALTER TABLE lieutenant ADD COLUMN base_max_mana INTEGER",
-            "ALTER TABLE lieutenant ADD COLUMN base_attack INTEGER",
-            "ALTER TABLE lieutenant ADD COLUMN base_defense INTEGER",
-            "ALTER TABLE lieutenant ADD COLUMN base_crit_rate FLOAT",
-            "ALTER TABLE lieutenant ADD COLUMN base_dodge_rate FLOAT",
-        ):
-            try:
-                db.session.execute(db.text(_col_def))
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
-        # 副将设计专用标记:工作台创建的副将只在设计区可见,不进玩家正式列表
-        try:
-            db.session.execute(db.text("ALTER TABLE lieutenant ADD COLUMN is_design_only BOOLEAN DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE legions ADD COLUMN battle_points INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE legion_members ADD COLUMN quest_count INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE legion_members ADD COLUMN quest_date VARCHAR(10) DEFAULT ''"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE legion_members ADD COLUMN personal_battle_points INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN in_battlefield BOOLEAN DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN battlefield_city VARCHAR(32)"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN battlefield_death_time FLOAT DEFAULT 0.0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN battlefield_target_id INTEGER"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE legions ADD COLUMN occupied_cities_raw TEXT DEFAULT '[]'"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN party_id INTEGER"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN item_usage_raw TEXT DEFAULT '{}'"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN dungeon_clears_raw TEXT DEFAULT '{}'"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN tower_max_floor INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN boss_kills_raw TEXT DEFAULT '{}'"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN pk_loss_count INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN finance_data TEXT DEFAULT '{}'"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN elite_kills_by_area_raw TEXT DEFAULT '{}'"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN monster_kills_raw TEXT DEFAULT '{}'"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN divine_beast_kills INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN forge_count INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN enhance_success_count INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN enhance_fail_count INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN enhance_50_count INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE equipment_instances ADD COLUMN created_by VARCHAR(64)"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE equipment_instances ADD COLUMN created_at DATETIME"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN enhance_luck_small BOOLEAN DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN enhance_luck_medium BOOLEAN DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN yuanbao_spent INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN jinzu_spent INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        # forum interaction notification switch
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN forum_interaction_notify BOOLEAN DEFAULT 1"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        # 为没有 player_uid 的旧玩家生成 UID
-        import random
-        import string
-        from models.player import PlayerModel
-        players_without_uid = PlayerModel.query.filter(
-            PlayerModel.player_uid == None).all()
-        for p in players_without_uid:
-            while True:
-                uid = ''.join(random.choices(string.digits + string.ascii_lowercase, k=10))
-                if not PlayerModel.query.filter_by(player_uid=uid).first():
-                    break
-            p.player_uid = uid
-        if players_without_uid:
-            db.session.commit()
+        StartupTimer.mark('蛮夷活动')
         # Inject finance bandit monsters after legacy player columns are ready so finance init can rebuild holdings safely.
         FinanceService.register_bandit_monster(DataService.get_monsters())
-        FinanceService.start_maintenance(app)
+        StartupTimer.mark('理财')
         from services.maintenance_service import MaintenanceService
         MaintenanceService.start(app)
+        StartupTimer.mark('后台任务')
 
     # 服务端的 500 错误兜底:把完整 traceback 落盘,便于生产环境排查
     # (gunicorn 的 --error-logfile - 在手机控制台部署下会被丢弃,导致 500 无迹可寻)。
@@ -581,6 +352,7 @@ def create_app():
             "<h1>Internal Server Error</h1><p>The server encountered an internal "
             "error and was unable to complete your request.</p>", 500)
 
+    StartupTimer.finish(app)
     return app
 
 
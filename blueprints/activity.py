@@ -444,7 +444,7 @@ def finance_rank_finance():
     player = current_user
     from services.finance_service import FinanceService
     from models.player import PlayerModel
-    rows = PlayerModel.query.all()
+    rows = PlayerModel.query.options(db.undefer_group('finance')).all()
     entries = []
     for p in rows:
         profit = FinanceService.get_player_profit(p)
@@ -89,6 +89,11 @@ def fight():
     if result == "你被击败了":
         return redirect(url_for("battle.revive"))
 
+    if error and not player.in_battle:
+        # 世界BOSS被其他玩家抢先击杀等：战斗已结束
+        flash(error)
+        return redirect(url_for("game.scene"))
+
     if result:
         # monster defeated - go to battle result
         return redirect(url_for("battle.battle_result"))
@@ -216,6 +221,11 @@ def use_skill(skill_id):
     if result == "你被击败了":
         return redirect(url_for("battle.revive"))
 
+    if error and not player.in_battle:
+        # 世界BOSS被其他玩家抢先击杀等：战斗已结束
+        flash(error)
+        return redirect(url_for("game.scene"))
+
     if result:
         return redirect(url_for("battle.battle_result"))
 
@@ -237,6 +247,11 @@ def use_potion(item_id):
     if result == "你被击败了":
         return redirect(url_for("battle.revive"))
 
+    if error and not player.in_battle:
+        # 世界BOSS被其他玩家抢先击杀等：战斗已结束
+        flash(error)
+        return redirect(url_for("game.scene"))
+
     if result:
         return redirect(url_for("battle.battle_result"))
 
@@ -13,7 +13,6 @@ battlefield_bp = Blueprint('battlefield', __name__)
 @login_required
 def index():
     player = current_user
-    BattlefieldService.tick()
     if player.in_battlefield:
         return redirect(url_for('battlefield.city_view'))
     return render_template("battlefield_index.html",
@@ -44,7 +43,6 @@ def city_view():
     if not player.in_battlefield:
         return redirect(url_for('battlefield.index'))
 
-    BattlefieldService.tick()
     if BattlefieldService.should_force_exit():
         BattlefieldService.exit_battlefield(player)
         flash("战场已结束，你被传送出战场")
@@ -7,6 +7,7 @@ from services.data_service import DataService
 from services.battle_service import BattleService
 from services.copy_dungeon_service import CopyDungeonService
 from services.player_service import PlayerService
+from services.unit_of_work import UnitOfWork
 import traceback as _tb
 
 game_bp = Blueprint('game', __name__)
@@ -60,6 +61,7 @@ def scene():
 
         # If player left a copy dungeon map, reset their dungeon state
         data = player.activity_data
+        data_base = dict(data)  # 本页对 activity_data 的改动在末尾按差异合并回写
         # 清除可能残留的“上次击杀为精英/世界boss”标记（正常流程已在结算界面消费）
         data.pop('last_kill_special', None)
         if location and not location.get('is_copy_map'):
@@ -78,23 +80,19 @@ def scene():
 
         # Get monsters for this location (support both monster_type and monsters array)
         monsters_list = []
-        location_monsters = location.get("monsters", [])
-        if location_monsters:
-            all_monsters = DataService.get_monsters()
+        scene_index = DataService.get_scene_index().get(player.current_location)
+        if scene_index.monster_ids:
             from services.world_boss_service import WorldBossService
-            for monster_id in location_monsters:
-                monster_data = all_monsters.get(monster_id)
-                if not monster_data:
+            from services.one_time_elite_service import OneTimeEliteService
+            from models.monster import Monster
+            for monster_id in scene_index.monster_ids:
+                # 只有副本怪/一次性精英（仅任务进行中且未击杀时可见）需按玩家判断
+                if monster_id in scene_index.gated_ids and not (
+                        CopyDungeonService.should_show_monster_in_scene(player, monster_id)
+                        and OneTimeEliteService.should_show_in_scene(player, monster_id)):
                     continue
-                if not CopyDungeonService.should_show_monster_in_scene(player, monster_id):
-                    continue
-                # 一次性精英怪：仅任务进行中且未击杀时对当前玩家可见
-                from services.one_time_elite_service import OneTimeEliteService
-                if not OneTimeEliteService.should_show_in_scene(player, monster_id):
-                    continue
-                from models.monster import Monster
-                m = Monster.from_dict(monster_id, monster_data)
-                if monster_data.get("is_elite") and not monster_data.get("is_copy") and not monster_data.get("is_one_time_elite"):
+                m = Monster.create_monster(monster_id)
+                if monster_id in scene_index.world_boss_ids:
                     remaining = WorldBossService.get_respawn_remaining(monster_id)
                     if remaining > 0:
                         m.respawning = True
@@ -132,54 +130,67 @@ def scene():
 
         # Get NPCs in this location
         npcs = []
-        npc_ids = location.get("npcs", [])
-        if npc_ids:
-            all_monsters = DataService.get_monsters()
-            for nid in npc_ids:
-                ndata = all_monsters.get(nid)
-                if ndata:
-                    from models.monster import Monster
-                    npc = Monster.from_dict(nid, ndata)
-                    marker = CopyDungeonService.get_npc_marker(player, nid)
-                    npc.task_icon = marker['icon'] if marker else None
-                    npcs.append(npc)
+        if scene_index.npc_ids:
+            from models.monster import Monster
+            for nid in scene_index.npc_ids:
+                npc = Monster.create_monster(nid)
+                marker = CopyDungeonService.get_npc_marker(player, nid)
+                npc.task_icon = marker['icon'] if marker else None
+                npcs.append(npc)
 
         # Get messages from last 3 minutes
         cutoff = datetime.utcnow() - timedelta(minutes=3)
         from sqlalchemy import or_
 
         # Channel 1: single unread public/system message, consumed on each refresh
+        # 从进程内广播总线按游标取，不再每次刷新都查库
+        from services.public_chat import ChatBus
         last_c1_id = data.get('last_read_c1_id', 0)
-        next_c1 = ChatMessage.query.filter(
-            ChatMessage.message_type.in_(['public', 'system']),
-            ChatMessage.id > last_c1_id,
-            ChatMessage.created_at >= cutoff,
-            db.or_(ChatMessage.receiver_id == None, ChatMessage.receiver_id == player.id)
-        ).order_by(ChatMessage.id.asc()).first()
+        unread_c1 = ChatBus.since(last_c1_id, types=('public', 'system'),
+                                  receiver_id=player.id, cutoff=cutoff)
+        next_c1 = unread_c1[0] if unread_c1 else None
         channel1_msg = next_c1
         if next_c1:
             data['last_read_c1_id'] = next_c1.id
-        player.activity_data = data
-        db.session.commit()
+        # 中途 CopyDungeonService 也会改 activity_data（副本任务、每日免费次数）。
+        # 同一次加载内各处共享同一个对象，改动都已在 data 里；中途若有提交（raw 列重新载入），
+        # 则以当前值为底只合并本页改过的键。仅在确有变化时回写，不再每次刷新都整列覆盖+提交
+        latest = player.activity_data
+        if latest is data:
+            merged = data
+            changed = data != data_base
+        else:
+            merged = dict(latest)
+            for key in set(data_base) | set(data):
+                if key not in data:
+                    if key in data_base:
+                        merged.pop(key, None)
+                elif key not in data_base or data_base[key] != data[key]:
+                    merged[key] = data[key]
+            changed = merged != latest
+        if changed:
+            player.activity_data = merged
+            UnitOfWork.commit()
 
         # Channel 2: country messages (same country) + private messages (to/from player)
-        same_country_ids = [p.id for p in PlayerModel.query.filter_by(country=player.country).all()]
-        channel2 = ChatMessage.query.filter(
-            or_(
-                db.and_(
-                    ChatMessage.message_type == 'country',
-                    ChatMessage.sender_id.in_(same_country_ids)
-                ),
-                db.and_(
-                    ChatMessage.message_type == 'private',
-                    or_(
-                        ChatMessage.sender_id == player.id,
-                        ChatMessage.receiver_id == player.id
-                    )
-                )
-            ),
+        # 两路各走 (message_type, country, created_at) 索引的有界范围扫描，合并后取最新 10 条；
+        # 私聊消息 country 为空，3 分钟窗口内全服私聊量很小。
+        country_msgs = ChatMessage.query.filter(
+            ChatMessage.message_type == 'country',
+            ChatMessage.country == player.country,
             ChatMessage.created_at >= cutoff
         ).order_by(ChatMessage.created_at.desc()).limit(10).all()
+        private_msgs = ChatMessage.query.filter(
+            ChatMessage.message_type == 'private',
+            ChatMessage.country == None,
+            ChatMessage.created_at >= cutoff,
+            or_(
+                ChatMessage.sender_id == player.id,
+                ChatMessage.receiver_id == player.id
+            )
+        ).order_by(ChatMessage.created_at.desc()).limit(10).all()
+        channel2 = sorted(country_msgs + private_msgs,
+                          key=lambda m: m.created_at, reverse=True)[:10]
 
         # Player notifications (JSON field) - shown once then cleared
         notifications = player.notifications or []
@@ -199,8 +210,7 @@ def scene():
 
         # 通知不再写入系统频道历史，也不再自动清空：
         # 个人通知(含玫瑰赠送等)改为常驻「通知」频道展示，系统频道仅保留全局播报。
-        if friend_notifications or filtered_notifications:
-            db.session.commit()
+        # 这里只读不写，无需提交。
 
         # Get ground items
         ground_items = DataService.get_ground_items(location_id)
@@ -260,42 +270,26 @@ def scene():
 @login_required
 def move(direction):
     player = current_user
-    if player.in_battle:
-        flash("战斗中无法移动")
-        return redirect(url_for("battle.battle"))
-
-    if player.in_pk:
-        flash("PK中无法移动")
-        return redirect(url_for("battle.pk_battle",
-                               opponent=player.pk_opponent))
-
     locations = DataService.get_locations()
     location = locations.get(player.current_location)
-    if not location:
-        return redirect(url_for("game.scene"))
 
     exit_id = None
-    if direction == 'north':
-        exit_id = location.get("north_exit")
-    elif direction == 'south':
-        exit_id = location.get("south_exit")
-    elif direction == 'east':
-        exit_id = location.get("east_exit")
-    elif direction == 'west':
-        exit_id = location.get("west_exit")
-
-    if exit_id and exit_id in locations:
-        current_name = location.get("name")
-        target_name = locations[exit_id].get("name")
-        is_huangjin_river_crossing = (
-            location.get("copy_dungeon_id") == "huangjin_trial"
-            and {current_name, target_name} == {"黄河岸边", "兖州"}
-        )
-        if is_huangjin_river_crossing:
-            raft = DataService.get_inventory_item(player.id, "wood_raft")
-            if not raft or raft.quantity < 1:
-                flash("需要先前往小渔村击杀偷伐人，夺取木筏后才能渡河")
-                return redirect(url_for("game.scene"))
+    if location and direction in ('north', 'south', 'east', 'west'):
+        exit_id = location.get(f"{direction}_exit")
+
+    # 战斗/PK 中与渡河等逐条出口的检查，与寻路步行（MapService.walk_step）共用
+    from services.map_service import MapService
+    blocked = MapService.check_move(player, exit_id)
+    if blocked:
+        reason, msg = blocked
+        flash(msg)
+        if reason == 'battle':
+            return redirect(url_for("battle.battle"))
+        if reason == 'pk':
+            return redirect(url_for("battle.pk_battle", opponent=player.pk_opponent))
+        return redirect(url_for("game.scene"))
+    if not location:
+        return redirect(url_for("game.scene"))
 
     if exit_id and exit_id in locations:
         player.current_location = exit_id
@@ -3,7 +3,7 @@ from flask_login import login_required, current_user
 from services.data_service import DataService
 from services import db
 from services.lost_found_service import (
-    LostItemLifecycle, grant_lost_item, _resolve_item_name, get_redeem_price)
+    AUCTION_DAYS, grant_lost_item, _resolve_item_name, get_redeem_price)
 from models.player import LostItem
 from datetime import datetime, timedelta
 
@@ -16,9 +16,6 @@ def lost_found():
     player = current_user
     now = datetime.now()
 
-    # 惰性推进失物状态机（持有->拍卖->结算），无需独立定时任务
-    LostItemLifecycle.run()
-
     # Get player's lost items in holding stage
     holding_items = LostItem.query.filter_by(
         player_id=player.id, stage='holding').all()
@@ -149,6 +146,11 @@ def bid(item_id):
     if not lost_item:
         flash("物品不存在或拍卖已结束")
         return redirect(url_for('lost_found.lost_found'))
+    # 到期结算由后台任务推进，期满到结算之间不再接受出价
+    if lost_item.auction_started_at and (
+            datetime.now() - lost_item.auction_started_at).days >= AUCTION_DAYS:
+        flash("物品不存在或拍卖已结束")
+        return redirect(url_for('lost_found.lost_found'))
 
     if player.gold < bid_amount:
         flash("银两不足")
@@ -195,6 +195,64 @@ def shenxing_go(scene_id):
     return redirect(url_for('map.shenxing'))
 
 
+def _route_args():
+    """寻路目标参数：to=场景 id / quest=任务 id / mid=怪物 id，原样带到下一步链接。"""
+    return {k: request.args[k] for k in ('to', 'quest', 'mid') if request.args.get(k)}
+
+
+@map_bp.route("/route")
+@login_required
+def route():
+    """寻路 - 显示到目标的步行路线，可逐步前往"""
+    player = current_user
+    args = _route_args()
+    target_id, target_name = MapService.resolve_route_target(
+        player, to=args.get('to'), quest_id=args.get('quest'), monster_id=args.get('mid'))
+    if not target_id:
+        flash(target_name)
+        return redirect(url_for('map.index'))
+    steps = MapService.find_route(player, target_id)
+    return render_template("map_walk.html",
+                         player=player,
+                         location=DataService.get_location(player.current_location),
+                         target_id=target_id,
+                         target_name=target_name,
+                         steps=steps,
+                         route_args=args)
+
+
+@map_bp.route("/walk")
+@login_required
+def walk():
+    """寻路 - 朝目标走一步，到达后回到场景"""
+    player = current_user
+    args = _route_args()
+    target_id, target_name = MapService.resolve_route_target(
+        player, to=args.get('to'), quest_id=args.get('quest'), monster_id=args.get('mid'))
+    if not target_id:
+        flash(target_name)
+        return redirect(url_for('map.index'))
+    result = MapService.walk_step(player, target_id)
+    if not result['success']:
+        flash(result['msg'])
+        if result.get('reason') == 'battle':
+            return redirect(url_for("battle.battle"))
+        if result.get('reason') == 'pk':
+            return redirect(url_for("battle.pk_battle", opponent=player.pk_opponent))
+        return redirect(url_for('map.route', **args))
+
+    # 南蛮入侵：与场景页移动一样，非安全区按几率遭遇南蛮怪物
+    from services.barbarian_service import BarbarianService
+    encounter_mid = BarbarianService.maybe_encounter(player, DataService.get_location(player.current_location))
+    if encounter_mid:
+        return redirect(url_for("game.encounter", mid=encounter_mid))
+
+    flash(result['msg'])
+    if result['arrived']:
+        return redirect(url_for('game.scene'))
+    return redirect(url_for('map.route', **args))
+
+
 @map_bp.route("/world")
 @login_required
 def world():
@@ -22,18 +22,22 @@ market_bp = Blueprint('market', __name__)
 @market_bp.route("/")
 @login_required
 def index():
-    MarketService.expire_listings()
     category = request.args.get('category', '全部')
     search = (request.args.get('search') or '').strip()
     sort = request.args.get('sort', 'new')
+    # 键集分页：after/before 为游标，page 只用于显示页码
+    before = request.args.get('before')
+    cursor = before or request.args.get('after')
     try:
         page = max(1, int(request.args.get('page') or 1))
     except (TypeError, ValueError):
         page = 1
 
-    rows, total, total_pages, page, per_page, pinned = MarketService.get_listings(
+    rows, next_cursor, prev_cursor, pinned, total = MarketService.get_listings(
         category=category, search=search, sort=sort,
-        page=page, per_page=PER_PAGE_DEFAULT)
+        cursor=cursor, before=bool(before), per_page=PER_PAGE_DEFAULT)
+    if not prev_cursor:
+        page = 1
 
     listings = [MarketService._format_listing(r) for r in rows]
     pinned_fmt = [MarketService._format_listing(r) for r in pinned]
@@ -41,14 +45,13 @@ def index():
     return render_template("market.html", player=current_user,
                            listings=listings, pinned=pinned_fmt,
                            category=category, search=search, sort=sort,
-                           page=page, total_pages=total_pages,
-                           per_page=per_page, total=total)
+                           page=page, next_cursor=next_cursor,
+                           prev_cursor=prev_cursor, total=total)
 
 
 @market_bp.route("/my")
 @login_required
 def my():
-    MarketService.expire_listings()
     mine = MarketService.get_player_listings(current_user.id)
     listings = [MarketService._format_listing(r) for r in mine]
     cap = MarketService.get_listing_cap(current_user)
@@ -110,7 +113,6 @@ def create():
 @market_bp.route("/view/<int:listing_id>")
 @login_required
 def view(listing_id):
-    MarketService.expire_listings()
     listing = MarketService.get_listing(listing_id)
     if not listing:
         flash("挂单不存在或已结束")
@@ -566,7 +566,9 @@ def inventory(category='全部'):
     filtered = []
     search_word = request.args.get('search_word', '').strip()
     # Inventory items (non-equipment)
-    for inv in DataService.get_inventory(player.id):
+    inventory_rows = DataService.get_inventory(player.id)
+    unequipped = DataService.get_unequipped_equipment(player.id)
+    for inv in inventory_rows:
         if inv.quantity <= 0:
             continue
         item_data = DataService.get_item(inv.item_id)
@@ -603,7 +605,7 @@ def inventory(category='全部'):
             })
 
     # Equipment instances (unequipped)
-    for equip in DataService.get_unequipped_equipment(player.id):
+    for equip in unequipped:
         if search_word and search_word.lower() not in equip.name.lower():
             continue
         if category == '全部' or category == '装备':
@@ -621,7 +623,8 @@ def inventory(category='全部'):
     start = (page - 1) * per_page
     page_items = filtered[start:start + per_page]
 
-    used_capacity = DataService.get_backpack_used_capacity(player.id)
+    used_capacity = DataService.get_backpack_used_capacity(
+        player.id, inventory=inventory_rows, unequipped=unequipped)
 
     return render_template("inventory.html",
                          player=player,
@@ -1,7 +1,8 @@
 from flask import Blueprint, render_template
 from flask_login import login_required, current_user
-from models.player import PlayerModel, Achievement
+from models.player import PlayerModel
 from services.data_service import DataService
+from services.leaderboard_service import LeaderboardService
 from services.social_service import SocialService
 from services import db
 
@@ -39,35 +40,18 @@ def show(rank_type):
     player = current_user
     rdef = RANK_TYPES[rank_type]
 
-    if rank_type == 'wealth':
-        rows = PlayerModel.query.order_by(PlayerModel.gold.desc()).limit(30).all()
-        entries = [(p, p.gold) for p in rows]
-        my_val = player.gold
-    elif rank_type == 'honor':
-        rows = PlayerModel.query.order_by(PlayerModel.honor.desc()).limit(30).all()
-        entries = [(p, p.honor) for p in rows]
-        my_val = player.honor
-    elif rank_type == 'level':
-        rows = PlayerModel.query.order_by(
-            PlayerModel.level.desc(), PlayerModel.experience.desc()).limit(30).all()
-        entries = [(p, p.level) for p in rows]
-        my_val = player.level
-    elif rank_type == 'achievement':
-        rows = PlayerModel.query.all()
-        entries = []
-        for p in rows:
-            cnt = Achievement.query.filter_by(player_id=p.id, claimed=True).count()
-            entries.append((p, cnt))
-        entries.sort(key=lambda x: x[1], reverse=True)
-        entries = entries[:30]
-        my_val = Achievement.query.filter_by(player_id=player.id, claimed=True).count()
-    elif rank_type == 'charm':
-        rows = PlayerModel.query.order_by(PlayerModel.charm.desc()).limit(30).all()
-        entries = [(p, p.charm or 0) for p in rows]
-        my_val = player.charm or 0
+    if rank_type in LeaderboardService.BOARDS:
+        # 财富/荣誉/等级/魅力/成就：读内存榜单，取前 30 与查名次都不查 players 表
+        entries = LeaderboardService.top(rank_type)
+        if rank_type == 'achievement':
+            my_val = LeaderboardService.value_of('achievement', player.id)
+        else:
+            my_val = {'wealth': player.gold, 'honor': player.honor, 'level': player.level,
+                      'charm': player.charm}[rank_type] or 0
+        my_rank = LeaderboardService.rank_of(rank_type, player.id) if my_val > 0 else None
     elif rank_type == 'diligence':
         from services.activity_service import ActivityService
-        rows = PlayerModel.query.all()
+        rows = PlayerModel.query.options(db.undefer_group('scene')).all()
         entries = []
         for p in rows:
             kills = ActivityService.get_today_value(p, 'kill_count') or 0
@@ -76,31 +60,15 @@ def show(rank_type):
         entries = entries[:30]
         from services.activity_service import ActivityService as AS
         my_val = AS.get_today_value(player, 'kill_count') or 0
+        my_rank = None
+        for i, (p, v) in enumerate(entries):
+            if p.id == player.id:
+                my_rank = i + 1
+                break
     else:
         entries = []
         my_val = 0
-
-    # Find my rank
-    my_rank = None
-    for i, (p, v) in enumerate(entries):
-        if p.id == player.id:
-            my_rank = i + 1
-            break
-    if my_rank is None and my_val > 0:
-        if rank_type == 'wealth':
-            my_rank = PlayerModel.query.filter(PlayerModel.gold > player.gold).count() + 1
-        elif rank_type == 'honor':
-            my_rank = PlayerModel.query.filter(PlayerModel.honor > player.honor).count() + 1
-        elif rank_type == 'level':
-            my_rank = PlayerModel.query.filter(
-                (PlayerModel.level > player.level) |
-                ((PlayerModel.level == player.level) & (PlayerModel.experience > player.experience))
-            ).count() + 1
-        elif rank_type == 'achievement':
-            my_ach = Achievement.query.filter_by(player_id=player.id, claimed=True).count()
-            my_rank = sum(1 for p, v in entries if v > my_ach) + 1
-        elif rank_type == 'charm':
-            my_rank = PlayerModel.query.filter(PlayerModel.charm > (player.charm or 0)).count() + 1
+        my_rank = None
 
     return render_template('rank_show.html',
         player=player,
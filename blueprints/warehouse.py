@@ -109,7 +109,7 @@ def deposit(npc_id):
     page_items = items[start:start + per_page]
 
     # Calculate used capacity
-    bp_used = DataService.get_backpack_used_capacity(player.id)
+    bp_used = DataService.get_backpack_used_capacity(player.id, inventory=inventory)
     bp_max = player.backpack_capacity
     wh_used = DataService.get_warehouse_used_capacity(player.id)
     wh_max = player.warehouse_capacity
@@ -2,12 +2,11 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from flask_login import login_required, current_user
 from services import db
 from services.data_service import DataService
-from services.player_service import PlayerService
+from services.player_service import PlayerService, EffectiveStats
 from services.battlefield_service import BattlefieldService
 from models.player import PlayerModel
 import json
 import os
-import time
 import random as _random
 
 workbench_bp = Blueprint('workbench', __name__)
@@ -270,194 +269,9 @@ def view_player():
                 flash("找不到该玩家")
 
     if target:
-        # Compute detailed stat breakdown using PlayerService formulas
-        from services.title_service import TitleService
-        from services.social_service import SocialService
-        from services.vip_service import VipService
-        from models.lieutenant import Lieutenant
-
-        passive = target.get_passive_bonuses()
-        title_bonuses = TitleService.get_title_bonuses(target)
-
-        # --- Attack breakdown ---
-        base_atk = target.attack
-        equip_atk = PlayerService._get_equipment_stat_sum(target, "attack")
-        pill_atk = target.pill_attack
-        flat_atk, rate_atk = DataService.get_temp_stat_bonus(target.id, "attack")
-        rank_atk = target.rank_attack
-        passive_atk_flat = passive.get('attack', 0)
-        title_atk = title_bonuses.get('attack', 0)
-        lt_atk_rate = PlayerService._get_lt_passive_bonus(target, 'attack')
-        relation_atk = SocialService.get_online_relation_attack_bonus(target)
-        social_rate = SocialService.get_social_bonus_rate(target)
-        spouse_rate = SocialService.get_spouse_bonus_rate(target)
-        vip_rate = VipService.get_stat_bonus_rate(target)
-        atk_flat = base_atk + equip_atk + pill_atk + flat_atk + rank_atk + title_atk + relation_atk + passive_atk_flat
-        atk_rate = 1 + rate_atk + social_rate + spouse_rate + lt_atk_rate + vip_rate
-        atk_result = int(atk_flat * atk_rate)
-
-        details['attack'] = {
-            'name': '有效攻击力',
-            'flat_parts': [
-                ('基础攻击', base_atk),
-                ('装备加成', equip_atk),
-                ('丹药加成', pill_atk),
-                ('临时BUFF(flat)', flat_atk),
-                ('军衔加成', rank_atk),
-                ('称号加成', title_atk),
-                ('配偶在线', relation_atk),
-                ('被动技能', passive_atk_flat),
-            ],
-            'rate_parts': [
-                ('临时BUFF(rate)', rate_atk),
-                ('红颜/知己加成(1%)', social_rate),
-                ('结婚加成(5%)', spouse_rate),
-                ('副将加成', lt_atk_rate),
-                ('VIP加成', vip_rate),
-            ],
-            'flat_sum': atk_flat,
-            'rate_sum': atk_rate,
-            'result': atk_result,
-        }
-
-        # --- Defense breakdown ---
-        base_def = target.defense
-        equip_def = PlayerService._get_equipment_stat_sum(target, "defense")
-        pill_def = target.pill_defense
-        flat_def, rate_def = DataService.get_temp_stat_bonus(target.id, "defense")
-        passive_def_flat = passive.get('defense', 0)
-        title_def = title_bonuses.get('defense', 0)
-        lt_def_rate = PlayerService._get_lt_passive_bonus(target, 'defense')
-        def_flat = base_def + equip_def + pill_def + flat_def + title_def + passive_def_flat
-        def_rate = 1 + rate_def + social_rate + spouse_rate + lt_def_rate + vip_rate
-        def_result = int(def_flat * def_rate)
-
-        details['defense'] = {
-            'name': '有效防御力',
-            'flat_parts': [
-                ('基础防御', base_def),
-                ('装备加成', equip_def),
-                ('丹药加成', pill_def),
-                ('临时BUFF(flat)', flat_def),
-                ('称号加成', title_def),
-                ('被动技能', passive_def_flat),
-            ],
-            'rate_parts': [
-                ('临时BUFF(rate)', rate_def),
-                ('红颜/知己加成(1%)', social_rate),
-                ('结婚加成(5%)', spouse_rate),
-                ('副将加成', lt_def_rate),
-                ('VIP加成', vip_rate),
-            ],
-            'flat_sum': def_flat,
-            'rate_sum': def_rate,
-            'result': def_result,
-        }
-
-        # --- Max Health breakdown ---
-        base_hp = target.max_health
-        equip_hp = PlayerService._get_equipment_stat_sum(target, "max_health")
-        pill_hp = target.pill_max_health
-        flat_hp, rate_hp = DataService.get_temp_stat_bonus(target.id, "max_health")
-        passive_hp_flat = passive.get('max_health', 0)
-        title_hp = title_bonuses.get('max_health', 0)
-        lt_hp_rate = PlayerService._get_lt_passive_bonus(target, 'health')
-        hp_flat = base_hp + equip_hp + pill_hp + flat_hp + title_hp + passive_hp_flat
-        hp_rate = 1 + rate_hp + social_rate + spouse_rate + lt_hp_rate + vip_rate
-        hp_result = int(hp_flat * hp_rate)
-
-        details['max_health'] = {
-            'name': '有效生命上限',
-            'flat_parts': [
-                ('基础生命', base_hp),
-                ('装备加成', equip_hp),
-                ('丹药加成', pill_hp),
-                ('临时BUFF(flat)', flat_hp),
-                ('称号加成', title_hp),
-                ('被动技能', passive_hp_flat),
-            ],
-            'rate_parts': [
-                ('临时BUFF(rate)', rate_hp),
-                ('红颜/知己加成(1%)', social_rate),
-                ('结婚加成(5%)', spouse_rate),
-                ('副将加成', lt_hp_rate),
-                ('VIP加成', vip_rate),
-            ],
-            'flat_sum': hp_flat,
-            'rate_sum': hp_rate,
-            'result': hp_result,
-        }
-
-        # --- Max Mana breakdown ---
-        base_mp = target.max_mana
-        equip_mp = PlayerService._get_equipment_stat_sum(target, "max_mana")
-        pill_mp = target.pill_max_mana
-        flat_mp, rate_mp = DataService.get_temp_stat_bonus(target.id, "max_mana")
-        passive_mp_flat = passive.get('max_mana', 0)
-        title_mp = title_bonuses.get('max_mana', 0)
-        lt_mp_rate = PlayerService._get_lt_passive_bonus(target, 'mana')
-        mp_flat = base_mp + equip_mp + pill_mp + flat_mp + title_mp + passive_mp_flat
-        mp_rate = 1 + rate_mp + social_rate + spouse_rate + lt_mp_rate + vip_rate
-        mp_result = int(mp_flat * mp_rate)
-
-        details['max_mana'] = {
-            'name': '有效魔法上限',
-            'flat_parts': [
-                ('基础魔法', base_mp),
-                ('装备加成', equip_mp),
-                ('丹药加成', pill_mp),
-                ('临时BUFF(flat)', flat_mp),
-                ('称号加成', title_mp),
-                ('被动技能', passive_mp_flat),
-            ],
-            'rate_parts': [
-                ('临时BUFF(rate)', rate_mp),
-                ('红颜/知己加成(1%)', social_rate),
-                ('副将加成', lt_mp_rate),
-                ('VIP加成', vip_rate),
-            ],
-            'flat_sum': mp_flat,
-            'rate_sum': mp_rate,
-            'result': mp_result,
-        }
-
-        # --- Crit Rate ---
-        equip_crit = PlayerService._get_equipment_stat_sum(target, "crit_rate")
-        title_crit = title_bonuses.get('crit_rate', 0)
-        lt_crit = PlayerService._get_lt_passive_bonus(target, 'crit')
-        details['crit_rate'] = {
-            'name': '有效暴击率',
-            'flat_parts': [
-                ('基础暴击率', target.crit_rate),
-                ('装备加成', equip_crit),
-                ('被动技能', passive.get('crit_rate', 0)),
-                ('称号加成', title_crit),
-                ('副将加成', lt_crit),
-            ],
-            'rate_parts': [],
-            'flat_sum': target.crit_rate + equip_crit + passive.get('crit_rate', 0) + title_crit + lt_crit,
-            'rate_sum': 1,
-            'result': round(target.crit_rate + equip_crit + passive.get('crit_rate', 0) + title_crit + lt_crit, 4),
-        }
-
-        # --- Dodge Rate ---
-        equip_dodge = PlayerService._get_equipment_stat_sum(target, "dodge_rate")
-        title_dodge = title_bonuses.get('dodge_rate', 0)
-        lt_dodge = PlayerService._get_lt_passive_bonus(target, 'dodge')
-        details['dodge_rate'] = {
-            'name': '有效闪避率',
-            'flat_parts': [
-                ('基础闪避率', target.dodge_rate),
-                ('装备加成', equip_dodge),
-                ('被动技能', passive.get('dodge_rate', 0)),
-                ('称号加成', title_dodge),
-                ('副将加成', lt_dodge),
-            ],
-            'rate_parts': [],
-            'flat_sum': target.dodge_rate + equip_dodge + passive.get('dodge_rate', 0) + title_dodge + lt_dodge,
-            'rate_sum': 1,
-            'result': round(target.dodge_rate + equip_dodge + passive.get('dodge_rate', 0) + title_dodge + lt_dodge, 4),
-        }
+        # 明细与 PlayerService 实际公式同源（EffectiveStats），不再在此重复一遍加成汇总
+        stats = PlayerService.get_stats(target)
+        details = {stat: stats.breakdown(stat) for stat in EffectiveStats.STATS}
 
     return render_template("workbench/view_player.html", target=target, details=details)
 
@@ -542,16 +356,14 @@ def battlefield_test():
         if action == "start":
             # 清除各军团团战加成，开启10分钟测试战，结束后自动按积分占领
             BattlefieldService.reset_territories()
-            BattlefieldService.TEST_WAR_ACTIVE = True
-            BattlefieldService.TEST_WAR_START = time.time()
+            BattlefieldService.start_test_war()
             msg = "军团战测试已开启：已清除各军团团战加成，战场入口开放10分钟，结束后自动按积分占领城市。"
         elif action == "reset":
             # 测试期间重置领地（团战加成失效）
             BattlefieldService.reset_territories()
-            BattlefieldService.TEST_WAR_ACTIVE = False
+            BattlefieldService.stop_test_war()
             msg = "已重置所有领地占领（团战加成失效）。"
         elif action == "stop":
-            BattlefieldService.TEST_WAR_ACTIVE = False
             BattlefieldService._end_test_war()
             msg = "已结束测试战并强制清场（存活玩家被传出战场）。"
 
@@ -559,6 +371,51 @@ def battlefield_test():
     return render_template("workbench/battlefield_test.html", msg=msg, status=status)
 
 
+@workbench_bp.route("/runtime_stats", methods=["GET", "POST"])
+@login_required
+def runtime_stats():
+    """运行监控：进程内缓存命中率、后台任务耗时等运行时计数（仅当前 worker 进程）。"""
+    if not _require_designer():
+        return redirect(url_for('game.scene'))
+
+    from services.stat_cache import StatCache
+    from services.scheduler import Scheduler
+    from services.battle_session import BattleSessionRegistry
+    from services.world_boss_service import WorldBossService
+    from services.sqlite_tuning import SQLiteTuning
+    from services.unit_of_work import UnitOfWork
+    from services.achievement_queue import AchievementQueue
+    from services.startup_timer import StartupTimer
+    from services.schema_migrations import SchemaMigrations
+    from services.static_snapshot import StaticSnapshot
+    msg = None
+    action = request.form.get("action") if request.method == "POST" else None
+    if action == "clear_stat_cache":
+        StatCache.clear()
+        msg = "已清空属性加成缓存。"
+    elif action == "reset_commit_stats":
+        UnitOfWork.reset_metrics()
+        msg = "已清零提交次数统计。"
+    elif action == "run_job":
+        name = request.form.get("job", "")
+        msg = f"已触发任务 {name}，稍后刷新查看结果。" if Scheduler.trigger(name) else f"任务 {name} 不存在。"
+
+    return render_template("workbench/runtime_stats.html", msg=msg,
+                           stat_cache=StatCache.get_metrics(),
+                           jobs=Scheduler.get_metrics(),
+                           battle_sessions=BattleSessionRegistry.get_metrics(),
+                           world_bosses=WorldBossService.get_metrics(),
+                           achievement_queue=AchievementQueue.get_metrics(),
+                           world_graph=DataService.get_world_graph().get_metrics(),
+                           sqlite=SQLiteTuning.get_report(),
+                           startup=StartupTimer.get_report(),
+                           migrations=SchemaMigrations.get_report(),
+                           snapshot=StaticSnapshot.get_report(),
+                           commits=UnitOfWork.get_metrics(),
+                           conflicts=UnitOfWork.get_conflicts(),
+                           job_errors=Scheduler.get_errors()[:10])
+
+
 # ═══════════════════════════════════════════════════════════
 # Equipment Design System (装备设计系统)
 # ═══════════════════════════════════════════════════════════
@@ -784,6 +641,7 @@ def equip_add():
 
         # 刷新缓存
         DataService._cache['equipment_templates'][template_id] = tpl
+        DataService.invalidate_monster_prototypes()
 
         flash(f"装备 '{tpl.get('name', template_id)}' 已添加到 {target_file}")
         return redirect(url_for('workbench.equip_view', template_id=template_id))
@@ -925,6 +783,7 @@ def equip_add_set():
         # 刷新缓存
         for tid, tpl in items.items():
             DataService._cache['equipment_templates'][tid] = tpl
+        DataService.invalidate_monster_prototypes()
 
         flash(f"套装 '{set_name}' ({len(items)}件) 已添加到 {target_file}")
         return redirect(url_for('workbench.equip_design'))
@@ -973,6 +832,7 @@ def equip_edit(template_id):
 
         # 刷新缓存
         DataService._cache['equipment_templates'][template_id] = tpl
+        DataService.invalidate_monster_prototypes()
 
         flash(f"装备 '{tpl.get('name', template_id)}' 已更新")
         return redirect(url_for('workbench.equip_view', template_id=template_id))
@@ -1016,6 +876,7 @@ def equip_delete(template_id):
                 _save_set_file(source_file, data)
                 # 刷新缓存
                 DataService._cache['equipment_templates'].pop(template_id, None)
+                DataService.invalidate_monster_prototypes()
                 flash(f"装备 '{template.get('name', template_id)}' 已从 {source_file} 删除")
             else:
                 flash("文件中未找到该装备")
@@ -1480,6 +1341,7 @@ def monster_add():
 
         # 刷新缓存
         DataService._cache['monsters'][monster_id] = monster_data
+        DataService.rebuild_scene_index()
 
         flash(f"怪物 '{monster_data.get('name', monster_id)}' 已添加到 {target_file}")
         return redirect(url_for('workbench.monster_view', monster_id=monster_id))
@@ -1535,6 +1397,7 @@ def monster_edit(monster_id):
 
         # 刷新缓存
         DataService._cache['monsters'][monster_id] = monster_data
+        DataService.rebuild_scene_index()
 
         flash(f"怪物 '{monster_data.get('name', monster_id)}' 已更新")
         return redirect(url_for('workbench.monster_view', monster_id=monster_id))
@@ -1587,6 +1450,7 @@ def monster_delete(monster_id):
                     _save_monster_data(data)
                 # 刷新缓存
                 DataService._cache['monsters'].pop(monster_id, None)
+                DataService.rebuild_scene_index()
                 flash(f"怪物 '{monster.get('name', monster_id)}' 已从 {source_file} 删除")
             else:
                 flash("文件中未找到该怪物")
@@ -28,12 +28,35 @@ class Config:
     # check_same_thread=False: threaded=True 下允许跨线程访问(配合连接池每线程独立连接)
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{get_instance_path() / "game_data.db"}?check_same_thread=False'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite 文件库时 services/sqlite_tuning.py 会去掉 pool_pre_ping/pool_recycle 并指定连接池类型
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_size': 10,
         'max_overflow': 20,
         'pool_pre_ping': True,
         'pool_recycle': 1800,
     }
+    # 每个新 SQLite 连接执行的 PRAGMA；启动时读回自检，结果见工作台运行监控
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',       # 写事务不阻塞读
+        'synchronous': 'NORMAL',     # WAL 下掉电最多丢最近的提交，不会损坏库
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000')),  # 毫秒；锁被占时等待而非立即报错
+        'cache_size': -32000,        # 负数单位 KiB：每连接约 32MB 页缓存
+        'mmap_size': 268435456,      # 256MB 内存映射读
+        'temp_store': 'MEMORY',      # 排序/临时表放内存
+    }
+    # 跨进程共享运行态（世界BOSS/地面物品/在线/劫匪/战场/股市/组队）与各缓存的失效计数：
+    # memory=进程内（只能单 worker），sqlite=存到下面这个 WAL 文件（多 worker 共用），
+    # 见 services/shared_state.py 与 gunicorn_config.py
+    SHARED_STATE_BACKEND = os.environ.get('SHARED_STATE_BACKEND', 'memory')
+    SHARED_STATE_PATH = os.environ.get('SHARED_STATE_PATH', str(get_instance_path() / "shared_state.db"))
+    # 静态配置（data/*.json）解析结果的快照，源文件或构建代码变动后自动重建（services/static_snapshot.py）；
+    # 设 0 则每次启动都解析 JSON
+    STATIC_SNAPSHOT = os.environ.get('STATIC_SNAPSHOT', '1') != '0'
+    # 是否在 create_app 里启动后台调度线程；gunicorn 配置里设 0，改由各 worker 在 post_worker_init 启动
+    SCHEDULER_AUTOSTART = os.environ.get('SCHEDULER_AUTOSTART', '1') != '0'
+    STATIC_SNAPSHOT_PATH = os.environ.get('STATIC_SNAPSHOT_PATH', str(get_instance_path() / "static_snapshot.pickle"))
+    # 成就检查交给后台线程批量判定（services/achievement_queue.py）；设 0 则在请求内同步检查
+    ACHIEVEMENT_QUEUE = os.environ.get('ACHIEVEMENT_QUEUE', '1') != '0'
     # 关闭部署态下的模板逐请求重编译（性能优化）。需要本地热改模板时把 DEBUG 设为 True。
     DEBUG = False
     TEMPLATES_AUTO_RELOAD = DEBUG
\ No newline at end of file
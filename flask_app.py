@@ -12,6 +12,8 @@ login_manager = LoginManager()
 
 
 def create_app():
+    from services.startup_timer import StartupTimer
+    StartupTimer.start()
     app = Flask(__name__)
     app.config['TEMPLATES_AUTO_RELOAD'] = True
 
@@ -24,8 +26,14 @@ def create_app():
     instance_config = Path(app.instance_path) / 'config.py'
     if instance_config.exists():
         app.config.from_pyfile(instance_config)
+    StartupTimer.mark('配置')
 
+    from services.sqlite_tuning import SQLiteTuning
+    SQLiteTuning.configure(app)  # 连接池参数须在 db.init_app 之前定好
     db.init_app(app)
+    SQLiteTuning.init_app(app)   # 连接时 PRAGMA + 自检
+    from services.unit_of_work import UnitOfWork
+    UnitOfWork.init_app(app)     # 请求级提交合并，须先于其他 before_request 注册
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login_page'
     login_manager.login_message = None
@@ -34,7 +42,13 @@ def create_app():
     def load_user(user_id):
         return PlayerModel.query.get(int(user_id))
 
+    from services.shared_state import SharedState
+    SharedState.init_app(app)
+    StartupTimer.mark('数据库与共享状态')
     DataService.init_app(app)
+    StartupTimer.mark('静态数据')
+    from services.achievement_queue import AchievementQueue
+    AchievementQueue.init_app(app)
 
     @app.before_request
     def track_online():
@@ -45,6 +59,7 @@ def create_app():
 
     from services.world_boss_service import WorldBossService
     WorldBossService.init_bosses()
+    StartupTimer.mark('世界BOSS')
 
     from blueprints.auth import auth_bp
     from blueprints.game import game_bp
@@ -107,99 +122,20 @@ def create_app():
         from flask import redirect, url_for
         return redirect(url_for('game.scene'))
 
+    StartupTimer.mark('蓝图与钩子')
+
     with app.app_context():
         db.create_all()
-        # 为已有数据库添加新列（SQLite 不支持 ALTER TABLE ADD COLUMN IF NOT EXISTS）
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN player_uid VARCHAR(10)"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN is_designer BOOLEAN DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN warehouse_gold INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN backpack_capacity INTEGER DEFAULT 20"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN warehouse_capacity INTEGER DEFAULT 20"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE lieutenant ADD COLUMN tier INTEGER DEFAULT 3"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE legions ADD COLUMN battle_points INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE legion_members ADD COLUMN quest_count INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE legion_members ADD COLUMN quest_date VARCHAR(10) DEFAULT ''"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE legion_members ADD COLUMN personal_battle_points INTEGER DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN in_battlefield BOOLEAN DEFAULT 0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN battlefield_city VARCHAR(32)"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN battlefield_death_time FLOAT DEFAULT 0.0"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE legions ADD COLUMN occupied_cities_raw TEXT DEFAULT '[]'"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        try:
-            db.session.execute(db.text("ALTER TABLE players ADD COLUMN party_id INTEGER"))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        # 为没有 player_uid 的旧玩家生成 UID
-        import random
-        import string
-        from models.player import PlayerModel
-        players_without_uid = PlayerModel.query.filter(
-            PlayerModel.player_uid == None).all()
-        for p in players_without_uid:
-            while True:
-                uid = ''.join(random.choices(string.digits + string.ascii_lowercase, k=10))
-                if not PlayerModel.query.filter_by(player_uid=uid).first():
-                    break
-            p.player_uid = uid
-        if players_without_uid:
-            db.session.commit()
-
+        StartupTimer.mark('建表')
+        # 旧库补列、补索引、数据修补：按 schema_version 只执行尚未执行的迁移（services.schema_migrations）
+        from services.schema_migrations import SchemaMigrations
+        SchemaMigrations.run(app)
+        StartupTimer.mark('库结构迁移')
+        # 上次进程被强杀时残留在 achievement_events 的成就事件，同步补判（services.achievement_queue）
+        AchievementQueue.recover(app)
+        StartupTimer.mark('成就补判')
+
+    StartupTimer.finish(app)
     return app
 
 
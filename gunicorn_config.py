@@ -1,7 +1,16 @@
-# Gunicorn 配置 - 单进程16线程
-# 原因：世界Boss/地面物品/劫匪等状态存进程内存(WorldBossService._bosses等类级dict)，
-# 多worker下各进程内存独立、击杀状态会分裂(玩家杀BOSS后请求落到别的worker还能再打)。
-# 单worker保证内存唯一，gthread线程池扛并发；--preload让init_bosses()在启动期完成。
+# Gunicorn 配置 - 默认单进程16线程；SHARED_STATE_BACKEND=sqlite 时可开多个 worker（-w N）
+# 世界Boss/地面物品/在线玩家/劫匪/战场/股市行情与委托簿/组队等运行态经 services.shared_state 读写：
+#   - memory（默认）：存在进程内，只能 1 个 worker，on_starting 拒绝以多于1个worker启动（含 -w 命令行参数）；
+#   - sqlite：存到 SHARED_STATE_PATH 的 WAL 库，各 worker 共用。
+# sqlite 后端下其余进程内缓存靠 shared_state 的 generation 计数器跨进程失效：
+#   - 属性加成缓存 StatCache：每个请求首次读取时比对玩家/军团计数器
+#   - 排行榜 LeaderboardService、集市搜索索引 MarketSearchIndex：定期比对计数器，变了整体重建
+#   - 公聊 ChatBus：别的 worker 发言后从 chat_messages 补拉
+#   - PvE战斗会话 BattleSessionRegistry：每次提交写检查点，检查点被别的 worker 推进过就从库里恢复
+# 后台任务（调度器、成就队列）在 post_worker_init 里于每个 worker 内启动，master 不起线程
+# （raw_env 设 SCHEDULER_AUTOSTART=0）；共享任务由持有租约的一个worker执行。成就队列在新 worker 里
+# 先补判 achievement_events 残留行，被超时杀掉后重新 fork 的 worker 也会接手前一个进程的事件。
+# --preload让init_bosses()在启动期完成。
 # 2核机器上单worker×16线程 IO密集文本页 QPS~300+/s，远超200-400人在线峰值(~100QPS)。
 # --timeout 60 兜底单请求卡死(会被杀重启worker)。
 
@@ -16,3 +25,21 @@ daemon = True
 accesslog = "/tmp/gunicorn_access.log"
 errorlog = "/tmp/gunicorn_error.log"
 access_log_format = '%(h)s "%(r)s" %(s)s %(b)s'
+raw_env = ["SCHEDULER_AUTOSTART=0"]
+
+
+def on_starting(server):
+    if server.cfg.workers > 1:
+        # preload_app 已在 master 里建好应用，SharedState 即配置的后端
+        from services.shared_state import SharedState
+        if SharedState.is_shared():
+            return
+        msg = (f"workers={server.cfg.workers}：SHARED_STATE_BACKEND=memory 时运行态只在进程内，"
+               "只能以 1 个 worker 运行；多 worker 请设 SHARED_STATE_BACKEND=sqlite（见 gunicorn_config.py）")
+        server.log.error(msg)  # daemon 模式下 stderr 已重定向，错误日志里才看得到
+        raise RuntimeError(msg)
+
+
+def post_worker_init(worker):
+    from services.maintenance_service import MaintenanceService
+    MaintenanceService.start_worker(worker.wsgi)
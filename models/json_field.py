@@ -0,0 +1,295 @@
+"""模型 JSON 文本列的访问描述符：每次加载只解析一次，原地修改自动标脏，flush 前统一序列化一次。
+
+原来 PlayerModel.activity_data 这类属性每读一次 json.loads、每写一次 json.dumps，
+场景页、战斗结算、理财一个请求里要对同一列反复解析十几次；而且每次读到的都是新副本，
+两处代码各改各的副本再先后写回，后写的会覆盖先写的（场景页因此要按差异合并）。
+
+JSONField 挂在原有的 ``*_raw`` 文本列之上：
+
+- 读：按实例缓存解析结果，以 raw 列当前值的「对象身份」判断是否仍有效——commit/rollback/expire
+  后 raw 列重新载入成新的字符串对象，缓存自然作废，即「每次加载解析一次」；
+  同一次加载内各处拿到的是同一个 TrackedDict/TrackedList；
+- 改：容器的顶层修改（``d[k] = v``、``pop``、``append`` 等）把该列标脏（flag_modified），
+  嵌套层的修改感知不到，仍需像以前一样整体赋值回去（``player.x = d``），赋值总会标脏；
+- 写：Session before_flush 时把脏字段各序列化一次写回 raw 列；结果与原文相同则不产生 UPDATE。
+  写回走普通属性赋值，StatCache 等监听 raw 列 set 事件的逻辑照常生效。
+
+直接给 raw 列赋值（或给描述符赋 str）仍然有效，且优先于尚未写回的容器改动。
+装有 orjson 时用它编解码，否则用标准库 json。列里的文本是标准库 json.dumps 写的，
+orjson 不认的内容（NaN/Infinity、超出 64 位的整数）读时改用标准库解析，不丢精度。
+
+raw 非空却解析失败时，读到的是不回写的默认值：修改它不标脏，整体赋值也不写回（记 warning），
+原文保留在库里待人工修复，不会被默认值覆盖。
+"""
+import json
+import re
+import weakref
+
+from flask import current_app, has_app_context
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+
+_CACHE_KEY = '_json_fields'  # 实例 __dict__ 里的缓存：{字段名: _Entry}
+
+
+def dumps(value):
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:  # 超出 64 位的整数等 orjson 不支持的值
+            pass
+    return json.dumps(value, ensure_ascii=False)
+
+
+_LONG_DIGITS = re.compile(r'\d{20}')  # 可能超出 64 位的整数：orjson 会读成 float
+
+
+def loads(text):
+    if orjson is not None and not _LONG_DIGITS.search(text):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:  # NaN/Infinity 等 json.dumps 写得出、orjson 不认的文本
+            pass
+    return json.loads(text)
+
+
+def _warn(msg, *args):
+    if has_app_context():
+        current_app.logger.warning(msg, *args)
+
+
+class _Entry:
+    __slots__ = ('raw', 'value', 'dirty', 'broken')
+
+    def __init__(self, raw, value, broken=False):
+        self.raw = raw        # 解析来源的 raw 列字符串（按身份比较）
+        self.value = value
+        self.dirty = False
+        self.broken = broken  # raw 非空但解析失败：value 是不回写的默认值
+
+
+class _Tracked:
+    """TrackedDict/TrackedList 的公共部分：记住所属实例和字段，修改时通知字段标脏。"""
+    __slots__ = ()
+
+    def _bind(self, instance, field):
+        self._owner = weakref.ref(instance)
+        self._field = field
+        return self
+
+    def _changed(self):
+        owner = self._owner() if self._owner is not None else None
+        if owner is not None:
+            self._field.mark_dirty(owner, self)
+
+
+class TrackedDict(_Tracked, dict):
+    __slots__ = ('_owner', '_field')
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._owner = None
+        self._field = None
+
+    def __setitem__(self, key, value):
+        # 标量写入相同值不算修改（如每次刷新都写一遍的已读标记）；容器可能在嵌套层改过，一律标脏
+        if not isinstance(value, (dict, list)) and key in self and dict.__getitem__(self, key) == value:
+            return
+        dict.__setitem__(self, key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._changed()
+
+    def pop(self, key, *default):
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = dict.pop(self, key)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self._changed()
+        return item
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return dict.__getitem__(self, key)
+        dict.__setitem__(self, key, default)
+        self._changed()
+        return default
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._changed()
+
+    def __ior__(self, other):
+        dict.update(self, other)
+        self._changed()
+        return self
+
+    def clear(self):
+        if self:
+            dict.clear(self)
+            self._changed()
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self),)
+
+
+class TrackedList(_Tracked, list):
+    __slots__ = ('_owner', '_field')
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self._owner = None
+        self._field = None
+
+    def _mutator(name):
+        method = getattr(list, name)
+
+        def wrapper(self, *args):
+            result = method(self, *args)
+            self._changed()
+            return result
+        wrapper.__name__ = name
+        return wrapper
+
+    __setitem__ = _mutator('__setitem__')
+    __delitem__ = _mutator('__delitem__')
+    append = _mutator('append')
+    extend = _mutator('extend')
+    insert = _mutator('insert')
+    pop = _mutator('pop')
+    remove = _mutator('remove')
+    clear = _mutator('clear')
+    sort = _mutator('sort')
+    reverse = _mutator('reverse')
+    __iadd__ = _mutator('__iadd__')
+    __imul__ = _mutator('__imul__')
+    del _mutator
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+
+class JSONField:
+    """挂在 JSON 文本列上的描述符：``activity_data = JSONField('activity_data_raw', dict)``。
+
+    default 为 raw 为空或解析失败时的值的工厂（dict/list）。
+    """
+
+    def __init__(self, raw_attr, default=dict):
+        self.raw_attr = raw_attr
+        self.default = default
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    @staticmethod
+    def _cache(instance):
+        cache = instance.__dict__.get(_CACHE_KEY)
+        if cache is None:
+            cache = instance.__dict__[_CACHE_KEY] = {}
+        return cache
+
+    def _current(self, instance):
+        """当前有效的缓存项；raw 列未载入或已被替换时返回 None。"""
+        entry = instance.__dict__.get(_CACHE_KEY, {}).get(self.name)
+        if entry is None or self.raw_attr not in instance.__dict__:
+            return None
+        return entry if instance.__dict__[self.raw_attr] is entry.raw else None
+
+    def _wrap(self, instance, value):
+        if isinstance(value, _Tracked):
+            value = dict(value) if isinstance(value, dict) else list(value)
+        if isinstance(value, dict):
+            return TrackedDict(value)._bind(instance, self)
+        if isinstance(value, list):
+            return TrackedList(value)._bind(instance, self)
+        return value
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        raw = getattr(instance, self.raw_attr)  # 延迟加载的列在这里随组载入
+        entry = self._current(instance)
+        if entry is not None:
+            return entry.value
+        if not raw:
+            value = self._wrap(instance, self.default())
+        else:
+            try:
+                value = self._wrap(instance, loads(raw))
+            except (ValueError, TypeError) as e:
+                _warn("%s.%s 的 JSON 无法解析，按默认值只读（不回写）：%r",
+                      type(instance).__name__, self.name, e)
+                entry = self._cache(instance)[self.name] = _Entry(raw, self.default(), broken=True)
+                return entry.value
+        entry = self._cache(instance)[self.name] = _Entry(raw, value)
+        return entry.value
+
+    def __set__(self, instance, value):
+        if isinstance(value, str):
+            # 直接给出 JSON 文本：照旧写 raw 列，缓存作废
+            self._cache(instance).pop(self.name, None)
+            setattr(instance, self.raw_attr, value)
+            return
+        entry = self._current(instance)
+        if entry is not None and entry.broken:
+            # 读到的是代替坏数据的默认值，由它改出来的值写回会抹掉原文
+            _warn("%s.%s 的 JSON 无法解析，忽略本次赋值以保留原文", type(instance).__name__, self.name)
+            return
+        if entry is None:
+            # raw 列未载入（延迟加载/已过期）时不为赋值专门查库，直接序列化写入
+            raw = dumps(value)
+            setattr(instance, self.raw_attr, raw)
+            self._cache(instance)[self.name] = _Entry(raw, self._wrap(instance, value))
+            return
+        if value is not entry.value:
+            entry.value = self._wrap(instance, value)
+        # 整体赋值总会标脏：嵌套层的修改只能靠赋值感知
+        entry.dirty = True
+        flag_modified(instance, self.raw_attr)
+
+    def mark_dirty(self, instance, value):
+        entry = self._current(instance)
+        if entry is None or entry.value is not value or entry.dirty:
+            return  # 已过期的旧容器的修改不再生效（与以前改副本不写回的行为一致）
+        entry.dirty = True
+        flag_modified(instance, self.raw_attr)
+
+    def flush(self, instance):
+        """把脏值序列化写回 raw 列；before_flush 调用。"""
+        entry = self._current(instance)
+        if entry is None or not entry.dirty:
+            return
+        entry.dirty = False
+        raw = dumps(entry.value)
+        if raw == entry.raw:
+            set_committed_value(instance, self.raw_attr, entry.raw)  # 撤销标脏，不产生 UPDATE
+            return
+        setattr(instance, self.raw_attr, raw)
+        entry.raw = raw
+
+
+@event.listens_for(Session, 'before_flush')
+def _flush_json_fields(session, flush_context, instances):
+    for obj in list(session.dirty) + list(session.new):
+        cache = obj.__dict__.get(_CACHE_KEY)
+        if not cache:
+            continue
+        for name, entry in list(cache.items()):
+            if entry.dirty:
+                getattr(type(obj), name).flush(obj)
@@ -1,6 +1,6 @@
 from services import db
+from models.json_field import JSONField
 from datetime import datetime
-import json
 
 
 class Legion(db.Model):
@@ -59,18 +59,7 @@ class Legion(db.Model):
     def can_upgrade(self):
         return self.level < self.MAX_LEVEL
 
-    @property
-    def occupied_cities(self):
-        if self.occupied_cities_raw:
-            try:
-                return json.loads(self.occupied_cities_raw)
-            except (json.JSONDecodeError, TypeError):
-                return []
-        return []
-
-    @occupied_cities.setter
-    def occupied_cities(self, value):
-        self.occupied_cities_raw = json.dumps(value, ensure_ascii=False)
+    occupied_cities = JSONField('occupied_cities_raw', list)
 
 
 class LegionMember(db.Model):
@@ -89,6 +78,8 @@ class LegionMember(db.Model):
     quest_date = db.Column(db.String(10), default='')
     personal_battle_points = db.Column(db.Integer, default=0)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=0)  # 乐观锁（贡献/签到/捐献计数）
+    __mapper_args__ = {'version_id_col': version}
 
     player = db.relationship('PlayerModel', backref='legion_member_record')
 
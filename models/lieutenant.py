@@ -1,5 +1,6 @@
 import math
 from services import db
+from models.json_field import JSONField
 from flask_login import UserMixin
 
 
@@ -73,17 +74,7 @@ class Lieutenant(db.Model):
     def class_name(self):
         return CLASS_NAMES.get(self.class_type, '战士')
 
-    @property
-    def skills(self):
-        import json
-        if not self.skills_raw:
-            return []
-        return json.loads(self.skills_raw)
-
-    @skills.setter
-    def skills(self, value):
-        import json
-        self.skills_raw = json.dumps(value, ensure_ascii=False)
+    skills = JSONField('skills_raw', list)
 
     @property
     def quality_mult(self):
@@ -1,51 +1,172 @@
+import operator
 import random
 from services.data_service import DataService
 
 
+def _restore_prototype(values):
+    proto = object.__new__(MonsterPrototype)
+    for name, value in zip(MonsterPrototype.__slots__, values):
+        object.__setattr__(proto, name, value)
+    return proto
+
+
+class MonsterPrototype:
+    """一条怪物配置编译后的只读原型：静态字段 + 预处理好的掉落表。
+
+    DataService 按 monster_id 缓存，同一配置只编译一次；Monster 实例只是原型之上的一层
+    战斗状态（血蓝、回合日志），场景列表与遭遇战不再逐个复制三十来个字段，
+    击杀掉落也不必每次重新清洗稀有度权重、筛选模板池。
+    source 记录编译所用的配置 dict，配置被整体替换（工作台编辑）时据此判断原型过期。
+    """
+    __slots__ = ('monster_id', 'source', 'name', 'level', 'killable', 'immortal', 'description',
+                 'is_elite', 'is_one_time_elite', 'is_divine_beast', 'is_copy', 'copy_only',
+                 'copy_dungeon_id', 'copy_stage', 'copy_role',
+                 'health', 'max_health', 'mana', 'max_mana', 'attack', 'defense',
+                 'crit_rate', 'dodge_rate', 'skills', 'drops', 'guaranteed_items',
+                 'artifact_drop', 'artifact_drop_rate',
+                 'equip_drop_rate', 'template_ids', 'template_cum_weights',
+                 'rarity_table', 'star_range', 'star_table', 'item_drops')
+
+    # 透传给 Monster 实例的只读字段
+    STATIC_FIELDS = ('monster_id', 'name', 'level', 'killable', 'immortal', 'description',
+                     'is_elite', 'is_one_time_elite', 'is_divine_beast', 'is_copy', 'copy_only',
+                     'copy_dungeon_id', 'copy_stage', 'copy_role', 'max_mana', 'attack',
+                     'defense', 'crit_rate', 'dodge_rate', 'skills', 'drops',
+                     'guaranteed_items', 'artifact_drop', 'artifact_drop_rate')
+
+    def __init__(self, monster_id, data):
+        from services.equipment_generator import EquipmentGenerator
+        s = object.__setattr__
+        s(self, 'monster_id', monster_id)
+        s(self, 'source', data)
+        s(self, 'is_elite', data.get("is_elite", False))
+        s(self, 'is_one_time_elite', data.get("is_one_time_elite", False))
+        s(self, 'is_divine_beast', data.get("is_divine_beast", False))
+        s(self, 'is_copy', data.get("is_copy", False) or data.get("copy_only", False))
+        s(self, 'copy_only', data.get("copy_only", False))
+        s(self, 'copy_dungeon_id', data.get("copy_dungeon_id"))
+        s(self, 'copy_stage', data.get("copy_stage"))
+        s(self, 'copy_role', data.get("copy_role"))
+        s(self, 'name', data["name"])
+        s(self, 'level', data["level"])
+        s(self, 'killable', data["killable"])
+        s(self, 'immortal', data["immortal"])
+        s(self, 'description', data["description"])
+
+        stats = data["base_stats"]
+        s(self, 'health', stats.get("current_health", stats["health"]))
+        s(self, 'max_health', stats["max_health"] if "max_health" in stats else stats["health"])
+        s(self, 'mana', stats["mana"])
+        s(self, 'max_mana', stats["mana"])
+        s(self, 'attack', stats["attack"])
+        s(self, 'defense', stats["defense"])
+        s(self, 'crit_rate', stats["crit_rate"])
+        s(self, 'dodge_rate', stats["dodge_rate"])
+
+        s(self, 'skills', data["skills"])
+        s(self, 'drops', data["drops"])
+        s(self, 'guaranteed_items', data.get("guaranteed_items", []))
+        equip_cfg = data.get("drops", {}).get("equipment_drop", {})
+        s(self, 'artifact_drop', equip_cfg.get("artifact_template"))
+        s(self, 'artifact_drop_rate', equip_cfg.get("artifact_drop_rate", 0.05))
+
+        # 装备掉落：模板池只保留存在且非神器的模板（怪物来源不掉神器模板），权重预先累计
+        s(self, 'equip_drop_rate', equip_cfg.get("drop_rate", 0.0))
+        pool = equip_cfg.get("templates", self.drops.get("equipment_templates", [])) or []
+        valid = []
+        for tid in pool:
+            template = DataService.get_equipment_template(tid)
+            if template and not template.get("is_artifact", False):
+                valid.append(tid)
+        template_weights = equip_cfg.get("template_weights")
+        cum = None
+        if valid and template_weights and len(template_weights) == len(pool):
+            pairs = [(tid, w) for tid, w in zip(pool, template_weights) if tid in valid]
+            valid = [tid for tid, _ in pairs]
+            cum = EquipmentGenerator.cumulate(w for _, w in pairs)
+        s(self, 'template_ids', tuple(valid))
+        s(self, 'template_cum_weights', cum)
+
+        rarity_weights = equip_cfg.get(
+            "rarity_weights_elite" if self.is_elite else "rarity_weights")
+        rarity_weights = Monster._sanitize_monster_rarity_weights(rarity_weights, self.is_elite)
+        s(self, 'rarity_table', EquipmentGenerator.compile_rarity_weights(
+            rarity_weights, allow_legendary=False))
+        star_range = None
+        if "star_min" in equip_cfg or "star_max" in equip_cfg:
+            star_range = (int(equip_cfg.get("star_min", 1)), int(equip_cfg.get("star_max", 5)))
+        s(self, 'star_range', star_range)
+        s(self, 'star_table', EquipmentGenerator.compile_star_weights(equip_cfg.get("star_weights")))
+        s(self, 'item_drops', tuple(self.drops.get("items", {}).items()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"MonsterPrototype 只读：{name}")
+
+    def __reduce__(self):
+        # 静态数据快照（services.static_snapshot）：默认的 slots 还原要走 __setattr__
+        return _restore_prototype, (tuple(getattr(self, name) for name in self.__slots__),)
+
+    def roll_equipment(self):
+        """按预编译的表抽一件装备：{"template_id", "rarity", "stars"}；模板池为空时返回 None。"""
+        from services.equipment_generator import EquipmentGenerator
+        if not self.template_ids:
+            return None
+        if self.template_cum_weights:
+            template_id = random.choices(self.template_ids, cum_weights=self.template_cum_weights, k=1)[0]
+        else:
+            template_id = random.choice(self.template_ids)
+        if not DataService.get_equipment_template(template_id):
+            return None  # 编译后模板被删除
+        rarity = EquipmentGenerator.roll_rarity_from_table(self.rarity_table, is_elite=True)
+        if self.star_range:
+            stars = random.randint(*self.star_range)
+        elif self.star_table:
+            stars = random.choices(self.star_table[0], cum_weights=self.star_table[1], k=1)[0]
+        else:
+            stars = EquipmentGenerator.roll_stars()
+        return {
+            "template_id": template_id,
+            "rarity": rarity,
+            "stars": stars,
+        }
+
+
 class Monster:
+    """怪物实例：原型 + 本场战斗的可变状态（血蓝、回合日志）及场景页标记。"""
+    __slots__ = ('proto', 'health', 'max_health', 'mana',
+                 'last_damage_taken', 'last_damage_dealt', 'last_action', 'last_skill',
+                 'respawning', 'respawn_remaining',
+                 'is_barbarian_leader', 'is_bandit', 'task_icon', 'has_quest', 'has_completable')
+
     MONSTER_ALLOWED_RARITIES = {
         False: {"common", "uncommon", "普通", "精良"},
         True: {"uncommon", "rare", "epic", "精良", "卓越", "史诗"},
     }
 
     def __init__(self, monster_id, data):
-        self.monster_id = monster_id
-        self.is_elite = data.get("is_elite", False)
-        self.is_one_time_elite = data.get("is_one_time_elite", False)
-        self.is_divine_beast = data.get("is_divine_beast", False)
-        self.is_copy = data.get("is_copy", False) or data.get("copy_only", False)
-        self.copy_only = data.get("copy_only", False)
-        self.copy_dungeon_id = data.get("copy_dungeon_id")
-        self.copy_stage = data.get("copy_stage")
-        self.copy_role = data.get("copy_role")
-        self.name = data["name"]
-        self.level = data["level"]
-        self.killable = data["killable"]
-        self.immortal = data["immortal"]
-        self.description = data["description"]
-
-        stats = data["base_stats"]
-        self.health = stats.get("current_health", stats["health"])
-        self.max_health = stats["max_health"] if "max_health" in stats else stats["health"]
-        self.mana = stats["mana"]
-        self.max_mana = stats["mana"]
-        self.attack = stats["attack"]
-        self.defense = stats["defense"]
-        self.crit_rate = stats["crit_rate"]
-        self.dodge_rate = stats["dodge_rate"]
-
-        self.skills = data["skills"]
-        self.drops = data["drops"]
-        equip_cfg = data.get("drops", {}).get("equipment_drop", {})
-        self.artifact_drop = equip_cfg.get("artifact_template")
-        self.artifact_drop_rate = equip_cfg.get("artifact_drop_rate", 0.05)
+        """由配置或旧版整包遭遇 dict 构造；data 就是缓存中的配置时复用其原型。"""
+        if DataService.get_monster(monster_id) is data:
+            proto = DataService.get_monster_prototype(monster_id)
+        else:
+            proto = MonsterPrototype(monster_id, data)
+        self._init_state(proto)
         self.last_damage_taken = data.get("last_damage_taken", 0)
         self.last_damage_dealt = data.get("last_damage_dealt", "")
         self.last_action = data.get("last_action", "")
         self.last_skill = data.get("last_skill", "")
+
+    def _init_state(self, proto):
+        self.proto = proto
+        self.health = proto.health
+        self.max_health = proto.max_health
+        self.mana = proto.mana
+        self.last_damage_taken = 0
+        self.last_damage_dealt = self.last_action = self.last_skill = ""
         self.respawning = False
         self.respawn_remaining = 0
-        self.guaranteed_items = data.get("guaranteed_items", [])
+        self.is_barbarian_leader = self.is_bandit = False
+        self.has_quest = self.has_completable = False
+        self.task_icon = None
 
     @classmethod
     def _sanitize_monster_rarity_weights(cls, weights, is_elite):
@@ -60,16 +181,22 @@ class Monster:
 
         return sanitized or None
 
+    @classmethod
+    def from_prototype(cls, proto):
+        monster = cls.__new__(cls)
+        monster._init_state(proto)
+        return monster
+
     @classmethod
     def create_monster(cls, monster_id):
-        monsters = DataService.get_monsters()
-        if monster_id in monsters:
-            return cls(monster_id, monsters[monster_id])
-        return None
+        proto = DataService.get_monster_prototype(monster_id)
+        return cls.from_prototype(proto) if proto is not None else None
 
     @classmethod
     def from_dict(cls, monster_id, data):
         """Create a Monster from a dict (either cached data or encounter data)."""
+        if DataService.get_monster(monster_id) is data:
+            return cls.create_monster(monster_id)
         return cls(monster_id, data)
 
     def attack_player(self, player):
@@ -97,30 +224,9 @@ class Monster:
             return 0
 
     def get_loot(self):
-        from services.equipment_service import EquipmentService
-        equip_cfg = self.drops.get("equipment_drop", {})
-        drop_rate = equip_cfg.get("drop_rate", 0.0)
-        if random.random() < drop_rate:
-            pool = equip_cfg.get("templates", self.drops.get("equipment_templates", []))
-            template_weights = equip_cfg.get("template_weights")
-            rarity_weights = equip_cfg.get(
-                "rarity_weights_elite" if self.is_elite else "rarity_weights")
-            rarity_weights = self._sanitize_monster_rarity_weights(rarity_weights, self.is_elite)
-            star_range = None
-            if "star_min" in equip_cfg or "star_max" in equip_cfg:
-                star_range = (equip_cfg.get("star_min", 1), equip_cfg.get("star_max", 5))
-            star_weights = equip_cfg.get("star_weights")
-
-            from services.equipment_generator import EquipmentGenerator, EquipmentSource
-            roll = EquipmentGenerator.generate_from_pool(
-                source=EquipmentSource.MONSTER,
-                template_pool=pool,
-                template_weights=template_weights,
-                template_loader=DataService.get_equipment_template,
-                rarity_weights=rarity_weights,
-                star_range=star_range,
-                star_weights=star_weights,
-            )
+        proto = self.proto
+        if random.random() < proto.equip_drop_rate:
+            roll = proto.roll_equipment()
             if roll:
                 return roll
 
@@ -134,7 +240,7 @@ class Monster:
                     "stars": stars,
                 }
 
-        for item_id, chance in self.drops.get("items", {}).items():
+        for item_id, chance in proto.item_drops:
             if random.random() < chance:
                 return ("item", item_id)
         return None
@@ -148,3 +254,9 @@ class Monster:
     def reset_health(self):
         if self.immortal:
             self.health = self.max_health
+
+
+# 静态字段直接读原型（只读属性）
+for _name in MonsterPrototype.STATIC_FIELDS:
+    setattr(Monster, _name, property(operator.attrgetter('proto.' + _name)))
+del _name
@@ -5,6 +5,7 @@ import uuid
 from datetime import datetime
 from flask_login import UserMixin
 from services import db
+from models.json_field import JSONField
 
 
 class PlayerModel(db.Model, UserMixin):
@@ -87,18 +88,26 @@ class PlayerModel(db.Model, UserMixin):
     blood_reserve_enabled = db.Column(db.Boolean, default=False)
     mana_reserve_enabled = db.Column(db.Boolean, default=False)
 
+    # JSON 大字段一律延迟加载：请求入口 load_user 与场景同地点玩家列表只取标量列，
+    # 首次访问某个字段时按分组一条 SELECT 取回同组全部字段。分组按一起读写的功能划分：
+    #   scene       场景页每次都读（活动数据、通知、结交邀请、足迹、任务）
+    #   battle      战斗遇怪与快捷栏        kill_stats  击杀/使用统计（成就、战斗结算）
+    #   social      仇人/好友/黑名单        chat        私聊记录
+    #   titles / finance / vip              各自页面单独使用
+    # 批量查询其他玩家并读取这些字段时，用 .options(db.undefer_group('组名')) 随主查询一并取回。
+
     # Quest system: JSON tracking {quest_id: progress, ...}
-    active_quests = db.Column(db.Text, default='{}')
-    completed_quests = db.Column(db.Text, default='[]')
+    active_quests = db.deferred(db.Column(db.Text, default='{}'), group='scene')
+    completed_quests = db.deferred(db.Column(db.Text, default='[]'), group='scene')
 
     current_view = db.Column(db.String(20), default='chat')
-    current_encounter = db.Column(db.Text, nullable=True)
+    current_encounter = db.deferred(db.Column(db.Text, nullable=True), group='battle')
 
-    shortcuts_raw = db.Column('shortcuts', db.Text, default='{"skill1":"attack","skill2":"attack","skill3":"attack","skill4":"attack","potion1":null,"potion2":null}')
-    chat_history_raw = db.Column('chat_history', db.Text, default='{}')
-    last_chat_message = db.Column(db.Text, nullable=True)
+    shortcuts_raw = db.deferred(db.Column('shortcuts', db.Text, default='{"skill1":"attack","skill2":"attack","skill3":"attack","skill4":"attack","potion1":null,"potion2":null}'), group='battle')
+    chat_history_raw = db.deferred(db.Column('chat_history', db.Text, default='{}'), group='chat')
+    last_chat_message = db.deferred(db.Column(db.Text, nullable=True), group='chat')
     chat_refresh_count = db.Column(db.Integer, default=0)
-    notifications_raw = db.Column('notifications', db.Text, default='[]')
+    notifications_raw = db.deferred(db.Column('notifications', db.Text, default='[]'), group='scene')
 
     # Achievement tracking counters
     kill_count = db.Column(db.Integer, default=0)
@@ -108,42 +117,42 @@ class PlayerModel(db.Model, UserMixin):
     gold_earned = db.Column(db.Integer, default=0)
     gift_count = db.Column(db.Integer, default=0)
     chat_count = db.Column(db.Integer, default=0)
-    item_usage_raw = db.Column(db.Text, default='{}')  # JSON: {item_id: count}
-    dungeon_clears_raw = db.Column(db.Text, default='{}')  # JSON: {dungeon_id: clear_count}
-    boss_kills_raw = db.Column(db.Text, default='{}')  # JSON: {boss_name: kill_count}
-    elite_kills_by_area_raw = db.Column(db.Text, default='{}')  # JSON: {area: kill_count} (kunlun/shennong/wokou)
-    monster_kills_raw = db.Column(db.Text, default='{}')  # JSON: {monster_id: kill_count}
+    item_usage_raw = db.deferred(db.Column(db.Text, default='{}'), group='kill_stats')  # JSON: {item_id: count}
+    dungeon_clears_raw = db.deferred(db.Column(db.Text, default='{}'), group='kill_stats')  # JSON: {dungeon_id: clear_count}
+    boss_kills_raw = db.deferred(db.Column(db.Text, default='{}'), group='kill_stats')  # JSON: {boss_name: kill_count}
+    elite_kills_by_area_raw = db.deferred(db.Column(db.Text, default='{}'), group='kill_stats')  # JSON: {area: kill_count} (kunlun/shennong/wokou)
+    monster_kills_raw = db.deferred(db.Column(db.Text, default='{}'), group='kill_stats')  # JSON: {monster_id: kill_count}
     divine_beast_kills = db.Column(db.Integer, default=0)  # 神兽累计击杀数
     forge_count = db.Column(db.Integer, default=0)  # 累计打造装备次数
     enhance_success_count = db.Column(db.Integer, default=0)  # 累计强化成功次数
     enhance_fail_count = db.Column(db.Integer, default=0)  # 累计强化失败次数
     enhance_50_count = db.Column(db.Integer, default=0)  # 累计强化到+50的装备件数
     tower_max_floor = db.Column(db.Integer, default=0)
-    visited_locations_raw = db.Column('visited_locations', db.Text, default='[]')
+    visited_locations_raw = db.deferred(db.Column('visited_locations', db.Text, default='[]'), group='scene')
 
     title_prefix_id = db.Column(db.String(64), nullable=True)
     title_suffix_id = db.Column(db.String(64), nullable=True)
-    owned_titles_raw = db.Column('owned_titles', db.Text, default='[]')
+    owned_titles_raw = db.deferred(db.Column('owned_titles', db.Text, default='[]'), group='titles')
 
-    activity_data_raw = db.Column('activity_data', db.Text, default='{}')
+    activity_data_raw = db.deferred(db.Column('activity_data', db.Text, default='{}'), group='scene')
 
     # Finance (理财·股市) holdings: {holdings:{stock_id:{shares,avg_cost}}, realized_profit, total_traded}
-    finance_data_raw = db.Column('finance_data', db.Text, default='{}')
+    finance_data_raw = db.deferred(db.Column('finance_data', db.Text, default='{}'), group='finance')
 
     # Enemy list (仇人)
-    enemies_raw = db.Column('enemies', db.Text, default='[]')
+    enemies_raw = db.deferred(db.Column('enemies', db.Text, default='[]'), group='social')
 
     # Friend list (好友)
-    friends_raw = db.Column('friends', db.Text, default='[]')
+    friends_raw = db.deferred(db.Column('friends', db.Text, default='[]'), group='social')
 
     # Blacklist (黑名单)
-    blacklist_raw = db.Column('blacklist', db.Text, default='[]')
+    blacklist_raw = db.deferred(db.Column('blacklist', db.Text, default='[]'), group='social')
 
     # Charm value (魅力值)
     charm = db.Column(db.Integer, default=0)
 
     # Relationship requests pending (结交邀请)
-    relation_requests_raw = db.Column('relation_requests', db.Text, default='[]')
+    relation_requests_raw = db.deferred(db.Column('relation_requests', db.Text, default='[]'), group='scene')
 
     # Need revive flag
     need_revive = db.Column(db.Boolean, default=False)
@@ -162,7 +171,7 @@ class PlayerModel(db.Model, UserMixin):
     vip_level = db.Column(db.Integer, default=1)
     vip_exp = db.Column(db.Integer, default=0)
     vip_expire_time = db.Column(db.DateTime, nullable=True)
-    vip_daily_claimed_raw = db.Column('vip_daily_claimed', db.Text, default='{}')
+    vip_daily_claimed_raw = db.deferred(db.Column('vip_daily_claimed', db.Text, default='{}'), group='vip')
 
     # Story
     story_completed = db.Column(db.Boolean, default=False)
@@ -211,194 +220,29 @@ class PlayerModel(db.Model, UserMixin):
         elif isinstance(value, str):
             self.shortcuts_raw = value
 
-    @property
-    def chat_history(self):
-        try:
-            return json.loads(self.chat_history_raw) if self.chat_history_raw else {}
-        except (json.JSONDecodeError, TypeError):
-            return {}
-
-    @chat_history.setter
-    def chat_history(self, value):
-        if isinstance(value, dict):
-            self.set_chat_history(value)
-        elif isinstance(value, str):
-            self.chat_history_raw = value
-
-    @property
-    def notifications(self):
-        try:
-            return json.loads(self.notifications_raw) if self.notifications_raw else []
-        except (json.JSONDecodeError, TypeError):
-            return []
-
-    @notifications.setter
-    def notifications(self, value):
-        if isinstance(value, list):
-            self.set_notifications(value)
-        elif isinstance(value, str):
-            self.notifications_raw = value
-
-    @property
-    def visited_locations(self):
-        try:
-            return json.loads(self.visited_locations_raw) if self.visited_locations_raw else []
-        except (json.JSONDecodeError, TypeError):
-            return []
-
-    @visited_locations.setter
-    def visited_locations(self, value):
-        self.visited_locations_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def item_usage(self):
-        try:
-            return json.loads(self.item_usage_raw) if self.item_usage_raw else {}
-        except (json.JSONDecodeError, TypeError):
-            return {}
-
-    @item_usage.setter
-    def item_usage(self, value):
-        self.item_usage_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def dungeon_clears(self):
-        try:
-            return json.loads(self.dungeon_clears_raw) if self.dungeon_clears_raw else {}
-        except (json.JSONDecodeError, TypeError):
-            return {}
-
-    @dungeon_clears.setter
-    def dungeon_clears(self, value):
-        self.dungeon_clears_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def boss_kills(self):
-        try:
-            return json.loads(self.boss_kills_raw) if self.boss_kills_raw else {}
-        except (json.JSONDecodeError, TypeError):
-            return {}
-
-    @boss_kills.setter
-    def boss_kills(self, value):
-        self.boss_kills_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def elite_kills_by_area(self):
-        try:
-            return json.loads(self.elite_kills_by_area_raw) if self.elite_kills_by_area_raw else {}
-        except (json.JSONDecodeError, TypeError):
-            return {}
-
-    @elite_kills_by_area.setter
-    def elite_kills_by_area(self, value):
-        self.elite_kills_by_area_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def monster_kills(self):
-        try:
-            return json.loads(self.monster_kills_raw) if self.monster_kills_raw else {}
-        except (json.JSONDecodeError, TypeError):
-            return {}
-
-    @monster_kills.setter
-    def monster_kills(self, value):
-        self.monster_kills_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def owned_titles(self):
-        try:
-            return json.loads(self.owned_titles_raw) if self.owned_titles_raw else []
-        except (json.JSONDecodeError, TypeError):
-            return []
-
-    @owned_titles.setter
-    def owned_titles(self, value):
-        self.owned_titles_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def activity_data(self):
-        try:
-            return json.loads(self.activity_data_raw) if self.activity_data_raw else {}
-        except (json.JSONDecodeError, TypeError):
-            return {}
-
-    @activity_data.setter
-    def activity_data(self, value):
-        self.activity_data_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def finance_data(self):
-        try:
-            return json.loads(self.finance_data_raw) if self.finance_data_raw else {}
-        except (json.JSONDecodeError, TypeError):
-            return {}
-
-    @finance_data.setter
-    def finance_data(self, value):
-        self.finance_data_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def enemies(self):
-        try:
-            return json.loads(self.enemies_raw) if self.enemies_raw else []
-        except (json.JSONDecodeError, TypeError):
-            return []
-
-    @enemies.setter
-    def enemies(self, value):
-        self.enemies_raw = json.dumps(value, ensure_ascii=False)
+    # JSON 列的解析视图：每次加载只解析一次，原地修改自动标脏，flush 前统一写回（见 models.json_field）
+    chat_history = JSONField('chat_history_raw', dict)
+    notifications = JSONField('notifications_raw', list)
+    visited_locations = JSONField('visited_locations_raw', list)
+    item_usage = JSONField('item_usage_raw', dict)
+    dungeon_clears = JSONField('dungeon_clears_raw', dict)
+    boss_kills = JSONField('boss_kills_raw', dict)
+    elite_kills_by_area = JSONField('elite_kills_by_area_raw', dict)
+    monster_kills = JSONField('monster_kills_raw', dict)
+    owned_titles = JSONField('owned_titles_raw', list)
+    activity_data = JSONField('activity_data_raw', dict)
+    finance_data = JSONField('finance_data_raw', dict)
+    enemies = JSONField('enemies_raw', list)
+    friends = JSONField('friends_raw', list)
+    blacklist = JSONField('blacklist_raw', list)
+    relation_requests = JSONField('relation_requests_raw', list)
+    vip_daily_claimed = JSONField('vip_daily_claimed_raw', dict)
 
     def add_enemy(self, username):
         """Add a player to enemy list."""
         enemies = self.enemies
         if username not in enemies:
             enemies.append(username)
-            self.enemies = enemies
-
-    @property
-    def friends(self):
-        try:
-            return json.loads(self.friends_raw) if self.friends_raw else []
-        except (json.JSONDecodeError, TypeError):
-            return []
-
-    @friends.setter
-    def friends(self, value):
-        self.friends_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def blacklist(self):
-        try:
-            return json.loads(self.blacklist_raw) if self.blacklist_raw else []
-        except (json.JSONDecodeError, TypeError):
-            return []
-
-    @blacklist.setter
-    def blacklist(self, value):
-        self.blacklist_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def relation_requests(self):
-        try:
-            return json.loads(self.relation_requests_raw) if self.relation_requests_raw else []
-        except (json.JSONDecodeError, TypeError):
-            return []
-
-    @relation_requests.setter
-    def relation_requests(self, value):
-        self.relation_requests_raw = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def vip_daily_claimed(self):
-        try:
-            return json.loads(self.vip_daily_claimed_raw) if self.vip_daily_claimed_raw else {}
-        except (json.JSONDecodeError, TypeError):
-            return {}
-
-    @vip_daily_claimed.setter
-    def vip_daily_claimed(self, value):
-        self.vip_daily_claimed_raw = json.dumps(value, ensure_ascii=False)
 
     def get_today_activity(self, key):
         """Get a daily activity value, auto-resets at midnight."""
@@ -425,7 +269,9 @@ class PlayerModel(db.Model, UserMixin):
                 suffix_name = suffix.get('name', '')
         return prefix_name + suffix_name if prefix_name or suffix_name else None
 
-    version = db.Column(db.Integer, default=0)
+    # 乐观锁：UPDATE ... WHERE version = ?，并发改同一行时后提交者抛 StaleDataError（见 services.unit_of_work）
+    version = db.Column(db.Integer, nullable=False, default=0)
+    __mapper_args__ = {'version_id_col': version}
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -565,35 +411,23 @@ class PlayerModel(db.Model, UserMixin):
 
     @property
     def effective_crit_rate(self):
-        from services.title_service import TitleService
         from services.player_service import PlayerService
-        passive = self.get_passive_bonuses()
-        title_bonuses = TitleService.get_title_bonuses(self)
-        lt_bonus = PlayerService._get_lt_passive_bonus(self, 'crit')
-        equip_bonus = PlayerService._get_equipment_stat_sum(self, 'crit_rate')
-        return self.crit_rate + passive.get('crit_rate', 0) + title_bonuses.get('crit_rate', 0) + lt_bonus + equip_bonus
+        return PlayerService.get_stats(self).get('crit_rate')
 
     @property
     def effective_dodge_rate(self):
-        from services.title_service import TitleService
         from services.player_service import PlayerService
-        passive = self.get_passive_bonuses()
-        title_bonuses = TitleService.get_title_bonuses(self)
-        lt_bonus = PlayerService._get_lt_passive_bonus(self, 'dodge')
-        equip_bonus = PlayerService._get_equipment_stat_sum(self, 'dodge_rate')
-        return self.dodge_rate + passive.get('dodge_rate', 0) + title_bonuses.get('dodge_rate', 0) + lt_bonus + equip_bonus
+        return PlayerService.get_stats(self).get('dodge_rate')
 
     @property
     def inventory(self):
         from services.data_service import DataService as DS
         result = {}
-        for inv in DS.get_inventory(self.id):
+        for inv, equip in DS.get_inventory_with_equipment(self.id):
             item_data = DS.get_item(inv.item_id)
             if item_data:
                 result[inv.item_id] = {"item": item_data, "quantity": inv.quantity}
             else:
-                equip = EquipmentInstance.query.filter_by(
-                    instance_id=inv.item_id, player_id=self.id).first()
                 if equip:
                     result[f"equipment_{inv.item_id}"] = equip
                 else:
@@ -724,22 +558,16 @@ class PlayerModel(db.Model, UserMixin):
         self.shortcuts_raw = json.dumps(data, ensure_ascii=False)
 
     def get_chat_history(self):
-        try:
-            return json.loads(self.chat_history_raw) if self.chat_history_raw else {}
-        except (json.JSONDecodeError, TypeError):
-            return {}
+        return self.chat_history
 
     def set_chat_history(self, data):
-        self.chat_history_raw = json.dumps(data, ensure_ascii=False)
+        self.chat_history = data
 
     def get_notifications(self):
-        try:
-            return json.loads(self.notifications_raw) if self.notifications_raw else []
-        except (json.JSONDecodeError, TypeError):
-            return []
+        return self.notifications
 
     def set_notifications(self, data):
-        self.notifications_raw = json.dumps(data, ensure_ascii=False)
+        self.notifications = data
 
     def get_last_chat_message(self):
         try:
@@ -780,6 +608,8 @@ class EquipmentInstance(db.Model):
     enhance_level = db.Column(db.Integer, default=0)
     created_by = db.Column(db.String(64), nullable=True)   # 创建者昵称
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # 创建时间
+    version = db.Column(db.Integer, nullable=False, default=0)  # 乐观锁（交易/赠送转移归属）
+    __mapper_args__ = {'version_id_col': version}
 
     STAT_NAMES = {
         "max_health": "生命上限",
@@ -796,6 +626,39 @@ class EquipmentInstance(db.Model):
 
     RARITIES = ["普通", "精良", "卓越", "史诗", "神器"]
 
+    __table_args__ = (db.Index('ix_equipment_instances_player', 'player_id'),)
+
+    # 已解析属性缓存：{id: (base_stats 原文, extra_stats 原文, (base, extra, totals))}
+    # 表里没有更新时间列，以两列 JSON 原文作版本号：强化/洗练等任何改写都会让旧条目失配。
+    # 缓存里的 dict 全进程共享，只读；需要修改时仍走 get_base_stats/get_extra_stats 拿副本。
+    _decoded_cache = {}
+    DECODED_CACHE_MAX = 20000
+
+    def get_decoded_stats(self):
+        """返回 (base, extra, totals) 只读结构，同一版本的装备只解析一次 JSON。
+
+        totals 为六项面板属性的 基础+附加 合计（附加只取列表首值，与属性汇总口径一致）。
+        """
+        base_raw, extra_raw = self.base_stats, self.extra_stats
+        cached = self._decoded_cache.get(self.id) if self.id is not None else None
+        if cached is not None and cached[0] == base_raw and cached[1] == extra_raw:
+            return cached[2]
+        base = self.get_base_stats()
+        extra = self.get_extra_stats()
+        totals = {}
+        for stat in self.STAT_NAMES:
+            total = base.get(stat, 0)
+            value = extra.get(stat)
+            if value and isinstance(value, list):
+                total += value[0]
+            totals[stat] = total
+        decoded = (base, extra, totals)
+        if self.id is not None:
+            if len(self._decoded_cache) >= self.DECODED_CACHE_MAX:
+                self._decoded_cache.clear()
+            self._decoded_cache[self.id] = (base_raw, extra_raw, decoded)
+        return decoded
+
     def get_base_stats(self):
         try:
             return json.loads(self.base_stats) if self.base_stats else {}
@@ -873,8 +736,7 @@ class EquipmentInstance(db.Model):
 
     def get_display_stats(self):
         result = {}
-        base = self.get_base_stats()
-        extra = self.get_extra_stats()
+        base, extra, _ = self.get_decoded_stats()
         for stat, value in base.items():
             display_name = self.STAT_NAMES.get(stat, stat)
             if stat in ['crit_rate', 'dodge_rate']:
@@ -897,9 +759,10 @@ class EquipmentInstance(db.Model):
 
     def get_total_stats(self):
         total = {}
-        for stat, value in self.get_base_stats().items():
+        base, extra, _ = self.get_decoded_stats()
+        for stat, value in base.items():
             total[stat] = total.get(stat, 0) + value
-        for stat, data in self.get_extra_stats().items():
+        for stat, data in extra.items():
             value = data[0] if isinstance(data, list) else data
             total[stat] = total.get(stat, 0) + value
         return total
@@ -997,12 +860,19 @@ class MarketListing(db.Model):
     expires_at = db.Column(db.DateTime, nullable=False)    # created_at+7d
     sold_at = db.Column(db.DateTime, nullable=True)
     buyer_id = db.Column(db.Integer, db.ForeignKey('players.id'), nullable=True)  # 最近买者（审计）
+    version = db.Column(db.Integer, nullable=False, default=0)  # 乐观锁：同一挂单并发购买只有一笔成功
+    __mapper_args__ = {'version_id_col': version}
 
     __table_args__ = (
         db.Index('ix_market_status', 'status'),
         db.Index('ix_market_seller', 'seller_id'),
         db.Index('ix_market_category', 'category'),
         db.Index('ix_market_expires', 'expires_at'),
+        # 列表页按分类浏览：单一 status + category 下按 expires_at 有序，键集分页直接沿索引走
+        db.Index('ix_market_status_category_expires_created',
+                 'status', 'category', 'expires_at', 'created_at'),
+        # 「全部」分类浏览与过期到期队列
+        db.Index('ix_market_status_expires_created', 'status', 'expires_at', 'created_at'),
     )
 
 
@@ -1200,11 +1070,18 @@ class ChatMessage(db.Model):
     receiver_id = db.Column(db.Integer, db.ForeignKey('players.id'), nullable=True)
     content = db.Column(db.String(512), nullable=False)
     message_type = db.Column(db.String(10), default='system')
+    # 国家频道消息的所属国家（发送时写入），其余类型为空；国家频道按此列走索引范围扫描
+    country = db.Column(db.String(10), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     sender = db.relationship('PlayerModel', foreign_keys=[sender_id])
     receiver = db.relationship('PlayerModel', foreign_keys=[receiver_id])
 
+    __table_args__ = (
+        db.Index('ix_chat_messages_type_country_created', 'message_type', 'country', 'created_at'),
+        db.Index('ix_chat_messages_receiver_created', 'receiver_id', 'created_at'),
+    )
+
 
 class PartyChat(db.Model):
     """队伍聊天消息（持久化，按 party_id 存储）。"""
@@ -1230,3 +1107,14 @@ class Achievement(db.Model):
     completed_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     __table_args__ = (db.UniqueConstraint('player_id', 'achievement_id'),)
+
+
+class AchievementEvent(db.Model):
+    """成就队列中尚未判定的事件（services.achievement_queue）：随产生它的请求一起提交，判定后删除。"""
+    __tablename__ = 'achievement_events'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    player_id = db.Column(db.Integer, nullable=False)
+    condition_type = db.Column(db.String(64), nullable=False)
+    group_key = db.Column(db.Text)  # 分组键 JSON（元组存为数组）；NULL 为该类型全部分组
+    value = db.Column(db.Text)      # 已知进度 JSON；NULL 为由后台按玩家当前状态计算
@@ -0,0 +1,136 @@
+"""
+Benchmark: SQLite read/write concurrency before and after the connect-time tuning
+in services/sqlite_tuning.py.
+
+Builds a throwaway database shaped like the players table (a few thousand rows
+with a JSON text column), then runs the same workload twice through SQLAlchemy
+engines:
+
+  - baseline: the old setup (QueuePool + pool_pre_ping, rollback journal,
+    synchronous=FULL, pysqlite's default 5s busy handler)
+  - tuned:    engine_options() + SQLITE_PRAGMAS from config.Config
+
+Workload: READERS threads loop "select one player by id", WRITERS threads loop
+"update one player + commit" (one short transaction per request, like the game
+routes). Reports reads/s, writes/s, p95 read latency and lock errors.
+
+Usage:
+    python scripts/bench_sqlite_tuning.py                 # 8 readers, 4 writers, 5s each
+    python scripts/bench_sqlite_tuning.py 16 4 10         # readers writers seconds
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.pool import QueuePool  # noqa: E402
+
+from services.sqlite_tuning import engine_options, install_pragmas  # noqa: E402
+
+ROWS = 5000
+BASE_OPTIONS = {'pool_size': 10, 'max_overflow': 20, 'pool_pre_ping': True, 'pool_recycle': 1800}
+
+
+def _tuned_pragmas():
+    from config import Config
+    return dict(Config.SQLITE_PRAGMAS)
+
+
+def build_db(path):
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE players (id INTEGER PRIMARY KEY, nickname TEXT,"
+                          " money INTEGER, experience INTEGER, inventory TEXT)"))
+        conn.execute(text("INSERT INTO players VALUES (:id, :n, 0, 0, :inv)"),
+                     [{'id': i, 'n': f'p{i}', 'inv': '{"items": [%s]}' % ','.join(['1'] * 200)}
+                      for i in range(1, ROWS + 1)])
+    engine.dispose()
+
+
+def make_engine(path, tuned):
+    url = f'sqlite:///{path}?check_same_thread=False'
+    if not tuned:
+        with create_engine(url).begin() as conn:
+            conn.execute(text("PRAGMA journal_mode=DELETE"))
+        return create_engine(url, poolclass=QueuePool, **BASE_OPTIONS)
+    engine = create_engine(url, **engine_options(url, BASE_OPTIONS))
+    install_pragmas(engine, _tuned_pragmas())
+    return engine
+
+
+def run(engine, readers, writers, seconds):
+    stop = time.time() + seconds
+    lock = threading.Lock()
+    stats = {'reads': 0, 'writes': 0, 'errors': 0, 'latencies': []}
+
+    def reader():
+        n, lat = 0, []
+        while time.time() < stop:
+            t0 = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT * FROM players WHERE id = :id"),
+                                 {'id': random.randint(1, ROWS)}).fetchone()
+                n += 1
+                lat.append(time.perf_counter() - t0)
+            except OperationalError:
+                with lock:
+                    stats['errors'] += 1
+        with lock:
+            stats['reads'] += n
+            stats['latencies'].extend(lat)
+
+    def writer():
+        n = 0
+        while time.time() < stop:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text("UPDATE players SET money = money + 1, experience = experience + 3"
+                                      " WHERE id = :id"), {'id': random.randint(1, ROWS)})
+                n += 1
+            except OperationalError:
+                with lock:
+                    stats['errors'] += 1
+        with lock:
+            stats['writes'] += n
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    lat = sorted(stats['latencies']) or [0.0]
+    return {
+        'reads/s': stats['reads'] / seconds,
+        'writes/s': stats['writes'] / seconds,
+        'p95 read ms': lat[int(len(lat) * 0.95) - 1 if len(lat) > 1 else 0] * 1000,
+        'lock errors': stats['errors'],
+    }
+
+
+def main():
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f"readers={readers} writers={writers} seconds={seconds} rows={ROWS}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for tuned in (False, True):
+            path = os.path.join(tmp, f"bench_{'tuned' if tuned else 'baseline'}.db")
+            build_db(path)
+            engine = make_engine(path, tuned)
+            result = run(engine, readers, writers, seconds)
+            engine.dispose()
+            print(f"{'tuned' if tuned else 'baseline':>8}: " +
+                  "  ".join(f"{k} {v:.1f}" if isinstance(v, float) else f"{k} {v}"
+                            for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Build the static data snapshot (services/static_snapshot.py) ahead of time.
+
+create_app writes the snapshot itself the first time it has to parse the JSON,
+so this is only needed to keep that cost out of the first boot after a deploy
+or a data edit (e.g. run it in the release step before restarting gunicorn).
+It parses data/ with the same code path as startup and writes the file to
+Config.STATIC_SNAPSHOT_PATH (STATIC_SNAPSHOT_PATH env var overrides it).
+
+Usage:
+    python scripts/build_static_snapshot.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from services.data_service import DataService, get_base_path  # noqa: E402
+from services.static_snapshot import StaticSnapshot  # noqa: E402
+
+
+def main():
+    app = Flask(__name__)
+    app.config.from_object('config.Config')
+    app.config['STATIC_SNAPSHOT'] = True
+    DataService._app = app
+    started = time.perf_counter()
+    if not DataService.rebuild_static_snapshot():
+        print('failed to write snapshot (see log above)')
+        return 1
+    path = StaticSnapshot.path(app)
+    print(f'wrote {path} ({path.stat().st_size / 1024:.0f} KiB) in {time.perf_counter() - started:.2f}s')
+
+    started = time.perf_counter()
+    payload = StaticSnapshot.load(app, DataService._static_sources(get_base_path() / 'data'))
+    print(f'reload check: {"ok" if payload is not None else "FAILED"} in {time.perf_counter() - started:.3f}s')
+    return 0 if payload is not None else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
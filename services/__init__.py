@@ -3,4 +3,5 @@ from flask_sqlalchemy import SQLAlchemy
 db = SQLAlchemy()
 
 class ConcurrentModificationError(Exception):
+    """乐观锁冲突重试用尽（见 services.unit_of_work.retry_on_conflict）。"""
     pass
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""成就定义索引：加载配置时按条件类型分组、按阈值排序，检查时只看已越过的阈值。
+
+原来 AchievementService.check 每次都扫一遍全部成就定义，对同类型的每一条再单独查一次
+「是否已完成」，一次击杀或使用道具就是几十上百条查询。这里一次性把定义整理成：
+
+- condition_type → {分组键: ThresholdGroup}。同组成就的进度相同，只是阈值不同：
+  标量类型（等级、击杀数、消费……）整类一组，分组键为 None；按对象统计的类型
+  （指定怪物/BOSS/副本/道具系列/副将/神器……）按对象分组，分组键见 GROUP_KEYS；
+- 每组的阈值升序排列，进度算一次后二分即可得到已越过的阈值，逐条与已完成集合比对。
+
+索引整体构建后替换，读取无需加锁；DataService._load_all_data 重新加载配置时一并作废。
+"""
+from bisect import bisect_right
+
+
+# 按对象统计进度的条件类型 → 从定义取分组键（同键的定义进度相同）
+GROUP_KEYS = {
+    'item_use': lambda adef: (adef.get('tracking_key'), tuple(adef.get('tracking_keys', [])),
+                              adef.get('item_name'), adef.get('item_id')),
+    'dungeon_clear': lambda adef: adef.get('dungeon_id'),
+    'boss_kill': lambda adef: adef.get('boss_name', ''),
+    'elite_kill_area': lambda adef: adef.get('area', ''),
+    'elite_kill_monster': lambda adef: adef.get('monster_id', ''),
+    'kill_monster': lambda adef: adef.get('monster_id', ''),
+    'barbarian_leader_kill': lambda adef: adef.get('side', '南'),
+    'lieutenant_owned': lambda adef: adef.get('lt_name', ''),
+    'artifact_owned': lambda adef: adef.get('template_id', ''),
+    'quest_done': lambda adef: tuple(adef.get('condition_quests') or ()),
+}
+
+
+class ThresholdGroup:
+    """进度相同的一组成就：阈值升序，sample 为计算进度用的代表定义。"""
+    __slots__ = ('values', 'ids', 'sample')
+
+    def __init__(self, entries):
+        entries.sort(key=lambda e: e[0])
+        self.values = tuple(value for value, _, _ in entries)
+        self.ids = tuple(aid for _, aid, _ in entries)
+        self.sample = entries[0][2]
+
+    def crossed(self, progress):
+        """阈值不超过 progress 的成就 id（升序）。"""
+        return self.ids[:bisect_right(self.values, progress)]
+
+
+class AchievementIndex:
+
+    def __init__(self, achievements):
+        self.definitions = achievements
+        grouped = {}
+        for aid, adef in achievements.items():
+            ctype = adef.get('condition_type')
+            key_of = GROUP_KEYS.get(ctype)
+            key = key_of(adef) if key_of else None
+            grouped.setdefault(ctype, {}).setdefault(key, []).append(
+                (adef.get('condition_value', 0), aid, adef))
+        self._groups = {ctype: {key: ThresholdGroup(entries) for key, entries in groups.items()}
+                        for ctype, groups in grouped.items()}
+
+    def groups(self, condition_type):
+        """{分组键: ThresholdGroup}；没有该类型成就时为空 dict。"""
+        return self._groups.get(condition_type, {})
+
+    def condition_types(self):
+        return tuple(self._groups)
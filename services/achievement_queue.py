@@ -0,0 +1,311 @@
+"""成就检查的后台队列：请求里只记事件，提交后交给后台线程批量判定。
+
+成就检查原先在战斗、打造、使用道具等请求里同步执行，恰好拖慢玩家最常连点的操作。
+现在请求内的 AchievementService.check 只把 (player_id, 条件类型, 分组键) → 进度
+记进当前会话的 session.info，过程中即按键合并（同一玩家同一类型连杀十次只留一条）：
+
+- 会话提交后（after_commit，即请求结束时 UnitOfWork 的那次提交）整批交给进程内队列，
+  回滚则随之丢弃——和计数器本身的改动同进同退，不会判定到未落库的进度；
+- 后台线程取出队列里积攒的全部事件，再按键合并一次，逐个玩家读最新已提交状态判定，
+  每个玩家的新成就一条 INSERT，整批一次提交；
+- 线程不在（未启动、gunicorn fork 后的新 worker、异常退出）时，交接时重新拉起；
+  一批处理失败会放回队列重试一次；进程退出前 atexit 把剩余事件同步处理完。
+
+内存队列在进程被强杀（gunicorn 超时 SIGKILL、OOM）时 atexit 来不及执行，因此事件同时落库：
+提交前（before_commit）把本事务的事件写进 achievement_events 表，与计数器改动同一事务；
+后台判定一批后，在写入新成就的同一事务里删掉这批事件行。启动时 recover 把上次残留的行
+同步判定一遍；gunicorn 杀掉 worker 后重新 fork 的进程不会再走 create_app，因此后台线程在
+新进程里第一次启动时，先把表里现存的行扫一遍再进入循环。进程怎么退出都不会丢事件
+（与别的 worker 正在处理的行可能重复判定一次，判定本身是幂等的）。
+
+请求之外（后台任务、脚本）以及未调用 init_app（ACHIEVEMENT_QUEUE 关闭）时，check 仍同步执行。
+"""
+import atexit
+import json
+import os
+import threading
+import traceback
+
+from flask import has_request_context
+from sqlalchemy import insert as db_insert
+
+
+_INFO_KEY = '_achievement_events'  # session.info 里本事务待交接的事件 {(pid, ctype, key): value}
+_IDS_KEY = '_achievement_event_ids'  # session.info 里这些事件落库的行 id {(pid, ctype, key): id}
+_RECOMPUTE = None                  # 进度未知，由后台按玩家当前状态计算
+
+
+def _freeze(value):
+    """JSON 读回的数组还原成元组（分组键须可哈希）。"""
+    return tuple(_freeze(v) for v in value) if isinstance(value, list) else value
+
+
+def _merge(events, event_key, value):
+    """同键事件合并：已知进度取较大值，只要有一条需要重新计算就重新计算。"""
+    if event_key in events:
+        old = events[event_key]
+        value = _RECOMPUTE if old is _RECOMPUTE or value is _RECOMPUTE else max(old, value)
+    events[event_key] = value
+
+
+class AchievementQueue:
+    MAX_ATTEMPTS = 2
+
+    _app = None
+    _cond = threading.Condition()
+    _pending = {}    # {(player_id, ctype, key): value}
+    _row_ids = {}    # {(player_id, ctype, key): [achievement_events 行 id]}，与 _pending 同步
+    _dead_ids = []   # 放弃重试的事件行，随下一批成功的提交删除
+    _retries = {}    # {(player_id, ctype, key): 已失败次数}
+    _thread = None
+    _pid = None
+    _busy = False
+    _stats = {'enqueued': 0, 'coalesced': 0, 'processed': 0, 'batches': 0,
+              'completed': 0, 'failures': 0, 'dropped': 0, 'restarts': 0, 'recovered': 0}
+
+    @classmethod
+    def init_app(cls, app):
+        if not app.config.get('ACHIEVEMENT_QUEUE', True):
+            return
+        cls._app = app
+        atexit.register(cls.drain)
+
+    @classmethod
+    def enabled(cls):
+        return cls._app is not None and has_request_context()
+
+    # ---- 请求侧 ----
+
+    @classmethod
+    def record(cls, player_id, condition_type, value=None, key=None):
+        """记下一条事件，随当前会话提交交给后台；队列未启用或不在请求内返回 False。"""
+        if not cls.enabled():
+            return False
+        from services import db
+        events = db.session.info.setdefault(_INFO_KEY, {})
+        event_key = (player_id, condition_type, key)
+        with cls._cond:
+            cls._stats['enqueued'] += 1
+            if event_key in events:
+                cls._stats['coalesced'] += 1
+        _merge(events, event_key, value)
+        return True
+
+    @staticmethod
+    def _on_before_commit(session):
+        """事件随本事务写进 achievement_events，记下各自的行 id。"""
+        events = session.info.get(_INFO_KEY)
+        if not events:
+            return
+        from models.player import AchievementEvent
+        keys = [k for k in events if k not in session.info.get(_IDS_KEY, {})]
+        if not keys:
+            return
+        rows = [{'player_id': pid, 'condition_type': ctype,
+                 'group_key': None if key is None else json.dumps(key, ensure_ascii=False),
+                 'value': None if events[(pid, ctype, key)] is _RECOMPUTE
+                 else json.dumps(events[(pid, ctype, key)])}
+                for pid, ctype, key in keys]
+        ids = session.execute(
+            db_insert(AchievementEvent).returning(AchievementEvent.id, sort_by_parameter_order=True),
+            rows).scalars().all()
+        session.info.setdefault(_IDS_KEY, {}).update(zip(keys, ids))
+
+    @classmethod
+    def _on_commit(cls, session):
+        events = session.info.pop(_INFO_KEY, None)
+        row_ids = session.info.pop(_IDS_KEY, None) or {}
+        if events:
+            cls.put(events, {k: [row_ids[k]] for k in events if k in row_ids})
+
+    @staticmethod
+    def _on_rollback(session):
+        session.info.pop(_INFO_KEY, None)
+        session.info.pop(_IDS_KEY, None)
+
+    @classmethod
+    def put(cls, events, row_ids=None):
+        with cls._cond:
+            cls._enqueue(events, row_ids or {})
+            cls._ensure_worker()
+            cls._cond.notify()
+
+    @classmethod
+    def _enqueue(cls, events, row_ids):
+        """调用方持有 _cond。"""
+        for event_key, value in events.items():
+            if event_key in cls._pending:
+                cls._stats['coalesced'] += 1
+            _merge(cls._pending, event_key, value)
+            if row_ids.get(event_key):
+                cls._row_ids.setdefault(event_key, []).extend(row_ids[event_key])
+
+    @classmethod
+    def _take(cls):
+        """调用方持有 _cond：取走当前积压 (事件, 行 id)。"""
+        batch, cls._pending = cls._pending, {}
+        row_ids, cls._row_ids = cls._row_ids, {}
+        return batch, row_ids
+
+    @classmethod
+    def recover(cls, app):
+        """启动时调用（建表之后）：上次进程残留在 achievement_events 的事件同步判定一遍。"""
+        if cls._app is None:
+            return 0
+        count = cls._sweep()
+        if count:
+            app.logger.warning("成就队列：补判上次残留的 %d 条事件", count)
+        return count
+
+    @classmethod
+    def _sweep(cls):
+        """achievement_events 里现存的事件全部判定一遍，返回行数。"""
+        from services import db
+        from models.player import AchievementEvent
+        with cls._app.app_context():
+            rows = db.session.query(AchievementEvent.id, AchievementEvent.player_id,
+                                    AchievementEvent.condition_type, AchievementEvent.group_key,
+                                    AchievementEvent.value).order_by(AchievementEvent.id).all()
+            db.session.rollback()
+        if not rows:
+            return 0
+        batch, row_ids = {}, {}
+        for row_id, pid, ctype, key, value in rows:
+            event_key = (pid, ctype, None if key is None else _freeze(json.loads(key)))
+            _merge(batch, event_key, _RECOMPUTE if value is None else json.loads(value))
+            row_ids.setdefault(event_key, []).append(row_id)
+        with cls._cond:
+            cls._stats['recovered'] += len(rows)
+        cls._process(batch, row_ids)
+        return len(rows)
+
+    # ---- 后台线程 ----
+
+    @classmethod
+    def start(cls):
+        """在本进程拉起后台线程（gunicorn worker 启动时调用），不必等第一条事件。"""
+        if cls._app is None:
+            return
+        with cls._cond:
+            cls._ensure_worker()
+
+    @classmethod
+    def _ensure_worker(cls):
+        """调用方持有 _cond。线程不存在、已退出或属于 fork 前的父进程时重新拉起；
+        新进程里第一次拉起的线程先补判表里残留的事件（被杀的前一个 worker 留下的）。"""
+        if cls._thread is not None and cls._thread.is_alive() and cls._pid == os.getpid():
+            return
+        if cls._thread is not None:
+            cls._stats['restarts'] += 1
+        sweep = cls._pid != os.getpid()
+        cls._pid = os.getpid()
+        cls._thread = threading.Thread(target=cls._loop, args=(sweep,), name='achievement-queue',
+                                       daemon=True)
+        cls._thread.start()
+
+    @classmethod
+    def _loop(cls, sweep=False):
+        if sweep:
+            try:
+                count = cls._sweep()
+                if count:
+                    cls._app.logger.warning("成就队列：进程 %d 启动，补判残留的 %d 条事件",
+                                            os.getpid(), count)
+            except Exception:
+                cls._app.logger.error("成就队列补判失败：\n%s", traceback.format_exc())
+        while True:
+            with cls._cond:
+                while not cls._pending:
+                    cls._cond.wait()
+                batch, row_ids = cls._take()
+                cls._busy = True
+            try:
+                cls._process(batch, row_ids)
+            finally:
+                with cls._cond:
+                    cls._busy = False
+                    cls._cond.notify_all()
+
+    @classmethod
+    def _process(cls, batch, row_ids):
+        from services import db
+        from services.achievement_service import AchievementService
+        from models.player import AchievementEvent
+        by_player = {}
+        for (player_id, ctype, key), value in batch.items():
+            by_player.setdefault(player_id, []).append((ctype, key, value))
+        with cls._cond:
+            dead_ids, cls._dead_ids = cls._dead_ids, []
+        done_ids = [i for ids in row_ids.values() for i in ids] + dead_ids
+        try:
+            with cls._app.app_context():
+                try:
+                    completed = AchievementService.evaluate_events(by_player)
+                    if done_ids:
+                        # 与新成就同一事务删除事件行：要么都生效，要么下次（含重启后）重新判定
+                        db.session.query(AchievementEvent).filter(
+                            AchievementEvent.id.in_(done_ids)).delete(synchronize_session=False)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+        except Exception:
+            cls._requeue(batch, row_ids, dead_ids)
+            cls._app.logger.error("成就队列处理失败：\n%s", traceback.format_exc())
+            return
+        with cls._cond:
+            cls._stats['batches'] += 1
+            cls._stats['processed'] += len(batch)
+            cls._stats['completed'] += completed
+            for event_key in batch:
+                cls._retries.pop(event_key, None)
+
+    @classmethod
+    def _requeue(cls, batch, row_ids, dead_ids):
+        """失败的一批放回队列，每个事件最多重试 MAX_ATTEMPTS 次；放弃的事件行随下一批删除。"""
+        with cls._cond:
+            cls._stats['failures'] += 1
+            cls._dead_ids.extend(dead_ids)
+            for event_key, value in batch.items():
+                attempts = cls._retries.get(event_key, 0) + 1
+                if attempts >= cls.MAX_ATTEMPTS:
+                    cls._retries.pop(event_key, None)
+                    cls._dead_ids.extend(row_ids.get(event_key, ()))
+                    cls._stats['dropped'] += 1
+                    continue
+                cls._retries[event_key] = attempts
+                cls._enqueue({event_key: value}, row_ids)
+
+    # ---- 同步收尾 ----
+
+    @classmethod
+    def drain(cls, timeout=10.0):
+        """等后台线程处理完当前积压；线程不在时在调用线程里同步处理。进程退出前与测试用。"""
+        if cls._app is None:
+            return
+        with cls._cond:
+            alive = cls._thread is not None and cls._thread.is_alive() and cls._pid == os.getpid()
+            if alive:
+                cls._cond.wait_for(lambda: not cls._pending and not cls._busy, timeout)
+                return
+            batch, row_ids = cls._take()
+        if batch:
+            cls._process(batch, row_ids)
+
+    @classmethod
+    def get_metrics(cls):
+        with cls._cond:
+            return dict(cls._stats, pending=len(cls._pending),
+                        running=cls._thread is not None and cls._thread.is_alive())
+
+
+def _register_listeners():
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    event.listen(Session, 'before_commit', AchievementQueue._on_before_commit)
+    event.listen(Session, 'after_commit', AchievementQueue._on_commit)
+    event.listen(Session, 'after_rollback', AchievementQueue._on_rollback)
+
+
+_register_listeners()
@@ -8,135 +8,91 @@ class AchievementService:
 
     @classmethod
     def check_all(cls, player):
-        for ctype in ['level', 'kill', 'elite_kill', 'elite_kill_area', 'elite_kill_monster', 'kill_monster',
-                       'divine_beast_kill', 'pk_win', 'pk_loss', 'enhance', 'enhance_success', 'enhance_fail',
-                       'enhance_50', 'forge', 'artifact_owned', 'barbarian_soldier_kill', 'barbarian_leader_kill',
-                       'visit', 'equip_full', 'gold_earned', 'gold_total', 'yuanbao_spent', 'jinzu_spent', 'gift', 'chat', 'vip_level',
-                       'lieutenant_owned', 'item_use', 'dungeon_clear', 'dungeon_tower',
-                       'boss_kill', 'quest', 'quest_done',
-                       'flower_received', 'friend_count', 'bless_count',
-                       'steal_skill_success', 'steal_medicine_success', 'steal_caught']:
-            cls.check(player, ctype)
+        """成就页打开时同步补查全部类型（玩家正看着结果，不走后台队列）。"""
+        for ctype in DataService.get_achievement_index().condition_types():
+            cls._check_now(player, ctype)
 
     @classmethod
-    def check(cls, player, condition_type, current_value=None):
-        achievements = DataService.get_achievements()
-        for aid, adef in achievements.items():
-            if adef['condition_type'] != condition_type:
+    def check(cls, player, condition_type, current_value=None, key=None):
+        """检查 condition_type 类成就。请求内交给后台队列（services.achievement_queue），否则同步检查。
+
+        current_value：调用方已知的进度（标量类型），省去重新计算；
+        key：只检查该对象的分组（如 kill_monster 传 monster_id），不传则检查该类型全部分组。
+        """
+        from services.achievement_queue import AchievementQueue
+        if AchievementQueue.record(player.id, condition_type, current_value, key):
+            return
+        cls._check_now(player, condition_type, current_value, key)
+
+    @classmethod
+    def _check_now(cls, player, condition_type, current_value=None, key=None):
+        completed = cls._completed_ids(player.id)
+        newly = cls._evaluate(player, condition_type, current_value, key, completed)
+        if newly:
+            cls._insert_completed(player.id, newly)
+            completed.update(newly)
+
+    @classmethod
+    def evaluate_events(cls, events_by_player):
+        """后台队列调用：{player_id: [(ctype, key, value), ...]}，按玩家最新状态判定并写入，返回新完成数。"""
+        from models.player import PlayerModel
+        total = 0
+        for player_id, events in events_by_player.items():
+            player = db.session.get(PlayerModel, player_id)
+            if player is None:
                 continue
-            if cls.is_completed(player.id, aid):
+            completed = cls._load_completed_ids(player_id)
+            newly = []
+            for ctype, key, value in events:
+                found = cls._evaluate(player, ctype, value, key, completed)
+                completed.update(found)
+                newly.extend(found)
+            if newly:
+                cls._insert_completed(player_id, newly)
+                total += len(newly)
+        return total
+
+    @classmethod
+    def _evaluate(cls, player, condition_type, current_value, key, completed):
+        """condition_type 类中已越过阈值、且不在 completed 里的成就 id 列表。"""
+        groups = DataService.get_achievement_index().groups(condition_type)
+        if key is not None:
+            group = groups.get(key)
+            groups = {key: group} if group else {}
+        newly = []
+        for group in groups.values():
+            if completed.issuperset(group.ids):
                 continue
             if current_value is not None:
-                if current_value >= adef['condition_value']:
-                    cls._complete(player, aid)
-            elif cls._check_condition(player, adef):
-                cls._complete(player, aid)
+                progress = current_value
+            else:
+                progress = cls._get_progress(player, None, group.sample)
+            newly.extend(aid for aid in group.crossed(progress) if aid not in completed)
+        return newly
 
     @classmethod
-    def _check_condition(cls, player, adef):
-        ctype = adef['condition_type']
-        val = adef['condition_value']
-        if ctype == 'level':
-            return player.level >= val
-        elif ctype == 'kill':
-            return player.kill_count >= val
-        elif ctype == 'elite_kill':
-            return player.elite_kill_count >= val
-        elif ctype == 'pk_win':
-            return player.pk_win_count >= val
-        elif ctype == 'pk_loss':
-            return (player.pk_loss_count or 0) >= val
-        elif ctype == 'enhance':
-            from models.player import EquipmentInstance
-            max_enh = db.session.query(
-                db.func.max(EquipmentInstance.enhance_level)).filter_by(
-                player_id=player.id).scalar() or 0
-            return max_enh >= val
-        elif ctype == 'visit':
-            return len(player.visited_locations) >= val
-        elif ctype == 'equip_full':
-            equipped = DataService.get_equipped(player.id)
-            count = sum(1 for v in equipped.values() if v is not None)
-            return count >= val
-        elif ctype == 'gold_earned':
-            return player.gold_earned >= val
-        elif ctype == 'gold_total':
-            return (player.gold + player.warehouse_gold) >= val
-        elif ctype == 'yuanbao_spent':
-            return (player.yuanbao_spent or 0) >= val
-        elif ctype == 'jinzu_spent':
-            return (player.jinzu_spent or 0) >= val
-        elif ctype == 'gift':
-            return player.gift_count >= val
-        elif ctype == 'chat':
-            return player.chat_count >= val
-        elif ctype == 'flower_received':
-            return (player.charm or 0) >= val
-        elif ctype == 'friend_count':
-            return cls._get_friend_count(player) >= val
-        elif ctype == 'bless_count':
-            return cls._get_social_stat(player, 'ach_bless_count') >= val
-        elif ctype == 'steal_skill_success':
-            return cls._get_social_stat(player, 'ach_steal_skill') >= val
-        elif ctype == 'steal_medicine_success':
-            return cls._get_social_stat(player, 'ach_steal_medicine') >= val
-        elif ctype == 'steal_caught':
-            return cls._get_social_stat(player, 'ach_steal_caught') >= val
-        elif ctype == 'vip_level':
-            return player.vip_level >= val
-        elif ctype == 'lieutenant_owned':
-            from models.lieutenant import Lieutenant
-            name = adef.get('lt_name', '')
-            return Lieutenant.query.filter_by(owner_id=player.id, name=name).first() is not None
-        elif ctype == 'item_use':
-            return cls._get_item_use_progress(player, adef) >= val
-        elif ctype == 'dungeon_clear':
-            return cls._get_dungeon_clear_progress(player, adef) >= val
-        elif ctype == 'dungeon_tower':
-            return cls._get_dungeon_tower_progress(player, adef) >= val
-        elif ctype == 'boss_kill':
-            return cls._get_boss_kill_progress(player, adef) >= val
-        elif ctype == 'elite_kill_area':
-            return cls._get_elite_kill_area_progress(player, adef) >= val
-        elif ctype == 'elite_kill_monster':
-            return cls._get_elite_kill_monster_progress(player, adef) >= val
-        elif ctype == 'kill_monster':
-            return cls._get_kill_monster_progress(player, adef) >= val
-        elif ctype == 'divine_beast_kill':
-            return cls._get_divine_beast_kill_progress(player, adef) >= val
-        elif ctype == 'forge':
-            return (player.forge_count or 0) >= val
-        elif ctype == 'enhance_success':
-            return (player.enhance_success_count or 0) >= val
-        elif ctype == 'enhance_fail':
-            return (player.enhance_fail_count or 0) >= val
-        elif ctype == 'enhance_50':
-            return (player.enhance_50_count or 0) >= val
-        elif ctype == 'artifact_owned':
-            return cls._get_artifact_owned_progress(player, adef) >= val
-        elif ctype == 'barbarian_soldier_kill':
-            data = getattr(player, 'activity_data', {}) or {}
-            return (data.get('barbarian', {}) or {}).get('soldier_total', 0) >= val
-        elif ctype == 'barbarian_leader_kill':
-            side = adef.get('side', '南')
-            data = getattr(player, 'activity_data', {}) or {}
-            return (data.get('barbarian', {}) or {}).get(side + '_leader', 0) >= val
-        elif ctype == 'quest':
-            return cls._get_quest_progress(player, adef) >= val
-        elif ctype == 'quest_done':
-            return cls._get_quest_done_progress(player, adef) >= val
-        return False
+    def _completed_ids(cls, player_id):
+        """玩家已完成的成就 id 集合：请求内每个玩家只查一次，之后随完成同步更新。"""
+        from flask import g, has_request_context
+        if has_request_context():
+            cache = g.setdefault('_achievements_completed', {})
+            if player_id not in cache:
+                cache[player_id] = cls._load_completed_ids(player_id)
+            return cache[player_id]
+        return cls._load_completed_ids(player_id)
 
-    @classmethod
-    def _complete(cls, player, achievement_id):
-        if cls.is_completed(player.id, achievement_id):
-            return
-        db.session.add(Achievement(
-            player_id=player.id,
-            achievement_id=achievement_id,
-            claimed=False
-        ))
-        db.session.flush()
+    @staticmethod
+    def _load_completed_ids(player_id):
+        rows = db.session.query(Achievement.achievement_id).filter_by(player_id=player_id).all()
+        return {aid for aid, in rows}
+
+    @staticmethod
+    def _insert_completed(player_id, achievement_ids):
+        """一条 INSERT 写入全部新完成的成就。"""
+        db.session.execute(db.insert(Achievement), [
+            {'player_id': player_id, 'achievement_id': aid, 'claimed': False}
+            for aid in achievement_ids
+        ])
 
     @classmethod
     def claim(cls, player, achievement_id):
@@ -249,6 +205,8 @@ class AchievementService:
             return cls._get_social_stat(player, 'ach_steal_medicine')
         elif ctype == 'steal_caught':
             return cls._get_social_stat(player, 'ach_steal_caught')
+        elif ctype == 'vip_level':
+            return player.vip_level or 0
         elif ctype == 'lieutenant_owned':
             from models.lieutenant import Lieutenant
             name = adef.get('lt_name', '')
@@ -264,10 +264,15 @@ class BarbarianService:
         db.session.commit()
         return state
 
+    @classmethod
+    def tick_all(cls):
+        """后台调度任务：推进南北两方。"""
+        for side in SIDES:
+            cls.tick(side)
+
     # ---------- 查询 ----------
     @classmethod
     def get_state(cls, player, side):
-        cls.tick(side)
         state = cls.get_or_create_state(side)
         leaders = []
         for cfg in LEADERS_CFG:
@@ -437,7 +442,6 @@ class BarbarianService:
             return []
         result = []
         for side in SIDES:
-            cls.tick(side)
             for leader in BarbarianLeader.query.filter_by(side=side, status='alive').all():
                 if getattr(leader, 'location_id', None) == location_id:
                     result.append(leader.monster_id)
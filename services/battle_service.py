@@ -9,6 +9,8 @@ from services.one_time_elite_service import OneTimeEliteService
 from models.player import PlayerModel, EquipmentInstance, InventoryItem, PlayerSkill
 from models.monster import Monster
 from models.lieutenant import Lieutenant
+from services.battle_session import BattleSessionRegistry
+from services.unit_of_work import UnitOfWork
 
 
 class BattleService:
@@ -18,7 +20,7 @@ class BattleService:
     # 技能特殊效果配置：skill_id -> {effect: {...}}
     # 状态效果以「剩余回合数」计，存于：
     #   - 玩家身上：PlayerModel.status_confuse_rounds / status_silence_rounds
-    #   - 怪物身上：encounter['monster_status'] = {bleed: {rounds, value}, ...}
+    #   - 怪物身上：BattleSession.monster_status = {bleed: {rounds, value}, ...}
     #   - PK 双方：PlayerModel 同上（PK 期间也走玩家状态列）
 
     # 伤害公式（统一）：
@@ -100,27 +102,34 @@ class BattleService:
                 if p.status_bleed_rounds <= 0:
                     p.status_bleed_value = 0
 
-    # ---- 怪物状态效果 helpers（存于 encounter JSON）----
+    # ---- 怪物状态效果 helpers（存于 PvE 战斗会话）----
     @classmethod
     def _get_monster_status(cls, player):
-        data = player.get_current_encounter_data() or {}
-        return data.get('monster_status', {}) or {}
+        session = BattleSessionRegistry.peek(player.id)
+        return session.monster_status if session else {}
 
     @classmethod
     def _set_monster_status(cls, player, status):
-        data = player.get_current_encounter_data() or {}
-        data['monster_status'] = status or {}
-        player.set_current_encounter_data(data)
+        session = BattleSessionRegistry.peek(player.id)
+        if session:
+            session.monster_status = status or {}
 
-    # ---- 副将战斗状态 helpers（存于 encounter JSON 的 lt_status）----
+    # ---- 副将战斗状态 helpers（PvE 存于战斗会话；PK 无会话，仍存于 encounter JSON 的 lt_status）----
     # 存：atk_buff_rounds(猛击本回合攻+50%,1回合)、def_debuff_rounds(猛击自身防减半,2回合)、shield(法相护盾,本回合)
     @classmethod
     def _get_lt_status(cls, player):
+        session = BattleSessionRegistry.peek(player.id)
+        if session:
+            return session.lt_status
         data = player.get_current_encounter_data() or {}
         return data.get('lt_status', {}) or {}
 
     @classmethod
     def _set_lt_status(cls, player, status):
+        session = BattleSessionRegistry.peek(player.id)
+        if session:
+            session.lt_status = status or {}
+            return
         data = player.get_current_encounter_data() or {}
         data['lt_status'] = status or {}
         player.set_current_encounter_data(data)
@@ -611,16 +620,13 @@ class BattleService:
             return None, "你已经处于战斗中"
 
         location_data = DataService.get_locations().get(player.current_location, {})
-        monster_ids = location_data.get("monsters", [])
-
-        # Filter out NPCs (non-killable)
+        scene = DataService.get_scene_index().get(player.current_location)
         all_monsters = DataService.get_monsters()
-        killable_ids = [mid for mid in monster_ids
-                        if all_monsters.get(mid, {}).get("killable", True)
-                        and CopyDungeonService.should_show_monster_in_scene(player, mid)
-                        and OneTimeEliteService.should_show_in_scene(player, mid)]
-        if not killable_ids and not monster_id:
-            return None, "这里没有怪物"
+
+        # 只有副本怪/一次性精英需要按玩家判断可见性，其余按场景索引预分好的列表直接取
+        def _visible(mid):
+            return CopyDungeonService.should_show_monster_in_scene(player, mid) \
+                and OneTimeEliteService.should_show_in_scene(player, mid)
 
         # Finance bandit: a bandit present at this location may be targeted (理财·劫匪, 世界BOSS)
         from services.finance_service import FinanceService
@@ -629,38 +635,24 @@ class BattleService:
             if location_data.get('is_copy_map'):
                 _ad = player.activity_data or {}
                 last_copy = _ad.get('last_copy_kill')
-                if last_copy and last_copy in killable_ids:
+                if last_copy and scene.is_available(last_copy, _visible):
                     monster_id = last_copy
-                elif killable_ids:
-                    # 兜底：选场景内第一个非精英/非despawn的常驻副本怪
-                    def _is_persistent_copy(mid):
-                        md = all_monsters.get(mid, {})
-                        return (md.get('is_copy') or md.get('copy_only')) \
-                            and not md.get('is_elite') and not md.get('copy_final_boss') \
-                            and not md.get('despawn_after_defeat')
-                    _pool = [mid for mid in killable_ids if _is_persistent_copy(mid)]
+                else:
+                    _pool = [mid for mid in scene.persistent_copy_ids if _visible(mid)]
                     monster_id = random.choice(_pool) if _pool else None
             if monster_id is None:
                 # 非副本或副本内无常驻副本怪：随机遇怪，只能是本场景【常驻】的【普通】怪物。
                 # 排除：精英/世界boss(需主动点链接挑战)、副本怪、以及非本场景常驻的刷新怪(如理财·劫匪)。
-                def _is_resident_normal(mid):
-                    md = all_monsters.get(mid, {})
-                    if not md.get("killable", True):
-                        return False
-                    if md.get("is_elite") or md.get("is_divine_beast"):
-                        return False
-                    if md.get("is_copy") or md.get("copy_only"):
-                        return False
-                    if str(mid).startswith("bandit_") or md.get("is_bandit"):
-                        return False
-                    return True
-                random_pool = [mid for mid in killable_ids if _is_resident_normal(mid)]
+                random_pool = scene.resident_normal_ids
+                if scene.resident_gated_ids:
+                    random_pool = random_pool + tuple(
+                        mid for mid in scene.resident_gated_ids if _visible(mid))
                 monster_id = random.choice(random_pool) if random_pool else None
         else:
             # 指定怪物：劫匪需在该场景且在场，其它怪需属于该场景
             bandit_info = FinanceService.get_bandit_at_location(player.current_location)
             is_bandit = bandit_info and bandit_info[0] == monster_id
-            if not is_bandit and monster_id not in killable_ids:
+            if not is_bandit and not scene.is_available(monster_id, _visible):
                 # 南蛮/北夷首领可从活动页任意地点挑战
                 from services.barbarian_service import BarbarianService
                 if not BarbarianService.is_barbarian_monster(monster_id):
@@ -703,10 +695,9 @@ class BattleService:
             lt.current_health = lt.get_max_health()
             lt.current_mana = lt.get_max_mana()
 
-        cls._save_encounter(player, monster)
-        db.session.commit()
+        BattleSessionRegistry.start(player, monster)
 
-        # Monster strikes first
+        # Monster strikes first（与开战同一次提交）
         lt = cls._get_deployed_lt(player)
         cls._monster_attack_with_lt(monster, player, lt)
         cls._save_encounter(player, monster)
@@ -722,21 +713,21 @@ class BattleService:
             if lt and lt.is_alive:
                 from services.lieutenant_service import LieutenantService
                 LieutenantService.handle_death(lt, owner_died=True)
-            db.session.commit()
+            UnitOfWork.commit()
             return None, "怪物先发制人，你被击败了"
         cls._apply_reserve_restore(player, monster)
         player.last_damage_taken = monster.last_damage_dealt or 0
-        db.session.commit()
+        UnitOfWork.commit()
         return monster, None
 
     @classmethod
     def get_current_monster(cls, player):
-        data = player.get_current_encounter_data()
-        if not data:
+        session = BattleSessionRegistry.get(player)
+        if not session:
             return None
-        monster = Monster(data.get('monster_id'), data)
+        monster = session.monster
         # Sync world boss HP from shared state
-        if data.get('is_world_boss'):
+        if cls._is_world_boss(monster):
             boss = WorldBossService.get_boss(monster.monster_id)
             if boss:
                 monster.health = boss.current_health
@@ -745,42 +736,32 @@ class BattleService:
 
     @classmethod
     def _save_encounter(cls, player, monster):
-        encounter = {
-            'monster_id': monster.monster_id,
-            'name': monster.name,
-            'level': monster.level,
-            'is_elite': monster.is_elite,
-            'is_one_time_elite': getattr(monster, 'is_one_time_elite', False),
-            'is_divine_beast': monster.is_divine_beast,
-            'is_copy': getattr(monster, 'is_copy', False),
-            'copy_only': getattr(monster, 'copy_only', False),
-            'copy_dungeon_id': getattr(monster, 'copy_dungeon_id', None),
-            'copy_stage': getattr(monster, 'copy_stage', None),
-            'copy_role': getattr(monster, 'copy_role', None),
-            'killable': monster.killable,
-            'immortal': monster.immortal,
-            'description': monster.description,
-            'base_stats': {
-                'current_health': monster.health,
-                'health': monster.max_health,
-                'max_health': monster.max_health,
-                'mana': monster.mana,
-                'max_mana': monster.max_mana,
-                'attack': monster.attack,
-                'defense': monster.defense,
-                'crit_rate': monster.crit_rate,
-                'dodge_rate': monster.dodge_rate,
-            },
-            'skills': monster.skills,
-            'drops': monster.drops,
-            'last_damage_taken': monster.last_damage_taken,
-            'last_damage_dealt': monster.last_damage_dealt,
-            'last_action': monster.last_action,
-            'last_skill': monster.last_skill,
-            'is_world_boss': monster.is_elite and not getattr(monster, 'is_copy', False) and not getattr(monster, 'is_one_time_elite', False),
-            'guaranteed_items': getattr(monster, 'guaranteed_items', []),
-        }
-        player.set_current_encounter_data(encounter)
+        """回合状态已直接记在会话的 Monster 对象上；这里只在到点时顺带写检查点。"""
+        BattleSessionRegistry.maybe_checkpoint(player)
+
+    @classmethod
+    def _commit_boss_hits(cls, player, monster, boss_hits):
+        """回合伤害提交到世界 BOSS 共享血量，并以共享血量为准。
+
+        返回 False 表示 BOSS 已被别的玩家抢先击杀：本场战斗结束、不结算击杀。
+        """
+        killed, health = boss_hits.commit()
+        if health is None:
+            return True  # 无共享状态，按个人战斗处理
+        monster.health = health
+        if health > 0 or killed:
+            return True
+        player.in_battle = False
+        player.current_encounter = None
+        player.last_battle_result = "该怪物已被其他玩家击杀"
+        db.session.commit()
+        return False
+
+    @staticmethod
+    def _is_world_boss(monster):
+        """共享血量的世界 BOSS（副本精英、一次性精英是个人战斗）。"""
+        return bool(monster.is_elite and not getattr(monster, 'is_copy', False)
+                    and not getattr(monster, 'is_one_time_elite', False))
 
     @classmethod
     def player_attack(cls, player):
@@ -800,7 +781,7 @@ class BattleService:
         player.last_hp_delta = 0
         player.last_mp_delta = 0
 
-        encounter_data = player.get_current_encounter_data()
+        is_world_boss = cls._is_world_boss(monster)
 
         # 玩家被混乱：无法普攻/技能/撤退，跳过本回合行动（怪物仍会反击）
         if cls._player_is_confused(player):
@@ -835,6 +816,7 @@ class BattleService:
 
         # Build battle log: player attack
         player_log = f"*『{player.name}』使出[普攻]"
+        boss_hits = WorldBossService.batch(monster.monster_id, player.id) if is_world_boss else None
         lt = cls._get_deployed_lt(player)
         lt_damage = 0
         # 怪物被混乱时，受到的攻击伤害减半
@@ -852,8 +834,8 @@ class BattleService:
                 dmg_text = f"{damage}(暴击)"
             monster.health -= damage
             monster.last_damage_taken = damage
-            if encounter_data.get('is_world_boss'):
-                WorldBossService.damage_boss(monster.monster_id, player.id, damage)
+            if boss_hits:
+                boss_hits.add(damage)
             # Lieutenant also attacks
             if lt and lt.is_alive:
                 lt_damage, lt_skill = cls._lt_attack_monster(lt, monster, player)
@@ -862,8 +844,8 @@ class BattleService:
                     monster.last_damage_taken += lt_damage
                     player_log += f",『{lt.name}』使出[{lt_skill or '普攻'}]"
                     dmg_text += f"＋{lt_damage}"
-                    if encounter_data.get('is_world_boss'):
-                        WorldBossService.damage_boss(monster.monster_id, player.id, lt_damage)
+                    if boss_hits:
+                        boss_hits.add(lt_damage)
             player_log += f",『{monster.name}』受到{dmg_text}伤害."
             player.last_damage_dealt = dmg_text
         else:
@@ -875,17 +857,21 @@ class BattleService:
                     monster.health -= lt_damage
                     monster.last_damage_taken += lt_damage
                     player_log += f",『{lt.name}』使出[{lt_skill or '普攻'}]"
-                    if encounter_data.get('is_world_boss'):
-                        WorldBossService.damage_boss(monster.monster_id, player.id, lt_damage)
+                    if boss_hits:
+                        boss_hits.add(lt_damage)
             player_log += f",『{monster.name}』受到0(闪避)伤害."
             player.last_damage_dealt = "0(闪避)"
         player.last_action = player_log
 
+        if boss_hits and not cls._commit_boss_hits(player, monster, boss_hits):
+            return monster, "该怪物已被其他玩家击杀", None
+
         cls._save_encounter(player, monster)
 
         if monster.health <= 0:
             result = cls._handle_monster_defeat(player, monster)
-            db.session.commit()
+            # 世界 BOSS 击杀奖励立即落库，其余随请求结束统一提交
+            UnitOfWork.commit_now() if is_world_boss else UnitOfWork.commit()
             return monster, None, result
 
         # Monster attacks, lieutenant absorbs if front
@@ -1001,7 +987,7 @@ class BattleService:
         player.last_hp_delta = 0
         player.last_mp_delta = mana_cost  # 技能耗蓝(扣蓝为正)
 
-        encounter_data = player.get_current_encounter_data()
+        is_world_boss = cls._is_world_boss(monster)
 
         base_rate = skill_data["base_damage_rate"]
         rate_per = skill_data.get("damage_rate_per_level", 0)
@@ -1054,11 +1040,9 @@ class BattleService:
         monster.health -= total_damage
         monster.last_damage_taken = total_damage
 
-        if encounter_data.get('is_world_boss'):
-            killed, killer_id = WorldBossService.damage_boss(
-                monster.monster_id, player.id, total_damage)
-            if killed:
-                monster.health = 0
+        boss_hits = WorldBossService.batch(monster.monster_id, player.id) if is_world_boss else None
+        if boss_hits:
+            boss_hits.add(total_damage)
 
         # 技能特殊效果（命中后才触发）
         effect_msg = ""
@@ -1083,19 +1067,23 @@ class BattleService:
                 monster.last_damage_taken += lt_damage
                 player_log += f",『{lt.name}』使出[{lt_skill or '普攻'}]"
                 dmg_text += f"＋{lt_damage}"
-                if encounter_data.get('is_world_boss'):
-                    WorldBossService.damage_boss(monster.monster_id, player.id, lt_damage)
+                if boss_hits:
+                    boss_hits.add(lt_damage)
         player_log += f",『{monster.name}』受到{dmg_text}伤害."
         if effect_msg:
             player_log += f"[{effect_msg}]"
         player.last_action = player_log
         player.last_damage_dealt = dmg_text
 
+        if boss_hits and not cls._commit_boss_hits(player, monster, boss_hits):
+            return monster, "该怪物已被其他玩家击杀", None
+
         cls._save_encounter(player, monster)
 
         if monster.health <= 0:
             result = cls._handle_monster_defeat(player, monster)
-            db.session.commit()
+            # 世界 BOSS 击杀奖励立即落库，其余随请求结束统一提交
+            UnitOfWork.commit_now() if is_world_boss else UnitOfWork.commit()
             return monster, None, result
 
         # Monster attacks, lieutenant absorbs if front
@@ -1474,7 +1462,8 @@ class BattleService:
         if monster.is_elite:
             AchievementService.check(player, 'elite_kill_area')
         # Check per-monster kill achievements
-        AchievementService.check(player, 'elite_kill_monster' if monster.is_elite else 'kill_monster')
+        AchievementService.check(player, 'elite_kill_monster' if monster.is_elite else 'kill_monster',
+                                 key=monster.monster_id)
         # Check divine beast cumulative kill achievements
         if monster.is_divine_beast:
             AchievementService.check(player, 'divine_beast_kill')
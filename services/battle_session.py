@@ -0,0 +1,282 @@
+"""PvE 战斗会话：进行中的遭遇战常驻进程内存，按玩家 id 索引。
+
+原来每个回合都把整场遭遇在 PlayerModel.current_encounter 里往返一次：_save_encounter
+拼 25 个键的 dict（连同整棵 drops/skills 配置）再 json.dumps，get_current_monster 再 json.loads
+重建 Monster。现在开战时把 Monster 对象放进 BattleSession，之后各回合直接在同一对象上结算；
+drops/skills 随 Monster.create_monster 引用 DataService 里的怪物配置，不再复制。
+
+current_encounter 列退化为检查点：开战时写一次，之后距上次写入超过 CHECKPOINT_INTERVAL
+才随该回合的提交顺带写一次，只存 monster_id 与变化的战斗状态（血蓝、回合日志、怪物/副将状态）。
+进程重启后首次访问从检查点恢复（最多回退 CHECKPOINT_INTERVAL 秒内的进度）；
+旧版整包 JSON 也能恢复。战斗结束的各条路径都会把 current_encounter 置空，
+这里监听该列的赋值，置空即丢弃会话，无需逐处改写。
+长时间无操作的会话由后台任务 battle_sessions 写回检查点后逐出。
+
+多 worker（共享后端为 sqlite）时同一玩家的请求可能落到不同 worker，会话对象各进程各一份：
+每次提交前（before_commit）把本事务动过的会话都写成检查点，内容没变则不写；取用会话时
+比对本进程最后写入/读到的检查点与库里的 current_encounter，不一致说明别的 worker 推进过
+这场战斗，丢弃本地会话、按库里的检查点恢复。
+
+会话在内存里就地修改、不随数据库事务回滚，因此每个事务首次取用/开战/丢弃某玩家的会话时，
+先在 session.info 里记下原会话对象及其状态快照：事务提交则清掉记录；回滚（乐观锁冲突、
+retry_on_conflict 重跑、请求异常）或未提交就结束时，把会话还原成事务开始前的样子
+（已丢弃的放回、新开的移除），与回滚后的 current_encounter 保持一致。
+"""
+import copy
+import json
+import threading
+import time
+
+from flask import has_app_context
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.util import identity_key
+
+from services.shared_state import SharedState
+
+
+_INFO_KEY = '_battle_sessions'  # session.info：本事务动过的会话 {player_id: (原会话或 None, 状态快照)}
+
+
+class BattleSession:
+    """一场进行中的 PvE 遭遇：怪物对象 + 回合间需要保留的状态。"""
+    __slots__ = ('player_id', 'monster', 'monster_status', 'lt_status',
+                 'checkpointed_at', 'touched_at', 'checkpoint_text')
+
+    def __init__(self, player_id, monster, monster_status=None, lt_status=None):
+        self.player_id = player_id
+        self.monster = monster
+        self.monster_status = monster_status or {}
+        self.lt_status = lt_status or {}
+        self.checkpointed_at = 0.0
+        self.touched_at = time.time()
+        self.checkpoint_text = None  # 本进程最后写入/读到的 current_encounter，多 worker 时据此发现别处的推进
+
+    def to_checkpoint(self):
+        m = self.monster
+        return {
+            'v': 2,
+            'monster_id': m.monster_id,
+            'health': m.health,
+            'max_health': m.max_health,
+            'mana': m.mana,
+            'last_damage_taken': m.last_damage_taken,
+            'last_damage_dealt': m.last_damage_dealt,
+            'last_action': m.last_action,
+            'last_skill': m.last_skill,
+            'monster_status': self.monster_status,
+            'lt_status': self.lt_status,
+        }
+
+    @classmethod
+    def from_checkpoint(cls, player_id, data):
+        """由检查点（或旧版整包遭遇 JSON）恢复；怪物已从配置中删除时返回 None。"""
+        from models.monster import Monster
+        monster_id = data.get('monster_id')
+        if 'base_stats' in data:  # 旧版：整场遭遇都在 JSON 里
+            monster = Monster(monster_id, data)
+        else:
+            monster = Monster.create_monster(monster_id)
+            if monster is None:
+                return None
+            for field in ('health', 'max_health', 'mana', 'last_damage_taken',
+                          'last_damage_dealt', 'last_action', 'last_skill'):
+                if field in data:
+                    setattr(monster, field, data[field])
+        return cls(player_id, monster, data.get('monster_status'), data.get('lt_status'))
+
+    def snapshot(self):
+        from models.monster import Monster
+        return (tuple(getattr(self.monster, name) for name in Monster.__slots__),
+                copy.deepcopy(self.monster_status), copy.deepcopy(self.lt_status),
+                self.checkpointed_at, self.checkpoint_text)
+
+    def restore(self, snap):
+        from models.monster import Monster
+        values, self.monster_status, self.lt_status, self.checkpointed_at, self.checkpoint_text = snap
+        for name, value in zip(Monster.__slots__, values):
+            setattr(self.monster, name, value)
+
+
+class BattleSessionRegistry:
+    CHECKPOINT_INTERVAL = 30  # 秒；两次检查点之间最多丢失的进度
+    IDLE_TTL = 1800           # 秒；无操作超过此时长的会话写回检查点后逐出内存
+
+    _lock = threading.Lock()
+    _sessions = {}  # {player_id: BattleSession}
+    _stats = {'started': 0, 'restored': 0, 'checkpoints': 0, 'evicted': 0, 'rolled_back': 0,
+              'superseded': 0}
+
+    @classmethod
+    def start(cls, player, monster):
+        """开战：登记新会话并立即写检查点（随开战的提交落库）。"""
+        cls._track(object_session(player), player.id)
+        session = BattleSession(player.id, monster)
+        with cls._lock:
+            cls._sessions[player.id] = session
+            cls._stats['started'] += 1
+        cls.checkpoint(player, session)
+        return session
+
+    @classmethod
+    def peek(cls, player_id):
+        """只查内存，不从检查点恢复。"""
+        with cls._lock:
+            return cls._sessions.get(player_id)
+
+    @classmethod
+    def get(cls, player):
+        """取玩家的会话；内存中没有（或已被别的 worker 推进）时从 current_encounter 检查点恢复。"""
+        session = cls.peek(player.id)
+        if session is not None and SharedState.is_shared() \
+                and session.checkpoint_text != player.current_encounter:
+            cls._track(object_session(player), player.id)
+            with cls._lock:
+                if cls._sessions.get(player.id) is session:
+                    del cls._sessions[player.id]
+                cls._stats['superseded'] += 1
+            session = None
+        if session is None:
+            data = player.get_current_encounter_data()
+            if not data or not data.get('monster_id'):
+                return None  # 无遭遇，或只有 PK 副将状态
+            session = BattleSession.from_checkpoint(player.id, data)
+            if session is None:
+                return None
+            session.checkpointed_at = time.time()
+            session.checkpoint_text = player.current_encounter
+            with cls._lock:
+                session = cls._sessions.setdefault(player.id, session)
+                cls._stats['restored'] += 1
+        cls._track(object_session(player), player.id)
+        session.touched_at = time.time()
+        return session
+
+    @classmethod
+    def checkpoint(cls, player, session=None):
+        session = session or cls.peek(player.id)
+        if session is None:
+            return
+        player.set_current_encounter_data(session.to_checkpoint())
+        session.checkpointed_at = time.time()
+        session.checkpoint_text = player.current_encounter
+        with cls._lock:
+            cls._stats['checkpoints'] += 1
+
+    @classmethod
+    def maybe_checkpoint(cls, player):
+        """回合结束调用：距上次检查点超过 CHECKPOINT_INTERVAL 才写列。"""
+        session = cls.peek(player.id)
+        if session is not None and time.time() - session.checkpointed_at >= cls.CHECKPOINT_INTERVAL:
+            cls.checkpoint(player, session)
+
+    @classmethod
+    def discard(cls, player_id, db_session=None):
+        cls._track(db_session, player_id)
+        with cls._lock:
+            cls._sessions.pop(player_id, None)
+
+    # ---- 随数据库事务回滚 ----
+
+    @classmethod
+    def _track(cls, db_session, player_id):
+        """本事务首次动到该玩家的会话时，记下原会话与状态快照。"""
+        if db_session is None:
+            if not has_app_context():
+                return
+            from services import db
+            db_session = db.session()
+        touched = db_session.info.setdefault(_INFO_KEY, {})
+        if player_id in touched:
+            return
+        session = cls.peek(player_id)
+        touched[player_id] = (session, session.snapshot() if session is not None else None)
+
+    @classmethod
+    def _on_before_commit(cls, db_session):
+        """多 worker 时：本事务动过、仍在进行的会话随这次提交写回检查点，换到别的 worker 也能接着打。"""
+        if not SharedState.is_shared():
+            return
+        touched = db_session.info.get(_INFO_KEY)
+        if not touched:
+            return
+        from models.player import PlayerModel
+        for player_id in touched:
+            session = cls.peek(player_id)
+            player = db_session.identity_map.get(identity_key(PlayerModel, player_id))
+            if session is None or player is None or player.current_encounter is None:
+                continue
+            if json.dumps(session.to_checkpoint(), ensure_ascii=False) != player.current_encounter:
+                cls.checkpoint(player, session)  # 内容没变则不写
+
+    @staticmethod
+    def _on_commit(db_session):
+        db_session.info.pop(_INFO_KEY, None)
+
+    @classmethod
+    def _on_transaction_end(cls, db_session, transaction):
+        """事务未提交就结束（回滚/关闭）：会话还原成事务开始前的样子。"""
+        if transaction.parent is not None:
+            return
+        touched = db_session.info.pop(_INFO_KEY, None)
+        if not touched:
+            return
+        with cls._lock:
+            for player_id, (session, snap) in touched.items():
+                if session is None:
+                    cls._sessions.pop(player_id, None)
+                else:
+                    session.restore(snap)
+                    cls._sessions[player_id] = session
+                cls._stats['rolled_back'] += 1
+
+    @classmethod
+    def evict_idle(cls):
+        """后台任务：闲置会话写回检查点后逐出（只更新仍有遭遇的玩家行）。
+
+        多 worker 时检查点每次提交都已写回，且库里可能是别的 worker 更新的进度，只逐出不写。"""
+        from services import db
+        from models.player import PlayerModel
+        cutoff = time.time() - cls.IDLE_TTL
+        with cls._lock:
+            idle = [s for s in cls._sessions.values() if s.touched_at < cutoff]
+        if not idle:
+            return 0
+        if not SharedState.is_shared():
+            for session in idle:
+                PlayerModel.query.filter(
+                    PlayerModel.id == session.player_id,
+                    PlayerModel.current_encounter.isnot(None),
+                ).update({'current_encounter': json.dumps(session.to_checkpoint(), ensure_ascii=False),
+                          'version': PlayerModel.version + 1},  # 不经 ORM，手动推进乐观锁版本
+                         synchronize_session=False)
+            db.session.commit()
+        with cls._lock:
+            for session in idle:
+                if cls._sessions.get(session.player_id) is session and session.touched_at < cutoff:
+                    del cls._sessions[session.player_id]
+                    cls._stats['evicted'] += 1
+        return len(idle)
+
+    @classmethod
+    def get_metrics(cls):
+        with cls._lock:
+            return dict(cls._stats, active=len(cls._sessions))
+
+
+def _register_listeners():
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    from models.player import PlayerModel
+
+    @event.listens_for(PlayerModel.current_encounter, 'set')
+    def _on_set(target, value, oldvalue, initiator):
+        # 各条结束战斗的路径（击杀/战败/逃跑/复活/休息/工作台）都会把该列置空
+        if value is None and target.id is not None:
+            BattleSessionRegistry.discard(target.id, object_session(target))
+
+    event.listen(Session, 'before_commit', BattleSessionRegistry._on_before_commit)
+    event.listen(Session, 'after_commit', BattleSessionRegistry._on_commit)
+    event.listen(Session, 'after_transaction_end', BattleSessionRegistry._on_transaction_end)
+
+
+_register_listeners()
@@ -6,6 +6,7 @@ from models.lieutenant import Lieutenant
 from models.player import PlayerModel
 from services import db
 from services.data_service import DataService
+from services.shared_state import DELETE, SharedState
 from datetime import datetime, date
 
 
@@ -58,20 +59,73 @@ class CityState:
         self.war_date = ''
         self.winner_legion_id = None
 
+    def to_dict(self):
+        return {
+            'players': sorted(self.players),
+            'legion_scores': self.legion_scores,
+            'player_scores': self.player_scores,
+            'kill_log': self.kill_log,
+            'war_date': self.war_date,
+            'winner_legion_id': self.winner_legion_id,
+        }
+
+    @classmethod
+    def from_dict(cls, city_key, data):
+        state = cls(city_key)
+        state.players = set(data.get('players') or [])
+        # JSON 对象的键只能是字符串，军团/玩家 id 还原为 int
+        state.legion_scores = {int(k): v for k, v in (data.get('legion_scores') or {}).items()}
+        state.player_scores = {int(k): v for k, v in (data.get('player_scores') or {}).items()}
+        state.kill_log = list(data.get('kill_log') or [])
+        state.war_date = data.get('war_date') or ''
+        state.winner_legion_id = data.get('winner_legion_id')
+        return state
+
+
+# 各城当日战况存 SharedState（多 worker 共用）；sqlite 后端按 dict 存取
+CITY_NAMESPACE = 'battlefield_city'
+SharedState.register_codec(
+    CITY_NAMESPACE,
+    encode=lambda state: dict(state.to_dict(), city_key=state.city_key),
+    decode=lambda data: CityState.from_dict(data['city_key'], data))
+# 全服战事标记：'test_war' 为工作台开启的测试战 {active, start}，'weekly_reset' 为最近一次周重置的日期
+WAR_NAMESPACE = 'battlefield_war'
+
 
 class BattlefieldService:
 
     TESTING_MODE = True
 
-    _cities = {}
+    # 各城 CityState 在 SharedState 的 CITY_NAMESPACE 里，经 _city/_update_city 读写
 
     # --- Time control ---
 
     # --- Test war (workbench-triggered, non-Saturday) ---
-    TEST_WAR_ACTIVE = False
-    TEST_WAR_START = 0.0
+    # 开启状态存 SharedState（WAR_NAMESPACE 'test_war'），工作台在哪个 worker 开启都对全服生效
     TEST_WAR_DURATION = 600  # 10 minutes
 
+    @classmethod
+    def _test_war(cls):
+        """返回 (是否开启测试战, 开始时间)。"""
+        war = SharedState.backend.get(WAR_NAMESPACE, 'test_war') or {}
+        return bool(war.get('active')), float(war.get('start') or 0)
+
+    @classmethod
+    def start_test_war(cls):
+        SharedState.backend.set(WAR_NAMESPACE, 'test_war', {'active': True, 'start': time.time()})
+
+    @classmethod
+    def stop_test_war(cls):
+        """关闭测试战，返回是否由本次调用关闭（多个 worker 同时到时只有一个拿到 True）。"""
+        stopped = []
+
+        def _stop(war):
+            if war and war.get('active'):
+                stopped.append(True)
+            return DELETE
+        SharedState.backend.update(WAR_NAMESPACE, 'test_war', _stop)
+        return bool(stopped)
+
     @classmethod
     def _in_saturday_window(cls):
         now = datetime.now()
@@ -79,24 +133,27 @@ class BattlefieldService:
 
     @classmethod
     def is_war_time(cls):
-        if cls.TEST_WAR_ACTIVE:
-            return time.time() - cls.TEST_WAR_START < cls.TEST_WAR_DURATION
+        active, start = cls._test_war()
+        if active:
+            return time.time() - start < cls.TEST_WAR_DURATION
         if cls.TESTING_MODE:
             return True
         return cls._in_saturday_window()
 
     @classmethod
     def is_entry_allowed(cls):
-        if cls.TEST_WAR_ACTIVE:
-            return time.time() - cls.TEST_WAR_START < cls.TEST_WAR_DURATION
+        active, start = cls._test_war()
+        if active:
+            return time.time() - start < cls.TEST_WAR_DURATION
         if cls.TESTING_MODE:
             return True
         return cls._in_saturday_window()
 
     @classmethod
     def should_force_exit(cls):
-        if cls.TEST_WAR_ACTIVE:
-            return time.time() - cls.TEST_WAR_START >= cls.TEST_WAR_DURATION
+        active, start = cls._test_war()
+        if active:
+            return time.time() - start >= cls.TEST_WAR_DURATION
         if cls.TESTING_MODE:
             return False
         now = datetime.now()
@@ -108,37 +165,48 @@ class BattlefieldService:
 
     @classmethod
     def get_test_war_status(cls):
-        if not cls.TEST_WAR_ACTIVE:
+        active, start = cls._test_war()
+        if not active:
             return {'active': False, 'remaining': 0}
-        remaining = max(0, int(cls.TEST_WAR_DURATION - (time.time() - cls.TEST_WAR_START)))
+        remaining = max(0, int(cls.TEST_WAR_DURATION - (time.time() - start)))
         return {'active': True, 'remaining': remaining}
 
     # --- Weekly territory reset & war tick ---
-    _last_reset_date = ''
+    _last_reset_date = ''  # 本进程已确认过的重置日期，省去重复读后端
 
     @classmethod
     def ensure_weekly_territory_reset(cls):
-        """周六0点清空所有城池属性加成(占领)与军团/个人积分状态，待本周团战后再占领。"""
+        """周六0点清空所有城池属性加成(占领)与军团/个人积分状态，待本周团战后再占领。
+        重置日期记在 SharedState（WAR_NAMESPACE 'weekly_reset'），多个 worker 只有一个执行。"""
         today = date.today()
         if today.weekday() == 5:  # Saturday
             if cls._last_reset_date != today.isoformat():
                 cls._last_reset_date = today.isoformat()
-                cls.reset_territories()
-                cls.reset_weekly_points()
+                claimed = []
+
+                def _claim(last):
+                    if last == today.isoformat():
+                        return last
+                    claimed.append(True)
+                    return today.isoformat()
+                SharedState.backend.update(WAR_NAMESPACE, 'weekly_reset', _claim)
+                if claimed:
+                    cls.reset_territories()
+                    cls.reset_weekly_points()
 
     @classmethod
     def _end_test_war(cls):
         """测试战结束：关闭入口、强制清场、按积分自动占领。"""
-        cls.TEST_WAR_ACTIVE = False
+        cls.stop_test_war()
         for p in PlayerModel.query.filter_by(in_battlefield=True).all():
             cls.exit_battlefield(p)
         cls._auto_settle_territories()
 
     @classmethod
     def tick(cls):
-        """战场相关页面加载时调用：处理周重置、测试战结束、强制清场。"""
+        """后台调度任务 battlefield 定时调用：处理周重置、测试战结束、强制清场。"""
         cls.ensure_weekly_territory_reset()
-        if cls.TEST_WAR_ACTIVE and cls.should_force_exit():
+        if cls._test_war()[0] and cls.should_force_exit() and cls.stop_test_war():
             cls._end_test_war()
         # 死亡超时清扫：续命窗口(15秒)已过的阵亡玩家强制传出战场，
         # 避免有灯不复活/离线玩家永久滞留 in_battlefield=True。
@@ -165,12 +233,29 @@ class BattlefieldService:
 
     @classmethod
     def _ensure_city(cls, city_key):
+        """返回该城当日的 CityState（跨天则换成空状态）。只读：修改须走 _update_city。"""
         today = date.today().isoformat()
-        if city_key not in cls._cities:
-            cls._cities[city_key] = CityState(city_key)
-        if cls._cities[city_key].war_date != today:
-            cls._cities[city_key] = CityState(city_key)
-            cls._cities[city_key].war_date = today
+        state = SharedState.backend.get(CITY_NAMESPACE, city_key)
+        if state is not None and state.war_date == today:
+            return state
+
+        def _reset(state):
+            if state is not None and state.war_date == today:
+                return state
+            state = CityState(city_key)
+            state.war_date = today
+            return state
+        return SharedState.backend.update(CITY_NAMESPACE, city_key, _reset)
+
+    @classmethod
+    def _update_city(cls, city_key, func):
+        """原子修改该城当日状态：func 就地修改 CityState。"""
+        cls._ensure_city(city_key)
+
+        def _apply(state):
+            func(state)
+            return state
+        return SharedState.backend.update(CITY_NAMESPACE, city_key, _apply)
 
     # --- Enter / Exit ---
 
@@ -217,10 +302,10 @@ class BattlefieldService:
         player.health = PlayerService.get_max_health(player)
         player.mana = PlayerService.get_max_mana(player)
 
-        cls._ensure_city(city_key)
-        cls._cities[city_key].players.add(player.id)
-        if player.id not in cls._cities[city_key].player_scores:
-            cls._cities[city_key].player_scores[player.id] = 0
+        def _enter(state):
+            state.players.add(player.id)
+            state.player_scores.setdefault(player.id, 0)
+        cls._update_city(city_key, _enter)
 
         db.session.commit()
         return True, f"进入了{city['name']}战场！"
@@ -228,8 +313,8 @@ class BattlefieldService:
     @classmethod
     def exit_battlefield(cls, player):
         city_key = player.battlefield_city
-        if city_key and city_key in cls._cities:
-            cls._cities[city_key].players.discard(player.id)
+        if city_key and SharedState.backend.get(CITY_NAMESPACE, city_key) is not None:
+            cls._update_city(city_key, lambda state: state.players.discard(player.id))
         # 解除仍被本玩家锁定的对手的“战斗中”状态（互锁时双方都要解，避免对手卡在决斗中）
         locked_id = player.battlefield_target_id
         if locked_id:
@@ -522,18 +607,19 @@ class BattlefieldService:
             #    与野外 PK 的荣誉零和分档无关。
 
             # 3. Legion battle points (in-memory + persistent)
-            cls._ensure_city(city_key)
-            if attacker_member:
-                lid = attacker_member.legion_id
-                cls._cities[city_key].legion_scores[lid] = \
-                    cls._cities[city_key].legion_scores.get(lid, 0) + TIER_POINTS[tier]
+            lid = attacker_member.legion_id if attacker_member else None
+
+            def _score(state):
+                points = TIER_POINTS[tier]
+                if lid is not None:
+                    state.legion_scores[lid] = state.legion_scores.get(lid, 0) + points
+                state.player_scores[attacker.id] = state.player_scores.get(attacker.id, 0) + points
+            cls._update_city(city_key, _score)
+            if lid is not None:
                 legion = Legion.query.get(lid)
                 if legion:
                     legion.battle_points += TIER_POINTS[tier]
 
-            cls._cities[city_key].player_scores[attacker.id] = \
-                cls._cities[city_key].player_scores.get(attacker.id, 0) + TIER_POINTS[tier]
-
         # Update military ranks (honor 未变化，通常不触发军衔变动)
         from services.player_service import PlayerService
         PlayerService.update_military_rank(attacker)
@@ -541,10 +627,7 @@ class BattlefieldService:
 
         # Kill log
         log_entry = f"{attacker.nickname}击杀了{defender.nickname}"
-        city_state = cls._cities[city_key]
-        city_state.kill_log.append(log_entry)
-        if len(city_state.kill_log) > 8:
-            city_state.kill_log = city_state.kill_log[-8:]
+        cls._update_city(city_key, lambda state: cls._append_kill_log(state, log_entry))
 
         # Set defender death state
         defender.battlefield_death_time = time.time()
@@ -607,18 +690,19 @@ class BattlefieldService:
             # 2. 荣誉不转移（与正常击杀一致）
 
             # 3. 军团积分（内存态 + 持久化）
-            cls._ensure_city(city_key)
-            if winner_member:
-                lid = winner_member.legion_id
-                cls._cities[city_key].legion_scores[lid] = \
-                    cls._cities[city_key].legion_scores.get(lid, 0) + TIER_POINTS[tier]
+            lid = winner_member.legion_id if winner_member else None
+
+            def _score(state):
+                points = TIER_POINTS[tier]
+                if lid is not None:
+                    state.legion_scores[lid] = state.legion_scores.get(lid, 0) + points
+                state.player_scores[winner.id] = state.player_scores.get(winner.id, 0) + points
+            cls._update_city(city_key, _score)
+            if lid is not None:
                 legion = Legion.query.get(lid)
                 if legion:
                     legion.battle_points += TIER_POINTS[tier]
 
-            cls._cities[city_key].player_scores[winner.id] = \
-                cls._cities[city_key].player_scores.get(winner.id, 0) + TIER_POINTS[tier]
-
         # 军衔更新
         from services.player_service import PlayerService
         PlayerService.update_military_rank(winner)
@@ -626,10 +710,7 @@ class BattlefieldService:
 
         # 战报
         log_entry = f"{winner.nickname}击败了逃跑的{loser.nickname}"
-        city_state = cls._cities[city_key]
-        city_state.kill_log.append(log_entry)
-        if len(city_state.kill_log) > 8:
-            city_state.kill_log = city_state.kill_log[-8:]
+        cls._update_city(city_key, lambda state: cls._append_kill_log(state, log_entry))
 
         # 结算结果
         if same_legion:
@@ -650,6 +731,12 @@ class BattlefieldService:
         loser.in_pk = False
         db.session.commit()
 
+    @staticmethod
+    def _append_kill_log(state, log_entry):
+        state.kill_log.append(log_entry)
+        if len(state.kill_log) > 8:
+            state.kill_log = state.kill_log[-8:]
+
     # --- Death & Revive ---
 
     @classmethod
@@ -677,9 +764,9 @@ class BattlefieldService:
     @classmethod
     def force_death_exit(cls, player):
         city_key = player.battlefield_city
-        if city_key and city_key in cls._cities:
+        if city_key and SharedState.backend.get(CITY_NAMESPACE, city_key) is not None:
             # 阵亡即没收该玩家已累积的个人战场积分（死亡后不再获得/保留积分）
-            cls._cities[city_key].player_scores.pop(player.id, None)
+            cls._update_city(city_key, lambda state: state.player_scores.pop(player.id, None))
         cls.exit_battlefield(player)
         return True, "你被传送出战场"
 
@@ -687,8 +774,7 @@ class BattlefieldService:
 
     @classmethod
     def get_city_rankings(cls, city_key):
-        cls._ensure_city(city_key)
-        state = cls._cities[city_key]
+        state = cls._ensure_city(city_key)
 
         sorted_players = sorted(state.player_scores.items(), key=lambda x: x[1], reverse=True)[:10]
         player_ranking = []
@@ -728,19 +814,20 @@ class BattlefieldService:
         领土战没有独立的结束触发器,占领/领取时按需惰性结算,使 /legion/occupy 可用。
         内存态 legion_scores 为空(跨天/重启清零)时,回退到持久化的 Legion.battle_points 取首,
         使占领不依赖易失内存。"""
-        cls._ensure_city(city_key)
-        state = cls._cities[city_key]
+        state = cls._ensure_city(city_key)
         if state.legion_scores:
             winner_id = max(state.legion_scores, key=state.legion_scores.get)
             # 占领条件：总积分排名第一 且 积分必须 > 0，否则无占领资格
             if state.legion_scores[winner_id] <= 0:
                 winner_id = None
-            state.winner_legion_id = winner_id
         else:
             top = Legion.query.filter(Legion.battle_points > 0) \
                 .order_by(Legion.battle_points.desc()).first()
-            state.winner_legion_id = top.id if top else None
-        return state
+            winner_id = top.id if top else None
+
+        def _set_winner(state):
+            state.winner_legion_id = winner_id
+        return cls._update_city(city_key, _set_winner)
 
     @classmethod
     def settle_war(cls):
@@ -826,6 +913,12 @@ class BattlefieldService:
         legion = Legion.query.get(member.legion_id)
         if not legion:
             return {}
+        return cls.get_legion_territory_bonuses(legion)
+
+    @classmethod
+    def get_legion_territory_bonuses(cls, legion):
+        """已加载军团的占领城池加成（不再查 LegionMember/Legion）。"""
+        cls.ensure_weekly_territory_reset()
         bonuses = {'attack': 0, 'defense': 0, 'max_health': 0, 'max_mana': 0}
         for city_key in legion.occupied_cities:
             city = BATTLEFIELD_CITIES.get(city_key)
@@ -854,7 +947,7 @@ class BattlefieldService:
         db.session.commit()
         # 重置内存中 CityState 积分（下次访问会按当天重建空状态）
         for city_key in BATTLEFIELD_CITIES:
-            cls._cities.pop(city_key, None)
+            SharedState.backend.delete(CITY_NAMESPACE, city_key)
 
     # --- Get battlefield players ---
 
@@ -871,5 +964,4 @@ class BattlefieldService:
 
     @classmethod
     def get_kill_log(cls, city_key):
-        cls._ensure_city(city_key)
-        return cls._cities[city_key].kill_log[-8:]
+        return cls._ensure_city(city_key).kill_log[-8:]
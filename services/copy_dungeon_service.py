@@ -509,25 +509,27 @@ class CopyDungeonService:
         if changed:
             data['copy_dungeon_daily'] = daily
             player.activity_data = data
-            db.session.commit()
+            from services.unit_of_work import UnitOfWork
+            UnitOfWork.commit()
         return daily
 
     @classmethod
     def reset_all_daily_free_entries(cls):
-        """后台批量刷新所有玩家每日副本免费次数。"""
+        """批量刷新所有玩家每日副本免费次数（一条 json_set UPDATE，不加载玩家对象）。
+
+        日常无需调用：_get_daily_state 读取时已按日期惰性重置。
+        """
         from datetime import date
-        from models.player import PlayerModel
         today = date.today().isoformat()
-        changed = False
-        for player in PlayerModel.query.all():
-            data = player.activity_data
-            if not isinstance(data, dict):
-                data = {}
-            daily = data.get('copy_dungeon_daily', {})
-            if not isinstance(daily, dict) or daily.get('date') != today:
-                data['copy_dungeon_daily'] = {'date': today, 'free_used': False}
-                player.activity_data = data
-                changed = True
+        result = db.session.execute(db.text(
+            "UPDATE players SET activity_data = json_set("
+            "CASE WHEN json_valid(activity_data) THEN activity_data ELSE '{}' END, "
+            "'$.copy_dungeon_daily', json_object('date', :today, 'free_used', json('false'))), "
+            "version = version + 1 "  # 不经 ORM，手动推进乐观锁版本，持有旧行的请求提交时冲突
+            "WHERE json_valid(activity_data) = 0 "
+            "OR json_extract(activity_data, '$.copy_dungeon_daily.date') IS NOT :today"),
+            {'today': today})
+        changed = result.rowcount > 0
         if changed:
             db.session.commit()
         return changed
@@ -5,7 +5,8 @@ import sys
 from pathlib import Path
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-from services import db, ConcurrentModificationError
+from services import db
+from services.unit_of_work import UnitOfWork
 from services.achievement_catalog import (
     ALIGNED_CATEGORIES,
     build_aligned_item_achievements,
@@ -29,31 +30,82 @@ def get_base_path():
 class DataService:
     _app = None
     _cache = {}
-    _ground_items = {}  # location_id -> {"items": [...], "next_refresh": timestamp}
+    _monster_protos = {}  # monster_id -> MonsterPrototype（按配置 dict 的身份校验是否过期）
+    _scene_index = None   # services.scene_index.SceneIndex
+    _world_graph = None   # services.world_graph.WorldGraph
+    _achievement_index = None  # services.achievement_index.AchievementIndex，首次使用时构建
+    GROUND_NAMESPACE = 'ground_items'  # SharedState：location_id -> {"items": [...], "next_refresh": timestamp}
     GROUND_REFRESH_INTERVAL = 60  # seconds
+    # _cache 键 → data/ 下的文件；另有 finance_stocks、copy_monsters、locations/、equipment_sets/
+    STATIC_FILES = {
+        'items': 'items.json',
+        'monsters': 'monsters.json',
+        'copy_dungeons': 'copy_dungeons.json',
+        'equipment_templates': 'equipment_templates.json',
+        'shops': 'shops.json',
+        'skills': 'skills.json',
+        'game_config': 'game_config.json',
+        'achievements': 'achievements.json',
+        'titles': 'titles.json',
+        'guides': 'guides.json',
+        'guides_content': 'guides_content.json',
+        'quests': 'quests.json',
+        'vip_config': 'vip_config.json',
+    }
 
     @classmethod
     def init_app(cls, app):
         cls._app = app
         cls._load_all_data()
 
+    @classmethod
+    def _static_sources(cls, data_dir):
+        """_parse_static_data 读取的全部文件，静态数据快照据此判断是否过期。"""
+        sources = [data_dir / filename for filename in cls.STATIC_FILES.values()]
+        sources += [data_dir / 'finance_stocks.json', data_dir / 'copy_monsters.json']
+        for sub in ('locations', 'equipment_sets'):
+            sources += sorted((data_dir / sub).glob("*.json"))
+        return sources
+
     @classmethod
     def _load_all_data(cls):
+        """载入静态配置：快照新鲜时直接载入（services.static_snapshot），否则解析 JSON 并重写快照。"""
+        from services.static_snapshot import StaticSnapshot
+        data_dir = get_base_path() / "data"
+        sources = cls._static_sources(data_dir)
+        snapshot = StaticSnapshot.load(cls._app, sources)
+        if snapshot is not None:
+            cls._cache.update(snapshot['cache'])
+            cls._monster_protos = snapshot['monster_protos']
+            cls._scene_index = snapshot['scene_index']
+            cls._world_graph = snapshot['world_graph']
+        else:
+            cls._parse_static_data(data_dir)
+            StaticSnapshot.save(cls._app, sources, cls._snapshot_payload())
+        cls._achievement_index = None
+
+    @classmethod
+    def rebuild_static_snapshot(cls):
+        """重新解析 JSON 并写快照（scripts/build_static_snapshot.py），返回是否写入成功。"""
+        from services.static_snapshot import StaticSnapshot
         data_dir = get_base_path() / "data"
-        files = {
-            'items': 'items.json',
-            'monsters': 'monsters.json',
-            'copy_dungeons': 'copy_dungeons.json',
-            'equipment_templates': 'equipment_templates.json',
-            'shops': 'shops.json',
-            'skills': 'skills.json',
-            'game_config': 'game_config.json',
-            'achievements': 'achievements.json',
-            'titles': 'titles.json',
-            'guides': 'guides.json',
-            'guides_content': 'guides_content.json',
+        cls._parse_static_data(data_dir)
+        cls._achievement_index = None
+        return StaticSnapshot.save(cls._app, cls._static_sources(data_dir),
+                                   cls._snapshot_payload())
+
+    @classmethod
+    def _snapshot_payload(cls):
+        return {
+            'cache': dict(cls._cache),
+            'monster_protos': cls._monster_protos,
+            'scene_index': cls._scene_index,
+            'world_graph': cls._world_graph,
         }
-        for key, filename in files.items():
+
+    @classmethod
+    def _parse_static_data(cls, data_dir):
+        for key, filename in cls.STATIC_FILES.items():
             filepath = data_dir / filename
             if filepath.exists():
                 with open(filepath, 'r', encoding='utf-8') as f:
@@ -94,6 +146,17 @@ class DataService:
         cls._cache['locations_raw'] = raw_locations
         cls._cache['locations_flat'] = cls._flatten_locations(raw_locations)
 
+        # 怪物原型依赖装备模板（掉落池筛选），放在模板加载之后整体编译
+        cls._monster_protos = {}
+        for monster_id in cls._cache.get('monsters', {}):
+            try:
+                cls.get_monster_prototype(monster_id)
+            except (KeyError, TypeError):
+                pass  # 配置残缺的条目留到访问时再报错，不影响启动
+
+        cls.rebuild_scene_index()
+        cls.rebuild_world_graph()
+
     @classmethod
     def _flatten_locations(cls, raw_locations):
         flat = {}
@@ -209,6 +272,53 @@ class DataService:
     def get_monsters(cls):
         return cls._cache.get('monsters', {})
 
+    @classmethod
+    def get_monster_prototype(cls, monster_id):
+        """怪物的只读原型（models.monster.MonsterPrototype），配置不存在时返回 None。
+
+        运行时新增/替换的配置（劫匪注册、工作台编辑）首次访问时按需编译。
+        """
+        data = cls._cache.get('monsters', {}).get(monster_id)
+        if data is None:
+            return None
+        proto = cls._monster_protos.get(monster_id)
+        if proto is None or proto.source is not data:
+            from models.monster import MonsterPrototype
+            proto = cls._monster_protos[monster_id] = MonsterPrototype(monster_id, data)
+        return proto
+
+    @classmethod
+    def invalidate_monster_prototypes(cls):
+        """装备模板变动后调用：掉落池按模板筛选过，原型需重新编译。"""
+        cls._monster_protos = {}
+
+    @classmethod
+    def get_scene_index(cls):
+        """按场景预分区的怪物/NPC 列表、怪物→场景反查与出口邻接（services.scene_index）。"""
+        if cls._scene_index is None:
+            cls.rebuild_scene_index()
+        return cls._scene_index
+
+    @classmethod
+    def rebuild_scene_index(cls):
+        """整体重建后替换；怪物配置（精英/副本/可击杀等标记）变动后调用。"""
+        from services.scene_index import SceneIndex
+        cls._scene_index = SceneIndex(cls._cache.get('locations_flat', {}), cls._cache.get('monsters', {}))
+
+    @classmethod
+    def get_world_graph(cls):
+        """场景出口连通图：区域/分区划分、区域拓扑与步行寻路（services.world_graph）。"""
+        if cls._world_graph is None:
+            cls.rebuild_world_graph()
+        return cls._world_graph
+
+    @classmethod
+    def rebuild_world_graph(cls):
+        """整体重建后替换；场景配置（出口/区域/副本标记）变动后调用。"""
+        from services.world_graph import WorldGraph
+        from services.map_service import MapService
+        cls._world_graph = WorldGraph(cls._cache.get('locations_flat', {}), MapService.region_key_of)
+
     @classmethod
     def get_finance_stocks(cls):
         """Return list of finance stock definitions (理财·股市)."""
@@ -270,20 +380,37 @@ class DataService:
     def get_shops(cls):
         return cls._cache.get('shops', {})
 
+    @classmethod
+    def get_quests(cls):
+        return cls._cache.get('quests', {})
+
+    @classmethod
+    def get_vip_config(cls):
+        return cls._cache.get('vip_config', {})
+
     @classmethod
     def get_game_config(cls):
         return cls._cache.get('game_config', {})
 
     @classmethod
     def get_achievements(cls):
-        base = cls._cache.get('achievements', {}).get('achievements', {})
-        # 用站点对齐后的道具成就覆盖旧版道具定义，其他分类先沿用现有本地数据。
-        merged = {
-            aid: adef for aid, adef in base.items()
-            if adef.get('condition_type') != 'item_use'
-        }
-        merged.update(build_aligned_item_achievements())
-        return merged
+        """合并后的成就定义（进程内共享，只读）。"""
+        return cls.get_achievement_index().definitions
+
+    @classmethod
+    def get_achievement_index(cls):
+        """成就定义按条件类型分组、按阈值排序的索引（services.achievement_index）。"""
+        if cls._achievement_index is None:
+            from services.achievement_index import AchievementIndex
+            base = cls._cache.get('achievements', {}).get('achievements', {})
+            # 用站点对齐后的道具成就覆盖旧版道具定义，其他分类先沿用现有本地数据。
+            merged = {
+                aid: adef for aid, adef in base.items()
+                if adef.get('condition_type') != 'item_use'
+            }
+            merged.update(build_aligned_item_achievements())
+            cls._achievement_index = AchievementIndex(merged)
+        return cls._achievement_index
 
     @classmethod
     def get_achievement_categories(cls):
@@ -334,21 +461,13 @@ class DataService:
 
     @classmethod
     def save_player(cls, player):
-        old_version = player.version
-        player.version = (player.version or 0) + 1
-        result = db.session.commit()
-        # SQLite doesn't support rowcount on commit, so we verify by re-querying
-        fresh = PlayerModel.query.get(player.id)
-        if fresh and fresh.version != player.version:
-            db.session.rollback()
-            raise ConcurrentModificationError(
-                f"Player {player.id} was modified by another transaction")
+        # version 是 version_id_col：flush 时自动 +1 并以 WHERE version = 旧值 更新，
+        # 被并发修改过则抛 StaleDataError，无需提交后回查
+        UnitOfWork.commit()
 
     @classmethod
     def save_players(cls, *players):
-        for p in players:
-            p.version = (p.version or 0) + 1
-        db.session.commit()
+        UnitOfWork.commit()
 
     @classmethod
     def get_all_players_in_location(cls, location_id, exclude_player_id=None):
@@ -540,25 +659,27 @@ class DataService:
     def get_inventory(cls, player_id):
         return InventoryItem.query.filter_by(player_id=player_id).all()
 
+    @classmethod
+    def get_inventory_with_equipment(cls, player_id):
+        """背包行连同其对应的装备实例一次取回：[(InventoryItem, EquipmentInstance|None)]。
+
+        旧数据里背包行的 item_id 可能是装备 instance_id，LEFT JOIN 代替逐行补查。
+        """
+        return db.session.query(InventoryItem, EquipmentInstance).outerjoin(
+            EquipmentInstance, db.and_(
+                EquipmentInstance.instance_id == InventoryItem.item_id,
+                EquipmentInstance.player_id == InventoryItem.player_id)
+        ).filter(InventoryItem.player_id == player_id).all()
+
     # --- Equipment Slots ---
 
     @classmethod
     def get_equipped(cls, player_id):
-        result = {}
-        slots = EquipmentSlot.query.filter_by(player_id=player_id).all()
-        # 批量加载装备实例，避免逐槽 N+1 查询
-        ids = [s.equipment_instance_id for s in slots if s.equipment_instance_id]
-        equip_map = {}
-        if ids:
-            for e in EquipmentInstance.query.filter(
-                    EquipmentInstance.id.in_(ids)).all():
-                equip_map[e.id] = e
-        for s in slots:
-            if s.equipment_instance_id:
-                result[s.slot_name] = equip_map.get(s.equipment_instance_id)
-            else:
-                result[s.slot_name] = None
-        return result
+        # 槽位与已穿戴装备一次 LEFT JOIN 取回，避免先查槽位再 IN 查实例
+        rows = db.session.query(EquipmentSlot.slot_name, EquipmentInstance).outerjoin(
+            EquipmentInstance, EquipmentInstance.id == EquipmentSlot.equipment_instance_id
+        ).filter(EquipmentSlot.player_id == player_id).order_by(EquipmentSlot.slot_name).all()
+        return {slot_name: equip for slot_name, equip in rows}
 
     @classmethod
     def init_equipment_slots(cls, player_id):
@@ -571,29 +692,35 @@ class DataService:
 
     @classmethod
     def get_unequipped_equipment(cls, player_id):
-        equipped_ids = {s.equipment_instance_id for s in
-                        EquipmentSlot.query.filter_by(player_id=player_id).all()
-                        if s.equipment_instance_id}
+        # 已穿戴 id 作子查询，一条 SQL 取回背包装备
+        equipped_ids = db.select(EquipmentSlot.equipment_instance_id).where(
+            EquipmentSlot.player_id == player_id,
+            EquipmentSlot.equipment_instance_id.isnot(None))
         return EquipmentInstance.query.filter(
             EquipmentInstance.player_id == player_id,
             ~EquipmentInstance.id.in_(equipped_ids)
-        ).all() if equipped_ids else EquipmentInstance.query.filter_by(
-            player_id=player_id).all()
+        ).all()
 
     # --- Capacity ---
 
     @classmethod
-    def get_backpack_used_capacity(cls, player_id):
-        """背包已用容量：物品 + 未装备的装备"""
+    def get_backpack_used_capacity(cls, player_id, inventory=None, unequipped=None):
+        """背包已用容量：物品 + 未装备的装备
+
+        页面已取过背包行/背包装备时可直接传入，省去重复查询。
+        """
         total = 0.0
         # Items: capacity from items.json * quantity
-        for inv in cls.get_inventory(player_id):
+        if inventory is None:
+            inventory = cls.get_inventory(player_id)
+        for inv in inventory:
             item_data = cls.get_item(inv.item_id)
             cap = item_data.get('capacity', 0.5) if item_data else 0.5
             total += cap * inv.quantity
         # Unequipped equipment: each equipment = 1
-        for equip in cls.get_unequipped_equipment(player_id):
-            total += 1.0
+        if unequipped is None:
+            unequipped = cls.get_unequipped_equipment(player_id)
+        total += 1.0 * len(unequipped)
         return total
 
     @classmethod
@@ -664,6 +791,8 @@ class DataService:
         )
         db.session.add(msg)
         db.session.commit()
+        from services.public_chat import ChatBus
+        ChatBus.publish(msg)
 
     @classmethod
     def broadcast_player(cls, player_id, content):
@@ -674,6 +803,9 @@ class DataService:
         )
         db.session.add(msg)
         db.session.commit()
+        from services.public_chat import ChatBus
+        sender = db.session.get(PlayerModel, player_id) if player_id else None
+        ChatBus.publish(msg, sender.nickname if sender else "")
 
     @classmethod
     def list_latest_messages(cls, limit=10):
@@ -699,32 +831,47 @@ class DataService:
 
     @classmethod
     def get_ground_items(cls, location_id):
-        now = time.time()
-        ground = cls._ground_items.get(location_id)
-        if not ground or now >= ground['next_refresh']:
-            cls._refresh_ground_items(location_id)
-            ground = cls._ground_items[location_id]
+        from services.shared_state import SharedState
+        ground = SharedState.backend.get(cls.GROUND_NAMESPACE, location_id)
+        if not ground or time.time() >= ground['next_refresh']:
+            ground = cls._refresh_ground_items(location_id)
         return ground['items']
 
     @classmethod
     def _refresh_ground_items(cls, location_id):
-        now = time.time()
-        items = []
-        cls._ground_items[location_id] = {
-            'items': items,
-            'next_refresh': now + cls.GROUND_REFRESH_INTERVAL
-        }
+        from services.shared_state import SharedState
+
+        def _refresh(ground):
+            now = time.time()
+            # 并发刷新时只有第一个生效，其余沿用刚刷新的结果
+            if ground and now < ground['next_refresh']:
+                return ground
+            items = []
+            return {
+                'items': items,
+                'next_refresh': now + cls.GROUND_REFRESH_INTERVAL
+            }
+        return SharedState.backend.update(cls.GROUND_NAMESPACE, location_id, _refresh)
 
     @classmethod
     def pickup_ground_item(cls, location_id, item_id):
-        ground = cls._ground_items.get(location_id)
-        if not ground:
+        from services.shared_state import SharedState
+        picked = []
+
+        def _pickup(ground):
+            # 原子取走：同一件物品只会被一名玩家捡到
+            if not ground:
+                return ground
+            for i, item in enumerate(ground['items']):
+                if item['id'] == item_id:
+                    picked.append(ground['items'].pop(i))
+                    break
+            return ground
+
+        if SharedState.backend.get(cls.GROUND_NAMESPACE, location_id) is None:
             return None
-        for i, item in enumerate(ground['items']):
-            if item['id'] == item_id:
-                ground['items'].pop(i)
-                return item
-        return None
+        SharedState.backend.update(cls.GROUND_NAMESPACE, location_id, _pickup)
+        return picked[0] if picked else None
 
     # --- Guides ---
 
@@ -1,3 +1,4 @@
+import itertools
 import random
 import uuid
 from enum import Enum
@@ -16,6 +17,8 @@ class EquipmentGenerator:
     RARITY_NAMES = ["普通", "精良", "卓越", "史诗", "神器"]
 
     DEFAULT_STAR_WEIGHTS = [0.30, 0.25, 0.20, 0.15, 0.10]
+    STAR_VALUES = (1, 2, 3, 4, 5)
+    DEFAULT_STAR_CUM_WEIGHTS = tuple(itertools.accumulate(DEFAULT_STAR_WEIGHTS))
     HIGH_STAR_WEIGHTS = [0.05, 0.10, 0.20, 0.30, 0.35]
 
     @classmethod
@@ -31,7 +34,23 @@ class EquipmentGenerator:
             weights = [float(w) for w in star_weights]
             stars = list(range(1, len(weights) + 1))
             return random.choices(stars, weights=weights, k=1)[0]
-        return random.choices([1, 2, 3, 4, 5], weights=cls.DEFAULT_STAR_WEIGHTS, k=1)[0]
+        return random.choices(cls.STAR_VALUES, cum_weights=cls.DEFAULT_STAR_CUM_WEIGHTS, k=1)[0]
+
+    @staticmethod
+    def cumulate(weights):
+        """权重列表 → random.choices(cum_weights=...) 用的累计权重；总和不为正时返回 None。"""
+        cum = list(itertools.accumulate(float(w) for w in weights))
+        return tuple(cum) if cum and cum[-1] > 0 else None
+
+    @classmethod
+    def compile_star_weights(cls, star_weights):
+        """星级权重 → (星级元组, 累计权重)；无效时返回 None（按默认星级权重）。"""
+        if not star_weights:
+            return None
+        cum = cls.cumulate(star_weights)
+        if cum is None:
+            return None
+        return tuple(range(1, len(cum) + 1)), cum
 
     @classmethod
     def generate_from_pool(cls, source, template_pool, template_loader,
@@ -102,28 +121,41 @@ class EquipmentGenerator:
     }
 
     @classmethod
-    def _roll_rarity_from_weights(cls, weights, is_elite=False, allow_legendary=True):
-        if weights:
-            if isinstance(weights, dict):
-                mapped = {}
-                for k, v in weights.items():
-                    cn = cls.RARITY_KEY_MAP.get(k, k)
-                    mapped[cn] = float(v)
-                if not allow_legendary:
-                    mapped.pop("神器", None)
-                mapped = {name: weight for name, weight in mapped.items() if weight > 0}
-                if mapped:
-                    names = list(mapped.keys())
-                    values = list(mapped.values())
-                    return random.choices(names, weights=values, k=1)[0]
-            else:
-                wlist = [float(w) for w in weights]
-                if len(wlist) == len(cls.RARITY_NAMES):
-                    if not allow_legendary:
-                        wlist = wlist[:-1]
-                        names = cls.RARITY_NAMES[:-1]
-                        return random.choices(names, weights=wlist, k=1)[0]
-                    return random.choices(cls.RARITY_NAMES, weights=wlist, k=1)[0]
+    def compile_rarity_weights(cls, weights, allow_legendary=True):
+        """稀有度权重（dict 或 5 项列表）→ (稀有度名元组, 累计权重)；无可用权重时返回 None。"""
+        if not weights:
+            return None
+        if isinstance(weights, dict):
+            mapped = {}
+            for k, v in weights.items():
+                cn = cls.RARITY_KEY_MAP.get(k, k)
+                mapped[cn] = float(v)
+            if not allow_legendary:
+                mapped.pop("神器", None)
+            mapped = {name: weight for name, weight in mapped.items() if weight > 0}
+            if not mapped:
+                return None
+            return tuple(mapped.keys()), cls.cumulate(mapped.values())
+        wlist = [float(w) for w in weights]
+        if len(wlist) != len(cls.RARITY_NAMES):
+            return None
+        names = cls.RARITY_NAMES
+        if not allow_legendary:
+            wlist = wlist[:-1]
+            names = names[:-1]
+        return tuple(names), cls.cumulate(wlist)
+
+    @classmethod
+    def roll_rarity_from_table(cls, table, is_elite=False):
+        """按 compile_rarity_weights 的结果抽稀有度；table 为 None 时按精英/普通默认范围等概率。"""
+        if table:
+            names, cum = table
+            return random.choices(names, cum_weights=cum, k=1)[0]
         if is_elite:
             return random.choice(["精良", "卓越", "史诗"])
         return random.choice(["普通", "精良"])
+
+    @classmethod
+    def _roll_rarity_from_weights(cls, weights, is_elite=False, allow_legendary=True):
+        table = cls.compile_rarity_weights(weights, allow_legendary=allow_legendary)
+        return cls.roll_rarity_from_table(table, is_elite=is_elite)
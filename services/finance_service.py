@@ -1,9 +1,10 @@
 import time
 import random
 import json
-import threading
 from datetime import date, datetime
 from services.data_service import DataService
+from services.shared_state import DELETE, SharedState
+from services.unit_of_work import UnitOfWork, retry_on_conflict
 from services import db
 
 
@@ -37,6 +38,10 @@ POP_THRESHOLD = 20           # 人气满档所需当日NPC访问次数
 BANDIT_THRESHOLD = 10        # 劫匪满档所需当日击杀次数
 BANDIT_RESPAWN = 300         # 劫匪击杀后5分钟复活
 BANDIT_POINTS_PER_JINZU = 100  # 击杀劫匪积分：每100点兑1金珠（等效每次0.01金珠）
+BANDIT_NAMESPACE = 'finance_bandit'  # SharedState：{city: 劫匪状态 dict}，多 worker 共用
+MARKET_NAMESPACE = 'finance_market'  # SharedState：'market' → 行情/流通量/当日统计，见 _dump_market
+MARKET_KEY = 'market'
+ORDER_NAMESPACE = 'finance_order'    # SharedState：{order_id: pending 委托 dict}，即委托簿
 HISTORY_LEN = 48             # 每只股票保留的历史价条数
 # 排名制涨跌区间：人气/劫匪各自按全市场排名，最高者区间上偏，最低者下偏
 RANK_BEST_LO = -0.005        # 排名最高股票：区间下界 -0.5%
@@ -490,7 +495,9 @@ def _interp_path(path, t_ratio):
 
 
 class BanditState:
-    __slots__ = ('city', 'spawned', 'defeated_at', 'killer_today', 'location_id')
+    """本进程的劫匪状态快照；权威值在 SharedState 的 BANDIT_NAMESPACE 里。"""
+    __slots__ = ('city', 'spawned', 'defeated_at', 'killer_today', 'location_id', 'day_key')
+    FIELDS = ('spawned', 'defeated_at', 'killer_today', 'location_id', 'day_key')
 
     def __init__(self, city):
         self.city = city
@@ -498,20 +505,37 @@ class BanditState:
         self.defeated_at = 0
         self.killer_today = None
         self.location_id = ''        # 当前出没的具体场景 location_id（随机）
+        self.day_key = str(date.today())  # 最近一次跨天重置的日期
+
+    def to_dict(self):
+        return {f: getattr(self, f) for f in self.FIELDS}
+
+    def load(self, state):
+        for f in self.FIELDS:
+            if f in state:
+                setattr(self, f, state[f])
 
 
 class FinanceService:
-    """理财·股市服务。股价、劫匪、当日统计使用类级缓存运行，并落库到 finance_state。"""
+    """理财·股市服务。股价、劫匪、当日统计使用类级缓存运行，并落库到 finance_state。
+
+    行情（价格/走势/流通量/当日统计）、委托簿、劫匪的权威值都在 SharedState 后端里，
+    多 worker 共用一份：_stocks/_daily_stats 是本进程的快照，读前由 _sync_market 按版本号刷新，
+    改动一律经 _update_market 原子读改写；跨天、tick 撮合也在其中认领，只由一个进程执行。
+    """
 
-    _stocks = {}          # {stock_id: {...}}
+    _stocks = {}          # {stock_id: {...}}：静态配置 + 最近一次同步的行情
     _bandits = {}         # {city: BanditState}
+    _bandits_seeded = set()  # 由本进程写入共享后端初值的城市（仅这些从 finance_state 恢复）
     _daily_stats = {}     # {stock_id: {"npc_visits": int, "bandit_kills": int, "npc_visitors": set}}
-    _orders = {}          # 委托单 {order_id: {...}}，类级内存；pending 委托同步保存在玩家 finance_data.finance_orders
     _day_key = None
     _last_tick = 0.0
     _initialized = False
     _outstanding_rebuilt = False
-    _maintenance_started = False
+    _market_version = None  # 本地快照对应的共享行情版本号；None 表示需要重新读取
+    # 随行情共享的每股动态字段（其余为 finance_stocks.json 的静态配置）
+    MARKET_FIELDS = ('open_price', 'price', 'last_price', 'pre_open_price', 'day_change',
+                     'pop_part', 'bandit_part', 'strategy_idx', 'total_shares', 'outstanding')
 
     # ===================================================================
     #  初始化
@@ -519,6 +543,7 @@ class FinanceService:
     @classmethod
     def _ensure_init(cls):
         if cls._initialized:
+            cls._sync_market()
             if not cls._outstanding_rebuilt:
                 cls._rebuild_outstanding()
                 cls._load_persisted_orders()
@@ -553,39 +578,143 @@ class FinanceService:
                 'npc_visits': 0, 'bandit_kills': 0, 'npc_visitors': set()}
             city = sd.get('city', '')
             if city and city not in cls._bandits:
-                b = BanditState(city)
-                cls._randomize_bandit_location(b)
-                cls._bandits[city] = b
+                cls._bandits[city] = BanditState(city)
         cls._resolve_stock_npc_ids()
-        cls._orders = {}
-        cls._day_key = str(date.today())
-        cls._last_tick = time.time()
-        restored = cls._load_market_state()
-        cls._rebuild_outstanding()
-        cls._load_persisted_orders()
-        if not restored:
-            cls._settle_day_change()   # 开盘随机A+排名B/C+选路径
-            cls._save_market_state()
+        cls._seed_bandits()
+        cls._seed_market()
         cls._initialized = True
 
     @classmethod
-    def start_maintenance(cls, app):
-        """启动后台维护线程，定时推进跨天、tick、委托撮合和状态落库。"""
-        if cls._maintenance_started:
+    def _seed_market(cls):
+        """共享后端里还没有行情时写入初值（finance_state 落库的行情，没有则按默认开盘）；已有则载入。
+
+        写入初值的进程再按玩家持仓/委托 JSON 重建流通量与委托簿。
+        """
+        saved = cls._read_market_row()
+        seeded = []
+
+        def _seed(state):
+            if state is not None:
+                return state
+            cls._day_key = str(date.today())
+            cls._last_tick = time.time()
+            if saved:
+                cls._load_market(saved)
+            else:
+                cls._settle_day_change()   # 开盘随机A+排名B/C+选路径
+            cls._outstanding_rebuilt = False
+            seeded.append(True)
+            return cls._dump_market()
+        cls._load_market(SharedState.backend.update(MARKET_NAMESPACE, MARKET_KEY, _seed))
+        cls._market_version = None
+        if seeded:
+            if saved:
+                cls._restore_saved_bandits(saved)
+            cls._clear_orders()
+            cls._rebuild_outstanding()
+            cls._load_persisted_orders()
+            if not saved:
+                cls._save_market_state()
+        cls._bandits_seeded.clear()
+
+    # ---- 共享行情 ----
+
+    @classmethod
+    def _dump_market(cls):
+        """本地快照 → 共享后端里存的 dict（全部复制，memory 后端不会与本地快照共用对象）。"""
+        return {
+            'day_key': cls._day_key,
+            'last_tick': cls._last_tick,
+            'outstanding_rebuilt': cls._outstanding_rebuilt,
+            'stocks': {
+                sid: dict({f: s[f] for f in cls.MARKET_FIELDS},
+                          path=[tuple(p) for p in s['path']], history=list(s['history']))
+                for sid, s in cls._stocks.items()
+            },
+            'daily_stats': cls._serialize_daily_stats(),
+        }
+
+    @classmethod
+    def _load_market(cls, state):
+        """共享行情（或 finance_state 落库的行情）载入本地快照；缺的键保留本地值。"""
+        if not state:
             return
-        cls._maintenance_started = True
+        cls._day_key = state.get('day_key') or cls._day_key
+        cls._last_tick = float(state.get('last_tick') or cls._last_tick or time.time())
+        if 'outstanding_rebuilt' in state:
+            cls._outstanding_rebuilt = bool(state['outstanding_rebuilt'])
+        for sid, saved in (state.get('stocks') or {}).items():
+            s = cls._stocks.get(sid)
+            if s is None:
+                continue
+            for key in cls.MARKET_FIELDS:
+                if key in saved:
+                    s[key] = saved[key]
+            s['path'] = [tuple(p) for p in saved.get('path', s.get('path', []))]
+            s['history'] = list(saved.get('history') or [s['price']])[-HISTORY_LEN:]
+        cls._restore_daily_stats(state.get('daily_stats') or {})
 
-        def _loop():
-            while True:
-                try:
-                    with app.app_context():
-                        cls._ensure_init()
-                except Exception:
-                    pass
-                time.sleep(60)
+    @classmethod
+    def _sync_market(cls):
+        """共享行情版本变了（别的 worker 或本进程写过）才重新读取。"""
+        version = SharedState.backend.version(MARKET_NAMESPACE, MARKET_KEY)
+        if version == cls._market_version:
+            return
+        state, version = SharedState.backend.get_versioned(MARKET_NAMESPACE, MARKET_KEY)
+        cls._load_market(state)
+        cls._market_version = version
 
-        t = threading.Thread(target=_loop, name='finance-maintenance', daemon=True)
-        t.start()
+    @classmethod
+    def _update_market(cls, func):
+        """原子读改写行情：func() 在最新状态上就地修改本地快照，返回 False 表示不改。返回是否写入。"""
+        applied = []
+
+        def _apply(state):
+            cls._load_market(state)
+            if func() is False:
+                return state
+            applied.append(True)
+            return cls._dump_market()
+        cls._load_market(SharedState.backend.update(MARKET_NAMESPACE, MARKET_KEY, _apply))
+        cls._market_version = None  # 写入后的版本号下次同步时再取，期间别的写入也不会漏掉
+        return bool(applied)
+
+    # ---- 共享委托簿（仅 pending 委托；成交/撤销/作废即删除） ----
+
+    @classmethod
+    def _order(cls, order_id):
+        """只读；修改须走 _claim_order/_save_order。"""
+        return SharedState.backend.get(ORDER_NAMESPACE, order_id)
+
+    @classmethod
+    def _pending_orders(cls):
+        return [dict(o) for o in SharedState.backend.items(ORDER_NAMESPACE).values()
+                if o.get('status') == 'pending']
+
+    @classmethod
+    def _save_order(cls, order):
+        SharedState.backend.set(ORDER_NAMESPACE, order['order_id'], dict(order))
+
+    @classmethod
+    def _drop_order(cls, order_id):
+        SharedState.backend.delete(ORDER_NAMESPACE, order_id)
+
+    @classmethod
+    def _claim_order(cls, order_id):
+        """原子取走一张 pending 委托（撤销与撮合之间只有一方拿到），返回其副本；已不在簿中返回 None。"""
+        claimed = []
+
+        def _take(order):
+            if order is not None and order.get('status') == 'pending':
+                claimed.append(dict(order))
+            return DELETE
+        SharedState.backend.update(ORDER_NAMESPACE, order_id, _take)
+        return claimed[0] if claimed else None
+
+    @classmethod
+    def _clear_orders(cls):
+        for order_id in SharedState.backend.items(ORDER_NAMESPACE):
+            SharedState.backend.delete(ORDER_NAMESPACE, order_id)
 
     @staticmethod
     def _wallet_amount(amount):
@@ -642,36 +771,15 @@ class FinanceService:
 
     @classmethod
     def _serialize_market_state(cls):
-        return {
-            'day_key': cls._day_key,
-            'last_tick': cls._last_tick,
-            'stocks': {
-                sid: {
-                    'open_price': s['open_price'],
-                    'price': s['price'],
-                    'last_price': s['last_price'],
-                    'pre_open_price': s.get('pre_open_price', s['open_price']),
-                    'day_change': s.get('day_change', 0),
-                    'pop_part': s.get('pop_part', 0),
-                    'bandit_part': s.get('bandit_part', 0),
-                    'strategy_idx': s.get('strategy_idx', 0),
-                    'path': s.get('path', [(0.0, 0.0), (1.0, 0.0)]),
-                    'total_shares': s.get('total_shares', 5000),
-                    'history': s.get('history', []),
-                }
-                for sid, s in cls._stocks.items()
-            },
-            'daily_stats': cls._serialize_daily_stats(),
-            'bandits': {
-                city: {
-                    'spawned': b.spawned,
-                    'defeated_at': b.defeated_at,
-                    'killer_today': b.killer_today,
-                    'location_id': b.location_id,
-                }
-                for city, b in cls._bandits.items()
-            },
-        }
+        return dict(cls._dump_market(), bandits={
+            city: {
+                'spawned': b.spawned,
+                'defeated_at': b.defeated_at,
+                'killer_today': b.killer_today,
+                'location_id': b.location_id,
+            }
+            for city, b in ((c, cls._sync_bandit(b)) for c, b in cls._bandits.items())
+        })
 
     @classmethod
     def _save_market_state(cls):
@@ -688,39 +796,30 @@ class FinanceService:
             db.session.rollback()
 
     @classmethod
-    def _load_market_state(cls):
-        """从数据库恢复行情/统计/劫匪状态；失败则保留默认初始行情。"""
+    def _read_market_row(cls):
+        """finance_state 落库的行情/统计/劫匪状态；没有或读取失败返回 None。"""
         try:
             row = FinanceStateModel.query.get('market')
-            if not row or not row.value:
-                return False
-            state = json.loads(row.value)
-            cls._day_key = state.get('day_key') or cls._day_key
-            cls._last_tick = float(state.get('last_tick') or cls._last_tick or time.time())
-            for sid, saved in (state.get('stocks') or {}).items():
-                if sid not in cls._stocks:
-                    continue
-                s = cls._stocks[sid]
-                for key in ('open_price', 'price', 'last_price', 'pre_open_price',
-                            'day_change', 'pop_part', 'bandit_part', 'strategy_idx',
-                            'total_shares'):
-                    if key in saved:
-                        s[key] = saved[key]
-                s['path'] = [tuple(p) for p in saved.get('path', s.get('path', []))]
-                s['history'] = list(saved.get('history') or [s['price']])[-HISTORY_LEN:]
-            cls._restore_daily_stats(state.get('daily_stats') or {})
-            for city, saved in (state.get('bandits') or {}).items():
-                b = cls._bandits.get(city)
-                if not b:
-                    continue
+            return json.loads(row.value) if row and row.value else None
+        except Exception:
+            db.session.rollback()
+            return None
+
+    @classmethod
+    def _restore_saved_bandits(cls, state):
+        """落库的劫匪状态写回共享后端（仅本进程刚写入初值的城市）。"""
+        for city, saved in (state.get('bandits') or {}).items():
+            b = cls._bandits.get(city)
+            # 其他 worker 已在共享后端里的劫匪是实时状态，不用落库快照覆盖
+            if not b or city not in cls._bandits_seeded:
+                continue
+
+            def _restore(b, saved=saved):
                 b.spawned = bool(saved.get('spawned', True))
                 b.defeated_at = float(saved.get('defeated_at') or 0)
                 b.killer_today = saved.get('killer_today')
                 b.location_id = saved.get('location_id') or b.location_id
-            return True
-        except Exception:
-            db.session.rollback()
-            return False
+            cls._update_bandit(b, _restore)
 
     @classmethod
     def _resolve_stock_npc_ids(cls):
@@ -741,22 +840,53 @@ class FinanceService:
                             ids.add(npc_id)
             s['npc_ids'] = ids
 
+    @classmethod
+    def _scan_finance_data(cls, *keys):
+        """只读列扫描玩家 finance_data（不建 PlayerModel 实例），跳过不含任一键名的行。
+
+        返回 [(player_id, finance_data dict)]。键名按 JSON 文本 LIKE 预筛，没理过财的玩家不解析。
+        """
+        from models.player import PlayerModel
+        from models.json_field import loads
+        col = PlayerModel.finance_data_raw
+        query = db.session.query(PlayerModel.id, col).filter(
+            db.or_(*[col.like(f'%"{key}"%') for key in keys]))
+        rows = []
+        for player_id, raw in query:
+            try:
+                fd = loads(raw)
+            except (ValueError, TypeError):
+                continue
+            if isinstance(fd, dict):
+                rows.append((player_id, fd))
+        return rows
+
+    @classmethod
+    def _load_finance_players(cls, player_ids):
+        """按 id 载入需要修改 finance_data 的玩家（连同 finance 延迟加载组）。"""
+        if not player_ids:
+            return []
+        from models.player import PlayerModel
+        return (PlayerModel.query.options(db.undefer_group('finance'))
+                .filter(PlayerModel.id.in_(player_ids)).order_by(PlayerModel.id).all())
+
     @classmethod
     def _rebuild_outstanding(cls):
         """启动时从所有玩家持仓聚合流通股数（含委托锁定股）。"""
         try:
-            from models.player import PlayerModel
             totals = {sid: 0 for sid in cls._stocks}
-            for p in PlayerModel.query.all():
-                fd = p.finance_data or {}
+            for _, fd in cls._scan_finance_data('holdings'):
                 for sid, h in (fd.get('holdings') or {}).items():
                     totals[sid] = totals.get(sid, 0) + int(h.get('shares', 0)) + int(h.get('locked', 0))
+        except Exception:
+            # 可能在 app_context/旧库迁移之前初始化；共享行情里仍记未统计，后续请求会再次尝试。
+            return
+
+        def _apply():
             for sid, s in cls._stocks.items():
                 s['outstanding'] = max(0, totals.get(sid, 0))
             cls._outstanding_rebuilt = True
-        except Exception:
-            # 可能在 app_context/旧库 ALTER 之前初始化；后续请求会再次尝试。
-            cls._outstanding_rebuilt = False
+        cls._update_market(_apply)
 
     @classmethod
     def _expire_order_for_player(cls, player, order, status='expired'):
@@ -785,21 +915,22 @@ class FinanceService:
         orders[order['order_id']] = dict(order)
         fd['finance_orders'] = orders
         player.finance_data = fd
-        cls._orders.pop(order['order_id'], None)
+        cls._drop_order(order['order_id'])
         return True
 
     @classmethod
     def _expire_pending_orders(cls, status='expired'):
         """跨天/清理时作废全部 pending 委托，避免冻结资产卡死。"""
         try:
-            from models.player import PlayerModel
             from services import db
             changed = False
-            for p in PlayerModel.query.all():
+            pending_ids = [pid for pid, fd in cls._scan_finance_data('pending')
+                           if cls._has_pending_order(fd)]
+            for p in cls._load_finance_players(pending_ids):
                 for order in list(cls._finance_orders(p.finance_data or {}).values()):
                     if isinstance(order, dict) and order.get('status') == 'pending':
                         changed = cls._expire_order_for_player(p, order, status) or changed
-            cls._orders = {}
+            cls._clear_orders()
             if changed:
                 db.session.commit()
             cls._rebuild_outstanding()
@@ -808,14 +939,19 @@ class FinanceService:
 
     @classmethod
     def _load_persisted_orders(cls):
-        """从玩家 JSON 恢复当日 pending 委托，并修复孤儿冻结资金/锁定股。"""
+        """从玩家 JSON 恢复当日 pending 委托到委托簿，并修复孤儿冻结资金/锁定股。
+
+        先只读扫描，只有存在 pending 委托、冻结资金或锁定股的玩家才载入实例逐个核对。
+        委托簿按 order_id 覆盖写入，重复执行结果相同。
+        """
         try:
-            from models.player import PlayerModel
             from services import db
             today = cls._day_key or str(date.today())
-            cls._orders = {}
+            book = {}
             changed = False
-            for p in PlayerModel.query.all():
+            candidate_ids = [pid for pid, fd in cls._scan_finance_data('pending', 'frozen', 'locked', 'finance_orders')
+                             if cls._needs_order_check(fd)]
+            for p in cls._load_finance_players(candidate_ids):
                 fd = p.finance_data or {}
                 orders = cls._finance_orders(fd)
                 expected_frozen = 0.0
@@ -840,7 +976,7 @@ class FinanceService:
                         fd = p.finance_data or {}
                         orders = cls._finance_orders(fd)
                         continue
-                    cls._orders[oid] = dict(order)
+                    book[oid] = dict(order)
                     if order.get('side') == 'buy':
                         expected_frozen += float(order.get('frozen_total', 0) or 0)
                     else:
@@ -869,10 +1005,32 @@ class FinanceService:
                 p.finance_data = fd
             if changed:
                 db.session.commit()
-            cls._rebuild_outstanding()
+            for order in book.values():
+                cls._save_order(order)
+            # 作废/修复只在 locked 与 shares 之间挪动，流通股总数不变；尚未统计过时才统计
+            if not cls._outstanding_rebuilt:
+                cls._rebuild_outstanding()
         except Exception:
             pass
 
+    @classmethod
+    def _has_pending_order(cls, fd):
+        return any(isinstance(o, dict) and o.get('status') == 'pending'
+                   for o in cls._finance_orders(fd).values())
+
+    @classmethod
+    def _needs_order_check(cls, fd):
+        """_load_persisted_orders 是否需要核对该玩家：有 pending 委托、冻结资金、锁定股或旧版 list 委托。"""
+        if isinstance(fd.get('finance_orders'), list) or cls._has_pending_order(fd):
+            return True
+        try:
+            if abs(float(fd.get('frozen', 0) or 0)) >= 0.01:
+                return True
+        except (TypeError, ValueError):
+            return True
+        return any(int((h or {}).get('locked', 0) or 0) > 0
+                   for h in (fd.get('holdings') or {}).values())
+
     # ===================================================================
     #  交易时段
     # ===================================================================
@@ -929,27 +1087,77 @@ class FinanceService:
         today = str(date.today())
         if today == cls._day_key:
             return
-        # 跨天：未成交委托隔夜作废，先退款/解锁，再用昨日统计生成今日走势。
+
+        # 跨天：在共享行情里认领（按 day_key 只有一个进程执行），再用昨日统计生成今日走势
+        def _roll():
+            if cls._day_key == today:
+                return False
+            for sid, s in cls._stocks.items():
+                s['open_price'] = s['price']
+                s['last_price'] = s['price']
+                s['pre_open_price'] = s['price']
+                s['history'] = [s['price']]
+            cls._day_key = today
+            cls._settle_day_change()  # 注意：此时仍使用上一日统计作为今日 B/C 因子来源
+            for sid in cls._daily_stats:
+                cls._daily_stats[sid] = cls._empty_stats()
+            cls._last_tick = time.time()
+        if not cls._update_market(_roll):
+            return
+        # 未成交委托隔夜作废：退款/解锁
         cls._expire_pending_orders('expired')
-        for sid, s in cls._stocks.items():
-            s['open_price'] = s['price']
-            s['last_price'] = s['price']
-            s['pre_open_price'] = s['price']
-            s['history'] = [s['price']]
-        cls._day_key = today
-        cls._settle_day_change()  # 注意：此时仍使用上一日统计作为今日 B/C 因子来源
-        for sid in cls._daily_stats:
-            cls._daily_stats[sid] = cls._empty_stats()
-        # 劫匪跨天重新生成（随机刷新到新场景）
-        for city, b in cls._bandits.items():
+
+        # 劫匪跨天重新生成（随机刷新到新场景）；按 day_key 只重置一次
+        def _new_day(b):
+            if b.day_key == today:
+                return False
+            b.day_key = today
             b.spawned = True
             b.defeated_at = 0
             b.killer_today = None
             cls._randomize_bandit_location(b)
-        cls._last_tick = time.time()
+        for city, b in cls._bandits.items():
+            cls._update_bandit(b, _new_day)
         cls._load_persisted_orders()
         cls._save_market_state()
 
+    @classmethod
+    def _seed_bandits(cls):
+        """共享后端里还没有的城市劫匪写入初值（随机刷新点）；已有则载入。"""
+        for city, b in cls._bandits.items():
+            def _seed(state, b=b):
+                if state is not None:
+                    return state
+                cls._randomize_bandit_location(b)
+                cls._bandits_seeded.add(b.city)
+                return b.to_dict()
+            b.load(SharedState.backend.update(BANDIT_NAMESPACE, city, _seed))
+
+    @classmethod
+    def _sync_bandit(cls, b):
+        """从共享后端刷新劫匪快照。"""
+        state = SharedState.backend.get(BANDIT_NAMESPACE, b.city)
+        if state is not None:
+            b.load(state)
+        return b
+
+    @classmethod
+    def _update_bandit(cls, b, func):
+        """原子读改写劫匪状态：func 在最新状态上就地修改 b，返回 False 表示不改。返回是否写入。"""
+        applied = []
+
+        def _apply(state):
+            if state is not None:
+                b.load(state)
+            if func(b) is False:
+                return state
+            applied.append(True)
+            return b.to_dict()
+        state = SharedState.backend.update(BANDIT_NAMESPACE, b.city, _apply)
+        if state is not None:
+            b.load(state)
+        return bool(applied)
+
     @classmethod
     def _randomize_bandit_location(cls, b):
         """把劫匪随机刷新到该城市区域内的某个场景。"""
@@ -961,10 +1169,7 @@ class FinanceService:
         if not area_id:
             b.location_id = ''
             return
-        locations = DataService.get_locations()
-        candidates = [lid for lid, loc in locations.items()
-                      if loc.get('area_id') == area_id
-                      and not loc.get('is_copy_map')]
+        candidates = DataService.get_scene_index().open_locations_in_area(area_id)
         if candidates:
             b.location_id = random.choice(candidates)
         else:
@@ -1046,39 +1251,42 @@ class FinanceService:
     @classmethod
     def _maybe_tick(cls):
         """惰性实时tick：距上次>=5分钟则按当日路径插值推进，相邻差≤1%。
-        集合竞价段(9-9:30)不刷新股价（用开盘价=昨收撮合委托单），9:30后才实时变动。"""
+        集合竞价段(9-9:30)不刷新股价（用开盘价=昨收撮合委托单），9:30后才实时变动。
+        每次 tick 在共享行情里认领，多个 worker 同时到点也只推进、撮合一次。"""
         now = time.time()
         if now - cls._last_tick < TICK_INTERVAL:
             return
-        cls._last_tick = now
         phase = cls.get_market_phase()
-        # 盘前(9点前)与集合竞价(9-9:30)都不刷新股价
-        if phase in ('pre_open', 'auction'):
-            # 集合竞价段：用开盘价撮合9点前/盘中的委托单
-            if phase == 'auction':
-                cls._match_orders()
-            cls._save_market_state()
+
+        def _tick():
+            if now - cls._last_tick < TICK_INTERVAL:
+                return False  # 别的进程已推进
+            cls._last_tick = now
+            # 盘前(9点前)与集合竞价(9-9:30)都不刷新股价
+            if phase in ('pre_open', 'auction'):
+                return
+            progress = cls._day_progress()
+            for sid, s in cls._stocks.items():
+                # 路径目标价
+                target_ratio = _interp_path(s['path'], progress)
+                target = s['open_price'] * (1 + target_ratio)
+                # 微小随机抖动
+                drift = random.uniform(-TICK_DRIFT * 0.5, TICK_DRIFT * 0.5)
+                new_price = target * (1 + drift)
+                # 与上次差不超过1%
+                lo = s['price'] * (1 - TICK_DRIFT)
+                hi = s['price'] * (1 + TICK_DRIFT)
+                new_price = max(lo, min(hi, new_price))
+                new_price = round(max(0.01, new_price), 2)
+                s['last_price'] = s['price']
+                s['price'] = new_price
+                s['history'].append(new_price)
+                if len(s['history']) > HISTORY_LEN:
+                    s['history'] = s['history'][-HISTORY_LEN:]
+        if not cls._update_market(_tick):
             return
-        progress = cls._day_progress()
-        for sid, s in cls._stocks.items():
-            # 路径目标价
-            target_ratio = _interp_path(s['path'], progress)
-            target = s['open_price'] * (1 + target_ratio)
-            # 微小随机抖动
-            drift = random.uniform(-TICK_DRIFT * 0.5, TICK_DRIFT * 0.5)
-            new_price = target * (1 + drift)
-            # 与上次差不超过1%
-            lo = s['price'] * (1 - TICK_DRIFT)
-            hi = s['price'] * (1 + TICK_DRIFT)
-            new_price = max(lo, min(hi, new_price))
-            new_price = round(max(0.01, new_price), 2)
-            s['last_price'] = s['price']
-            s['price'] = new_price
-            s['history'].append(new_price)
-            if len(s['history']) > HISTORY_LEN:
-                s['history'] = s['history'][-HISTORY_LEN:]
-        # 连续交易时段逐tick撮合委托单（按实时价）
-        if phase == 'open':
+        # 集合竞价段用开盘价撮合9点前/盘中的委托单；连续交易时段逐tick按实时价撮合
+        if phase in ('auction', 'open'):
             cls._match_orders()
         cls._save_market_state()
 
@@ -1182,6 +1390,7 @@ class FinanceService:
     #  交易（即时买卖，仅连续交易时段 9:30-18:00）
     # ===================================================================
     @classmethod
+    @retry_on_conflict
     def buy(cls, player, stock_id, shares):
         cls._ensure_init()
         if not cls.is_tradable():
@@ -1218,14 +1427,16 @@ class FinanceService:
         fd['holdings'] = holdings
         fd['total_traded'] = round(float(fd.get('total_traded', 0)) + pay, 2)
         player.finance_data = fd
-        s['outstanding'] += shares
 
-        from services import db
-        db.session.commit()
+        # 玩家行带版本号：同一玩家并发买卖时冲突回滚并重跑（retry_on_conflict），
+        # 共享流通量在提交成功后才变动，重跑不会重复累加
+        UnitOfWork.commit_now()
+        cls._adjust_outstanding(stock_id, shares)
         return True, (f"买入{s['name']}{shares}股，单价{s['price']}金珠，"
                       f"手续费{round(fee,2)}，实扣{pay}金珠")
 
     @classmethod
+    @retry_on_conflict
     def sell(cls, player, stock_id, shares):
         cls._ensure_init()
         if not cls.is_tradable():
@@ -1264,13 +1475,19 @@ class FinanceService:
             holdings.pop(stock_id, None)
         fd['holdings'] = holdings
         player.finance_data = fd
-        s['outstanding'] -= shares
 
-        from services import db
-        db.session.commit()
+        UnitOfWork.commit_now()
+        cls._adjust_outstanding(stock_id, -shares)
         return True, (f"卖出{s['name']}{shares}股，单价{s['price']}金珠，"
                       f"手续费{round(fee,2)}，实到账{credit}金珠，本次盈亏{round(realized,2)}")
 
+    @classmethod
+    def _adjust_outstanding(cls, stock_id, delta):
+        """玩家成交后增减共享流通量（须在玩家行提交之后调用）。"""
+        def _apply():
+            cls._stocks[stock_id]['outstanding'] += delta
+        cls._update_market(_apply)
+
     @classmethod
     def get_player_profit(cls, player):
         """股神榜用：已实现盈亏 + 浮动盈亏。"""
@@ -1331,7 +1548,7 @@ class FinanceService:
             fd['holdings'] = holdings
 
         order_id = f"o{int(time.time()*1000)}{random.randint(100,999)}"
-        cls._orders[order_id] = {
+        order = {
             'order_id': order_id,
             'player_id': player.id,
             'stock_id': stock_id,
@@ -1344,11 +1561,12 @@ class FinanceService:
             'created_day': cls._day_key or str(date.today()),
         }
         fd_orders = cls._finance_orders(fd)
-        fd_orders[order_id] = dict(cls._orders[order_id])
+        fd_orders[order_id] = dict(order)
         fd['finance_orders'] = fd_orders
         player.finance_data = fd
         from services import db
         db.session.commit()
+        cls._save_order(order)  # 玩家 JSON 提交后才进委托簿，撮合不会看到未落库的委托
         return True, f"委托单已提交：{side=='buy' and '买入' or '卖出'}{s['name']}{shares}股@{round(limit_price,2)}金珠"
 
     @classmethod
@@ -1358,14 +1576,16 @@ class FinanceService:
           买单：委托价 >= 当前价 → 按当前价成交
           卖单：委托价 <= 当前价 → 按当前价成交
         流通量限制：买单本次成交股数 = min(委托股数, 可流通量)，超额部分继续挂单。"""
-        pending = [o for o in cls._orders.values() if o['status'] == 'pending']
+        pending = cls._pending_orders()
         if not pending:
             return
         for o in pending:
             s = cls._stocks.get(o['stock_id'])
             if not s:
-                o['status'] = 'rejected'
-                cls._refund_order(o)
+                o = cls._claim_order(o['order_id'])
+                if o:
+                    o['status'] = 'rejected'
+                    cls._refund_order(o)
                 continue
             market = cls._match_price(s)
             fill = False
@@ -1381,14 +1601,22 @@ class FinanceService:
     def _fill_order(cls, o, s, market_price=None):
         """以当前撮合价成交一单（支持部分成交+流通量限制）。
         买单：成交股数 = min(委托股数, 可流通量)，超额部分继续挂单。
-        卖单：按委托股数成交（持仓已预冻结）。"""
+        卖单：按委托股数成交（持仓已预冻结）。
+        成交前先从共享委托簿原子取走该单，与撤单、别的 worker 的撮合只有一方拿到。"""
         from models.player import PlayerModel
         p = PlayerModel.query.get(o['player_id'])
         if not p:
-            o['status'] = 'rejected'
-            cls._orders.pop(o['order_id'], None)
+            cls._drop_order(o['order_id'])
             return
+        if o['side'] == 'buy' and s['total_shares'] - s['outstanding'] <= 0:
+            return  # 无可流通量，继续挂单等待
+        o = cls._claim_order(o['order_id'])
+        if o is None:
+            return  # 已被撤销或由别的 worker 成交
         fd = p.finance_data
+        saved = cls._finance_orders(fd).get(o['order_id'])
+        if isinstance(saved, dict) and saved.get('status', 'pending') != 'pending':
+            return  # 玩家 JSON 里已结清（重载委托簿时的旧副本）
         price = round(float(market_price if market_price is not None else cls._match_price(s)), 2)
         order_shares = o['shares']
         if o['side'] == 'buy':
@@ -1396,7 +1624,8 @@ class FinanceService:
             available = s['total_shares'] - s['outstanding']
             fill_shares = min(order_shares, available)
             if fill_shares <= 0:
-                return  # 无可流通量，继续挂单等待
+                cls._save_order(o)  # 流通量刚被买完，放回继续挂单
+                return
             actual_cost = fill_shares * price
             fee = actual_cost * FEE_RATE
             total = actual_cost + fee
@@ -1419,7 +1648,7 @@ class FinanceService:
             holdings[o['stock_id']] = {'shares': new_shares, 'avg_cost': round(new_avg, 4)}
             fd['holdings'] = holdings
             fd['total_traded'] = round(float(fd.get('total_traded', 0)) + used_frozen, 2)
-            s['outstanding'] += fill_shares
+            delta = fill_shares
             if fill_shares < order_shares:
                 # 部分成交：剩余股数继续挂单，减少冻结基数
                 remaining = order_shares - fill_shares
@@ -1428,7 +1657,6 @@ class FinanceService:
                 msg = f"委托买入{s['name']}部分成交{fill_shares}股@{price}（剩{remaining}股挂单中，退回{refund}金珠）"
             else:
                 o['status'] = 'filled'
-                cls._orders.pop(o['order_id'], None)
                 msg = f"委托买入{s['name']}{fill_shares}股@{price}成交，实扣{used_frozen}金珠，退回{refund}金珠"
         else:
             # 卖出：按委托股数成交（持仓已预冻结）
@@ -1453,24 +1681,29 @@ class FinanceService:
             if cur['shares'] <= 0 and cur.get('locked', 0) <= 0:
                 holdings.pop(o['stock_id'], None)
             fd['holdings'] = holdings
-            s['outstanding'] -= fill_shares
+            delta = -fill_shares
             o['status'] = 'filled'
-            cls._orders.pop(o['order_id'], None)
             msg = f"委托卖出{s['name']}{fill_shares}股@{price}成交，实到账{credit}金珠，盈亏{round(realized,2)}"
         p.finance_data = fd
         cls._sync_order_to_player(p, o)
         from services import db
         db.session.commit()
+        if o['status'] == 'pending':
+            cls._save_order(o)  # 部分成交：剩余股数放回委托簿
+        cls._adjust_outstanding(o['stock_id'], delta)
         cls._save_market_state()
         return msg
 
     @classmethod
     def _refund_order(cls, o):
-        """委托单作废时退回冻结资金/持仓。"""
+        """委托单作废时退回冻结资金/持仓。o 须是 _claim_order 取走的副本。"""
         from models.player import PlayerModel
         p = PlayerModel.query.get(o['player_id'])
         if not p:
             return
+        saved = cls._finance_orders(p.finance_data or {}).get(o['order_id'])
+        if isinstance(saved, dict) and saved.get('status', 'pending') != 'pending':
+            return  # 玩家 JSON 里已结清，不重复退款
         status = o.get('status') if o.get('status') != 'pending' else 'rejected'
         o['status'] = 'pending'  # _expire_order_for_player 只对 pending 做一次退款，避免重复退款
         cls._expire_order_for_player(p, o, status)
@@ -1508,11 +1741,14 @@ class FinanceService:
     def cancel_order(cls, player, order_id):
         """撤销未成交委托单。"""
         cls._ensure_init()
-        o = cls._orders.get(order_id)
+        o = cls._order(order_id)
         if not o or o['player_id'] != player.id:
             return False, "委托单不存在"
         if o['status'] != 'pending':
             return False, f"委托单已{o['status']=='filled' and '成交' or '作废'}，不可撤销"
+        o = cls._claim_order(order_id)
+        if o is None:
+            return False, "委托单已成交或作废，不可撤销"
         o['status'] = 'cancelled'
         cls._refund_order(o)
         return True, "委托单已撤销，冻结资金/持仓已退回"
@@ -1532,7 +1768,9 @@ class FinanceService:
             return False, "增股数量无效"
         if amount <= 0:
             return False, "增股数量必须大于0"
-        s['total_shares'] += amount
+        def _apply():
+            cls._stocks[stock_id]['total_shares'] += amount
+        cls._update_market(_apply)
         cls._save_market_state()
         return True, f"{s['name']}增发{amount}股，新发行总量{s['total_shares']}股"
 
@@ -1546,12 +1784,18 @@ class FinanceService:
         for sid, s in cls._stocks.items():
             npc_ids = s.get('npc_ids') or set()
             if monster_id in npc_ids:
-                stats = cls._daily_stats.setdefault(sid, cls._empty_stats())
-                if player_id in stats['npc_visitors']:
+                stats = cls._daily_stats.get(sid)
+                if stats and player_id in stats['npc_visitors']:
                     return
-                stats['npc_visitors'].add(player_id)
-                stats['npc_visits'] += 1
-                cls._save_market_state()
+
+                def _visit():
+                    stats = cls._daily_stats.setdefault(sid, cls._empty_stats())
+                    if player_id in stats['npc_visitors']:
+                        return False
+                    stats['npc_visitors'].add(player_id)
+                    stats['npc_visits'] += 1
+                if cls._update_market(_visit):
+                    cls._save_market_state()
                 return
 
     # ===================================================================
@@ -1571,13 +1815,19 @@ class FinanceService:
     @classmethod
     def _check_bandit_respawn(cls, b):
         """劫匪击杀后5分钟重新生成（随机刷新到新场景）。"""
-        if b.spawned:
+        cls._sync_bandit(b)
+        if b.spawned or not b.defeated_at or time.time() - b.defeated_at < BANDIT_RESPAWN:
             return
-        if b.defeated_at and time.time() - b.defeated_at >= BANDIT_RESPAWN:
+
+        def _respawn(b):
+            # 原子复查：并发到期时只有一个调用刷新落点
+            if b.spawned or not b.defeated_at or time.time() - b.defeated_at < BANDIT_RESPAWN:
+                return False
             b.spawned = True
             b.defeated_at = 0
             b.killer_today = None
             cls._randomize_bandit_location(b)
+        cls._update_bandit(b, _respawn)
 
     @classmethod
     def _bandit_monster_id(cls, city):
@@ -1630,19 +1880,25 @@ class FinanceService:
             return None
         city = monster_id[len("bandit_"):]
         b = cls._bandits.get(city)
-        if not b or not b.spawned:
+        if not b:
+            return None
+
+        def _kill(b):
+            # 标记击杀，启动5分钟复活（复活时随机刷新到新场景）；同时击杀只算第一个
+            if not b.spawned:
+                return False
+            b.spawned = False
+            b.defeated_at = time.time()
+            b.killer_today = player.id
+        if not cls._update_bandit(b, _kill):
             return None
-        # 标记击杀，启动5分钟复活（复活时随机刷新到新场景）
-        b.spawned = False
-        b.defeated_at = time.time()
-        b.killer_today = player.id
         # 该城市所有关联股票的当日击杀统计 +1（击杀北平劫匪→北平所有股票+1）
-        affected = 0
-        for sid, s in cls._stocks.items():
-            if s['city'] == city:
-                stats = cls._daily_stats.setdefault(sid, cls._empty_stats())
-                stats['bandit_kills'] += 1
-                affected += 1
+        def _count():
+            for sid, s in cls._stocks.items():
+                if s['city'] == city:
+                    stats = cls._daily_stats.setdefault(sid, cls._empty_stats())
+                    stats['bandit_kills'] += 1
+        cls._update_market(_count)
         # 积分制：每次+1点，满100点自动兑换1金珠
         fd = player.finance_data
         bandit_points = int(fd.get('bandit_points', 0)) + 1
@@ -0,0 +1,241 @@
+"""排行榜物化服务：财富/荣誉/等级/魅力/成就五个榜常驻内存。
+
+原 rank.show 每次打开都要扫 players 表，成就榜还要对每个玩家单独 COUNT 一次成就，
+「我的排名」再跑一遍无索引的 COUNT(*) WHERE gold > ?。这里为每个榜维护一个按排序键
+升序的有序数组 [(sort_key, player_id)]：取前 N 名是切片，查名次是一次二分，均不查库。
+
+数据来源：
+- 首次访问（或距上次全量超过 REBUILD_INTERVAL）时从库里全量构建一次；
+- 之后由 ORM 事件增量维护：flush 时记下 PlayerModel 相关列的新值与成就领取数的增减，
+  事务提交后才写入榜单，回滚则丢弃——任何改银两/荣誉/等级/魅力/领成就的写路径都会命中，
+  无需在几十处业务代码里逐个调用。绕过 ORM 的批量 UPDATE 由定期全量重建兜底；
+- 多 worker 时提交后还递增 'leaderboard' generation 计数器，别的 worker 发现计数变了就全量重建
+  （最多每 STALE_CHECK_INTERVAL 秒检查一次）。
+"""
+import bisect
+import threading
+import time
+
+from services import db
+from services.shared_state import GenerationWatch
+
+
+class LeaderboardEntry:
+    """榜单用的玩家快照；rank_show.html 只用到 id/username/nickname 与在线判断所需的 last_login。"""
+    __slots__ = ('id', 'username', 'nickname', 'last_login', 'gold', 'honor',
+                 'level', 'experience', 'charm', 'achievements')
+
+    def __init__(self, player_id):
+        self.id = player_id
+        self.username = self.nickname = ''
+        self.last_login = None
+        self.gold = self.honor = self.level = self.experience = self.charm = 0
+        self.achievements = 0
+
+
+class LeaderboardService:
+    BOARDS = ('wealth', 'honor', 'level', 'charm', 'achievement')
+    TOP_N = 30
+    REBUILD_INTERVAL = 600  # 秒；全量重建兜底绕过 ORM 的改动
+    STALE_CHECK_INTERVAL = 30  # 秒；多 worker 时最多隔这么久发现别的 worker 的改动并重建
+    # 需要跟踪的 PlayerModel 列（排序键 + 页面显示字段）
+    PLAYER_FIELDS = ('username', 'nickname', 'last_login', 'gold', 'honor',
+                     'level', 'experience', 'charm')
+
+    _lock = threading.Lock()
+    _build_lock = threading.Lock()
+    _entries = {}                            # {player_id: LeaderboardEntry}
+    _keys = {board: [] for board in BOARDS}  # {board: 升序 [(sort_key, player_id)]}
+    _built_at = 0
+    _watch = GenerationWatch('leaderboard', interval=STALE_CHECK_INTERVAL)
+
+    @staticmethod
+    def _sort_key(board, e):
+        """升序即名次顺序：取负值让大数排前。"""
+        if board == 'wealth':
+            return (-(e.gold or 0),)
+        if board == 'honor':
+            return (-(e.honor or 0),)
+        if board == 'level':
+            return (-(e.level or 0), -(e.experience or 0))
+        if board == 'charm':
+            return (-(e.charm or 0),)
+        return (-(e.achievements or 0),)
+
+    @staticmethod
+    def _value(board, e):
+        return {
+            'wealth': e.gold, 'honor': e.honor, 'level': e.level,
+            'charm': e.charm, 'achievement': e.achievements,
+        }[board] or 0
+
+    # ------------------------------------------------------------------
+    # 构建与增量维护
+    # ------------------------------------------------------------------
+    @classmethod
+    def rebuild(cls):
+        """从库里全量构建：一次 players 列查询 + 一次成就分组计数。"""
+        from models.player import PlayerModel, Achievement
+        generation = cls._watch.current()  # 先取计数再读库：读库期间别的 worker 的写入下次仍会发现
+        rows = db.session.query(
+            PlayerModel.id, *[getattr(PlayerModel, f) for f in cls.PLAYER_FIELDS]).all()
+        counts = dict(db.session.query(Achievement.player_id, db.func.count(Achievement.id))
+                      .filter(Achievement.claimed == True)  # noqa: E712
+                      .group_by(Achievement.player_id).all())
+        entries = {}
+        for row in rows:
+            e = LeaderboardEntry(row[0])
+            for field, value in zip(cls.PLAYER_FIELDS, row[1:]):
+                setattr(e, field, value)
+            e.achievements = counts.get(e.id, 0)
+            entries[e.id] = e
+        keys = {board: sorted((cls._sort_key(board, e), pid) for pid, e in entries.items())
+                for board in cls.BOARDS}
+        with cls._lock:
+            cls._entries = entries
+            cls._keys = keys
+            cls._built_at = time.time()
+            cls._watch.mark(generation)
+
+    @classmethod
+    def _ensure_built(cls):
+        stale = cls._watch.stale()
+        if not stale and time.time() - cls._built_at <= cls.REBUILD_INTERVAL:
+            return
+        # 已有旧榜时，别的线程正在重建就先用旧榜，避免到期瞬间多个线程同时全量扫表
+        if not cls._build_lock.acquire(blocking=not cls._built_at):
+            return
+        try:
+            if stale or time.time() - cls._built_at > cls.REBUILD_INTERVAL:
+                cls.rebuild()
+        finally:
+            cls._build_lock.release()
+
+    @classmethod
+    def _move(cls, e, changes):
+        """修改快照字段，并把该玩家在各榜的位置挪到新排序键上。"""
+        for board in cls.BOARDS:
+            keys = cls._keys[board]
+            old = (cls._sort_key(board, e), e.id)
+            i = bisect.bisect_left(keys, old)
+            if i < len(keys) and keys[i] == old:
+                del keys[i]
+        for field, value in changes.items():
+            setattr(e, field, value)
+        for board in cls.BOARDS:
+            bisect.insort(cls._keys[board], (cls._sort_key(board, e), e.id))
+
+    @classmethod
+    def _apply_pending(cls, pending):
+        with cls._lock:
+            if not cls._built_at:
+                return  # 尚未构建，首次访问时全量读取即可
+            for pid in pending['removed']:
+                e = cls._entries.pop(pid, None)
+                if e is None:
+                    continue
+                for board in cls.BOARDS:
+                    keys = cls._keys[board]
+                    i = bisect.bisect_left(keys, (cls._sort_key(board, e), pid))
+                    if i < len(keys) and keys[i][1] == pid:
+                        del keys[i]
+            for pid, fields in pending['players'].items():
+                if pid in pending['removed']:
+                    continue
+                e = cls._entries.get(pid)
+                if e is None:
+                    e = cls._entries[pid] = LeaderboardEntry(pid)
+                    for board in cls.BOARDS:
+                        bisect.insort(cls._keys[board], (cls._sort_key(board, e), pid))
+                cls._move(e, fields)
+            for pid, delta in pending['achievements'].items():
+                e = cls._entries.get(pid)
+                if e is not None and delta:
+                    cls._move(e, {'achievements': max(0, e.achievements + delta)})
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+    @classmethod
+    def top(cls, board, n=None):
+        """前 n 名：[(LeaderboardEntry, 数值)]。"""
+        cls._ensure_built()
+        with cls._lock:
+            return [(cls._entries[pid], cls._value(board, cls._entries[pid]))
+                    for _, pid in cls._keys[board][:n or cls.TOP_N]]
+
+    @classmethod
+    def rank_of(cls, board, player_id):
+        """玩家在该榜的名次（1 起），不在榜返回 None。"""
+        cls._ensure_built()
+        with cls._lock:
+            e = cls._entries.get(player_id)
+            if e is None:
+                return None
+            keys = cls._keys[board]
+            i = bisect.bisect_left(keys, (cls._sort_key(board, e), player_id))
+            return i + 1 if i < len(keys) and keys[i][1] == player_id else None
+
+    @classmethod
+    def value_of(cls, board, player_id):
+        cls._ensure_built()
+        with cls._lock:
+            e = cls._entries.get(player_id)
+            return cls._value(board, e) if e is not None else 0
+
+
+def _register_listeners():
+    from sqlalchemy import event, inspect
+    from sqlalchemy.orm import Session
+    from models.player import PlayerModel, Achievement
+
+    fields = LeaderboardService.PLAYER_FIELDS
+
+    def _pending(session):
+        return session.info.setdefault('_leaderboard_pending',
+                                       {'players': {}, 'removed': set(), 'achievements': {}})
+
+    @event.listens_for(Session, 'after_flush')
+    def _on_flush(session, flush_context):
+        # after_flush 时 new/dirty/deleted 与属性历史仍是 flush 前的状态
+        for obj in session.new | session.dirty:
+            if isinstance(obj, PlayerModel):
+                state = inspect(obj)
+                if obj not in session.new and not any(
+                        state.attrs[f].history.has_changes() for f in fields):
+                    continue
+                # 只取已加载的列，避免在 flush 中触发懒加载
+                values = {f: state.dict[f] for f in fields if f in state.dict}
+                if values:
+                    _pending(session)['players'].setdefault(obj.id, {}).update(values)
+            elif isinstance(obj, Achievement):
+                hist = inspect(obj).attrs.claimed.history
+                if obj in session.new:
+                    delta = 1 if obj.claimed else 0
+                elif hist.has_changes():
+                    delta = int(bool(obj.claimed)) - int(bool(hist.deleted and hist.deleted[0]))
+                else:
+                    continue
+                if delta:
+                    achs = _pending(session)['achievements']
+                    achs[obj.player_id] = achs.get(obj.player_id, 0) + delta
+        for obj in session.deleted:
+            if isinstance(obj, PlayerModel):
+                _pending(session)['removed'].add(obj.id)
+            elif isinstance(obj, Achievement) and inspect(obj).dict.get('claimed'):
+                achs = _pending(session)['achievements']
+                achs[obj.player_id] = achs.get(obj.player_id, 0) - 1
+
+    @event.listens_for(Session, 'after_commit')
+    def _on_commit(session):
+        pending = session.info.pop('_leaderboard_pending', None)
+        if pending:
+            LeaderboardService._apply_pending(pending)
+            LeaderboardService._watch.bump()
+
+    @event.listens_for(Session, 'after_rollback')
+    def _on_rollback(session):
+        session.info.pop('_leaderboard_pending', None)
+
+
+_register_listeners()
@@ -29,6 +29,11 @@ class LegionService:
         legion = Legion.query.get(member.legion_id)
         if not legion:
             return {}
+        return cls.get_legion_vip_aura(legion)
+
+    @classmethod
+    def get_legion_vip_aura(cls, legion):
+        """Return VIP aura bonuses (flat stats) for an already-loaded legion."""
         cls._refresh_vip_aura(legion)
         return {
             'max_health': legion.vip_aura_hp,
@@ -632,25 +637,21 @@ class LegionService:
 
     @classmethod
     def reset_all_daily_counters(cls):
-        """后台批量重置所有军团成员每日签到/捐献/任务次数。"""
+        """后台批量重置所有军团成员每日签到/捐献/任务次数（集合式 UPDATE，不加载成员对象）。"""
         today = date.today().isoformat()
-        changed = False
-        for member in LegionMember.query.all():
-            if member.sign_date != today:
-                member.signed_today = False
-                member.sign_date = today
-                changed = True
-            if member.gold_donate_date != today:
-                member.gold_donate_count = 0
-                member.gold_donate_date = today
-                changed = True
-            if member.quest_date != today:
-                member.quest_count = 0
-                member.quest_date = today
-                changed = True
+        changed = 0
+        for date_col, values in (
+                (LegionMember.sign_date, {'signed_today': False}),
+                (LegionMember.gold_donate_date, {'gold_donate_count': 0}),
+                (LegionMember.quest_date, {'quest_count': 0})):
+            values[date_col.key] = today
+            values['version'] = LegionMember.version + 1  # 批量 UPDATE 不经 ORM，手动推进乐观锁版本
+            changed += LegionMember.query.filter(
+                db.or_(date_col.is_(None), date_col != today)
+            ).update(values, synchronize_session=False)
         if changed:
             db.session.commit()
-        return changed
+        return changed > 0
 
     # --- Legion queries ---
 
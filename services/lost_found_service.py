@@ -9,8 +9,7 @@ PK 战败时，败方背包里每一堆「未绑定药品或未绑定装备」
 掉落的装备会把实例归属置空（中立），赎回/拍卖发放时再转移给新主人（grant_lost_item），
 保证 EquipmentInstance.player_id 与持有人一致（否则无法穿戴/强化）。
 
-LostItemLifecycle.run() 负责惰性推进状态机，由 lost_found 蓝图路由在查询前调用，
-无需独立定时任务。
+LostItemLifecycle.run() 负责推进状态机，由后台调度任务 lost_found 定时调用。
 """
 
 import random
@@ -125,7 +124,7 @@ def _format_dropped(dropped):
 
 
 class LostItemLifecycle:
-    """推进 LostItem 状态机，由蓝图路由惰性调用。"""
+    """推进 LostItem 状态机，由后台调度任务定时调用。"""
 
     @classmethod
     def run(cls):
@@ -1,37 +1,66 @@
-import threading
-import time
+class MaintenanceService:
+    """全局后台维护任务：推进不应依赖玩家访问页面的状态机。
 
+    各任务统一登记到 services.scheduler.Scheduler，由调度线程执行；页面路由不再顺带推进。
+    """
 
-class MaintenanceService:
-    """全局后台维护任务：推进不应依赖玩家访问页面的状态机。"""
+    @classmethod
+    def register_jobs(cls):
+        """登记全部后台任务（名称 → 触发方式），重复调用只会覆盖配置。"""
+        from services.scheduler import Scheduler
+        from services.market_service import MarketService
+        from services.finance_service import FinanceService
+        from services.lost_found_service import LostItemLifecycle
+        from services.battlefield_service import BattlefieldService
+        from services.barbarian_service import BarbarianService
+        from services.battle_session import BattleSessionRegistry
 
-    _started = False
+        # 集市 7 天过期退回卖家
+        Scheduler.register('market_expire', MarketService.expire_listings, interval=60, jitter=5)
+        # 金融市场：跨天开盘、5 分钟行情 tick、委托撮合与状态落库
+        Scheduler.register('finance', FinanceService._ensure_init, interval=60, jitter=5)
+        # 失物招领：持有期满转拍卖、拍卖期满结算（以天计，5 分钟粒度足够）
+        Scheduler.register('lost_found', LostItemLifecycle.run, interval=300, jitter=30)
+        # 战场：周六领地重置、测试战结束清场、阵亡超时清扫（续命窗口 15 秒）
+        Scheduler.register('battlefield', BattlefieldService.tick, interval=15, jitter=2)
+        # 蛮夷入侵：按小时刷新/清空士卒、刷新首领落点
+        Scheduler.register('barbarian', BarbarianService.tick_all, interval=30, jitter=3)
+        # PvE 战斗会话：闲置超时的写回检查点后逐出内存
+        Scheduler.register('battle_sessions', BattleSessionRegistry.evict_idle, interval=300, jitter=30,
+                           per_process=True)
+        # 跨天重置：启动时补跑一次（各重置按日期幂等），之后每日 0 点
+        Scheduler.register('daily_reset', cls.run_daily, daily_at='00:00', jitter=30)
 
     @classmethod
     def start(cls, app):
-        if cls._started:
-            return
-        cls._started = True
-
-        def _loop():
-            while True:
-                try:
-                    with app.app_context():
-                        cls.run_once()
-                except Exception:
-                    pass
-                time.sleep(60)
-
-        t = threading.Thread(target=_loop, name='game-maintenance', daemon=True)
-        t.start()
+        """登记任务；SCHEDULER_AUTOSTART 关闭时（gunicorn master）不在本进程起线程。"""
+        from services.scheduler import Scheduler
+        cls.register_jobs()
+        if app.config.get('SCHEDULER_AUTOSTART', True):
+            Scheduler.start(app)
 
     @classmethod
-    def run_once(cls):
-        """执行一次维护循环；也可用于测试/手动触发。"""
-        from services.market_service import MarketService
-        from services.legion_service import LegionService
-        from services.copy_dungeon_service import CopyDungeonService
+    def start_worker(cls, app):
+        """gunicorn fork 出 worker 后调用（post_worker_init）：在本进程启动调度器与成就队列。
+
+        成就队列线程在新进程里第一次启动时会补判 achievement_events 的残留行，
+        被杀后重新 fork 的 worker 也就接得住前一个进程没处理完的事件。
+
+        preload 时 master 里建立的数据库连接随 fork 复制到子进程，先丢弃连接池引用
+        （不关闭，免得动到 master 的连接），worker 用到时各自重连。
+        """
+        from services import db
+        from services.scheduler import Scheduler
+        from services.achievement_queue import AchievementQueue
+        with app.app_context():
+            db.engine.dispose(close=False)
+        Scheduler.start(app)
+        AchievementQueue.start()
 
-        MarketService.expire_listings()
+    @classmethod
+    def run_daily(cls):
+        """每日重置；也可用于测试/手动触发。"""
+        from services.legion_service import LegionService
         LegionService.reset_all_daily_counters()
-        CopyDungeonService.reset_all_daily_free_entries()
+        # 副本每日免费次数不再全表重写：读取入口 CopyDungeonService._get_daily_state
+        # 已按日期惰性重置
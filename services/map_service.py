@@ -1,4 +1,3 @@
-from collections import deque, OrderedDict
 from services.data_service import DataService
 from services import db
 
@@ -172,18 +171,18 @@ class MapService:
 
         locations = DataService.get_locations()
         points = []
-        for loc_id, loc_data in locations.items():
-            if loc_data.get('area_id') == area_id:
-                monsters = loc_data.get('monsters', [])
-                npcs = loc_data.get('npcs', [])
-                if monsters or npcs:
-                    name = loc_data.get('name', '')
-                    points.append({
-                        'id': loc_id,
-                        'name': name,
-                        'monsters': monsters,
-                        'npcs': npcs
-                    })
+        for loc_id in DataService.get_world_graph().area_scene_ids(area_id):
+            loc_data = locations[loc_id]
+            monsters = loc_data.get('monsters', [])
+            npcs = loc_data.get('npcs', [])
+            if monsters or npcs:
+                name = loc_data.get('name', '')
+                points.append({
+                    'id': loc_id,
+                    'name': name,
+                    'monsters': monsters,
+                    'npcs': npcs
+                })
         return points
 
     @classmethod
@@ -199,14 +198,14 @@ class MapService:
 
         # 按场景名称分组（同区域其他场景）
         scenes = []
-        for lid, ldata in all_locs.items():
-            if ldata.get('area_id') == area_id:
-                scenes.append({
-                    'id': lid,
-                    'name': ldata.get('name', ''),
-                    'monsters': ldata.get('monsters', []),
-                    'npcs': ldata.get('npcs', []),
-                })
+        for lid in DataService.get_world_graph().area_scene_ids(area_id):
+            ldata = all_locs[lid]
+            scenes.append({
+                'id': lid,
+                'name': ldata.get('name', ''),
+                'monsters': ldata.get('monsters', []),
+                'npcs': ldata.get('npcs', []),
+            })
         return scenes
 
     @classmethod
@@ -217,18 +216,18 @@ class MapService:
 
         locations = DataService.get_locations()
         scenes = []
-        for loc_id, loc_data in locations.items():
-            if loc_data.get('area_id') == area_id:
-                scenes.append({
-                    'id': loc_id,
-                    'name': loc_data.get('name', ''),
-                    'monsters': loc_data.get('monsters', []),
-                    'npcs': loc_data.get('npcs', []),
-                    'north_exit': loc_data.get('north_exit', ''),
-                    'south_exit': loc_data.get('south_exit', ''),
-                    'east_exit': loc_data.get('east_exit', ''),
-                    'west_exit': loc_data.get('west_exit', ''),
-                })
+        for loc_id in DataService.get_world_graph().area_scene_ids(area_id):
+            loc_data = locations[loc_id]
+            scenes.append({
+                'id': loc_id,
+                'name': loc_data.get('name', ''),
+                'monsters': loc_data.get('monsters', []),
+                'npcs': loc_data.get('npcs', []),
+                'north_exit': loc_data.get('north_exit', ''),
+                'south_exit': loc_data.get('south_exit', ''),
+                'east_exit': loc_data.get('east_exit', ''),
+                'west_exit': loc_data.get('west_exit', ''),
+            })
         return scenes
 
     # ---------- 传送导航（区域/分区/场景 + 出口拓扑） ----------
@@ -290,18 +289,8 @@ class MapService:
     @classmethod
     def list_accessible_regions(cls, player):
         """本国 + 中立区域列表（按国家/中立分组排序）。"""
-        locations = DataService.get_locations()
-        region_areas = OrderedDict()
-        for lid, loc in locations.items():
-            if loc.get('is_copy_map'):
-                continue
-            area_id = loc.get('area_id') or ''
-            if not area_id:
-                continue
-            rk = cls.region_key_of(area_id)
-            if not rk or not cls.player_can_access_region(player, rk):
-                continue
-            region_areas.setdefault(rk, set()).add(area_id)
+        region_keys = [rk for rk in DataService.get_world_graph().regions()
+                       if cls.player_can_access_region(player, rk)]
 
         def sort_key(rk):
             owner = cls.CITY_TO_COUNTRY.get(rk)
@@ -316,7 +305,7 @@ class MapService:
             return (group, cls.region_name(rk))
 
         result = []
-        for rk in sorted(region_areas.keys(), key=sort_key):
+        for rk in sorted(region_keys, key=sort_key):
             zones = cls.list_region_zones(rk)
             owner = cls.CITY_TO_COUNTRY.get(rk)
             if rk in cls.NEUTRAL_REGIONS or owner is None:
@@ -339,22 +328,18 @@ class MapService:
         """返回某区域下的分区列表（中/东/西/南/北），无分区则返回自身。"""
         locations = DataService.get_locations()
         found = {}  # zone_key or '' -> area_id / name
-        for lid, loc in locations.items():
-            if loc.get('is_copy_map'):
-                continue
+        for lid in DataService.get_world_graph().region_scene_ids(region_key):
+            loc = locations[lid]
             area_id = loc.get('area_id') or ''
-            if cls.region_key_of(area_id) != region_key:
-                continue
             zk = cls.zone_key_of(area_id)
-            if area_id not in found.values():
-                found[zk or area_id] = {
-                    'zone': zk,
-                    'area_id': area_id,
-                    'name': loc.get('area_name') or (
-                        cls.region_name(region_key) + cls.ZONE_LABELS.get(zk, '')
-                        if zk else cls.region_name(region_key)
-                    ),
-                }
+            found[zk or area_id] = {
+                'zone': zk,
+                'area_id': area_id,
+                'name': loc.get('area_name') or (
+                    cls.region_name(region_key) + cls.ZONE_LABELS.get(zk, '')
+                    if zk else cls.region_name(region_key)
+                ),
+            }
         # 去重 by area_id
         by_area = {}
         for item in found.values():
@@ -378,18 +363,14 @@ class MapService:
         """模式二：按出口连通关系列出该区域可达场景（BFS 序）。
 
         只包含 region_key 内的场景；若 start 不在该区域，取该区域中心/首个场景作起点。
+        BFS 序由 WorldGraph 按 (区域, 起点) 缓存。
         """
-        locations = DataService.get_locations()
-        region_scene_ids = [
-            lid for lid, loc in locations.items()
-            if not loc.get('is_copy_map')
-            and cls.region_key_of(loc.get('area_id') or '') == region_key
-        ]
+        graph = DataService.get_world_graph()
+        region_scene_ids = graph.region_scene_ids(region_key)
         if not region_scene_ids:
             return []
 
-        region_set = set(region_scene_ids)
-        start = start_location_id if start_location_id in region_set else None
+        start = start_location_id if graph.in_region(region_key, start_location_id) else None
         if not start:
             # 优先中区广场，否则任意
             for lid in region_scene_ids:
@@ -399,33 +380,20 @@ class MapService:
             if not start:
                 start = region_scene_ids[0]
 
-        dirs = (
-            ('north_exit', '北'),
-            ('south_exit', '南'),
-            ('east_exit', '东'),
-            ('west_exit', '西'),
-        )
+        locations = DataService.get_locations()
+        order, reached = graph.region_topology(region_key, start)
         ordered = []
-        seen = set()
-        q = deque([start])
-        while q:
-            cur = q.popleft()
-            if cur in seen or cur not in region_set:
-                continue
-            seen.add(cur)
+        for n, cur in enumerate(order):
             loc = locations.get(cur) or {}
             exits = []
-            for key, label in dirs:
-                dest = loc.get(key) or (loc.get('exits') or {}).get(key.replace('_exit', ''))
-                if dest and dest in region_set:
-                    dloc = locations.get(dest) or {}
+            if n < reached:
+                # 未连通的孤立场景不列出口
+                for d, dest in graph.region_exits(region_key, cur):
                     exits.append({
-                        'dir': label,
+                        'dir': graph.DIRECTION_LABELS[d],
                         'id': dest,
-                        'name': dloc.get('name', dest),
+                        'name': (locations.get(dest) or {}).get('name', dest),
                     })
-                    if dest not in seen:
-                        q.append(dest)
             ordered.append({
                 'id': cur,
                 'name': loc.get('name', cur),
@@ -434,20 +402,6 @@ class MapService:
                 'exits': exits,
                 'is_start': cur == start,
             })
-
-        # 补上未连通的孤立场景
-        for lid in region_scene_ids:
-            if lid in seen:
-                continue
-            loc = locations.get(lid) or {}
-            ordered.append({
-                'id': lid,
-                'name': loc.get('name', lid),
-                'area_id': loc.get('area_id', ''),
-                'area_name': loc.get('area_name', ''),
-                'exits': [],
-                'is_start': False,
-            })
         return ordered
 
     @classmethod
@@ -463,3 +417,115 @@ class MapService:
         if not cls.player_can_access_region(player, rk):
             return {'success': False, 'msg': '该区域不属于本国或中立开放区'}
         return cls.teleport_to_scene(player, scene_id, scene_name=loc.get('name', ''))
+
+    # ---------- 步行移动（场景页方向移动与寻路共用） ----------
+    @classmethod
+    def check_move(cls, player, dest_id=None):
+        """从当前场景走到相邻场景 dest_id 前的检查；可以走返回 None，否则 (原因, 提示)。
+
+        原因：'battle' 战斗中、'pk' PK 中、'blocked' 该出口暂时走不通（如黄巾副本渡河缺木筏）。
+        """
+        if player.in_battle:
+            return 'battle', "战斗中无法移动"
+        if player.in_pk:
+            return 'pk', "PK中无法移动"
+        locations = DataService.get_locations()
+        location, target = locations.get(player.current_location), locations.get(dest_id)
+        if location and target:
+            is_huangjin_river_crossing = (
+                location.get("copy_dungeon_id") == "huangjin_trial"
+                and {location.get("name"), target.get("name")} == {"黄河岸边", "兖州"}
+            )
+            if is_huangjin_river_crossing:
+                raft = DataService.get_inventory_item(player.id, "wood_raft")
+                if not raft or raft.quantity < 1:
+                    return 'blocked', "需要先前往小渔村击杀偷伐人，夺取木筏后才能渡河"
+        return None
+
+    # ---------- 寻路（步行前往场景 / 怪物 / 任务 NPC） ----------
+    @classmethod
+    def _route_target_allowed(cls, player, location_id):
+        """副本内的场景只有身在同一副本（area_id）时才能作为寻路目标。"""
+        loc = DataService.get_location(location_id) or {}
+        if not loc.get('is_copy_map'):
+            return True
+        current = DataService.get_location(player.current_location) or {}
+        return current.get('area_id') == loc.get('area_id')
+
+    @classmethod
+    def resolve_route_target(cls, player, to=None, quest_id=None, monster_id=None):
+        """寻路目标 → (场景 id, 目标说明)；无效时返回 (None, 原因)。
+
+        怪物出现在多个场景时取离当前位置最近的一处；副本内的场景只在同一副本内可作为目标。
+        """
+        locations = DataService.get_locations()
+        if to:
+            loc = locations.get(to)
+            if not loc:
+                return None, '目标场景不存在'
+            if not cls._route_target_allowed(player, to):
+                return None, '副本内的地点只能在该副本中寻路'
+            return to, loc.get('name', to)
+        if quest_id:
+            from services.quest_service import QuestService
+            q = QuestService.get_quest(quest_id)
+            if not q or q.get('npc_location') not in locations:
+                return None, '任务地点不存在'
+            if not cls._route_target_allowed(player, q['npc_location']):
+                return None, '副本内的地点只能在该副本中寻路'
+            return q['npc_location'], q.get('npc_location_name') or q.get('npc_name', '')
+        if monster_id:
+            graph = DataService.get_world_graph()
+            best = None
+            for lid in DataService.get_scene_index().locations_of(monster_id):
+                if not cls._route_target_allowed(player, lid):
+                    continue
+                steps = graph.route(player.current_location, lid)
+                if steps is not None and (best is None or len(steps) < best[0]):
+                    best = (len(steps), lid)
+            if best is None:
+                return None, '找不到可步行前往的地点'
+            monster = DataService.get_monster(monster_id) or {}
+            return best[1], monster.get('name', monster_id)
+        return None, '未指定目标'
+
+    @classmethod
+    def find_route(cls, player, target_id):
+        """当前位置到 target_id 的步行路线 [{'dir', 'direction', 'id', 'name'}]；不可达返回 None。"""
+        graph = DataService.get_world_graph()
+        steps = graph.route(player.current_location, target_id)
+        if steps is None:
+            return None
+        locations = DataService.get_locations()
+        return [{
+            'dir': graph.DIRECTION_LABELS[d],
+            'direction': graph.DIRECTIONS[d],
+            'id': dest,
+            'name': (locations.get(dest) or {}).get('name', dest),
+        } for d, dest in steps]
+
+    @classmethod
+    def walk_step(cls, player, target_id):
+        """朝 target_id 走一步（与场景页移动相同：经 check_move 检查、记录足迹、检查探索成就）。"""
+        graph = DataService.get_world_graph()
+        step = graph.next_step(player.current_location, target_id)
+        blocked = cls.check_move(player, step[1] if step else None)
+        if blocked:
+            return {'success': False, 'arrived': False, 'reason': blocked[0], 'msg': blocked[1]}
+        if player.current_location == target_id:
+            return {'success': True, 'arrived': True, 'msg': '已到达目的地'}
+        if step is None:
+            return {'success': False, 'arrived': False, 'msg': '无法步行前往该地点'}
+        _, dest = step
+        player.current_location = dest
+        visited = player.visited_locations
+        if dest not in visited:
+            visited.append(dest)
+            player.visited_locations = visited
+            from services.achievement_service import AchievementService
+            AchievementService.check(player, 'visit', len(visited))
+        db.session.commit()
+        arrived = dest == target_id
+        name = (DataService.get_location(dest) or {}).get('name', dest)
+        return {'success': True, 'arrived': arrived,
+                'msg': f'已到达目的地【{name}】' if arrived else f'来到【{name}】'}
@@ -0,0 +1,132 @@
+"""集市物品名搜索索引：在售挂单的单字/双字倒排表常驻内存。
+
+item_name LIKE '%词%' 用不上任何索引，每次搜索都要扫全部在售挂单；中文物品名也没有可用的前缀。
+这里对每条在售挂单的名称拆出单字与相邻双字，建 {字或双字: {listing_id}} 倒排表：
+- 单字搜索直接取单字桶；
+- 多字搜索取其各双字桶的交集（从最小的桶开始），再用子串校验去掉「双字都在但不相连」的误命中；
+- 名称与搜索词都先 casefold，与原先 LIKE 一样不区分英文大小写。
+命中集合小、且挂单的排序键（单价/到期时间/稀有度）也在条目里，搜索结果的筛选、排序、
+键集分页与总数都在内存完成，最后只按 id 回表取当前页。
+
+数据来源：首次搜索时从库里全量构建；之后由 MarketService 在上架/售罄/取消/过期提交后
+调用 add/discard 维护，并递增 'market_search' generation 计数器；多 worker 时别的 worker
+发现计数变了就全量重建（最多每 STALE_CHECK_INTERVAL 秒检查一次）。绕过 MarketService 直接写库的
+改动由定期全量重建兜底。
+"""
+import threading
+import time
+
+from services import db
+from services.shared_state import GenerationWatch
+
+
+class SearchEntry:
+    """索引里的一条在售挂单：名称 + 分类筛选与排序所需字段。"""
+    FIELDS = ('id', 'item_name', 'category', 'item_type', 'rarity', 'unit_price',
+              'created_at', 'expires_at')
+    __slots__ = FIELDS + ('folded_name',)
+
+    def __init__(self, listing):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(listing, field))
+        self.folded_name = (self.item_name or '').casefold()
+
+
+class MarketSearchIndex:
+    REBUILD_INTERVAL = 600  # 秒；全量重建兜底绕过 add/discard 的改动
+    STALE_CHECK_INTERVAL = 5  # 秒；多 worker 时最多隔这么久发现别的 worker 的上架/下架并重建
+
+    _lock = threading.Lock()
+    _build_lock = threading.Lock()
+    _entries = {}   # {listing_id: SearchEntry}
+    _grams = {}     # {单字或双字: set(listing_id)}
+    _built_at = 0
+    _watch = GenerationWatch('market_search', interval=STALE_CHECK_INTERVAL)
+
+    @staticmethod
+    def _split(name):
+        return set(name) | {name[i:i + 2] for i in range(len(name) - 1)}
+
+    @classmethod
+    def _index(cls, entry):
+        cls._entries[entry.id] = entry
+        for gram in cls._split(entry.folded_name):
+            cls._grams.setdefault(gram, set()).add(entry.id)
+
+    @classmethod
+    def _unindex(cls, listing_id):
+        entry = cls._entries.pop(listing_id, None)
+        if entry is None:
+            return
+        for gram in cls._split(entry.folded_name):
+            bucket = cls._grams.get(gram)
+            if bucket is not None:
+                bucket.discard(listing_id)
+                if not bucket:
+                    del cls._grams[gram]
+
+    @classmethod
+    def rebuild(cls):
+        """从库里全量构建：一次在售挂单列查询。"""
+        from models.player import MarketListing
+        from services.market_service import LIVE_STATUSES
+        generation = cls._watch.current()  # 先取计数再读库：读库期间别的 worker 的写入下次仍会发现
+        rows = db.session.query(*[getattr(MarketListing, f) for f in SearchEntry.FIELDS]) \
+            .filter(MarketListing.status.in_(LIVE_STATUSES)).all()
+        with cls._lock:
+            cls._entries = {}
+            cls._grams = {}
+            for row in rows:
+                cls._index(SearchEntry(row))
+            cls._built_at = time.time()
+            cls._watch.mark(generation)
+
+    @classmethod
+    def _ensure_built(cls):
+        stale = cls._watch.stale()
+        if not stale and time.time() - cls._built_at <= cls.REBUILD_INTERVAL:
+            return
+        # 已有旧索引时，别的线程正在重建就先用旧索引
+        if not cls._build_lock.acquire(blocking=not cls._built_at):
+            return
+        try:
+            if stale or time.time() - cls._built_at > cls.REBUILD_INTERVAL:
+                cls.rebuild()
+        finally:
+            cls._build_lock.release()
+
+    @classmethod
+    def add(cls, listing):
+        """新挂单提交后调用。"""
+        with cls._lock:
+            if cls._built_at:
+                cls._unindex(listing.id)
+                cls._index(SearchEntry(listing))
+        cls._watch.bump()
+
+    @classmethod
+    def discard(cls, listing_id):
+        """挂单售罄/取消/过期提交后调用。"""
+        with cls._lock:
+            cls._unindex(listing_id)
+        cls._watch.bump()
+
+    @classmethod
+    def search(cls, term):
+        """名称包含 term 的在售挂单条目（无序列表）。"""
+        cls._ensure_built()
+        term = (term or '').casefold()
+        grams = [term] if len(term) == 1 else [term[i:i + 2] for i in range(len(term) - 1)]
+        with cls._lock:
+            buckets = sorted((cls._grams.get(g, ()) for g in set(grams)), key=len)
+            if not buckets or not buckets[0]:
+                return []
+            ids = set(buckets[0])
+            for bucket in buckets[1:]:
+                ids &= bucket
+                if not ids:
+                    return []
+            entries = [cls._entries[i] for i in ids]
+        if len(term) > 2:
+            entries = [e for e in entries if term in e.folded_name]
+        return entries
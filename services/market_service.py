@@ -5,15 +5,18 @@
 - 买方付总价 +5% 手续费，卖家实收 95%；
 - 装备挂单期间归属置空(player_id=None)锁定，买入/取消/过期时转移归属
   （参考 lost_found grant_lost_item 模式，到手/退回均未绑定）；
-- 7 天自动下架退回（后台维护线程定时调用 expire_listings）；
+- 7 天自动下架退回（后台调度任务 market_expire 定时调用 expire_listings）；
 - 挂单上限 20 + VIP等级×2（VIP0=20 … VIP5=30）。
 """
 
+import heapq
 from datetime import datetime, timedelta
 
 from services import db
 from services.data_service import DataService
 from services.vip_service import VipService
+from services.market_search import MarketSearchIndex
+from services.unit_of_work import UnitOfWork, retry_on_conflict
 from models.player import (MarketListing, MarketTransaction,
                              InventoryItem, EquipmentInstance, EquipmentSlot)
 
@@ -39,6 +42,11 @@ VIP_CAP_BONUS_PER_LEVEL = 2
 # 分页
 PER_PAGE_DEFAULT = 20
 
+# 在售状态（部分售出仍在售）
+LIVE_STATUSES = ('active', 'partial')
+# 过期处理每批条数（每批一个事务）
+EXPIRE_BATCH = 200
+
 # items.json type -> 中文分类（用于 tab 筛选）
 TYPE_CATEGORY = {
     'material': '材料',
@@ -78,59 +86,139 @@ class MarketService:
     # ------------------------------------------------------------------
     # 列表查询（筛选 + 排序 + 分页）
     # ------------------------------------------------------------------
+    # 排序方式 → (是否降序, [(键列, 游标值类型)])。同一排序内各列方向一致，
+    # 才能用行值比较 (a, b, id) < (?, ?, ?) 表达「游标之后」；末列 id 保证全序。
+    # 最新：挂单有效期固定，expires_at 与 created_at 同序，按 expires_at 排可直接沿复合索引走。
+    # 稀有度：取负权重后与单价同为升序。
+    _RARITY_RANK = db.case(
+        (MarketListing.rarity == '神器', 5),
+        (MarketListing.rarity == '史诗', 4),
+        (MarketListing.rarity == '卓越', 3),
+        (MarketListing.rarity == '精良', 2),
+        else_=1,
+    )
+    SORT_KEYS = {
+        'new': (True, [(MarketListing.expires_at, 'dt'), (MarketListing.created_at, 'dt'),
+                       (MarketListing.id, 'int')]),
+        'price_asc': (False, [(MarketListing.unit_price, 'int'), (MarketListing.id, 'int')]),
+        'price_desc': (True, [(MarketListing.unit_price, 'int'), (MarketListing.id, 'int')]),
+        'rarity': (False, [(-_RARITY_RANK, 'int'), (MarketListing.unit_price, 'int'),
+                           (MarketListing.id, 'int')]),
+    }
+
+    @classmethod
+    def _sort_values(cls, sort, listing):
+        """挂单在该排序下的键值（与 SORT_KEYS 各列一一对应）。"""
+        if sort == 'new':
+            return (listing.expires_at, listing.created_at, listing.id)
+        if sort == 'rarity':
+            return (-RARITY_ORDER.get(listing.rarity, 1), listing.unit_price, listing.id)
+        return (listing.unit_price, listing.id)
+
     @classmethod
-    def get_listings(cls, category=None, search=None, sort='new',
-                     page=1, per_page=PER_PAGE_DEFAULT):
-        """首页列表查询。返回 (rows, total, total_pages, page, per_page, pinned)。
+    def _encode_cursor(cls, sort, listing):
+        return '~'.join(v.isoformat() if isinstance(v, datetime) else str(v)
+                        for v in cls._sort_values(sort, listing))
 
-        注：本系统改用 SQLAlchemy .filter().order_by().offset().limit() 而非
-        代码库惯用的内存切片——集市挂单会持续增长，DB 层分页更高效。
+    @classmethod
+    def _decode_cursor(cls, sort, cursor):
+        """游标串 → 键值元组；格式不符返回 None（按首页处理）。"""
+        kinds = [kind for _, kind in cls.SORT_KEYS[sort][1]]
+        parts = (cursor or '').split('~')
+        if len(parts) != len(kinds):
+            return None
+        try:
+            return tuple(datetime.fromisoformat(v) if kind == 'dt' else int(v)
+                         for v, kind in zip(parts, kinds))
+        except ValueError:
+            return None
+
+    @classmethod
+    def get_listings(cls, category=None, search=None, sort='new', cursor=None,
+                     before=False, per_page=PER_PAGE_DEFAULT):
+        """首页列表查询（只读）。返回 (rows, next_cursor, prev_cursor, pinned, total)。
+
+        键集分页：cursor 为上一页末行（before=True 时为当前页首行）的排序键，
+        查询条件是「排序键在游标之后」，翻到多深都只读 per_page+1 行，不再 OFFSET/COUNT(*)。
+        active/partial 两种状态各查一次再合并，使每条查询都落在单一 status 的索引区间内、
+        按索引顺序取前 N 行而无需排序。过期挂单由后台任务 market_expire 退回，
+        这里只按 expires_at > now 过滤掉尚未处理的。
+        有搜索词时改走内存搜索索引（MarketSearchIndex），total 为命中总数；否则 total 为 None。
         """
-        cls.expire_listings()
+        if sort not in cls.SORT_KEYS:
+            sort = 'new'
+        descending, columns = cls.SORT_KEYS[sort]
+        keys = [col for col, _ in columns]
+        after = cls._decode_cursor(sort, cursor) if cursor else None
+        # 向前翻页：反向排序取游标之前的 N 行，再倒回来
+        forward_desc = descending != bool(before and after)
         now = datetime.utcnow()
+        total = None
 
-        q = MarketListing.query.filter(
-            MarketListing.status.in_(['active', 'partial']),
-            MarketListing.expires_at > now,
-        )
-        if category and category != '全部':
-            q = q.filter(MarketListing.category == category)
         if search:
-            q = q.filter(MarketListing.item_name.like(f'%{search}%'))
-
-        if sort == 'price_asc':
-            q = q.order_by(MarketListing.unit_price.asc())
-        elif sort == 'price_desc':
-            q = q.order_by(MarketListing.unit_price.desc())
-        elif sort == 'rarity':
-            q = q.filter(MarketListing.item_type == 'equipment')
-            q = q.order_by(
-                db.case(
-                    (MarketListing.rarity == '神器', 5),
-                    (MarketListing.rarity == '史诗', 4),
-                    (MarketListing.rarity == '卓越', 3),
-                    (MarketListing.rarity == '精良', 2),
-                    else_=1,
-                ).desc(),
-                MarketListing.unit_price.asc(),
-            )
-        else:  # new
-            q = q.order_by(MarketListing.created_at.desc())
-
-        total = q.count()
-        total_pages = max(1, (total + per_page - 1) // per_page)
-        page = max(1, min(page, total_pages))
-        rows = q.offset((page - 1) * per_page).limit(per_page).all()
+            rows, total = cls._search_candidates(category, search, sort, after,
+                                                 forward_desc, per_page + 1, now)
+        else:
+            rows = []
+            for status in LIVE_STATUSES:
+                q = MarketListing.query.filter(
+                    MarketListing.status == status,
+                    MarketListing.expires_at > now,
+                )
+                if category and category != '全部':
+                    q = q.filter(MarketListing.category == category)
+                if sort == 'rarity':
+                    q = q.filter(MarketListing.item_type == 'equipment')
+                if after:
+                    row_key = db.tuple_(*keys)
+                    q = q.filter(row_key < after if forward_desc else row_key > after)
+                q = q.order_by(*[k.desc() if forward_desc else k.asc() for k in keys])
+                rows.extend(q.limit(per_page + 1).all())
+
+        rows.sort(key=lambda r: cls._sort_values(sort, r), reverse=forward_desc)
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if before and after:
+            rows.reverse()
+            next_cursor = cls._encode_cursor(sort, rows[-1]) if rows else None
+            prev_cursor = cls._encode_cursor(sort, rows[0]) if rows and has_more else None
+        else:
+            next_cursor = cls._encode_cursor(sort, rows[-1]) if rows and has_more else None
+            prev_cursor = cls._encode_cursor(sort, rows[0]) if rows and after else None
+        if search and rows:
+            # 命中的是索引条目，按当前页 id 一次回表
+            by_id = {r.id: r for r in MarketListing.query.filter(
+                MarketListing.id.in_([e.id for e in rows])).all()}
+            rows = [by_id[e.id] for e in rows if e.id in by_id]
 
         # 置顶区：ad_tier==2 且 pin_until>now，最多 5 条
         pinned = MarketListing.query.filter(
             MarketListing.ad_tier == AD_TIER_PREMIUM,
             MarketListing.pin_until > now,
-            MarketListing.status.in_(['active', 'partial']),
+            MarketListing.status.in_(LIVE_STATUSES),
             MarketListing.expires_at > now,
         ).order_by(MarketListing.pin_until.desc()).limit(5).all()
 
-        return rows, total, total_pages, page, per_page, pinned
+        return rows, next_cursor, prev_cursor, pinned, total
+
+    @classmethod
+    def _search_candidates(cls, category, search, sort, after, descending, limit, now):
+        """搜索路径：索引命中 → 分类/到期筛选 → 游标之后按排序键取前 limit 条。
+
+        返回 (条目列表, 命中总数)。条目与挂单行字段同名，可直接用于 _sort_values/_encode_cursor。
+        """
+        entries = [e for e in MarketSearchIndex.search(search)
+                   if e.expires_at > now
+                   and (not category or category == '全部' or e.category == category)
+                   and (sort != 'rarity' or e.item_type == 'equipment')]
+        total = len(entries)
+        if after:
+            if descending:
+                entries = [e for e in entries if cls._sort_values(sort, e) < after]
+            else:
+                entries = [e for e in entries if cls._sort_values(sort, e) > after]
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        return pick(limit, entries, key=lambda e: cls._sort_values(sort, e)), total
 
     @classmethod
     def get_listing(cls, listing_id):
@@ -291,6 +379,8 @@ class MarketService:
         db.session.add(listing)
         db.session.flush()  # 取 listing.id
         db.session.commit()
+        cls._note_due(listing.expires_at)
+        MarketSearchIndex.add(listing)
 
         # 广播（commit 后发，避免事务回滚后仍残留通知）
         if ad_tier > 0:
@@ -303,8 +393,12 @@ class MarketService:
     # 购买
     # ------------------------------------------------------------------
     @classmethod
+    @retry_on_conflict
     def buy_listing(cls, player, listing_id, buy_quantity=1):
-        """购买挂单（可部分购买可堆叠物品）。返回 (ok, msg)。"""
+        """购买挂单（可部分购买可堆叠物品）。返回 (ok, msg)。
+
+        挂单/买家/卖家/装备实例都带版本号：并发抢购同一挂单或同一买家连点时，
+        后提交的一方冲突回滚后按最新库存与余额重跑。"""
         try:
             buy_quantity = int(buy_quantity)
         except (TypeError, ValueError):
@@ -317,6 +411,8 @@ class MarketService:
             return False, "挂单不存在"
         if listing.status not in ('active', 'partial'):
             return False, "挂单已结束"
+        if listing.expires_at and listing.expires_at <= datetime.utcnow():
+            return False, "挂单已过期"
         if listing.seller_id == player.id:
             return False, "不能购买自己的挂单"
 
@@ -378,7 +474,10 @@ class MarketService:
         cls.record_transaction(listing, player, seller, buy_quantity,
                                total_price, buyer_fee, seller_receive)
 
-        db.session.commit()
+        sold_out = listing.status == 'sold'
+        UnitOfWork.commit_now()  # 扣款/库存变动须立即对其他买家可见
+        if sold_out:
+            MarketSearchIndex.discard(listing_id)
         return True, f"购买成功，花费{buyer_pays}银两"
 
     # ------------------------------------------------------------------
@@ -439,26 +538,55 @@ class MarketService:
         cls._return_to_seller(listing)
         listing.status = 'cancelled'
         db.session.commit()
+        MarketSearchIndex.discard(listing_id)
         return True, "挂单已取消，物品退回背包（手续费不退）"
 
     # ------------------------------------------------------------------
-    # 过期（后台维护线程定时调用；路由调用仅作兜底）
+    # 过期（后台调度任务 market_expire 定时调用）
     # ------------------------------------------------------------------
+    _next_due = None  # 在售挂单最早到期时间（下界）；None 表示需查库
+
+    @classmethod
+    def _note_due(cls, expires_at):
+        """新挂单入库后调用：必要时提前到期队列的下一个检查点。"""
+        if cls._next_due is None or expires_at < cls._next_due:
+            cls._next_due = expires_at
+
     @classmethod
     def expire_listings(cls):
-        """过期挂单退回卖家。无返回，静默推进。"""
+        """过期挂单退回卖家，返回处理条数。
+
+        到期队列即 (status, expires_at) 复合索引：每种在售状态按 expires_at 升序取已到期的一批，
+        处理完再取一次各状态的最小 expires_at 作为下一个检查点；未到检查点时直接返回，不查库。
+        """
         now = datetime.utcnow()
-        expired = MarketListing.query.filter(
-            MarketListing.expires_at <= now,
-            MarketListing.status.in_(['active', 'partial']),
-        ).all()
-        if not expired:
+        if cls._next_due is not None and cls._next_due > now:
             return 0
-        for listing in expired:
-            cls._return_to_seller(listing)
-            listing.status = 'expired'
-        db.session.commit()
-        return len(expired)
+        total = 0
+        for status in LIVE_STATUSES:
+            while True:
+                expired = MarketListing.query.filter(
+                    MarketListing.status == status,
+                    MarketListing.expires_at <= now,
+                ).order_by(MarketListing.expires_at).limit(EXPIRE_BATCH).all()
+                for listing in expired:
+                    cls._return_to_seller(listing)
+                    listing.status = 'expired'
+                if expired:
+                    expired_ids = [listing.id for listing in expired]
+                    db.session.commit()
+                    total += len(expired)
+                    for listing_id in expired_ids:
+                        MarketSearchIndex.discard(listing_id)
+                if len(expired) < EXPIRE_BATCH:
+                    break
+        dues = [db.session.query(db.func.min(MarketListing.expires_at))
+                .filter(MarketListing.status == status).scalar()
+                for status in LIVE_STATUSES]
+        dues = [d for d in dues if d is not None]
+        # 暂无在售挂单：新挂单最早也要 LISTING_DURATION 后到期，上架时 _note_due 会再提前
+        cls._next_due = min(dues) if dues else now + LISTING_DURATION
+        return total
 
     # ------------------------------------------------------------------
     # 内部工具
@@ -1,30 +1,38 @@
 import time
 from services import db
+from services.shared_state import DELETE, SharedState
 from models.player import PartyChat
 
 
 MAX_PARTY_SIZE = 5
 BONUS_PER_MEMBER = 0.01  # 1% per online member
 
-# Track logged-in user IDs for online detection
-_online_players = set()
+# Track logged-in user IDs for online detection（SharedState 'online' 命名空间，多 worker 共用）
+ONLINE_NAMESPACE = 'online'
+ONLINE_MARK_INTERVAL = 60  # 秒；每个请求都会 mark_online，本进程内节流写后端
+_online_marked_at = {}     # {player_id: 本进程上次写入时间}
 
 
 def mark_online(player_id):
-    _online_players.add(player_id)
+    now = time.time()
+    if now - _online_marked_at.get(player_id, 0) < ONLINE_MARK_INTERVAL:
+        return
+    _online_marked_at[player_id] = now
+    SharedState.backend.set(ONLINE_NAMESPACE, player_id, True)
 
 
 def mark_offline(player_id):
-    _online_players.discard(player_id)
+    _online_marked_at.pop(player_id, None)
+    SharedState.backend.delete(ONLINE_NAMESPACE, player_id)
 
 
 def is_player_online(player_id):
-    return player_id in _online_players
+    return SharedState.backend.get(ONLINE_NAMESPACE, player_id) is not None
 
 
 def get_online_player_ids():
     """返回当前在线的 player_id 列表（副本）。"""
-    return list(_online_players)
+    return list(SharedState.backend.items(ONLINE_NAMESPACE))
 
 
 class PartyState:
@@ -38,44 +46,106 @@ class PartyState:
         self.invites = {}  # {player_id: expire_time}
         self.applications = {}  # {player_id: apply_time}
 
+    def to_dict(self):
+        return {
+            'party_id': self.party_id,
+            'leader_id': self.leader_id,
+            'members': sorted(self.members),
+            'created_at': self.created_at,
+            'invites': self.invites,
+            'applications': self.applications,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['party_id'], data['leader_id'])
+        state.members = set(data.get('members') or [])
+        state.created_at = data.get('created_at') or state.created_at
+        # JSON 对象的键只能是字符串，玩家 id 还原为 int
+        state.invites = {int(k): v for k, v in (data.get('invites') or {}).items()}
+        state.applications = {int(k): v for k, v in (data.get('applications') or {}).items()}
+        return state
+
+
+# 队伍存 SharedState（多 worker 共用）：PARTY_NAMESPACE 为 {party_id: PartyState}，
+# MEMBER_NAMESPACE 为玩家→队伍索引 {player_id: party_id}，队伍编号取自 PARTY_ID_COUNTER 计数器
+PARTY_NAMESPACE = 'party'
+MEMBER_NAMESPACE = 'party_member'
+PARTY_ID_COUNTER = 'party_id'
+SharedState.register_codec(PARTY_NAMESPACE, encode=PartyState.to_dict, decode=PartyState.from_dict)
+
 
 class PartyService:
-    _parties = {}  # {party_id: PartyState}
-    _player_party = {}  # {player_id: party_id}
-    _next_id = 1
+
+    # 队伍经 get_party/_party_of 只读，修改一律走 _update_party/_claim_member/_release_member
+
+    @classmethod
+    def _party_of(cls, player_id):
+        return SharedState.backend.get(MEMBER_NAMESPACE, player_id)
+
+    @classmethod
+    def _claim_member(cls, player_id, party_id):
+        """原子登记玩家所在队伍；已登记在别的队伍时返回 False（并发入两个队只有一个成功）。"""
+        claimed = []
+
+        def _claim(current):
+            if current is not None and current != party_id:
+                return current
+            claimed.append(True)
+            return party_id
+        SharedState.backend.update(MEMBER_NAMESPACE, player_id, _claim)
+        return bool(claimed)
+
+    @classmethod
+    def _release_member(cls, player_id, party_id):
+        """索引仍指向该队伍时才删除，不误删玩家刚加入的新队伍。"""
+        SharedState.backend.update(
+            MEMBER_NAMESPACE, player_id,
+            lambda current: DELETE if current is None or current == party_id else current)
+
+    @classmethod
+    def _update_party(cls, party_id, func):
+        """原子修改队伍：func 就地修改 PartyState。返回修改后的队伍，队伍不存在返回 None（不调用 func）。"""
+        def _apply(party):
+            if party is None:
+                return DELETE
+            func(party)
+            return party
+        return SharedState.backend.update(PARTY_NAMESPACE, party_id, _apply)
 
     @classmethod
     def create_party(cls, player):
-        if player.id in cls._player_party:
+        if cls._party_of(player.id) is not None:
             return None, "你已在队伍中"
-        party_id = cls._next_id
-        cls._next_id += 1
+        party_id = SharedState.bump(PARTY_ID_COUNTER)
         party = PartyState(party_id, player.id)
-        cls._parties[party_id] = party
-        cls._player_party[player.id] = party_id
+        SharedState.backend.set(PARTY_NAMESPACE, party_id, party)
+        if not cls._claim_member(player.id, party_id):
+            SharedState.backend.delete(PARTY_NAMESPACE, party_id)
+            return None, "你已在队伍中"
         player.party_id = party_id
         db.session.commit()
         return party, None
 
     @classmethod
     def get_party(cls, party_id):
-        return cls._parties.get(party_id)
+        return SharedState.backend.get(PARTY_NAMESPACE, party_id)
 
     @classmethod
     def get_player_party(cls, player):
-        party_id = cls._player_party.get(player.id)
+        party_id = cls._party_of(player.id)
         if party_id:
-            party = cls._parties.get(party_id)
+            party = cls.get_party(party_id)
             if party and player.id in party.members:
                 return party
             # Stale mapping, clean up
-            cls._player_party.pop(player.id, None)
+            cls._release_member(player.id, party_id)
         # Check DB party_id
         if player.party_id:
-            party = cls._parties.get(player.party_id)
+            party = cls.get_party(player.party_id)
             if party and player.id in party.members:
                 # Re-sync mapping
-                cls._player_party[player.id] = player.party_id
+                cls._claim_member(player.id, player.party_id)
                 return party
             # DB party_id is stale, clean up
             player.party_id = None
@@ -120,19 +190,15 @@ class PartyService:
 
     @classmethod
     def leave_party(cls, player):
-        party_id = cls._player_party.get(player.id)
+        party_id = cls._party_of(player.id)
         if not party_id:
             return False, "你不在队伍中"
-        party = cls._parties.get(party_id)
-        if not party:
-            cls._player_party.pop(player.id, None)
-            player.party_id = None
-            db.session.commit()
-            return True, "已离开队伍"
-        party.members.discard(player.id)
-        cls._player_party.pop(player.id, None)
+        party = cls._update_party(party_id, lambda party: party.members.discard(player.id))
+        cls._release_member(player.id, party_id)
         player.party_id = None
         db.session.commit()
+        if not party:
+            return True, "已离开队伍"
 
         if player.id == party.leader_id:
             cls._dissolve_party(party_id)
@@ -153,8 +219,8 @@ class PartyService:
             return False, "该玩家不在队伍中"
         if target_id == party.leader_id:
             return False, "不能踢出自己"
-        party.members.discard(target_id)
-        cls._player_party.pop(target_id, None)
+        cls._update_party(party.party_id, lambda party: party.members.discard(target_id))
+        cls._release_member(target_id, party.party_id)
         from models.player import PlayerModel
         target = PlayerModel.query.get(target_id)
         if target:
@@ -169,45 +235,67 @@ class PartyService:
             return False, "你不在队伍中"
         if party.leader_id != leader.id:
             return False, "只有队长可以邀请"
-        if target_id in cls._player_party:
+        if cls._party_of(target_id) is not None:
             return False, "对方已在其他队伍中"
         if target_id in party.members:
             return False, "对方已在本队伍中"
         if len(party.members) >= MAX_PARTY_SIZE:
             return False, "队伍已满"
-        party.invites[target_id] = time.time() + 60  # 60s expiry
+        expire = time.time() + 60  # 60s expiry
+        cls._update_party(party.party_id, lambda party: party.invites.__setitem__(target_id, expire))
         return True, "已发送邀请"
 
+    @classmethod
+    def _join(cls, player_id, party_id, pending, taken_msg):
+        """把玩家从 invites/applications（pending 指定哪一个）转为成员。返回错误信息，成功返回 None。
+
+        先原子登记玩家→队伍索引，再在队伍里原子复查名额，并发加入时既不会一人入两队，也不会超员。
+        """
+        if not cls._claim_member(player_id, party_id):
+            return taken_msg
+        joined = []
+
+        def _add(party):
+            requests = getattr(party, pending)
+            if player_id not in requests:
+                return
+            requests.pop(player_id, None)
+            if len(party.members) >= MAX_PARTY_SIZE:
+                return
+            party.members.add(player_id)
+            joined.append(True)
+        party = cls._update_party(party_id, _add)
+        if joined:
+            return None
+        cls._release_member(player_id, party_id)
+        return "队伍已满" if party else "队伍不存在"
+
     @classmethod
     def accept_invite(cls, player, party_id):
-        if player.id in cls._player_party:
+        if cls._party_of(player.id) is not None:
             return False, "你已在队伍中"
-        party = cls._parties.get(party_id)
+        party = cls.get_party(party_id)
         if not party:
             return False, "队伍不存在"
         if player.id not in party.invites:
             return False, "没有收到该队伍的邀请"
         if party.invites[player.id] < time.time():
-            party.invites.pop(player.id, None)
+            cls._update_party(party_id, lambda party: party.invites.pop(player.id, None))
             return False, "邀请已过期"
-        if len(party.members) >= MAX_PARTY_SIZE:
-            party.invites.pop(player.id, None)
-            return False, "队伍已满"
-        party.members.add(player.id)
-        party.invites.pop(player.id, None)
-        cls._player_party[player.id] = party_id
+        error = cls._join(player.id, party_id, 'invites', "你已在队伍中")
+        if error:
+            return False, error
         player.party_id = party_id
         db.session.commit()
         return True, None
 
     @classmethod
     def apply_to_party(cls, player, party_id):
-        if player.id in cls._player_party:
+        if cls._party_of(player.id) is not None:
             return False, "你已在队伍中"
-        party = cls._parties.get(party_id)
-        if not party:
+        now = time.time()
+        if not cls._update_party(party_id, lambda party: party.applications.__setitem__(player.id, now)):
             return False, "队伍不存在"
-        party.applications[player.id] = time.time()
         return True, "已发送申请"
 
     @classmethod
@@ -219,15 +307,9 @@ class PartyService:
             return False, "只有队长可以审批申请"
         if applicant_id not in party.applications:
             return False, "没有该玩家的申请"
-        if applicant_id in cls._player_party:
-            party.applications.pop(applicant_id, None)
-            return False, "对方已加入其他队伍"
-        if len(party.members) >= MAX_PARTY_SIZE:
-            party.applications.pop(applicant_id, None)
-            return False, "队伍已满"
-        party.members.add(applicant_id)
-        party.applications.pop(applicant_id, None)
-        cls._player_party[applicant_id] = party.party_id
+        error = cls._join(applicant_id, party.party_id, 'applications', "对方已加入其他队伍")
+        if error:
+            return False, error
         from models.player import PlayerModel
         applicant = PlayerModel.query.get(applicant_id)
         if applicant:
@@ -242,17 +324,20 @@ class PartyService:
             return False, "你不在队伍中"
         if party.leader_id != leader.id:
             return False, "只有队长可以审批申请"
-        party.applications.pop(applicant_id, None)
+        cls._update_party(party.party_id, lambda party: party.applications.pop(applicant_id, None))
         return True, "已拒绝申请"
 
     @classmethod
     def get_pending_invites(cls, player):
         result = []
-        for party_id, party in cls._parties.items():
-            if player.id in party.invites and party.invites[player.id] > time.time():
+        now = time.time()
+        for party_id, party in SharedState.backend.items(PARTY_NAMESPACE).items():
+            if player.id not in party.invites:
+                continue
+            if party.invites[player.id] > now:
                 result.append(party)
             else:
-                party.invites.pop(player.id, None)
+                cls._update_party(party_id, lambda party: party.invites.pop(player.id, None))
         return result
 
     @classmethod
@@ -273,12 +358,19 @@ class PartyService:
 
     @classmethod
     def _dissolve_party(cls, party_id):
-        party = cls._parties.pop(party_id, None)
-        if not party:
+        removed = []
+
+        def _remove(party):
+            if party is not None:
+                removed.append(party)
+            return DELETE
+        SharedState.backend.update(PARTY_NAMESPACE, party_id, _remove)
+        if not removed:
             return
+        party = removed[0]
         from models.player import PlayerModel
         for mid in party.members:
-            cls._player_party.pop(mid, None)
+            cls._release_member(mid, party_id)
             p = PlayerModel.query.get(mid)
             if p:
                 p.party_id = None
@@ -287,22 +379,18 @@ class PartyService:
     @classmethod
     def remove_offline_members(cls):
         from models.player import PlayerModel
-        to_remove = []
-        for party_id, party in list(cls._parties.items()):
-            for mid in list(party.members):
-                if not is_player_online(mid):
-                    if mid != party.leader_id:
-                        to_remove.append((party_id, mid))
-            for pid, mid in to_remove:
-                pty = cls._parties.get(pid)
-                if pty:
-                    pty.members.discard(mid)
-                    cls._player_party.pop(mid, None)
-                    p = PlayerModel.query.get(mid)
-                    if p:
-                        p.party_id = None
-            if to_remove:
-                db.session.commit()
+        for party_id, party in SharedState.backend.items(PARTY_NAMESPACE).items():
+            to_remove = [mid for mid in party.members
+                         if mid != party.leader_id and not is_player_online(mid)]
+            if not to_remove:
+                continue
+            cls._update_party(party_id, lambda party, gone=to_remove: party.members.difference_update(gone))
+            for mid in to_remove:
+                cls._release_member(mid, party_id)
+                p = PlayerModel.query.get(mid)
+                if p:
+                    p.party_id = None
+            db.session.commit()
 
     @classmethod
     def on_player_disconnect(cls, player):
@@ -312,7 +400,7 @@ class PartyService:
         if party.leader_id == player.id:
             cls._dissolve_party(party.party_id)
         else:
-            party.members.discard(player.id)
-            cls._player_party.pop(player.id, None)
+            cls._update_party(party.party_id, lambda party: party.members.discard(player.id))
+            cls._release_member(player.id, party.party_id)
             player.party_id = None
             db.session.commit()
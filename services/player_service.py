@@ -1,10 +1,11 @@
 import random
 import time
 import math
-from datetime import datetime
+from datetime import datetime, date
 from werkzeug.security import generate_password_hash, check_password_hash
 from services import db
 from services.data_service import DataService
+from services.stat_cache import StatCache
 from models.player import (
     PlayerModel, EquipmentInstance, InventoryItem,
     EquipmentSlot, PlayerSkill, TempEffect
@@ -123,147 +124,68 @@ class PlayerService:
         value = value * (1 + rate)
         return value
 
+    @classmethod
+    def get_stats(cls, player):
+        """取玩家本请求内的有效属性快照（EffectiveStats），首次调用时汇总全部加成来源。
+
+        快照挂在 flask.g 上按 player.id 缓存；加成来源有写入时由 ORM 监听器整体清空。
+        无请求/应用上下文时（后台线程）每次现算，不缓存。
+        """
+        try:
+            from flask import g
+            cache = getattr(g, '_effective_stats', None)
+            if cache is None:
+                cache = {}
+                g._effective_stats = cache
+        except RuntimeError:
+            return EffectiveStats(player)
+        snap = cache.get(player.id)
+        if snap is None or snap.player is not player:
+            snap = EffectiveStats(player)
+            cache[player.id] = snap
+        return snap
+
+    @classmethod
+    def invalidate_stats(cls, player_id=None):
+        """清空本请求的有效属性快照；player_id 为空时清空全部。"""
+        try:
+            from flask import g
+            cache = getattr(g, '_effective_stats', None)
+        except RuntimeError:
+            return
+        if not cache:
+            return
+        if player_id is None:
+            cache.clear()
+        else:
+            cache.pop(player_id, None)
+
     @classmethod
     def get_attack(cls, player):
-        from services.title_service import TitleService
-        from services.social_service import SocialService
-        from services.vip_service import VipService
-        from services.legion_service import LegionService
-        from models.lieutenant import Lieutenant
-        base = player.attack
-        equip_atk = cls._get_equipment_stat_sum(player, "attack")
-        pill = player.pill_attack
-        flat, rate = DataService.get_temp_stat_bonus(player.id, "attack")
-        rank_atk = player.rank_attack
-        passive = player.get_passive_bonuses()
-        passive_flat = passive.get('attack', 0)
-        title_bonuses = TitleService.get_title_bonuses(player)
-        title_atk = title_bonuses.get('attack', 0)
-        lt_bonus_flat = cls._get_lt_passive_bonus(player, 'attack')
-        relation_atk = SocialService.get_online_relation_attack_bonus(player)
-        social_rate = SocialService.get_social_bonus_rate(player)
-        spouse_rate = SocialService.get_spouse_bonus_rate(player)
-        vip_rate = VipService.get_stat_bonus_rate(player)
-        legion_skills = LegionService.get_legion_skill_bonuses(player)
-        legion_atk = legion_skills.get('attack', 0)
-        legion_aura = LegionService.get_vip_aura_bonuses(player)
-        aura_atk = legion_aura.get('attack', 0)
-        from services.battlefield_service import BattlefieldService
-        territory = BattlefieldService.get_territory_bonuses(player)
-        territory_atk = territory.get('attack', 0)
-        from services.party_service import PartyService
-        party_rate = PartyService.get_party_bonus_rate(player)
-        return int((base + equip_atk + pill + flat + rank_atk + title_atk + relation_atk + legion_atk + aura_atk + territory_atk + passive_flat + lt_bonus_flat) * (1 + rate + social_rate + spouse_rate + vip_rate + party_rate))
+        return cls.get_stats(player).get('attack')
 
     @classmethod
     def get_defense(cls, player):
-        from services.title_service import TitleService
-        from services.social_service import SocialService
-        from services.vip_service import VipService
-        from services.legion_service import LegionService
-        from models.lieutenant import Lieutenant
-        base = player.defense
-        equip_def = cls._get_equipment_stat_sum(player, "defense")
-        pill = player.pill_defense
-        flat, rate = DataService.get_temp_stat_bonus(player.id, "defense")
-        passive = player.get_passive_bonuses()
-        passive_flat = passive.get('defense', 0)
-        title_bonuses = TitleService.get_title_bonuses(player)
-        title_def = title_bonuses.get('defense', 0)
-        lt_bonus_flat = cls._get_lt_passive_bonus(player, 'defense')
-        social_rate = SocialService.get_social_bonus_rate(player)
-        spouse_rate = SocialService.get_spouse_bonus_rate(player)
-        vip_rate = VipService.get_stat_bonus_rate(player)
-        legion_skills = LegionService.get_legion_skill_bonuses(player)
-        legion_def = legion_skills.get('defense', 0)
-        legion_aura = LegionService.get_vip_aura_bonuses(player)
-        aura_def = legion_aura.get('defense', 0)
-        from services.battlefield_service import BattlefieldService
-        territory = BattlefieldService.get_territory_bonuses(player)
-        territory_def = territory.get('defense', 0)
-        from services.party_service import PartyService
-        party_rate = PartyService.get_party_bonus_rate(player)
-        return int((base + equip_def + pill + flat + title_def + legion_def + aura_def + territory_def + passive_flat + lt_bonus_flat) * (1 + rate + social_rate + spouse_rate + vip_rate + party_rate))
+        return cls.get_stats(player).get('defense')
 
     @classmethod
     def get_max_health(cls, player):
-        from services.title_service import TitleService
-        from services.social_service import SocialService
-        from services.vip_service import VipService
-        from services.legion_service import LegionService
-        from models.lieutenant import Lieutenant
-        base = player.max_health
-        equip_hp = cls._get_equipment_stat_sum(player, "max_health")
-        pill = player.pill_max_health
-        flat, rate = DataService.get_temp_stat_bonus(player.id, "max_health")
-        passive = player.get_passive_bonuses()
-        passive_flat = passive.get('max_health', 0)
-        title_bonuses = TitleService.get_title_bonuses(player)
-        title_hp = title_bonuses.get('max_health', 0)
-        lt_bonus_flat = cls._get_lt_passive_bonus(player, 'health')
-        social_rate = SocialService.get_social_bonus_rate(player)
-        spouse_rate = SocialService.get_spouse_bonus_rate(player)
-        vip_rate = VipService.get_stat_bonus_rate(player)
-        legion_skills = LegionService.get_legion_skill_bonuses(player)
-        legion_hp = legion_skills.get('max_health', 0)
-        legion_aura = LegionService.get_vip_aura_bonuses(player)
-        aura_hp = legion_aura.get('max_health', 0)
-        from services.battlefield_service import BattlefieldService
-        territory = BattlefieldService.get_territory_bonuses(player)
-        territory_hp = territory.get('max_health', 0)
-        return int((base + equip_hp + pill + flat + title_hp + legion_hp + aura_hp + territory_hp + passive_flat + lt_bonus_flat) * (1 + rate + social_rate + spouse_rate + vip_rate))
+        return cls.get_stats(player).get('max_health')
 
     @classmethod
     def get_max_mana(cls, player):
-        from services.title_service import TitleService
-        from services.social_service import SocialService
-        from services.vip_service import VipService
-        from services.legion_service import LegionService
-        from models.lieutenant import Lieutenant
-        base = player.max_mana
-        equip_mp = cls._get_equipment_stat_sum(player, "max_mana")
-        pill = player.pill_max_mana
-        flat, rate = DataService.get_temp_stat_bonus(player.id, "max_mana")
-        passive = player.get_passive_bonuses()
-        passive_flat = passive.get('max_mana', 0)
-        title_bonuses = TitleService.get_title_bonuses(player)
-        title_mp = title_bonuses.get('max_mana', 0)
-        lt_bonus_flat = cls._get_lt_passive_bonus(player, 'mana')
-        social_rate = SocialService.get_social_bonus_rate(player)
-        spouse_rate = SocialService.get_spouse_bonus_rate(player)
-        vip_rate = VipService.get_stat_bonus_rate(player)
-        legion_skills = LegionService.get_legion_skill_bonuses(player)
-        legion_mp = legion_skills.get('max_mana', 0)
-        from services.battlefield_service import BattlefieldService
-        territory = BattlefieldService.get_territory_bonuses(player)
-        territory_mp = territory.get('max_mana', 0)
-        return int((base + equip_mp + pill + flat + title_mp + legion_mp + territory_mp + passive_flat + lt_bonus_flat) * (1 + rate + social_rate + spouse_rate + vip_rate))
+        return cls.get_stats(player).get('max_mana')
 
     @classmethod
     def _get_equipment_stat_sum(cls, player, stat_name):
-        total = 0
-        equipped = DataService.get_equipped(player.id)
-        for slot_name, equip in equipped.items():
-            if equip:
-                total += equip.get_base_stats().get(stat_name, 0)
-                extra = equip.get_extra_stats().get(stat_name)
-                if extra and isinstance(extra, list):
-                    total += extra[0]
-        if stat_name in ('crit_rate', 'dodge_rate'):
-            return total
-        return int(total)
+        return cls.get_stats(player).equip.get(stat_name, 0)
 
     @classmethod
     def _get_lt_passive_bonus(cls, player, bonus_type):
-        """Get lieutenant passive bonus for a stat type. Returns (flat, rate) tuple.
+        """Get lieutenant passive bonus for a stat type.
         attack/defense/health/mana are flat values (already computed from lt stat × %).
         crit/dodge are also flat values (rate points added to player's rate)."""
-        from models.lieutenant import Lieutenant
-        lt = Lieutenant.query.filter_by(owner_id=player.id, is_deployed=True, is_alive=True).first()
-        if not lt:
-            return 0
-        bonus = lt.get_passive_bonus()
-        return bonus.get(bonus_type, 0)
+        return cls.get_stats(player).lieutenant.get(bonus_type, 0)
 
     @classmethod
     def level_up(cls, player):
@@ -460,3 +382,159 @@ class PlayerService:
         # Map 12 ranks to 11 tiers: last two share tier 11
         tier = min(idx + 1, 11)
         return f"rongyu/{prefix}{tier:02d}.png"
+
+
+class EffectiveStats:
+    """玩家有效属性快照：一次性汇总全部加成来源，供六项面板属性及其明细复用。
+
+    原先 get_attack/get_defense/get_max_health/get_max_mana 与 effective_crit_rate/
+    effective_dodge_rate 各自重跑一遍装备、临时BUFF、被动技能、称号、副将、红颜/结婚、
+    军团、领地查询，一个页面显示六项属性就要 60+ 次 SQL。这里每类来源只查一次。
+
+    只缓存「加成来源」；基础列(attack/pill_attack/rank_attack 等)每次现读，
+    因此升级、吃丹药改动基础属性后无需失效。VIP 与组队加成不查库，也每次现算。
+    除临时BUFF外，各来源经 StatCache 跨请求缓存，失效规则见 services/stat_cache.py。
+    """
+
+    STATS = ('attack', 'defense', 'max_health', 'max_mana', 'crit_rate', 'dodge_rate')
+    STAT_LABELS = {
+        'attack': '有效攻击力', 'defense': '有效防御力',
+        'max_health': '有效生命上限', 'max_mana': '有效魔法上限',
+        'crit_rate': '有效暴击率', 'dodge_rate': '有效闪避率',
+    }
+    # 副将 get_passive_bonus 的键名 → 面板属性名
+    LT_KEYS = {'attack': 'attack', 'defense': 'defense', 'max_health': 'health',
+               'max_mana': 'mana', 'crit_rate': 'crit', 'dodge_rate': 'dodge'}
+
+    __slots__ = ('player', 'equip', 'temp', 'passive', 'title', 'lieutenant',
+                 'social_rate', 'spouse_rate', 'legion_skills', 'legion_aura', 'territory')
+
+    def __init__(self, player):
+        pid = player.id
+        self.player = player
+        self.equip = StatCache.get(pid, 'equip', lambda: self._load_equipment(player))
+        self.temp = self._load_temp_effects(player)
+        self.passive = StatCache.get(pid, 'passive', player.get_passive_bonuses)
+        from services.title_service import TitleService
+        self.title = StatCache.get(pid, 'title', lambda: TitleService.get_title_bonuses(player))
+        self.lieutenant = StatCache.get(pid, 'lieutenant', lambda: self._load_lieutenant(player))
+        from services.social_service import SocialService
+        self.social_rate, self.spouse_rate = StatCache.get(
+            pid, 'social', lambda: SocialService.get_relation_bonus_rates(player))
+        # 领地周重置原本挂在 get_territory_bonuses 入口，命中缓存时也要照常触发
+        from services.battlefield_service import BattlefieldService
+        BattlefieldService.ensure_weekly_territory_reset()
+        legion = StatCache.get(pid, 'legion', lambda: self._load_legion(player),
+                               is_fresh=lambda v: v['date'] == date.today().isoformat())
+        self.legion_skills, self.legion_aura, self.territory = (
+            legion['skills'], legion['aura'], legion['territory'])
+
+    @staticmethod
+    def _load_equipment(player):
+        totals = {}
+        for equip in DataService.get_equipped(player.id).values():
+            if not equip:
+                continue
+            equip_totals = equip.get_decoded_stats()[2]
+            for stat in EffectiveStats.STATS:
+                totals[stat] = totals.get(stat, 0) + equip_totals[stat]
+        # 与原 _get_equipment_stat_sum 一致：暴击/闪避保留小数，其余取整
+        return {stat: (totals.get(stat, 0) if stat in ('crit_rate', 'dodge_rate')
+                       else int(totals.get(stat, 0)))
+                for stat in EffectiveStats.STATS}
+
+    @staticmethod
+    def _load_temp_effects(player):
+        temp = {}
+        for e in DataService.get_temp_effects(player.id):
+            flat, rate = temp.get(e.stat, (0, 0))
+            temp[e.stat] = (flat + e.value, rate + e.rate)
+        return temp
+
+    @staticmethod
+    def _load_lieutenant(player):
+        from models.lieutenant import Lieutenant
+        lt = Lieutenant.query.filter_by(owner_id=player.id, is_deployed=True, is_alive=True).first()
+        return lt.get_passive_bonus() if lt else {}
+
+    @staticmethod
+    def _load_legion(player):
+        """军团技能、VIP 光环、领地加成共用一次 LegionMember/Legion 查询。
+
+        VIP 光环按日刷新，结果带上日期，跨天后由 StatCache 视为过期重载。
+        """
+        from models.legion import Legion, LegionMember
+        member = LegionMember.query.filter_by(player_id=player.id).first()
+        legion = Legion.query.get(member.legion_id) if member else None
+        entry = {'date': date.today().isoformat(), 'skills': {}, 'aura': {}, 'territory': {}}
+        StatCache.remember_legion(player.id, legion.id if legion else None)
+        if not legion:
+            return entry
+        from services.legion_service import LegionService
+        from services.battlefield_service import BattlefieldService
+        entry.update(skills=legion.get_skill_bonuses(),
+                     aura=LegionService.get_legion_vip_aura(legion),
+                     territory=BattlefieldService.get_legion_territory_bonuses(legion))
+        return entry
+
+    def _parts(self, stat):
+        """返回 (flat_parts, rate_parts)，各为 [(名称, 数值)]，顺序与原公式求和顺序一致。"""
+        from services.vip_service import VipService
+        from services.party_service import PartyService
+        p = self.player
+        lt = self.lieutenant.get(self.LT_KEYS[stat], 0)
+        if stat in ('crit_rate', 'dodge_rate'):
+            return [
+                ('基础', getattr(p, stat)),
+                ('被动技能', self.passive.get(stat, 0)),
+                ('称号加成', self.title.get(stat, 0)),
+                ('副将加成', lt),
+                ('装备加成', self.equip[stat]),
+            ], []
+        pill = getattr(p, 'pill_' + stat)
+        temp_flat, temp_rate = self.temp.get(stat, (0, 0))
+        flat = [('基础', getattr(p, stat)), ('装备加成', self.equip[stat]),
+                ('丹药加成', pill), ('临时BUFF', temp_flat)]
+        if stat == 'attack':
+            flat.append(('军衔加成', p.rank_attack))
+        flat.append(('称号加成', self.title.get(stat, 0)))
+        if stat == 'attack':
+            from services.social_service import SocialService
+            flat.append(('配偶在线', SocialService.get_online_relation_attack_bonus(p)))
+        flat.append(('军团技能', self.legion_skills.get(stat, 0)))
+        if stat != 'max_mana':
+            flat.append(('军团VIP光环', self.legion_aura.get(stat, 0)))
+        flat += [('领地加成', self.territory.get(stat, 0)),
+                 ('被动技能', self.passive.get(stat, 0)),
+                 ('副将加成', lt)]
+        rate = [('临时BUFF', temp_rate), ('红颜/知己', self.social_rate),
+                ('结婚加成', self.spouse_rate), ('VIP加成', VipService.get_stat_bonus_rate(p))]
+        if stat in ('attack', 'defense'):
+            rate.append(('组队加成', PartyService.get_party_bonus_rate(p)))
+        return flat, rate
+
+    def get(self, stat):
+        flat, rate = self._parts(stat)
+        flat_sum = sum(v for _, v in flat)
+        if stat in ('crit_rate', 'dodge_rate'):
+            return flat_sum
+        return int(flat_sum * (1 + sum(v for _, v in rate)))
+
+    def breakdown(self, stat):
+        """单项属性的计算明细（工作台查看玩家用）。"""
+        flat, rate = self._parts(stat)
+        flat_sum = sum(v for _, v in flat)
+        rate_sum = 1 + sum(v for _, v in rate)
+        if stat in ('crit_rate', 'dodge_rate'):
+            result = round(flat_sum, 4)
+        else:
+            result = int(flat_sum * rate_sum)
+        return {
+            'name': self.STAT_LABELS[stat],
+            'flat_parts': flat,
+            'rate_parts': rate,
+            'flat_sum': flat_sum,
+            'rate_sum': rate_sum,
+            'result': result,
+        }
+
@@ -1,6 +1,120 @@
 import json
+import threading
+from collections import deque
 from services import db
-from models.player import PlayerModel
+from services.shared_state import SharedState
+from services.unit_of_work import UnitOfWork
+from models.player import PlayerModel, ChatMessage
+
+CHAT_NAMESPACE = 'chat'  # {'latest_id': 已提交的最大总线消息 id}，多 worker 时用来发现别的 worker 的消息
+
+
+class ChatEntry:
+    """总线里的一条消息：发送者昵称已解析，读取时不再回表。"""
+    __slots__ = ('id', 'message_id', 'message_type', 'content', 'sender_id',
+                 'receiver_id', 'username', 'created_at')
+
+    def __init__(self, seq, msg, username):
+        self.id = seq
+        self.message_id = msg.id
+        self.message_type = msg.message_type
+        self.content = msg.content
+        self.sender_id = msg.sender_id
+        self.receiver_id = msg.receiver_id
+        self.username = username or ""
+        self.created_at = msg.created_at
+
+
+class ChatBus:
+    """进程内系统/公共消息环形缓冲（全服广播总线）。
+
+    写消息的地方（DataService.broadcast_system/broadcast_player、
+    SocialService.send_public_message）在提交后 publish；读者按游标取
+    「游标之后」的 k 条，倒序扫描 O(k)，不再每次页面访问都查最新 200 条并逐条懒加载发送者。
+
+    序号单调递增且不小于消息主键：启动时从库里预热最近消息（序号即主键），
+    之后每条取 max(上一序号+1, 主键)，因此旧游标（存的是主键）依然有效，
+    并发提交时后到的小主键消息也不会被已前移的游标跳过。
+
+    多 worker（共享后端为 sqlite）时各 worker 的序号必须一致（玩家的游标可能在任一 worker 上用），
+    因此改为序号即主键、消息一律从库里拉取：publish 只把 CHAT_NAMESPACE 的 latest_id 推到该消息 id，
+    since 发现 latest_id 超过本进程已拉到的 id 时按 id 升序拉取新消息。SQLite 写事务串行，
+    主键按提交顺序递增，按 id 拉取不会漏掉后提交的小主键消息。
+    """
+    CAPACITY = 256
+    TYPES = ('system', 'public', 'player')
+
+    _lock = threading.Lock()
+    _buffer = deque(maxlen=CAPACITY)
+    _last_seq = 0
+    _warm_max_id = None  # 预热时库里的最大消息 id；None 表示尚未预热
+    _pull_lock = threading.Lock()
+
+    @classmethod
+    def _ensure_loaded(cls):
+        if cls._warm_max_id is not None:
+            return
+        rows = ChatMessage.query.options(db.joinedload(ChatMessage.sender)).filter(
+            ChatMessage.message_type.in_(cls.TYPES)
+        ).order_by(ChatMessage.id.desc()).limit(cls.CAPACITY).all()
+        max_id = db.session.query(db.func.max(ChatMessage.id)).scalar() or 0
+        with cls._lock:
+            if cls._warm_max_id is not None:
+                return
+            for msg in reversed(rows):
+                cls._buffer.append(ChatEntry(msg.id, msg, msg.sender.nickname if msg.sender else ""))
+            cls._last_seq = max(cls._last_seq, max_id)
+            cls._warm_max_id = max_id
+
+    @classmethod
+    def publish(cls, msg, username=""):
+        """消息提交入库后调用，追加到总线。"""
+        if msg.message_type not in cls.TYPES:
+            return
+        cls._ensure_loaded()
+        if SharedState.is_shared():
+            SharedState.backend.update(CHAT_NAMESPACE, 'latest_id', lambda v: max(v or 0, msg.id))
+            return
+        with cls._lock:
+            if msg.id <= cls._warm_max_id:
+                return  # 预热时已从库里读到
+            cls._last_seq = max(cls._last_seq + 1, msg.id)
+            cls._buffer.append(ChatEntry(cls._last_seq, msg, username))
+
+    @classmethod
+    def since(cls, last_id, types=None, receiver_id=None, cutoff=None):
+        """游标之后的消息（按序号升序）。
+
+        receiver_id：只保留全服消息和发给该玩家的消息；cutoff：只保留此 UTC 时间之后的。
+        """
+        cls._ensure_loaded()
+        if SharedState.is_shared() and SharedState.backend.get(CHAT_NAMESPACE, 'latest_id', 0) > cls._last_seq:
+            cls._pull()
+        result = []
+        with cls._lock:
+            for entry in reversed(cls._buffer):
+                if entry.id <= last_id:
+                    break
+                result.append(entry)
+        result.reverse()
+        return [e for e in result
+                if (types is None or e.message_type in types)
+                and (e.receiver_id is None or e.receiver_id == receiver_id)
+                and (cutoff is None or (e.created_at and e.created_at >= cutoff))]
+
+
+    @classmethod
+    def _pull(cls):
+        """多 worker 时从库里拉取本进程已有最大 id 之后的消息（序号即主键）。"""
+        with cls._pull_lock:
+            rows = ChatMessage.query.options(db.joinedload(ChatMessage.sender)).filter(
+                ChatMessage.message_type.in_(cls.TYPES), ChatMessage.id > cls._last_seq
+            ).order_by(ChatMessage.id.desc()).limit(cls.CAPACITY).all()
+            with cls._lock:
+                for msg in reversed(rows):
+                    if msg.id > cls._last_seq:
+                        cls._buffer.append(ChatEntry(msg.id, msg, msg.sender.nickname if msg.sender else ""))
+                        cls._last_seq = msg.id
 
 
 class PublicChat:
@@ -20,15 +134,9 @@ class PublicChat:
         cls.add_message("", content, msg_type=msg_type)
 
     @classmethod
-    def _collect_new(cls, player):
-        """Collect new messages since last seen and add to pending.
-        Returns current pending list. Does NOT tick or save."""
-        from services.data_service import DataService
-        all_msgs = DataService.list_latest_messages(200)
-        all_msgs_asc = list(reversed(all_msgs))
-
-        last_seen_id = player.chat_refresh_count or 0
-        new_msgs = [m for m in all_msgs_asc if m.id > last_seen_id]
+    def _pending_with_new(cls, player):
+        """待显示列表 + 是否并入了新消息（不写库）。"""
+        new_msgs = ChatBus.since(player.chat_refresh_count or 0, types=('public',))
 
         # Read raw column directly to avoid property auto-parse
         raw = player.notifications_raw
@@ -38,18 +146,25 @@ class PublicChat:
         except (json.JSONDecodeError, TypeError):
             pending = []
 
+        for msg in new_msgs:
+            pending.append({
+                "type": msg.message_type,
+                "content": msg.content,
+                "username": msg.username if msg.message_type == 'player' else "",
+                "refreshes": 0,
+            })
         if new_msgs:
-            for msg in new_msgs:
-                pending.append({
-                    "type": msg.message_type,
-                    "content": msg.content,
-                    "username": msg.sender.nickname if msg.sender and msg.message_type == 'player' else "",
-                    "refreshes": 0,
-                })
             player.chat_refresh_count = new_msgs[-1].id
-            player.notifications_raw = json.dumps(pending, ensure_ascii=False)
-            db.session.commit()
+        return pending, bool(new_msgs)
 
+    @classmethod
+    def _collect_new(cls, player):
+        """Collect new messages since last seen and add to pending.
+        Returns current pending list. Does NOT tick; saves only when new messages arrived."""
+        pending, has_new = cls._pending_with_new(player)
+        if has_new:
+            player.notifications_raw = json.dumps(pending, ensure_ascii=False)
+            UnitOfWork.commit()
         return pending
 
     @classmethod
@@ -57,7 +172,7 @@ class PublicChat:
         """Get messages to display for this player.
         tick=True: page refresh, increment refresh counters, remove expired
         tick=False: AJAX poll, just return current pending without ticking"""
-        pending = cls._collect_new(player)
+        pending, has_new = cls._pending_with_new(player)
 
         if tick:
             display = []
@@ -67,11 +182,15 @@ class PublicChat:
                 if m["refreshes"] <= 3:
                     display.append(m)
                     kept.append(m)
-            player.notifications_raw = json.dumps(kept, ensure_ascii=False)
-            db.session.commit()
         else:
             display = list(pending)
+            kept = pending
+
+        # 只在有新消息或刷新计数确有变化时写库，且一次请求只提交一次
+        if has_new or (tick and pending):
+            player.notifications_raw = json.dumps(kept, ensure_ascii=False)
+            UnitOfWork.commit()
 
         system_msgs = [m for m in display if m["type"] == "system"]
         public_msgs = [m for m in display if m["type"] != "system"]
-        return system_msgs, public_msgs
\ No newline at end of file
+        return system_msgs, public_msgs
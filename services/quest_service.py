@@ -5,8 +5,6 @@ from services.data_service import DataService
 
 
 class QuestService:
-    _quests = None
-
     # 国家 -> 主线任务id前缀。主线任务按国家隔离,玩家只走本国任务链。
     # 魏=main_wei_xx, 吴=main_wu_xx, 蜀=main_shu_xx
     _COUNTRY_PREFIX = {'魏': 'main_wei_', '吴': 'main_wu_', '蜀': 'main_shu_'}
@@ -58,15 +56,8 @@ class QuestService:
 
     @classmethod
     def _load(cls):
-        if cls._quests is None:
-            import os
-            path = 'data/quests.json'
-            if os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as f:
-                    cls._quests = json.load(f)
-            else:
-                cls._quests = {}
-        return cls._quests
+        """data/quests.json，随静态配置由 DataService 载入。"""
+        return DataService.get_quests()
 
     @classmethod
     def get_quest(cls, quest_id):
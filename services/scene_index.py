@@ -0,0 +1,116 @@
+"""场景索引：加载配置时按场景预先分好怪物/NPC 列表，建好怪物→场景反查与出口邻接。
+
+原来 BattleService.start_pve 与 game.scene 每次调用都对场景里的每只怪物跑一串谓词
+（可击杀？精英？副本怪？劫匪？），WorldBossService 找怪物所在场景更要扫全部场景。
+这些只取决于静态配置，这里在 DataService._load_all_data 时一次性算好：
+
+- 每个场景一个 LocationScene：场景列表顺序的怪物与 NPC、随机遇怪池（常驻普通怪）、
+  共享血量的世界 BOSS、副本怪及其中的常驻普通副本怪；
+- 需要按玩家判断可见性的怪物（副本怪、一次性精英）单独放进 gated_ids，
+  只有这一小部分在请求时逐个过滤，其余直接随机取；
+- monster_id → 所在场景元组（配置顺序），区域 → 非副本场景元组（劫匪刷新点）；
+- 每个场景的出口 (方向, 目标场景) 元组，只保留目标存在的出口。
+
+索引整体构建后替换，读取无需加锁；工作台改动怪物配置后调用 DataService.rebuild_scene_index。
+"""
+
+
+class LocationScene:
+    """一个场景的预分区怪物/NPC 列表（均为 monster_id 元组，保持配置顺序）。"""
+    __slots__ = ('location_id', 'monster_ids', 'npc_ids', 'killable', 'gated_ids',
+                 'resident_normal_ids', 'resident_gated_ids', 'world_boss_ids',
+                 'copy_ids', 'persistent_copy_ids', 'exits')
+
+    def __init__(self, location_id):
+        self.location_id = location_id
+        self.monster_ids = ()          # 场景列表展示的怪物（配置中存在的）
+        self.npc_ids = ()
+        self.killable = frozenset()    # 可击杀的怪物
+        self.gated_ids = frozenset()   # 需按玩家判断可见性：副本怪、一次性精英
+        self.resident_normal_ids = ()  # 随机遇怪池：常驻普通怪（无需可见性判断）
+        self.resident_gated_ids = ()   # 随机遇怪池中需判断可见性的部分
+        self.world_boss_ids = frozenset()  # 共享血量、有复活倒计时的精英
+        self.copy_ids = ()
+        self.persistent_copy_ids = ()  # 副本地图内「继续遇怪」用的常驻普通副本怪
+        self.exits = ()                # ((方向, 目标场景 id), ...)
+
+    def is_available(self, monster_id, visible):
+        """monster_id 可在本场景挑战：可击杀，且（需要时）对玩家可见。visible 为 mid → bool。"""
+        if monster_id not in self.killable:
+            return False
+        return monster_id not in self.gated_ids or visible(monster_id)
+
+
+class SceneIndex:
+    EXIT_DIRECTIONS = ('north', 'south', 'east', 'west')
+    EMPTY = LocationScene(None)
+
+    def __init__(self, locations, monsters):
+        self._scenes = {}
+        monster_locations = {}
+        area_open_locations = {}
+        for location_id, loc in locations.items():
+            scene = self._scenes[location_id] = self._build_scene(location_id, loc, locations, monsters)
+            for mid in scene.monster_ids:
+                monster_locations.setdefault(mid, []).append(location_id)
+            if not loc.get('is_copy_map'):
+                area_open_locations.setdefault(loc.get('area_id'), []).append(location_id)
+        self._monster_locations = {mid: tuple(ids) for mid, ids in monster_locations.items()}
+        self._area_open_locations = {aid: tuple(ids) for aid, ids in area_open_locations.items()}
+
+    @classmethod
+    def _build_scene(cls, location_id, loc, locations, monsters):
+        scene = LocationScene(location_id)
+        monster_ids, killable, gated = [], set(), set()
+        resident, resident_gated, world_bosses, copies, persistent_copies = [], [], set(), [], []
+        for mid in loc.get('monsters', []):
+            md = monsters.get(mid)
+            if md is None:
+                continue
+            monster_ids.append(mid)
+            is_copy = bool(md.get('is_copy') or md.get('copy_only'))
+            is_one_time = bool(md.get('is_one_time_elite'))
+            if is_copy or is_one_time:
+                gated.add(mid)
+            if not md.get('killable', True):
+                continue
+            killable.add(mid)
+            if is_copy:
+                copies.append(mid)
+                if not md.get('is_elite') and not md.get('copy_final_boss') \
+                        and not md.get('despawn_after_defeat'):
+                    persistent_copies.append(mid)
+            elif md.get('is_elite') and not is_one_time:
+                world_bosses.add(mid)
+            # 随机遇怪只出常驻普通怪：排除精英/神兽（需点链接挑战）、副本怪、劫匪等刷新怪
+            if not (md.get('is_elite') or md.get('is_divine_beast') or is_copy
+                    or str(mid).startswith('bandit_') or md.get('is_bandit')):
+                (resident_gated if mid in gated else resident).append(mid)
+        scene.monster_ids = tuple(monster_ids)
+        scene.npc_ids = tuple(nid for nid in loc.get('npcs', []) if nid in monsters)
+        scene.killable = frozenset(killable)
+        scene.gated_ids = frozenset(gated)
+        scene.resident_normal_ids = tuple(resident)
+        scene.resident_gated_ids = tuple(resident_gated)
+        scene.world_boss_ids = frozenset(world_bosses)
+        scene.copy_ids = tuple(copies)
+        scene.persistent_copy_ids = tuple(persistent_copies)
+        exits = []
+        for direction in cls.EXIT_DIRECTIONS:
+            dest = loc.get(f'{direction}_exit') or (loc.get('exits') or {}).get(direction)
+            if dest and dest in locations:
+                exits.append((direction, dest))
+        scene.exits = tuple(exits)
+        return scene
+
+    def get(self, location_id):
+        """场景的 LocationScene；场景不存在时返回空场景 EMPTY。"""
+        return self._scenes.get(location_id, self.EMPTY)
+
+    def locations_of(self, monster_id):
+        """怪物出现的场景 id 元组（配置顺序）。"""
+        return self._monster_locations.get(monster_id, ())
+
+    def open_locations_in_area(self, area_id):
+        """区域内的非副本场景 id 元组。"""
+        return self._area_open_locations.get(area_id, ())
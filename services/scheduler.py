@@ -0,0 +1,224 @@
+"""进程内后台任务调度器：具名任务 + 固定间隔/每日定点触发 + 随机抖动。
+
+原先后台推进分散在几处：MaintenanceService 与 FinanceService 各起一个 60 秒死循环线程
+（异常一律 except: pass 吞掉），失物招领、战场、蛮夷入侵、集市过期则在页面路由里惰性推进，
+由恰好访问的玩家承担写事务。现统一登记到本调度器，由一个守护线程串行执行：
+
+- ``interval``  固定间隔（秒），按上次开始时间推算下一次，执行超时则结束后立即排下一次；
+- ``daily_at``  每日定点（'HH:MM'，本地时间），用于跨天重置一类任务；
+- ``jitter``    每次排期额外随机延后 0~jitter 秒，避免多个任务挤在同一秒；
+- ``budget``    单次耗时预算（秒），超出计一次 overrun；缺省取 interval。
+
+每个任务记录执行次数、失败次数、最近/最长/累计耗时与 overrun，异常连同 traceback 进入
+最近 ERROR_LOG_SIZE 条的内存日志，并追加写入 instance/scheduler_error.log；
+工作台「运行监控」页可查看并手动触发。
+
+多 worker 时每个进程都有调度线程，但只有持有 SharedState 租约 'scheduler' 的那个执行任务；
+持有者进程退出后租约过期（LEASE_TTL），由其他 worker 接手。只清理本进程内存的任务
+（per_process=True，如闲置战斗会话回收）不受租约限制，每个 worker 各自执行。
+gunicorn 下调度线程由 post_worker_init 在各 worker 内启动（见 gunicorn_config.py），
+fork 前 master 中启动的线程不会被子进程继承，因此 start() 按 pid 判断是否已启动。
+"""
+import os
+import random
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+
+
+class Job:
+    """一个具名任务的配置与运行统计。"""
+    __slots__ = ('name', 'func', 'interval', 'daily_at', 'jitter', 'budget', 'next_run',
+                 'running', 'runs', 'failures', 'overruns', 'last_started', 'last_duration',
+                 'max_duration', 'total_duration', 'last_error', 'per_process')
+
+    def __init__(self, name, func, interval=None, daily_at=None, jitter=0, budget=None,
+                 per_process=False):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.daily_at = daily_at
+        self.jitter = jitter
+        self.budget = budget or interval or 60
+        self.next_run = 0.0
+        self.running = False
+        self.runs = self.failures = self.overruns = 0
+        self.last_started = None
+        self.last_duration = self.max_duration = self.total_duration = 0.0
+        self.last_error = None
+        self.per_process = per_process
+
+    def schedule_next(self, started, finished):
+        if self.daily_at:
+            hour, minute = (int(x) for x in self.daily_at.split(':'))
+            now = datetime.fromtimestamp(finished)
+            at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if at <= now:
+                at += timedelta(days=1)
+            base = at.timestamp()
+        else:
+            base = max(started + self.interval, finished)
+        self.next_run = base + random.uniform(0, self.jitter)
+
+
+class Scheduler:
+    ERROR_LOG_SIZE = 50
+    MAX_SLEEP = 5.0  # 空闲时最长睡眠，新登记的任务最迟这么久后被发现
+    LEASE_NAME = 'scheduler'
+    LEASE_TTL = 120  # 秒；每轮循环续租，须长于单个任务的最长耗时
+
+    _lock = threading.Lock()
+    _wake = threading.Event()
+    _jobs = {}                              # {name: Job}，按登记顺序
+    _errors = deque(maxlen=ERROR_LOG_SIZE)  # [(时间, 任务名, traceback)]
+    _app = None
+    _thread = None
+    _pid = None
+
+    @classmethod
+    def register(cls, name, func, interval=None, daily_at=None, jitter=0, budget=None,
+                 run_at_start=True, per_process=False):
+        """登记任务；同名重复登记时覆盖配置、保留统计。
+
+        interval 与 daily_at 二选一。run_at_start=True 时启动后（抖动范围内）先执行一次，
+        否则等到第一个触发点。per_process=True 的任务只处理本进程内存，不必持有租约。
+        """
+        if (interval is None) == (daily_at is None):
+            raise ValueError("interval 与 daily_at 必须且只能指定一个")
+        job = Job(name, func, interval=interval, daily_at=daily_at, jitter=jitter, budget=budget,
+                  per_process=per_process)
+        now = time.time()
+        if run_at_start:
+            job.next_run = now + random.uniform(0, jitter)
+        else:
+            job.schedule_next(now, now)
+        with cls._lock:
+            old = cls._jobs.get(name)
+            if old is not None:
+                for attr in ('runs', 'failures', 'overruns', 'last_started', 'last_duration',
+                             'max_duration', 'total_duration', 'last_error'):
+                    setattr(job, attr, getattr(old, attr))
+            cls._jobs[name] = job
+        cls._wake.set()
+        return job
+
+    @classmethod
+    def start(cls, app):
+        """启动本进程的调度线程（同一进程内重复调用无副作用）。"""
+        with cls._lock:
+            if cls._thread is not None and cls._thread.is_alive() and cls._pid == os.getpid():
+                return
+            cls._app = app
+            cls._pid = os.getpid()
+            cls._thread = threading.Thread(target=cls._loop, name='game-scheduler', daemon=True)
+        cls._thread.start()
+
+    @classmethod
+    def _loop(cls):
+        while True:
+            cls._wake.clear()
+            now = time.time()
+            with cls._lock:
+                due = sorted((j for j in cls._jobs.values() if j.next_run <= now),
+                             key=lambda j: j.next_run)
+            if any(not j.per_process for j in due) and not cls._hold_lease():
+                # 其他 worker 在执行后台任务：共享任务保持到期状态，接手租约后再跑
+                for job in due:
+                    if job.per_process:
+                        cls._run(job)
+                cls._wake.wait(cls.MAX_SLEEP)
+                continue
+            for job in due:
+                cls._run(job)
+            with cls._lock:
+                upcoming = min((j.next_run for j in cls._jobs.values()), default=now + cls.MAX_SLEEP)
+            cls._wake.wait(min(cls.MAX_SLEEP, max(0.0, upcoming - time.time())))
+
+    @classmethod
+    def _hold_lease(cls):
+        from services.shared_state import SharedState
+        try:
+            return SharedState.backend.acquire_lease(cls.LEASE_NAME, SharedState.owner_id(),
+                                                     cls.LEASE_TTL)
+        except Exception as e:
+            cls._log_error('scheduler_lease', f"{type(e).__name__}: {e}")
+            return False
+
+    @classmethod
+    def _run(cls, job):
+        job.running = True
+        started = time.time()
+        job.last_started = datetime.fromtimestamp(started)
+        try:
+            with cls._app.app_context():
+                job.func()
+        except Exception as e:
+            job.failures += 1
+            job.last_error = f"{type(e).__name__}: {e}"
+            cls._log_error(job.name, "".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        finally:
+            finished = time.time()
+            duration = finished - started
+            job.running = False
+            job.runs += 1
+            job.last_duration = duration
+            job.max_duration = max(job.max_duration, duration)
+            job.total_duration += duration
+            if duration > job.budget:
+                job.overruns += 1
+            job.schedule_next(started, finished)
+
+    @classmethod
+    def _log_error(cls, name, trace):
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        with cls._lock:
+            cls._errors.append((stamp, name, trace))
+        try:
+            log_dir = Path(cls._app.instance_path)
+            log_dir.mkdir(parents=True, exist_ok=True)
+            with open(log_dir / "scheduler_error.log", "a", encoding="utf-8") as f:
+                f.write(f"\n===== {name} @ {stamp} =====\n{trace}\n")
+        except Exception:
+            pass  # 落盘失败不影响内存日志
+
+    @classmethod
+    def trigger(cls, name):
+        """让任务尽快执行一次（工作台手动触发）。返回任务是否存在。"""
+        with cls._lock:
+            job = cls._jobs.get(name)
+            if job is None:
+                return False
+            job.next_run = 0.0
+        cls._wake.set()
+        return True
+
+    @classmethod
+    def get_metrics(cls):
+        """各任务配置与运行统计，供工作台运行监控页展示。"""
+        with cls._lock:
+            jobs = list(cls._jobs.values())
+        return [{
+            'name': j.name,
+            'trigger': (f"每日 {j.daily_at}" if j.daily_at else f"每 {j.interval} 秒")
+                       + ("（每个 worker）" if j.per_process else ""),
+            'jitter': j.jitter,
+            'running': j.running,
+            'runs': j.runs,
+            'failures': j.failures,
+            'overruns': j.overruns,
+            'last_started': j.last_started,
+            'last_duration': j.last_duration,
+            'max_duration': j.max_duration,
+            'avg_duration': j.total_duration / j.runs if j.runs else 0.0,
+            'next_run': datetime.fromtimestamp(j.next_run) if j.next_run else None,
+            'last_error': j.last_error,
+        } for j in jobs]
+
+    @classmethod
+    def get_errors(cls):
+        """最近的任务异常，新的在前。"""
+        with cls._lock:
+            return list(reversed(cls._errors))
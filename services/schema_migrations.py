@@ -0,0 +1,254 @@
+"""带版本号的库结构迁移：schema_version 表记录已执行的迁移，启动时只执行尚未执行的。
+
+原来每次 create_app 都要把几十条 ALTER TABLE ... ADD COLUMN 各自包进 try/except 执行一遍
+（列已存在就报错回滚），再给没有 player_uid 的玩家逐个随机生成、每生成一个查一次是否重复。
+库越老、玩家越多，worker 启动越慢，而 gunicorn 超时杀 worker 后每次重启都要再来一遍。
+
+这里把这些改动整理成按版本编号的迁移（MIGRATIONS）：
+
+- 已执行到最新版本时，启动只读一次 schema_version 就返回；
+- 有待执行的迁移时，在一个事务里（SQLite 用 BEGIN IMMEDIATE，多进程同时启动时后到者等前者
+  提交后看到的已是新版本）依次执行并记下版本，任何一步失败整体回滚，下次启动重试；
+- 旧库已有的列/索引不再靠报错判断：每张表 PRAGMA table_info 一次，只补缺的列。
+  因此老库从任意历史状态升上来、新库（create_all 已建全）直接记版本，结果都一样。
+
+以后改表结构：在 MIGRATIONS 末尾追加一条（版本号递增），不要改已发布的迁移。
+迁移语句按 SQLite 写（PRAGMA table_info、BEGIN IMMEDIATE），与项目使用的数据库一致。
+"""
+import random
+import string
+import time
+
+
+def _columns(conn, table):
+    """表的现有列名集合；表不存在时为空集合。"""
+    rows = conn.exec_driver_sql(f'PRAGMA table_info("{table}")').fetchall()
+    return {row[1] for row in rows}
+
+
+def _add_columns(conn, table, columns):
+    """给表补上缺的列（已存在的跳过），返回实际补上的列名。表不存在时跳过（create_all 会建全）。"""
+    existing = _columns(conn, table)
+    if not existing:
+        return []
+    added = []
+    for name, ddl in columns:
+        if name not in existing:
+            conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}')
+            added.append(name)
+    return added
+
+
+# ---- 迁移 ----
+
+def _rebuild_barbarian_tables(conn):
+    """蛮夷入侵（南蛮/北夷）：旧版单阵营表（无 side 列）整表重建。"""
+    from models.barbarian import BarbarianInvasion, BarbarianLeader
+    inv_cols, lead_cols = _columns(conn, 'barbarian_invasion'), _columns(conn, 'barbarian_leaders')
+    if 'side' in inv_cols and 'side' in lead_cols:
+        return
+    conn.exec_driver_sql('DROP TABLE IF EXISTS barbarian_leaders')
+    conn.exec_driver_sql('DROP TABLE IF EXISTS barbarian_invasion')
+    BarbarianInvasion.__table__.create(conn)
+    BarbarianLeader.__table__.create(conn)
+
+
+LEGACY_COLUMNS = {
+    # 蛮夷首领落点
+    'barbarian_leaders': (
+        ('location_id', 'VARCHAR(80)'),
+    ),
+    # 多窗口 SSO（旧表只有 player_id/token/updated_at）
+    'active_session': (
+        ('active_sid', 'VARCHAR(16)'),
+        ('tokens', 'TEXT'),
+    ),
+    'players': (
+        ('player_uid', 'VARCHAR(10)'),
+        ('is_designer', 'BOOLEAN DEFAULT 0'),
+        ('last_hp_delta', 'INTEGER DEFAULT 0'),   # 战斗界面生命/魔法净变化
+        ('last_mp_delta', 'INTEGER DEFAULT 0'),
+        ('warehouse_gold', 'INTEGER DEFAULT 0'),
+        ('backpack_capacity', 'INTEGER DEFAULT 20'),
+        ('warehouse_capacity', 'INTEGER DEFAULT 20'),
+        ('in_battlefield', 'BOOLEAN DEFAULT 0'),
+        ('battlefield_city', 'VARCHAR(32)'),
+        ('battlefield_death_time', 'FLOAT DEFAULT 0.0'),
+        ('battlefield_target_id', 'INTEGER'),
+        ('party_id', 'INTEGER'),
+        ('item_usage_raw', "TEXT DEFAULT '{}'"),
+        ('dungeon_clears_raw', "TEXT DEFAULT '{}'"),
+        ('tower_max_floor', 'INTEGER DEFAULT 0'),
+        ('boss_kills_raw', "TEXT DEFAULT '{}'"),
+        ('pk_loss_count', 'INTEGER DEFAULT 0'),
+        ('finance_data', "TEXT DEFAULT '{}'"),
+        ('elite_kills_by_area_raw', "TEXT DEFAULT '{}'"),
+        ('monster_kills_raw', "TEXT DEFAULT '{}'"),
+        ('divine_beast_kills', 'INTEGER DEFAULT 0'),
+        ('forge_count', 'INTEGER DEFAULT 0'),
+        ('enhance_success_count', 'INTEGER DEFAULT 0'),
+        ('enhance_fail_count', 'INTEGER DEFAULT 0'),
+        ('enhance_50_count', 'INTEGER DEFAULT 0'),
+        ('enhance_luck_small', 'BOOLEAN DEFAULT 0'),
+        ('enhance_luck_medium', 'BOOLEAN DEFAULT 0'),
+        ('yuanbao_spent', 'INTEGER DEFAULT 0'),
+        ('jinzu_spent', 'INTEGER DEFAULT 0'),
+        ('forum_interaction_notify', 'BOOLEAN DEFAULT 1'),
+    ),
+    'lieutenant': (
+        ('tier', 'INTEGER DEFAULT 3'),
+        # 副将自定义基础属性（工作台副将设计）：可空，未设则走公式
+        ('base_max_health', 'INTEGER'),
+        ('base_max_mana', 'INTEGER'),
+        ('base_attack', 'INTEGER'),
+        ('base_defense', 'INTEGER'),
+        ('base_crit_rate', 'FLOAT'),
+        ('base_dodge_rate', 'FLOAT'),
+        ('is_design_only', 'BOOLEAN DEFAULT 0'),  # 工作台创建的副将只在设计区可见
+    ),
+    'legions': (
+        ('battle_points', 'INTEGER DEFAULT 0'),
+        ('occupied_cities_raw', "TEXT DEFAULT '[]'"),
+    ),
+    'legion_members': (
+        ('quest_count', 'INTEGER DEFAULT 0'),
+        ('quest_date', "VARCHAR(10) DEFAULT ''"),
+        ('personal_battle_points', 'INTEGER DEFAULT 0'),
+    ),
+    'equipment_instances': (
+        ('created_by', 'VARCHAR(64)'),
+        ('created_at', 'DATETIME'),
+    ),
+}
+
+
+def _legacy_columns(conn):
+    """历年 create_app 里 try/except ALTER 补的列，一次补齐。"""
+    for table, columns in LEGACY_COLUMNS.items():
+        _add_columns(conn, table, columns)
+    # 国家频道消息冗余国家列：新补列时按发送者当前国家回填旧消息
+    if _add_columns(conn, 'chat_messages', (('country', 'VARCHAR(10)'),)):
+        conn.exec_driver_sql(
+            "UPDATE chat_messages SET country = (SELECT country FROM players "
+            "WHERE players.id = chat_messages.sender_id) "
+            "WHERE message_type = 'country' AND country IS NULL")
+
+
+def _legacy_indexes(conn):
+    """create_all 不会给已有表补的索引。"""
+    for ddl in (
+        # 按玩家取背包装备
+        "CREATE INDEX IF NOT EXISTS ix_equipment_instances_player ON equipment_instances (player_id)",
+        # 频道消息分页
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_type_country_created "
+        "ON chat_messages (message_type, country, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_receiver_created "
+        "ON chat_messages (receiver_id, created_at)",
+        # 寄售列表
+        "CREATE INDEX IF NOT EXISTS ix_market_status_category_expires_created "
+        "ON market_listings (status, category, expires_at, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_market_status_expires_created "
+        "ON market_listings (status, expires_at, created_at)",
+    ):
+        conn.exec_driver_sql(ddl)
+
+
+def _version_columns(conn):
+    """乐观锁 version 列（version_id_col）：旧库补列；players.version 的 NULL 补 0，
+    否则 UPDATE ... WHERE version = NULL 永远匹配不到行。"""
+    for table in ('equipment_instances', 'market_listings', 'legion_members'):
+        _add_columns(conn, table, (('version', 'INTEGER NOT NULL DEFAULT 0'),))
+    if 'version' in _columns(conn, 'players'):
+        conn.exec_driver_sql("UPDATE players SET version = 0 WHERE version IS NULL")
+
+
+def _backfill_player_uids(conn):
+    """为没有 player_uid 的旧玩家生成 UID：已有 UID 一次读进集合，在内存里查重，批量写回。"""
+    missing = [row[0] for row in conn.exec_driver_sql(
+        "SELECT id FROM players WHERE player_uid IS NULL").fetchall()]
+    if not missing:
+        return
+    taken = {row[0] for row in conn.exec_driver_sql(
+        "SELECT player_uid FROM players WHERE player_uid IS NOT NULL").fetchall()}
+    alphabet = string.digits + string.ascii_lowercase
+    params = []
+    for player_id in missing:
+        while True:
+            uid = ''.join(random.choices(alphabet, k=10))
+            if uid not in taken:
+                break
+        taken.add(uid)
+        params.append((uid, player_id))
+    conn.exec_driver_sql("UPDATE players SET player_uid = ? WHERE id = ?", params)
+
+
+# (版本, 名称, 函数(conn))。只追加，不修改已发布的条目。
+MIGRATIONS = (
+    (1, 'rebuild_barbarian_tables', _rebuild_barbarian_tables),
+    (2, 'legacy_columns', _legacy_columns),
+    (3, 'legacy_indexes', _legacy_indexes),
+    (4, 'version_columns', _version_columns),
+    (5, 'backfill_player_uids', _backfill_player_uids),
+)
+
+
+class SchemaMigrations:
+    _report = None  # 最近一次执行结果，见 get_report
+
+    @classmethod
+    def latest_version(cls):
+        return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+    @staticmethod
+    def _current_version(conn):
+        """已执行到的版本；schema_version 表不存在时为 0。"""
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'").fetchone()
+        if not exists:
+            return 0
+        return conn.exec_driver_sql("SELECT MAX(version) FROM schema_version").scalar() or 0
+
+    @classmethod
+    def run(cls, app):
+        """db.create_all 之后调用：执行尚未执行的迁移（同一事务），返回本次执行的版本列表。"""
+        from services import db
+        started = time.perf_counter()
+        latest = cls.latest_version()
+        applied = []
+        with db.engine.connect() as conn:
+            current = cls._current_version(conn)
+            conn.rollback()
+            if current < latest:
+                # pysqlite 默认不为 DDL 开事务，这里显式 BEGIN IMMEDIATE：DDL 与数据修补同进同退，
+                # 并先拿到写锁再读版本，避免两个进程同时执行同一批迁移
+                conn.exec_driver_sql('BEGIN IMMEDIATE')
+                try:
+                    current = cls._current_version(conn)
+                    conn.exec_driver_sql(
+                        "CREATE TABLE IF NOT EXISTS schema_version ("
+                        "version INTEGER PRIMARY KEY, name VARCHAR(64) NOT NULL, applied_at FLOAT NOT NULL)")
+                    for version, name, migrate in MIGRATIONS:
+                        if version <= current:
+                            continue
+                        migrate(conn)
+                        conn.exec_driver_sql(
+                            "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                            (version, name, time.time()))
+                        applied.append(version)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        cls._report = {
+            'version': applied[-1] if applied else current,
+            'latest': latest,
+            'applied': [name for version, name, _ in MIGRATIONS if version in applied],
+            'seconds': time.perf_counter() - started,
+        }
+        if applied:
+            app.logger.warning("库结构迁移：已执行 %s", ', '.join(cls._report['applied']))
+        return applied
+
+    @classmethod
+    def get_report(cls):
+        return cls._report
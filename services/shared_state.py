@@ -0,0 +1,336 @@
+"""跨进程共享的游戏运行态：可插拔的键值存储后端。
+
+世界 BOSS 血量、地面物品、在线玩家、劫匪、战场城池、股市行情与委托簿、组队这些状态原先都是各服务的类级 dict，
+只在单个进程内唯一，gunicorn 因此只能开 1 个 worker（多 worker 下 BOSS 会被各进程各杀一次）。
+现在这些服务统一通过 SharedState.backend 读写，后端二选一（配置 SHARED_STATE_BACKEND）：
+
+- ``memory``：InProcessBackend，进程内 dict，值按引用保存、不做序列化，即原有行为（默认）；
+- ``sqlite``：SQLiteBackend，独立的 WAL 模式 SQLite 文件（SHARED_STATE_PATH），
+  值经命名空间编解码器转成 JSON，同机多个 worker 共用一份状态。
+
+接口按 (namespace, key) 寻址，写操作只有三种：
+- ``set/delete`` 覆盖写；
+- ``update(ns, key, func)`` 原子读改写：func 收到当前值（无则 default）返回新值，
+  返回 DELETE 表示删除。memory 后端按键分条加锁，sqlite 后端在 BEGIN IMMEDIATE 事务里执行，
+  跨进程同样只有一个写者——击杀判定等「只能有一个赢家」的转移都走这里；
+- ``compare_and_set(ns, key, version, value)`` 按版本号比较交换（version 由 get_versioned 取得）。
+
+此外还有 generation 计数器（SharedState.bump/generation）：进程内缓存（属性加成、排行榜、
+集市搜索、公聊总线）在写入提交后递增对应计数器，别的 worker 读缓存前比对计数器，变了就丢弃或重建。
+sqlite 后端下可以开多个 gunicorn worker（见 gunicorn_config.py）。
+
+注意：memory 后端 get 返回的是存储中的对象本身，调用方只能在 update 的 func 里修改它，
+否则换成 sqlite 后端后修改不会落地。
+"""
+import abc
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+DELETE = object()  # update 的 func 返回它表示删除该键
+GENERATION_NAMESPACE = 'generation'  # {名称: int}，见 SharedState.bump/generation
+
+
+class SharedStateBackend(abc.ABC):
+    """后端接口。值须能被该命名空间的编解码器转为 JSON（memory 后端不做转换）。"""
+
+    @abc.abstractmethod
+    def get(self, namespace, key, default=None):
+        """当前值；键不存在时返回 default。"""
+
+    @abc.abstractmethod
+    def get_versioned(self, namespace, key):
+        """返回 (值, 版本号)；键不存在时为 (None, 0)。"""
+
+    @abc.abstractmethod
+    def version(self, namespace, key):
+        """只取版本号（键不存在为 0），不解码值；用于判断本地副本是否过期。"""
+
+    @abc.abstractmethod
+    def items(self, namespace):
+        """命名空间下全部 {key: value}。"""
+
+    @abc.abstractmethod
+    def set(self, namespace, key, value):
+        """覆盖写。"""
+
+    @abc.abstractmethod
+    def delete(self, namespace, key):
+        """删除键（不存在时无操作）。"""
+
+    @abc.abstractmethod
+    def update(self, namespace, key, func, default=None):
+        """原子读改写，返回写入后的值（删除时返回 None）。"""
+
+    @abc.abstractmethod
+    def compare_and_set(self, namespace, key, version, value):
+        """当前版本等于 version（键不存在为 0）时写入并返回 True，否则返回 False。"""
+
+    def acquire_lease(self, name, owner, ttl):
+        """租约：owner 持有或租约已过期时续/抢占 ttl 秒并返回 True。用于多 worker 间选出唯一执行者。"""
+        now = time.time()
+        won = []
+
+        def _take(lease):
+            if lease and lease['owner'] != owner and lease['expires'] > now:
+                return lease
+            won.append(True)
+            return {'owner': owner, 'expires': now + ttl}
+
+        self.update('lease', name, _take)
+        return bool(won)
+
+
+class InProcessBackend(SharedStateBackend):
+    """进程内 dict：值按引用保存，update 按 (namespace, key) 分条加锁。"""
+    LOCK_STRIPES = 16
+
+    def __init__(self):
+        self._data = {}      # {namespace: {key: value}}
+        self._versions = {}  # {(namespace, key): version}
+        self._stripes = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+    def _lock(self, namespace, key):
+        return self._stripes[hash((namespace, key)) % self.LOCK_STRIPES]
+
+    def get(self, namespace, key, default=None):
+        return self._data.get(namespace, {}).get(key, default)
+
+    def get_versioned(self, namespace, key):
+        with self._lock(namespace, key):
+            return self._data.get(namespace, {}).get(key), self._versions.get((namespace, key), 0)
+
+    def version(self, namespace, key):
+        return self._versions.get((namespace, key), 0)
+
+    def items(self, namespace):
+        return dict(self._data.get(namespace, {}))
+
+    def _store(self, namespace, key, value):
+        if value is DELETE:
+            self._data.get(namespace, {}).pop(key, None)
+            self._versions.pop((namespace, key), None)
+            return None
+        self._data.setdefault(namespace, {})[key] = value
+        self._versions[(namespace, key)] = self._versions.get((namespace, key), 0) + 1
+        return value
+
+    def set(self, namespace, key, value):
+        with self._lock(namespace, key):
+            self._store(namespace, key, value)
+
+    def delete(self, namespace, key):
+        with self._lock(namespace, key):
+            self._store(namespace, key, DELETE)
+
+    def update(self, namespace, key, func, default=None):
+        with self._lock(namespace, key):
+            return self._store(namespace, key, func(self._data.get(namespace, {}).get(key, default)))
+
+    def compare_and_set(self, namespace, key, version, value):
+        with self._lock(namespace, key):
+            if self._versions.get((namespace, key), 0) != version:
+                return False
+            self._store(namespace, key, value)
+            return True
+
+
+class SQLiteBackend(SharedStateBackend):
+    """WAL 模式 SQLite 文件：每线程一个连接，写操作在 BEGIN IMMEDIATE 事务内完成。"""
+    BUSY_TIMEOUT = 30  # 秒
+
+    def __init__(self, path, codecs):
+        self._path = str(path)
+        self._codecs = codecs
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " version INTEGER NOT NULL, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+
+    def _conn(self):
+        # preload_app 时主进程建的连接不能带进 fork 出的 worker，按 pid 区分
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=self.BUSY_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _encode(self, namespace, value):
+        encode = self._codecs.get(namespace, (None, None))[0]
+        return json.dumps(encode(value) if encode else value, ensure_ascii=False)
+
+    def _decode(self, namespace, text):
+        if text is None:
+            return None
+        decode = self._codecs.get(namespace, (None, None))[1]
+        value = json.loads(text)
+        return decode(value) if decode else value
+
+    def get(self, namespace, key, default=None):
+        row = self._conn().execute(
+            "SELECT value FROM shared_state WHERE namespace = ? AND key = ?",
+            (namespace, json.dumps(key))).fetchone()
+        return self._decode(namespace, row[0]) if row else default
+
+    def get_versioned(self, namespace, key):
+        row = self._conn().execute(
+            "SELECT value, version FROM shared_state WHERE namespace = ? AND key = ?",
+            (namespace, json.dumps(key))).fetchone()
+        return (self._decode(namespace, row[0]), row[1]) if row else (None, 0)
+
+    def version(self, namespace, key):
+        row = self._conn().execute(
+            "SELECT version FROM shared_state WHERE namespace = ? AND key = ?",
+            (namespace, json.dumps(key))).fetchone()
+        return row[0] if row else 0
+
+    def items(self, namespace):
+        rows = self._conn().execute(
+            "SELECT key, value FROM shared_state WHERE namespace = ?", (namespace,)).fetchall()
+        return {json.loads(k): self._decode(namespace, v) for k, v in rows}
+
+    def _write(self, conn, namespace, key_text, value, version):
+        if value is DELETE:
+            conn.execute("DELETE FROM shared_state WHERE namespace = ? AND key = ?",
+                         (namespace, key_text))
+            return None
+        conn.execute(
+            "INSERT INTO shared_state (namespace, key, value, version, updated_at)"
+            " VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (namespace, key) DO UPDATE SET"
+            " value = excluded.value, version = excluded.version, updated_at = excluded.updated_at",
+            (namespace, key_text, self._encode(namespace, value), version + 1, time.time()))
+        return value
+
+    def _transaction(self, namespace, key, body):
+        """BEGIN IMMEDIATE 取得写锁后读出当前 (值, 版本)，交给 body 决定写入。"""
+        conn = self._conn()
+        key_text = json.dumps(key)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, version FROM shared_state WHERE namespace = ? AND key = ?",
+                (namespace, key_text)).fetchone()
+            current, version = (self._decode(namespace, row[0]), row[1]) if row else (None, 0)
+            result = body(conn, key_text, current, version)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def set(self, namespace, key, value):
+        self._transaction(namespace, key,
+                          lambda conn, k, cur, ver: self._write(conn, namespace, k, value, ver))
+
+    def delete(self, namespace, key):
+        self.set(namespace, key, DELETE)
+
+    def update(self, namespace, key, func, default=None):
+        def _body(conn, k, current, version):
+            new = func(current if current is not None else default)
+            return self._write(conn, namespace, k, new, version)
+        return self._transaction(namespace, key, _body)
+
+    def compare_and_set(self, namespace, key, version, value):
+        def _body(conn, k, current, current_version):
+            if current_version != version:
+                return False
+            self._write(conn, namespace, k, value, current_version)
+            return True
+        return self._transaction(namespace, key, _body)
+
+
+class SharedState:
+    """当前进程使用的后端；init_app 前为进程内后端。"""
+    backend = InProcessBackend()
+    _codecs = {}  # {namespace: (encode, decode)}
+
+    @staticmethod
+    def owner_id():
+        """本进程的租约持有者标识（fork 后各 worker 不同）。"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @classmethod
+    def is_shared(cls):
+        """后端是否跨进程共享；memory 后端只有本进程，进程内缓存无需跨进程失效。"""
+        return not isinstance(cls.backend, InProcessBackend)
+
+    @classmethod
+    def generation(cls, name):
+        """计数器当前值（从未递增过为 0）。"""
+        return cls.backend.get(GENERATION_NAMESPACE, name, 0)
+
+    @classmethod
+    def bump(cls, name):
+        """计数器原子加一，返回新值。"""
+        return cls.backend.update(GENERATION_NAMESPACE, name, lambda n: (n or 0) + 1)
+
+    @classmethod
+    def register_codec(cls, namespace, encode=None, decode=None):
+        """登记命名空间的 JSON 编解码（如把 set 转 list、把 int 键还原），仅 sqlite 后端使用。"""
+        cls._codecs[namespace] = (encode, decode)
+
+    @classmethod
+    def init_app(cls, app):
+        kind = app.config.get('SHARED_STATE_BACKEND', 'memory')
+        if kind == 'sqlite':
+            cls.backend = SQLiteBackend(app.config['SHARED_STATE_PATH'], cls._codecs)
+        elif kind == 'memory':
+            cls.backend = InProcessBackend()
+        else:
+            raise ValueError(f"未知的 SHARED_STATE_BACKEND：{kind}")
+
+
+class GenerationWatch:
+    """进程内缓存对一个 generation 计数器的跟踪，只在共享后端下生效（memory 后端全部是空操作）。
+
+    缓存重建前 mark(current()) 记下重建所依据的计数；写入提交后 bump()，若计数只比已知值大 1
+    （期间只有本进程的这次写入）则直接跟进，否则留待 stale() 发现。stale() 最多每 interval 秒
+    读一次后端，缓存因此最多滞后 interval 秒看到别的 worker 的写入。
+    """
+    __slots__ = ('name', 'interval', 'seen', 'checked_at', 'stale_hits')
+
+    def __init__(self, name, interval=0):
+        self.name = name
+        self.interval = interval
+        self.seen = None       # 本进程缓存对应的计数；None 表示尚未记录
+        self.checked_at = 0.0
+        self.stale_hits = 0    # 发现别的 worker 写入（缓存过期）的次数
+
+    def current(self):
+        return SharedState.generation(self.name) if SharedState.is_shared() else None
+
+    def mark(self, generation):
+        self.seen = generation
+        self.checked_at = time.time()
+
+    def bump(self):
+        if not SharedState.is_shared():
+            return
+        new = SharedState.bump(self.name)
+        if self.seen is not None and new == self.seen + 1:
+            self.seen = new
+
+    def stale(self):
+        if not SharedState.is_shared() or self.seen is None:
+            return False
+        now = time.time()
+        if now - self.checked_at < self.interval:
+            return False
+        self.checked_at = now
+        if SharedState.generation(self.name) == self.seen:
+            return False
+        self.stale_hits += 1
+        return True
@@ -1,5 +1,3 @@
-import json
-import os
 from services import db
 from services.data_service import DataService
 
@@ -7,14 +5,10 @@ from services.data_service import DataService
 class ShopService:
     """Shop service supporting reference-server-style multi-tab shops."""
 
-    _shops_cache = None
-
     @classmethod
     def _load_shops(cls):
-        if cls._shops_cache is None:
-            with open(os.path.join(os.path.dirname(__file__), '..', 'data', 'shops.json'), 'r', encoding='utf-8') as f:
-                cls._shops_cache = json.load(f)
-        return cls._shops_cache
+        """data/shops.json，随静态配置由 DataService 载入。"""
+        return DataService.get_shops()
 
     @classmethod
     def get_shop_data(cls, shop_id, tab=None, **kwargs):
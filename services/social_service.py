@@ -31,6 +31,24 @@ class SocialService:
         total = hongyan + zhiji
         return total * 0.01
 
+    @classmethod
+    def get_relation_bonus_rates(cls, player):
+        """一次查询同时算出红颜/知己加成率与结婚加成率，返回 (social_rate, spouse_rate)。
+
+        等价于 get_social_bonus_rate + get_spouse_bonus_rate，但只查一次 Relationship。
+        """
+        social_count = 0
+        spouse_id = None
+        for rel in Relationship.get_relationships(player.id):
+            if rel.rel_type in ('hongyan', 'zhiji'):
+                social_count += 1
+            elif rel.rel_type == 'spouse' and spouse_id is None:
+                spouse_id = rel.get_other_player_id(player.id)
+        spouse_rate = 0.0
+        if spouse_id is not None and PlayerModel.query.get(spouse_id):
+            spouse_rate = 0.05
+        return social_count * 0.01, spouse_rate
+
     @classmethod
     def send_public_message(cls, player, content):
         """Public chat - consumes 小喇叭 (horn_small)."""
@@ -49,6 +67,8 @@ class SocialService:
 
         player.chat_count = (player.chat_count or 0) + 1
         db.session.commit()
+        from services.public_chat import ChatBus
+        ChatBus.publish(msg, player.nickname)
 
         from services.achievement_service import AchievementService
         AchievementService.check(player, 'chat', player.chat_count)
@@ -60,7 +80,8 @@ class SocialService:
         msg = ChatMessage(
             sender_id=player.id,
             content=content,
-            message_type='country'
+            message_type='country',
+            country=player.country
         )
         db.session.add(msg)
 
@@ -150,13 +171,9 @@ class SocialService:
     @classmethod
     def get_country_messages(cls, country, limit=20):
         """Get country chat messages for a specific country."""
-        players = PlayerModel.query.filter_by(country=country).all()
-        player_ids = [p.id for p in players]
-        if not player_ids:
-            return []
         return ChatMessage.query.filter(
             ChatMessage.message_type == 'country',
-            ChatMessage.sender_id.in_(player_ids)
+            ChatMessage.country == country
         ).order_by(ChatMessage.created_at.desc()).limit(limit).all()
 
     @classmethod
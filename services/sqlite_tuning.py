@@ -0,0 +1,146 @@
+"""SQLite 连接调优：连接池选择 + 每个新连接执行的 PRAGMA + 启动自检。
+
+默认的回滚日志模式下，写事务提交期间所有读者都被挡住；而每个请求都有若干次提交，
+gthread 线程一多就互相排队，偶尔还会 database is locked。这里在 db.init_app 前后各做一步：
+
+- configure：按数据库 URI 调整 SQLALCHEMY_ENGINE_OPTIONS。文件库用 QueuePool，并去掉
+  pool_pre_ping / pool_recycle（本地文件连接不会被服务端断开，pre_ping 每次取连接多一条 SELECT 1）；
+  内存库（:memory:）用 StaticPool，所有线程共用同一连接，否则每个连接各是一个空库。
+- init_app：给引擎挂 connect 事件，新连接依次执行配置 SQLITE_PRAGMAS（journal_mode=WAL、
+  synchronous=NORMAL、busy_timeout、cache_size、mmap_size、temp_store=MEMORY）；
+  随后取一个连接读回各项实际值做自检，不一致（如网络盘上开不了 WAL）记 warning，
+  结果在工作台运行监控页展示。
+
+非 SQLite 数据库两步都不做任何事。读写并发对比见 scripts/bench_sqlite_tuning.py。
+"""
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, StaticPool
+
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -32000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+# PRAGMA 读回值的归一化：synchronous/temp_store 读回的是数字
+_READBACK = {
+    'synchronous': {'0': 'OFF', '1': 'NORMAL', '2': 'FULL', '3': 'EXTRA'},
+    'temp_store': {'0': 'DEFAULT', '1': 'FILE', '2': 'MEMORY'},
+}
+
+
+def is_sqlite(uri):
+    return str(uri).startswith('sqlite')
+
+
+def is_memory_db(uri):
+    uri = str(uri)
+    return uri in ('sqlite://', 'sqlite:///:memory:') or ':memory:' in uri or 'mode=memory' in uri
+
+
+def engine_options(uri, options):
+    """按数据库 URI 返回调整后的引擎参数（不修改传入的 dict）。"""
+    options = dict(options or {})
+    if not is_sqlite(uri):
+        return options
+    for key in ('pool_pre_ping', 'pool_recycle'):
+        options.pop(key, None)
+    if is_memory_db(uri):
+        for key in ('pool_size', 'max_overflow', 'pool_timeout'):
+            options.pop(key, None)
+        options['poolclass'] = StaticPool
+        connect_args = dict(options.get('connect_args') or {})
+        connect_args.setdefault('check_same_thread', False)
+        options['connect_args'] = connect_args
+    else:
+        options['poolclass'] = QueuePool
+    return options
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """在一个 DB-API 连接上依次执行 PRAGMA。"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def read_pragmas(dbapi_connection, names):
+    """读回 PRAGMA 当前值，统一成与配置可比的字符串。"""
+    cursor = dbapi_connection.cursor()
+    try:
+        result = {}
+        for name in names:
+            row = cursor.execute(f"PRAGMA {name}").fetchone()
+            value = str(row[0]) if row else ''
+            result[name] = _READBACK.get(name, {}).get(value, value)
+        return result
+    finally:
+        cursor.close()
+
+
+def install_pragmas(engine, pragmas):
+    """引擎每建一个新连接都执行 pragmas。"""
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+
+class SQLiteTuning:
+    _report = None  # 最近一次自检结果，见 self_check
+
+    @classmethod
+    def configure(cls, app):
+        """db.init_app 之前调用：改写 SQLALCHEMY_ENGINE_OPTIONS。"""
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+            app.config.get('SQLALCHEMY_DATABASE_URI', ''),
+            app.config.get('SQLALCHEMY_ENGINE_OPTIONS'))
+
+    @classmethod
+    def init_app(cls, app):
+        """db.init_app 之后调用：挂 PRAGMA 并自检。"""
+        from services import db
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+        if not is_sqlite(uri):
+            return
+        pragmas = dict(app.config.get('SQLITE_PRAGMAS') or DEFAULT_PRAGMAS)
+        if is_memory_db(uri):
+            pragmas.pop('journal_mode', None)  # 内存库只支持 memory 日志模式
+            pragmas.pop('mmap_size', None)
+        with app.app_context():
+            install_pragmas(db.engine, pragmas)
+            cls.self_check(app, db.engine, pragmas)
+
+    @classmethod
+    def self_check(cls, app, engine, pragmas):
+        """取一个连接读回各 PRAGMA，与配置不一致的记 warning。"""
+        import sqlite3
+        with engine.connect() as conn:
+            actual = read_pragmas(conn.connection.dbapi_connection, pragmas)
+        if not isinstance(engine.pool, StaticPool):
+            engine.dispose()  # 自检连接不留在池里，避免 preload 时被 fork 出的 worker 继承
+        rows = []
+        for name, expected in pragmas.items():
+            ok = str(expected).upper() == str(actual.get(name, '')).upper()
+            rows.append({'name': name, 'expected': expected, 'actual': actual.get(name), 'ok': ok})
+            if not ok:
+                app.logger.warning("SQLite PRAGMA %s 期望 %s，实际 %s", name, expected, actual.get(name))
+        pool = engine.pool
+        cls._report = {
+            'sqlite_version': sqlite3.sqlite_version,
+            'pool': type(pool).__name__,
+            'pool_size': pool.size() if hasattr(pool, 'size') else None,
+            'pragmas': rows,
+            'ok': all(r['ok'] for r in rows),
+        }
+        return cls._report
+
+    @classmethod
+    def get_report(cls):
+        return cls._report
@@ -0,0 +1,46 @@
+"""启动分段计时：create_app 各阶段耗时，启动结束写一行日志，并在工作台运行监控页展示。
+
+用法：create_app 开头 StartupTimer.start()，每个阶段结束处 StartupTimer.mark('阶段名')
+（记录的是距上一个 mark 的耗时），最后 StartupTimer.finish(app)。
+超过 SLOW_SECONDS 的启动记 warning（gunicorn 错误日志里可见），否则记 info。
+"""
+import time
+
+
+class StartupTimer:
+    SLOW_SECONDS = 1.0
+
+    _started = None
+    _last = None
+    _phases = []      # [(阶段名, 秒)]
+    _total = None
+
+    @classmethod
+    def start(cls):
+        cls._started = cls._last = time.perf_counter()
+        cls._phases = []
+        cls._total = None
+
+    @classmethod
+    def mark(cls, name):
+        if cls._started is None:
+            return
+        now = time.perf_counter()
+        cls._phases.append((name, now - cls._last))
+        cls._last = now
+
+    @classmethod
+    def finish(cls, app):
+        if cls._started is None:
+            return
+        cls._total = time.perf_counter() - cls._started
+        log = app.logger.warning if cls._total >= cls.SLOW_SECONDS else app.logger.info
+        log("启动耗时 %.3fs：%s", cls._total,
+            '，'.join(f'{name} {seconds:.3f}s' for name, seconds in cls._phases))
+
+    @classmethod
+    def get_report(cls):
+        return {
+            'total': cls._total,
+            'phases': [{'name': name, 'seconds': seconds} for name, seconds in cls._phases],
+        }
@@ -0,0 +1,304 @@
+"""玩家属性加成分量的进程级缓存（写穿透 + 按依赖失效）。
+
+EffectiveStats 每个请求汇总一次加成来源；本缓存让在线玩家的「慢变」分量跨请求常驻内存，
+最热的属性读路径退化为字典查找。缓存分量及其失效来源：
+
+- ``equip``      装备属性合计   ← EquipmentSlot.equipment_instance_id、EquipmentInstance 属性
+                                  （EquipmentService.equip/unequip/enhance）
+- ``passive``    被动技能加成   ← PlayerSkill 增删改（学习/升级技能）
+- ``title``      称号加成       ← PlayerModel.title_prefix_id/title_suffix_id/owned_titles_raw
+                                  （TitleService.set_title/grant_title）
+- ``lieutenant`` 出战副将被动   ← Lieutenant 出战/存活/等级/品质/技能等列
+                                  （LieutenantService.deploy/recall）
+- ``social``     红颜/知己/结婚 ← Relationship 增删改（SocialService.accept_marriage/divorce 等）
+- ``legion``     军团技能/光环/领地 ← LegionMember 增删改、Legion.level/occupied_cities_raw/vip_aura_*
+                                  （LegionService.upgrade_legion、BattlefieldService._set_city_owner）
+
+失效不靠在各业务方法里逐个手写调用，而是监听上述 ORM 列的赋值、新行挂入 session、
+flush 前的删除：任何写路径（含工作台直接改库）都会命中。写入当下立即失效一次，
+事务提交/回滚后再失效一次，避免其他线程在提交前把旧值重新载入缓存。
+临时BUFF 过期时间短、变化频繁，只进请求级快照，不进本缓存。
+
+多 worker（共享后端为 sqlite）时，提交后还会递增 SharedState 里该玩家（军团级失效为该军团）的
+generation 计数器；各 worker 每个请求首次读某玩家的缓存前比对计数器，变了就整体失效该玩家。
+"""
+import threading
+
+from services.shared_state import SharedState
+
+
+class StatCache:
+    COMPONENTS = ('equip', 'passive', 'title', 'lieutenant', 'social', 'legion')
+    MAX_PLAYERS = 2000  # 超出后整体清空重建（在线峰值 200-400 人，正常不会触发）
+
+    _entries = {}      # {player_id: {component: value}}
+    _generation = {}   # {player_id: int}，失效时递增，防止并发加载写回旧值
+    _legion_of = {}    # {player_id: legion_id}，军团级失效时反查成员
+    _lock = threading.Lock()
+    _remote_seen = {}  # {player_id: (玩家计数, 军团计数)}，本进程缓存对应的跨进程 generation
+    _hits = {}
+    _misses = {}
+    _invalidations = {}
+    _remote_invalidations = 0
+
+    @classmethod
+    def get(cls, player_id, component, loader, is_fresh=None):
+        """取缓存分量；未命中（或 is_fresh(value) 为假）时调用 loader() 计算并写回。"""
+        cls._check_remote(player_id)
+        with cls._lock:
+            entry = cls._entries.get(player_id)
+            if entry is not None and component in entry:
+                value = entry[component]
+                if is_fresh is None or is_fresh(value):
+                    cls._hits[component] = cls._hits.get(component, 0) + 1
+                    return value
+            cls._misses[component] = cls._misses.get(component, 0) + 1
+            gen = cls._generation.get(player_id, 0)
+        value = loader()
+        with cls._lock:
+            # 加载期间被失效过：本次结果可能基于旧数据，只返回不写回
+            if cls._generation.get(player_id, 0) != gen:
+                return value
+            if player_id not in cls._entries and len(cls._entries) >= cls.MAX_PLAYERS:
+                cls._entries.clear()
+                cls._legion_of.clear()
+            cls._entries.setdefault(player_id, {})[component] = value
+        return value
+
+    @classmethod
+    def remember_legion(cls, player_id, legion_id):
+        """记录玩家所属军团，供 invalidate_legion 反查。"""
+        with cls._lock:
+            if legion_id:
+                cls._legion_of[player_id] = legion_id
+            else:
+                cls._legion_of.pop(player_id, None)
+
+    @classmethod
+    def invalidate(cls, player_id, *components):
+        """失效某玩家的指定分量；不传 components 时失效全部。"""
+        if player_id is None:
+            return
+        with cls._lock:
+            cls._generation[player_id] = cls._generation.get(player_id, 0) + 1
+            entry = cls._entries.get(player_id)
+            for comp in components or cls.COMPONENTS:
+                cls._invalidations[comp] = cls._invalidations.get(comp, 0) + 1
+                if entry is not None:
+                    entry.pop(comp, None)
+
+    @classmethod
+    def invalidate_legion(cls, legion_id, *components):
+        """失效某军团全体（已缓存）成员的指定分量。"""
+        with cls._lock:
+            members = [pid for pid, lid in cls._legion_of.items() if lid == legion_id]
+        for pid in members:
+            cls.invalidate(pid, *components)
+
+    @staticmethod
+    def _player_key(player_id):
+        return f'stat_cache:{player_id}'
+
+    @staticmethod
+    def _legion_key(legion_id):
+        return f'stat_cache_legion:{legion_id}'
+
+    @classmethod
+    def _remote_generation(cls, player_id):
+        legion_id = cls._legion_of.get(player_id)
+        return (SharedState.generation(cls._player_key(player_id)),
+                SharedState.generation(cls._legion_key(legion_id)) if legion_id else 0)
+
+    @classmethod
+    def _check_remote(cls, player_id):
+        """别的 worker 提交过该玩家的相关改动则整体失效；请求内每个玩家只查一次后端。"""
+        if not SharedState.is_shared():
+            return
+        from flask import g, has_request_context
+        if has_request_context():
+            checked = g.setdefault('_stat_cache_checked', set())
+            if player_id in checked:
+                return
+            checked.add(player_id)
+        current = cls._remote_generation(player_id)
+        with cls._lock:
+            seen = cls._remote_seen.get(player_id)
+            cls._remote_seen[player_id] = current
+            if seen is not None and seen != current:
+                cls._remote_invalidations += 1
+        if seen != current:
+            cls.invalidate(player_id)
+
+    @classmethod
+    def publish(cls, player_ids, legion_ids):
+        """事务提交后调用：递增这些玩家/军团的跨进程计数器，通知其他 worker 失效。"""
+        if not SharedState.is_shared():
+            return
+        for pid in player_ids:
+            new = SharedState.bump(cls._player_key(pid))
+            with cls._lock:
+                seen = cls._remote_seen.get(pid)
+                # 期间只有本进程这一次写入：本地已失效过，直接跟进，免得下个请求再失效一次
+                if seen is not None and seen[0] + 1 == new:
+                    cls._remote_seen[pid] = (new, seen[1])
+        for legion_id in legion_ids:
+            new = SharedState.bump(cls._legion_key(legion_id))
+            with cls._lock:
+                for pid, lid in cls._legion_of.items():
+                    seen = cls._remote_seen.get(pid)
+                    if lid == legion_id and seen is not None and seen[1] + 1 == new:
+                        cls._remote_seen[pid] = (seen[0], new)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            for pid in cls._entries:
+                cls._generation[pid] = cls._generation.get(pid, 0) + 1
+            cls._entries.clear()
+            cls._legion_of.clear()
+
+    @classmethod
+    def get_metrics(cls):
+        """命中/未命中/失效计数，供工作台运行监控页核对缓存效果。"""
+        with cls._lock:
+            rows = []
+            for comp in cls.COMPONENTS:
+                hits = cls._hits.get(comp, 0)
+                misses = cls._misses.get(comp, 0)
+                total = hits + misses
+                rows.append({
+                    'component': comp,
+                    'hits': hits,
+                    'misses': misses,
+                    'invalidations': cls._invalidations.get(comp, 0),
+                    'hit_rate': hits / total if total else 0.0,
+                })
+            return {'players': len(cls._entries), 'components': rows,
+                    'remote_invalidations': cls._remote_invalidations}
+
+
+# --- 依赖登记：ORM 列 → (缓存分量, 受影响玩家) ---
+
+def _owner_ids(*attrs):
+    def _ids(target, value=None, oldvalue=None, key=None):
+        ids = [getattr(target, a, None) for a in attrs]
+        # 归属列本身被改时，新旧两位主人都受影响
+        if key in attrs and isinstance(oldvalue, int):
+            ids.append(oldvalue)
+        return [i for i in ids if i is not None]
+    return _ids
+
+
+def _dependencies():
+    from models.player import PlayerModel, EquipmentInstance, EquipmentSlot, PlayerSkill, TempEffect
+    from models.lieutenant import Lieutenant
+    from models.legion import Legion, LegionMember
+    from models.relationship import Relationship
+    # model: (component, watched columns, 受影响玩家 id 解析)
+    # component 为 None：只影响请求级快照；'legion*'：按军团整体失效
+    return {
+        EquipmentSlot: ('equip', ('equipment_instance_id',), _owner_ids('player_id')),
+        EquipmentInstance: ('equip', ('base_stats', 'extra_stats', 'player_id'), _owner_ids('player_id')),
+        TempEffect: (None, ('stat', 'value', 'rate', 'expire_time'), _owner_ids('player_id')),
+        PlayerSkill: ('passive', ('skill_id', 'skill_level'), _owner_ids('player_id')),
+        Lieutenant: ('lieutenant', ('is_deployed', 'is_alive', 'owner_id', 'level', 'class_type',
+                                    'quality', 'enlightenment', 'reinforce', 'skills_raw',
+                                    'base_max_health', 'base_max_mana', 'base_attack',
+                                    'base_defense', 'base_crit_rate', 'base_dodge_rate'),
+                     _owner_ids('owner_id')),
+        Relationship: ('social', ('rel_type', 'player1_id', 'player2_id'),
+                       _owner_ids('player1_id', 'player2_id')),
+        LegionMember: ('legion', ('legion_id', 'player_id'), _owner_ids('player_id')),
+        Legion: ('legion*', ('level', 'occupied_cities_raw', 'vip_aura_hp', 'vip_aura_atk',
+                             'vip_aura_def'), None),
+        PlayerModel: ('title', ('title_prefix_id', 'title_suffix_id', 'owned_titles_raw'),
+                      _owner_ids('id')),
+    }
+
+
+def _apply(target, component, resolve, value=None, oldvalue=None, key=None):
+    """立即失效，并返回 (player_ids, legion_id) 供事务结束后再失效一次。"""
+    from services.player_service import PlayerService
+    PlayerService.invalidate_stats()
+    if component is None:
+        return (), None
+    if component == 'legion*':
+        if target.id is not None:
+            StatCache.invalidate_legion(target.id, 'legion')
+        return (), target.id
+    ids = resolve(target, value, oldvalue, key)
+    for pid in ids:
+        StatCache.invalidate(pid, component)
+    return [(pid, component) for pid in ids], None
+
+
+def _remember(session, pending, legion_id):
+    if session is None:
+        return
+    bucket = session.info.setdefault('_stat_cache_pending', {'players': set(), 'legions': set()})
+    bucket['players'].update(pending)
+    if legion_id is not None:
+        bucket['legions'].add(legion_id)
+
+
+def _register_listeners():
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session, object_session
+
+    deps = _dependencies()
+    # 以行为单位增删的来源表（PlayerModel 只关心称号列的赋值）
+    row_types = {m for m in deps if m.__name__ != 'PlayerModel'}
+
+    def _make_on_set(model, key):
+        component, _, resolve = deps[model]
+
+        def _on_set(target, value, oldvalue, initiator):
+            if value is oldvalue:
+                return
+            # 尚未入库的新装备不可能已穿戴，掉落生成时不必失效 equip
+            if model.__name__ == 'EquipmentInstance' and target.id is None:
+                return
+            pending, legion_id = _apply(target, component, resolve, value, oldvalue, key)
+            _remember(object_session(target), pending, legion_id)
+        return _on_set
+
+    for model, (_, attrs, _) in deps.items():
+        for attr in attrs:
+            event.listen(getattr(model, attr), 'set', _make_on_set(model, attr))
+
+    def _on_row(session, obj):
+        component, _, resolve = deps[type(obj)]
+        pending, legion_id = _apply(obj, component, resolve)
+        _remember(session, pending, legion_id)
+
+    @event.listens_for(Session, 'after_attach')
+    def _on_attach(session, instance):
+        if type(instance) in row_types:
+            _on_row(session, instance)
+
+    @event.listens_for(Session, 'before_flush')
+    def _on_flush(session, flush_context, instances):
+        for obj in session.deleted:
+            if type(obj) in row_types:
+                _on_row(session, obj)
+
+    def _on_end(session):
+        bucket = session.info.pop('_stat_cache_pending', None)
+        if not bucket:
+            return None
+        for pid, component in bucket['players']:
+            StatCache.invalidate(pid, component)
+        for legion_id in bucket['legions']:
+            StatCache.invalidate_legion(legion_id, 'legion')
+        return bucket
+
+    def _on_commit(session):
+        bucket = _on_end(session)
+        if bucket:
+            StatCache.publish({pid for pid, _ in bucket['players']}, bucket['legions'])
+
+    event.listen(Session, 'after_commit', _on_commit)
+    event.listen(Session, 'after_rollback', _on_end)
+
+
+_register_listeners()
@@ -0,0 +1,136 @@
+"""静态数据快照：把 DataService 解析好的配置与派生索引整体存成一个 pickle，下次启动直接载入。
+
+每次启动（gunicorn preload_app 的主进程、不预加载时的每个 worker）都要重新解析约 2MB 的 JSON
+（怪物、副本怪物、任务、88 个场景文件、装备套装……），再展开场景、编译怪物原型、
+建场景索引与连通图。这些只取决于 data/ 下的文件和构建它们的代码，这里在首次解析后
+把结果写进 instance/static_snapshot.pickle（路径见 Config.STATIC_SNAPSHOT_PATH）：
+
+- 文件头是单独 pickle 的 (格式版本, 清单)，清单为每个源文件与构建代码的 (mtime_ns, 大小)；
+  载入时先读头比对当前文件，任何一项不符（改了配置、删了文件、部署了新代码）即视为过期，
+  不再读正文，回退解析 JSON 并重写快照；
+- 正文是 DataService._cache、怪物原型、SceneIndex、WorldGraph 一起 pickle，
+  原型与配置 dict 的引用关系随之保留（原型按 source 身份校验是否过期）；
+- 写入先写临时文件再 os.replace，多个进程同时重建也不会读到半截文件；
+  读写失败只记日志，照常走 JSON。
+
+运行时对配置的修改（工作台编辑、劫匪注册）发生在载入之后，不会写进快照；
+工作台保存配置会改动源文件，下次启动即按过期处理。
+手动预编译：python scripts/build_static_snapshot.py；设 STATIC_SNAPSHOT=0 关闭。
+"""
+import importlib.util
+import os
+import pickle
+import time
+from pathlib import Path
+
+
+class StaticSnapshot:
+    FORMAT_VERSION = 1
+    # 产出快照内容的模块：代码变了快照也要作废
+    BUILDER_MODULES = ('services.data_service', 'services.scene_index', 'services.world_graph',
+                       'services.map_service', 'services.equipment_generator', 'models.monster')
+
+    _report = None  # 最近一次载入/写入结果，见 get_report
+
+    @classmethod
+    def path(cls, app):
+        if app is None or not app.config.get('STATIC_SNAPSHOT', True):
+            return None
+        path = app.config.get('STATIC_SNAPSHOT_PATH')
+        return Path(path) if path else None
+
+    @classmethod
+    def manifest(cls, sources):
+        """{路径: (mtime_ns, 大小)}，不存在的文件记 None；拿不到构建代码的文件时返回 None。"""
+        entries = {}
+        for path in sources:
+            try:
+                st = os.stat(path)
+                entries[str(path)] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                entries[str(path)] = None
+        for name in cls.BUILDER_MODULES:
+            try:
+                st = os.stat(importlib.util.find_spec(name).origin)
+            except (ImportError, AttributeError, OSError, TypeError):
+                return None  # 打包运行等拿不到源码时不用快照
+            entries[name] = (st.st_mtime_ns, st.st_size)
+        return entries
+
+    @classmethod
+    def load(cls, app, sources):
+        """快照新鲜时返回正文 dict，否则返回 None（原因记入 get_report）。"""
+        started = time.perf_counter()
+        path = cls.path(app)
+        if path is None:
+            cls._record('json', started, reason='未启用')
+            return None
+        if not path.exists():
+            cls._record('json', started, path=path, reason='快照不存在')
+            return None
+        manifest = cls.manifest(sources)
+        if manifest is None:
+            cls._record('json', started, path=path, reason='构建代码不可用')
+            return None
+        try:
+            with open(path, 'rb') as f:
+                version, saved = pickle.load(f)
+                if version != cls.FORMAT_VERSION or saved != manifest:
+                    cls._record('json', started, path=path, reason='快照已过期')
+                    return None
+                payload = pickle.load(f)
+        except Exception as e:
+            cls._record('json', started, path=path, reason=f'快照损坏：{e.__class__.__name__}')
+            if app is not None:
+                app.logger.warning("静态数据快照 %s 读取失败，改为解析 JSON：%r", path, e)
+            return None
+        cls._record('snapshot', started, path=path)
+        return payload
+
+    @classmethod
+    def save(cls, app, sources, payload):
+        """写入快照，返回是否成功。调用方须在运行时改动配置之前调用。"""
+        path = cls.path(app)
+        manifest = cls.manifest(sources) if path is not None else None
+        if manifest is None:
+            return False
+        started = time.perf_counter()
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                pickle.dump((cls.FORMAT_VERSION, manifest), f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception as e:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            if app is not None:
+                app.logger.warning("静态数据快照 %s 写入失败：%r", path, e)
+            return False
+        if cls._report is not None:
+            cls._report['saved_seconds'] = time.perf_counter() - started
+        return True
+
+    @classmethod
+    def _record(cls, source, started, path=None, reason=None):
+        size = None
+        if path is not None:
+            try:
+                size = path.stat().st_size
+            except OSError:
+                pass
+        cls._report = {
+            'source': source,
+            'reason': reason,
+            'path': str(path) if path is not None else None,
+            'size': size,
+            'seconds': time.perf_counter() - started,
+            'saved_seconds': None,
+        }
+
+    @classmethod
+    def get_report(cls):
+        return cls._report
@@ -0,0 +1,171 @@
+"""请求级工作单元：一次请求里的多次「提交」合并成请求结束时的一次 commit。
+
+服务层原来到处直接 db.session.commit()：一次刷新场景要提交好几次（消费频道 1 消息一次、
+通知一次、公聊再一两次），SQLite 下每次提交都是一次 fsync 和一次写锁往返。
+改用 UnitOfWork.commit() 的地方在请求内只打「待提交」标记，after_request 统一提交一次；
+请求以 5xx 结束时不提交而是回滚：视图抛出的异常多半已被全局 errorhandler 或视图自己的
+try/except 换成了 500 响应（after_request 照常执行），未处理的异常则不走 after_request、
+会话随 Flask-SQLAlchemy 的 teardown 回滚。两种情况下经 UnitOfWork.commit() 合并的改动都一起作废；
+已经 commit_now() 或直接 db.session.commit() 提交的部分不受影响。
+请求之外（后台任务、脚本）UnitOfWork.commit() 照旧立即提交。
+
+需要立即对其他请求可见的写——世界 BOSS 击杀判定后的结算、集市购买扣款——用 commit_now()。
+仍直接调用 db.session.commit() 的旧代码不受影响，只是不参与合并。
+
+玩家、装备实例、集市挂单、军团成员带 version_id_col 乐观锁：两个请求并发改同一行时，
+后 flush 的一方 UPDATE 匹配不到行，抛 StaleDataError。幂等的服务操作（集市购买、股票买卖）
+用 retry_on_conflict 包装，回滚后按最新数据重跑；其余请求里的冲突统一回滚并提示玩家重试。
+
+引擎上挂 commit 事件，按 endpoint 统计每个请求实际发生的 DB 提交次数（只计真正发到 SQLite 的 COMMIT），
+工作台运行监控页按平均提交次数排序展示，用来发现新增的多次提交。
+"""
+import functools
+import threading
+
+from flask import flash, g, has_request_context, redirect, request, url_for
+from sqlalchemy import event
+from sqlalchemy.orm.exc import StaleDataError
+
+from services import db, ConcurrentModificationError
+
+CONFLICT_MESSAGE = "数据已被其他操作更新，请重试"
+
+
+def retry_on_conflict(func=None, attempts=3):
+    """服务方法装饰器：StaleDataError 时回滚并重跑，最多 attempts 次，仍冲突抛 ConcurrentModificationError。
+
+    回滚会作废本请求此前未提交的全部改动，且参数里的 ORM 对象随之过期、重跑时读到最新行，
+    因此只用于请求里第一个写操作、且内存副作用都在提交之后的幂等操作。
+    """
+    if func is None:
+        return functools.partial(retry_on_conflict, attempts=attempts)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for _ in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except StaleDataError:
+                db.session.rollback()
+                with UnitOfWork._lock:
+                    UnitOfWork._conflicts['retried'] += 1
+        with UnitOfWork._lock:
+            UnitOfWork._conflicts['exhausted'] += 1
+        raise ConcurrentModificationError(f"{func.__qualname__} 连续 {attempts} 次乐观锁冲突")
+    return wrapper
+
+
+class UnitOfWork:
+    BACKGROUND = '(后台)'  # 请求之外的提交计在这个名下
+
+    _lock = threading.Lock()
+    _stats = {}  # {endpoint: [请求数, 提交数, 单请求最多提交数]}
+    _conflicts = {'retried': 0, 'exhausted': 0, 'rejected': 0}  # 乐观锁冲突计数
+
+    @classmethod
+    def init_app(cls, app):
+        """在其他 before_request 之前注册，保证请求一开始就处于工作单元内。"""
+        app.before_request(cls._begin)
+        app.after_request(cls._finish)
+        app.register_error_handler(StaleDataError, cls._on_conflict)
+        app.register_error_handler(ConcurrentModificationError, cls._on_conflict)
+        with app.app_context():
+            event.listen(db.engine, 'commit', cls._on_commit)
+
+    # ---- 服务层接口 ----
+
+    @classmethod
+    def commit(cls):
+        """请求内：标记待提交，请求结束统一提交；请求外：立即提交。"""
+        if has_request_context() and g.get('_uow_active'):
+            g._uow_dirty = True
+            return
+        db.session.commit()
+
+    @classmethod
+    def commit_now(cls):
+        """立即提交（连同本请求此前积攒的改动），用于必须马上对其他请求可见的写。"""
+        db.session.commit()
+        if has_request_context():
+            g._uow_dirty = False
+
+    # ---- 请求钩子 ----
+
+    @staticmethod
+    def _begin():
+        g._uow_active = True
+        g._uow_dirty = False
+        g._uow_commits = 0
+
+    @classmethod
+    def _finish(cls, response):
+        if response.status_code >= 500:
+            # 异常已被换成 500 响应：不提交，请求内积攒的改动（连同待交接的成就事件）一起回滚
+            g._uow_dirty = False
+            db.session.rollback()
+        elif g.get('_uow_dirty'):
+            g._uow_dirty = False
+            try:
+                db.session.commit()
+            except StaleDataError:
+                # after_request 里的异常不走 errorhandler，这里直接换成冲突提示
+                response = cls._on_conflict(None)
+            except Exception:
+                db.session.rollback()
+                raise
+        g._uow_active = False
+        cls._record(request.endpoint or request.path, g.get('_uow_commits', 0))
+        return response
+
+    @classmethod
+    def _on_conflict(cls, e):
+        """乐观锁冲突：整个请求回滚，提示后回到来源页（无来源回场景）。"""
+        db.session.rollback()
+        g._uow_dirty = False
+        with cls._lock:
+            cls._conflicts['rejected'] += 1
+        flash(CONFLICT_MESSAGE)
+        return redirect(request.referrer or url_for('game.scene'))
+
+    @classmethod
+    def _on_commit(cls, conn):
+        if has_request_context() and g.get('_uow_active'):
+            g._uow_commits = g.get('_uow_commits', 0) + 1
+        else:
+            cls._record(cls.BACKGROUND, 1, request=False)
+
+    @classmethod
+    def _record(cls, endpoint, commits, request=True):
+        with cls._lock:
+            row = cls._stats.get(endpoint)
+            if row is None:
+                row = cls._stats[endpoint] = [0, 0, 0]
+            if request:
+                row[0] += 1
+                row[2] = max(row[2], commits)
+            row[1] += commits
+
+    @classmethod
+    def get_metrics(cls, limit=30):
+        """各 endpoint 的请求数、提交数、平均/最多每请求提交数，按平均提交数降序。"""
+        with cls._lock:
+            rows = [{
+                'endpoint': endpoint,
+                'requests': req,
+                'commits': commits,
+                'avg': commits / req if req else float(commits),
+                'max': most,
+            } for endpoint, (req, commits, most) in cls._stats.items()]
+        rows.sort(key=lambda r: (r['avg'], r['commits']), reverse=True)
+        return rows[:limit]
+
+    @classmethod
+    def get_conflicts(cls):
+        with cls._lock:
+            return dict(cls._conflicts)
+
+    @classmethod
+    def reset_metrics(cls):
+        with cls._lock:
+            cls._stats = {}
+            cls._conflicts = dict.fromkeys(cls._conflicts, 0)
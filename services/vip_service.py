@@ -1,25 +1,18 @@
-import json
-import os
 from datetime import datetime, timedelta
 from services import db
 from services.data_service import DataService
 
 
 class VipService:
-    _config = None
-
     @classmethod
     def _load_config(cls):
-        if cls._config is None:
-            config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'vip_config.json')
-            with open(config_path, 'r', encoding='utf-8') as f:
-                cls._config = json.load(f)
-        return cls._config
+        """data/vip_config.json，随静态配置由 DataService 载入。"""
+        return DataService.get_vip_config()
 
     @classmethod
     def get_vip_level_config(cls, level):
         config = cls._load_config()
-        return config['vip_levels'].get(str(level))
+        return config.get('vip_levels', {}).get(str(level))
 
     @classmethod
     def get_active_vip_level(cls, player):
@@ -1,27 +1,108 @@
+"""世界 BOSS 共享血量：经 SharedState 后端存取，按 BOSS 分条加锁。
+
+每只 BOSS 的静态配置（最大血量、复活时长）在各进程本地算出；血量、存活、阵亡时间、
+参与者等动态状态存在共享后端的 'world_boss' 命名空间里，多个 worker 看到同一份。
+gthread 线程池里多名玩家同时打同一只 BOSS 时，扣血、参与者累计、击杀判定在一次
+后端原子 update 内完成：只有把血量从正数打到 0 的那一次调用返回 killed，其余同时到达的
+攻击看到的是已阵亡状态，不会重复结算击杀。复活同理只有一个调用执行并播报。
+
+进程内再按 monster_id 散列到 LOCK_STRIPES 把锁上排队，不同 BOSS 之间基本互不阻塞；
+一回合内玩家普攻/技能与副将追击的多段伤害先记在 DamageBatch 里，回合结算时一次提交。
+每只 BOSS 记录（本进程的）提交次数、抢锁失败次数与等锁耗时，工作台运行监控页按争用排序展示。
+"""
+import threading
 import time
+from contextlib import contextmanager
+
 from services.data_service import DataService
+from services.shared_state import SharedState
+
+
+def _decode_boss(value):
+    # JSON 对象的键只能是字符串，参与者 player_id 还原为 int
+    value['participants'] = {int(k): v for k, v in (value.get('participants') or {}).items()}
+    return value
+
+
+SharedState.register_codec('world_boss', decode=_decode_boss)
 
 
 class WorldBossState:
+    """一只世界 BOSS：静态配置 + 最近一次从共享后端读到的动态状态快照。"""
     __slots__ = ('monster_id', 'current_health', 'max_health', 'is_alive',
-                 'defeated_at', 'respawn_time', 'participants', 'last_attack_time')
+                 'defeated_at', 'respawn_time', 'participants', 'last_attack_time',
+                 'hits', 'contended', 'wait_total')
 
     def __init__(self, monster_id, max_health, respawn_time):
         self.monster_id = monster_id
-        self.current_health = max_health
         self.max_health = max_health
-        self.is_alive = True
-        self.defeated_at = 0
         self.respawn_time = respawn_time
-        self.participants = {}  # {player_id: total_damage}
-        self.last_attack_time = 0
+        self._load(self.fresh_state())
+        # 争用统计（本进程累计，不随复活清零）
+        self.hits = 0           # 提交伤害的次数
+        self.contended = 0      # 其中锁被占用、需要等待的次数
+        self.wait_total = 0.0   # 累计等锁秒数
+
+    def fresh_state(self):
+        """满血存活时的动态状态（共享后端里存的就是这个 dict）。"""
+        return {'current_health': self.max_health, 'is_alive': True, 'defeated_at': 0,
+                'participants': {}, 'last_attack_time': 0}
+
+    def _load(self, state):
+        self.current_health = state['current_health']
+        self.is_alive = state['is_alive']
+        self.defeated_at = state['defeated_at']
+        self.participants = state['participants']  # {player_id: total_damage}
+        self.last_attack_time = state['last_attack_time']
+
+
+class DamageBatch:
+    """一回合内对同一世界 BOSS 的多段伤害，先本地累加，结算时一次加锁提交。"""
+    __slots__ = ('monster_id', 'player_id', 'pending')
+
+    def __init__(self, monster_id, player_id):
+        self.monster_id = monster_id
+        self.player_id = player_id
+        self.pending = 0
+
+    def add(self, damage):
+        if damage > 0:
+            self.pending += damage
+
+    def commit(self):
+        """提交累计伤害，返回 (killed, 提交后血量)；killed 仅对打出致命一击的调用为 True。
+        非世界 BOSS（无共享状态）时血量为 None。"""
+        damage, self.pending = self.pending, 0
+        return WorldBossService.apply_damage(self.monster_id, self.player_id, damage)
 
 
 class WorldBossService:
-    """Shared world-boss state, all in-memory (class-level), matching _ground_items pattern."""
+    """Shared world-boss state：静态配置在进程内 _bosses，动态状态在 SharedState 后端。"""
+
+    LOCK_STRIPES = 16
+    NAMESPACE = 'world_boss'
 
     _bosses = {}   # {monster_id: WorldBossState}
     _initialized = False
+    _stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    @classmethod
+    @contextmanager
+    def _locked(cls, boss):
+        lock = cls._stripes[hash(boss.monster_id) % cls.LOCK_STRIPES]
+        if lock.acquire(blocking=False):
+            waited = None
+        else:
+            started = time.perf_counter()
+            lock.acquire()
+            waited = time.perf_counter() - started
+        try:
+            if waited is not None:
+                boss.contended += 1
+                boss.wait_total += waited
+            yield boss
+        finally:
+            lock.release()
 
     # ---- respawn time helpers ----
 
@@ -34,16 +115,14 @@ class WorldBossService:
         if monster_data.get('is_divine_beast'):
             return 600
 
-        # Find which locations contain this monster
-        locations = DataService.get_locations()
+        # Find which locations contain this monster（场景索引的怪物→场景反查，取第一个）
         scene_name = ''
         area = ''
-        for loc_id, loc_data in locations.items():
-            monsters_list = loc_data.get('monsters', [])
-            if monster_id in monsters_list:
-                scene_name = loc_data.get('name', '')
-                area = loc_id.split('_')[0] if '_' in loc_id else ''
-                break
+        loc_ids = DataService.get_scene_index().locations_of(monster_id)
+        if loc_ids:
+            loc_id = loc_ids[0]
+            scene_name = DataService.get_location(loc_id).get('name', '')
+            area = loc_id.split('_')[0] if '_' in loc_id else ''
 
         if '粮草营' in scene_name:
             return 180
@@ -75,19 +154,24 @@ class WorldBossService:
             stats = mdata.get('base_stats', {})
             max_hp = stats.get('max_health', stats.get('health', 100))
             respawn = cls._get_respawn_time(mid, mdata)
-            cls._bosses[mid] = WorldBossState(mid, max_hp, respawn)
+            boss = WorldBossState(mid, max_hp, respawn)
+            # 共享后端里已有（其他 worker 先启动）则沿用，不重置血量
+            boss._load(SharedState.backend.update(
+                cls.NAMESPACE, mid, lambda state, boss=boss: state or boss.fresh_state()))
+            cls._bosses[mid] = boss
         cls._initialized = True
 
     # ---- public api ----
 
     @classmethod
     def get_boss(cls, monster_id):
-        """Return WorldBossState, or None if not a world boss."""
+        """Return WorldBossState (刚从共享后端刷新), or None if not a world boss."""
         if not cls._initialized:
             cls.init_bosses()
         boss = cls._bosses.get(monster_id)
         if boss is None:
             return None
+        cls._refresh(boss)
         cls._check_respawn(boss)
         return boss
 
@@ -99,49 +183,108 @@ class WorldBossService:
     @classmethod
     def get_respawn_remaining(cls, monster_id):
         boss = cls._bosses.get(monster_id)
-        if boss is None or boss.is_alive:
+        if boss is None:
+            return 0
+        cls._refresh(boss)
+        if boss.is_alive:
             return 0
         elapsed = time.time() - boss.defeated_at
         return max(0, int(boss.respawn_time - elapsed))
 
     @classmethod
-    def damage_boss(cls, monster_id, player_id, damage):
-        """Apply damage, return (killed: bool, killer_id: int or None)."""
+    def batch(cls, monster_id, player_id):
+        """开一个本回合的伤害累加器（见 DamageBatch）。"""
+        return DamageBatch(monster_id, player_id)
+
+    @classmethod
+    def apply_damage(cls, monster_id, player_id, damage):
+        """原子扣血，返回 (killed, 扣血后血量)；BOSS 已阵亡时返回 (False, 0)，非世界 BOSS 返回 (False, None)。"""
         boss = cls._bosses.get(monster_id)
-        if boss is None or not boss.is_alive:
+        if boss is None:
             return False, None
+        result = [False, 0]
 
-        boss.current_health -= damage
-        boss.last_attack_time = time.time()
-        boss.participants[player_id] = boss.participants.get(player_id, 0) + damage
+        def _hit(state):
+            if not state['is_alive']:
+                return state
+            if damage > 0:
+                state['current_health'] -= damage
+                state['last_attack_time'] = time.time()
+                participants = state['participants']
+                participants[player_id] = participants.get(player_id, 0) + damage
+            if state['current_health'] <= 0:
+                state['current_health'] = 0
+                state['is_alive'] = False
+                state['defeated_at'] = time.time()
+                result[0] = True
+            result[1] = state['current_health']
+            return state
 
-        if boss.current_health <= 0:
-            boss.current_health = 0
-            boss.is_alive = False
-            boss.defeated_at = time.time()
-            return True, player_id
-        return False, None
+        with cls._locked(boss):
+            boss.hits += 1
+            boss._load(SharedState.backend.update(cls.NAMESPACE, monster_id, _hit,
+                                                  default=boss.fresh_state()))
+        return result[0], result[1]
+
+    @classmethod
+    def damage_boss(cls, monster_id, player_id, damage):
+        """Apply damage, return (killed: bool, killer_id: int or None)."""
+        killed, _ = cls.apply_damage(monster_id, player_id, damage)
+        return (True, player_id) if killed else (False, None)
 
     @classmethod
     def get_participant_count(cls, monster_id, player_id=None):
         boss = cls._bosses.get(monster_id)
         if boss is None:
             return 0
+        participants = dict(cls._refresh(boss).participants)
         if player_id is not None:
-            return len([p for p in boss.participants if p != player_id])
-        return len(boss.participants)
+            return len([p for p in participants if p != player_id])
+        return len(participants)
+
+    @classmethod
+    def get_metrics(cls, limit=20):
+        """有过伤害提交的 BOSS 按争用次数降序，供工作台运行监控页展示。"""
+        rows = [{
+            'monster_id': b.monster_id,
+            'name': (DataService.get_monster(b.monster_id) or {}).get('name', b.monster_id),
+            'is_alive': b.is_alive,
+            'hits': b.hits,
+            'contended': b.contended,
+            'contention_rate': b.contended / b.hits if b.hits else 0.0,
+            'avg_wait': b.wait_total / b.contended if b.contended else 0.0,
+            'participants': len(b.participants),
+        } for b in list(cls._bosses.values()) if b.hits]
+        rows.sort(key=lambda r: (r['contended'], r['hits']), reverse=True)
+        return rows[:limit]
 
     # ---- internal ----
 
+    @classmethod
+    def _refresh(cls, boss):
+        """从共享后端读最新动态状态到本地快照。"""
+        state = SharedState.backend.get(cls.NAMESPACE, boss.monster_id)
+        if state is not None:
+            boss._load(state)
+        return boss
+
     @classmethod
     def _check_respawn(cls, boss):
-        if boss.is_alive:
+        if boss.is_alive or time.time() - boss.defeated_at < boss.respawn_time:
             return
-        if time.time() - boss.defeated_at >= boss.respawn_time:
-            boss.current_health = boss.max_health
-            boss.is_alive = True
-            boss.participants = {}
-            boss.last_attack_time = 0
+        respawned = []
+
+        def _respawn(state):
+            # 原子复查：多个线程/进程同时到期时只有一个执行复活
+            if state['is_alive'] or time.time() - state['defeated_at'] < boss.respawn_time:
+                return state
+            respawned.append(True)
+            return boss.fresh_state()
+
+        with cls._locked(boss):
+            boss._load(SharedState.backend.update(cls.NAMESPACE, boss.monster_id, _respawn,
+                                                  default=boss.fresh_state()))
+        if respawned:
             # Divine beast respawn: broadcast system message
             cls._announce_respawn(boss.monster_id)
 
@@ -153,14 +296,13 @@ class WorldBossService:
         if not mdata:
             return
         # Find location info
-        locations = DataService.get_locations()
         loc_name = ''
         area_name = ''
-        for loc_id, loc_data in locations.items():
-            if monster_id in loc_data.get('monsters', []):
-                loc_name = loc_data.get('name', '')
-                area_name = loc_data.get('area_name', '')
-                break
+        loc_ids = DataService.get_scene_index().locations_of(monster_id)
+        if loc_ids:
+            loc_data = DataService.get_location(loc_ids[0])
+            loc_name = loc_data.get('name', '')
+            area_name = loc_data.get('area_name', '')
 
         if mdata.get('is_divine_beast'):
             desc = mdata.get('description', mdata.get('name', monster_id))
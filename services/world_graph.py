@@ -0,0 +1,219 @@
+"""场景连通图：加载配置时把场景出口编译成整数下标的邻接表，拓扑序与寻路结果按需缓存。
+
+原来传送页的「出口拓扑」每次请求都要扫一遍全部场景挑出本区域、再从起点跑一遍 BFS，
+区域/分区列表也是每个区域各扫一遍全部场景。这些只取决于静态配置，这里一次性整理成：
+
+- 场景 id ↔ 下标，每个场景的出口 ((方向序号, 目标下标), ...) 与反向出口；
+- 区域 → 非副本场景下标元组、area_id → 场景下标元组（均为配置顺序）；
+- 区域拓扑：(区域, 起点) → BFS 序，首次请求时计算并缓存；
+- 寻路：目标 → 「每个场景朝目标走的下一步」表，反向 BFS 一次即可回答任意起点，
+  按目标 LRU 缓存；路径不穿过副本地图（副本只能经入口 NPC 进出）。
+
+图整体构建后替换，结构只读；两处缓存的填充用锁保护。
+DataService._load_all_data 重新加载配置时一并重建，或随静态数据快照载入。
+"""
+import threading
+from array import array
+from collections import OrderedDict, deque
+
+
+class WorldGraph:
+    DIRECTIONS = ('north', 'south', 'east', 'west')
+    DIRECTION_LABELS = ('北', '南', '东', '西')
+    ROUTE_CACHE_SIZE = 256  # 缓存的寻路目标数
+
+    def __init__(self, locations, region_of):
+        """region_of: area_id → 区域前缀（MapService.region_key_of）。"""
+        self.ids = tuple(locations)
+        self._index = {lid: i for i, lid in enumerate(self.ids)}
+        self._open = bytearray(len(self.ids))  # 1 = 非副本场景，寻路可经过
+        exits = []
+        reverse = [[] for _ in self.ids]
+        regions, areas = {}, {}
+        for i, (lid, loc) in enumerate(locations.items()):
+            edges = []
+            for d, direction in enumerate(self.DIRECTIONS):
+                dest = loc.get(f'{direction}_exit') or (loc.get('exits') or {}).get(direction)
+                j = self._index.get(dest) if dest else None
+                if j is not None:
+                    edges.append((d, j))
+                    reverse[j].append((d, i))
+            exits.append(tuple(edges))
+            area_id = loc.get('area_id') or ''
+            if area_id:
+                areas.setdefault(area_id, []).append(i)
+            if loc.get('is_copy_map'):
+                continue
+            self._open[i] = 1
+            region = region_of(area_id)
+            if region:
+                regions.setdefault(region, []).append(i)
+        self._exits = tuple(exits)
+        self._reverse = tuple(tuple(r) for r in reverse)
+        self._regions = {rk: tuple(ids) for rk, ids in regions.items()}
+        self._region_sets = {rk: frozenset(ids) for rk, ids in regions.items()}
+        self._areas = {aid: tuple(ids) for aid, ids in areas.items()}
+        self._init_caches()
+
+    def _init_caches(self):
+        self._lock = threading.Lock()
+        self._topologies = {}          # (region, 起点下标) → (BFS 序下标元组, 连通数)
+        self._routes = OrderedDict()   # 目标下标 → (下一步下标 array, 方向序号 array)
+        self._stats = {'route_hits': 0, 'route_misses': 0, 'topology_builds': 0}
+
+    def __getstate__(self):
+        """静态数据快照（services.static_snapshot）只存图结构，锁与缓存载入后重新建。"""
+        state = self.__dict__.copy()
+        for key in ('_lock', '_topologies', '_routes', '_stats'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_caches()
+
+    # ---- 结构查询 ----
+
+    def index_of(self, location_id):
+        return self._index.get(location_id)
+
+    def exits(self, location_id):
+        """((方向序号, 目标场景 id), ...)；只含目标存在的出口。"""
+        i = self._index.get(location_id)
+        if i is None:
+            return ()
+        return tuple((d, self.ids[j]) for d, j in self._exits[i])
+
+    def regions(self):
+        """有非副本场景的区域前缀（按首次出现的配置顺序）。"""
+        return tuple(self._regions)
+
+    def region_scene_ids(self, region_key):
+        return tuple(self.ids[i] for i in self._regions.get(region_key, ()))
+
+    def in_region(self, region_key, location_id):
+        i = self._index.get(location_id)
+        return i is not None and i in self._region_sets.get(region_key, ())
+
+    def area_scene_ids(self, area_id):
+        """area_id 下的全部场景 id（含副本地图，配置顺序）。"""
+        return tuple(self.ids[i] for i in self._areas.get(area_id, ()))
+
+    # ---- 区域拓扑 ----
+
+    def region_topology(self, region_key, start_id):
+        """从 start_id 出发、只走区域内出口的 BFS 序。
+
+        返回 (场景 id 元组, 连通数)：前「连通数」个按 BFS 序，其后为不连通的场景（配置顺序）。
+        start_id 须是区域内的场景，否则返回 ((), 0)。
+        """
+        start = self._index.get(start_id)
+        cache_key = (region_key, start)
+        cached = self._topologies.get(cache_key)
+        if cached is None:
+            if start not in self._region_sets.get(region_key, ()):
+                return (), 0
+            cached = self._build_topology(region_key, start)
+            with self._lock:
+                self._topologies[cache_key] = cached
+                self._stats['topology_builds'] += 1
+        order, reached = cached
+        return tuple(self.ids[i] for i in order), reached
+
+    def region_exits(self, region_key, location_id):
+        """场景在区域内的出口 ((方向序号, 目标场景 id), ...)。"""
+        members = self._region_sets.get(region_key, frozenset())
+        i = self._index.get(location_id)
+        if i is None:
+            return ()
+        return tuple((d, self.ids[j]) for d, j in self._exits[i] if j in members)
+
+    def _build_topology(self, region_key, start):
+        members, member_set = self._regions[region_key], self._region_sets[region_key]
+        seen = {start}
+        order = [start]
+        queue = deque(order)
+        while queue:
+            cur = queue.popleft()
+            for _, j in self._exits[cur]:
+                if j in member_set and j not in seen:
+                    seen.add(j)
+                    order.append(j)
+                    queue.append(j)
+        reached = len(order)
+        order.extend(i for i in members if i not in seen)
+        return tuple(order), reached
+
+    # ---- 寻路 ----
+
+    def route(self, src_id, dst_id):
+        """src → dst 的最短步行路线 ((方向序号, 到达场景 id), ...)。
+
+        起终点相同返回 ()；不可达或场景不存在返回 None。
+        """
+        src, dst = self._index.get(src_id), self._index.get(dst_id)
+        if src is None or dst is None:
+            return None
+        if src == dst:
+            return ()
+        nxt, dirs = self._toward(dst)
+        if nxt[src] < 0:
+            return None
+        steps = []
+        cur = src
+        while cur != dst:
+            steps.append((dirs[cur], self.ids[nxt[cur]]))
+            cur = nxt[cur]
+        return tuple(steps)
+
+    def next_step(self, src_id, dst_id):
+        """src 朝 dst 走的下一步 (方向序号, 场景 id)；已到达或不可达返回 None。"""
+        src, dst = self._index.get(src_id), self._index.get(dst_id)
+        if src is None or dst is None or src == dst:
+            return None
+        nxt, dirs = self._toward(dst)
+        if nxt[src] < 0:
+            return None
+        return dirs[src], self.ids[nxt[src]]
+
+    def _toward(self, dst):
+        with self._lock:
+            table = self._routes.get(dst)
+            if table is not None:
+                self._routes.move_to_end(dst)
+                self._stats['route_hits'] += 1
+                return table
+            self._stats['route_misses'] += 1
+        table = self._build_toward(dst)
+        with self._lock:
+            self._routes[dst] = table
+            while len(self._routes) > self.ROUTE_CACHE_SIZE:
+                self._routes.popitem(last=False)
+        return table
+
+    def _build_toward(self, dst):
+        """沿反向出口从 dst 做 BFS：nxt[i] 为 i 朝 dst 的下一个场景（-1 不可达），dirs[i] 为方向。
+
+        只从非副本场景继续扩展，即路线的中间场景都不是副本；起点在副本内仍可走出来。
+        """
+        n = len(self.ids)
+        nxt = array('i', [-1]) * n
+        dirs = array('b', [-1]) * n
+        nxt[dst] = dst
+        queue = deque([dst])
+        while queue:
+            cur = queue.popleft()
+            for d, i in self._reverse[cur]:
+                if nxt[i] >= 0:
+                    continue
+                nxt[i] = cur
+                dirs[i] = d
+                if self._open[i]:
+                    queue.append(i)
+        return nxt, dirs
+
+    def get_metrics(self):
+        with self._lock:
+            return dict(self._stats, scenes=len(self.ids), regions=len(self._regions),
+                        cached_routes=len(self._routes),
+                        cached_topologies=len(self._topologies))